@@ -0,0 +1,136 @@
+"""
+Support for compressed request bodies.
+
+Clients can send bodies compressed with gzip (or zstd, if the `zstandard` package is
+installed) by setting the Content-Encoding header. Bodies can also be serialized with
+msgpack (if the `msgpack` package is installed) by setting Content-Type to application/msgpack.
+"""
+
+import json
+import zlib
+from typing import Any, Callable, Coroutine
+
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+from loguru import logger
+
+from phospho_backend.core import config
+
+MSGPACK_CONTENT_TYPES = ["application/msgpack", "application/x-msgpack"]
+
+
+def _decompress_gzip(body: bytes, max_size: int) -> bytes:
+    # wbits=MAX_WBITS|16 to only accept gzip headers
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    data = decompressor.decompress(body, max_size)
+    if decompressor.unconsumed_tail:
+        raise HTTPException(status_code=413, detail="Decompressed body is too large")
+    return data
+
+
+def _decompress_zstd(body: bytes, max_size: int) -> bytes:
+    try:
+        import zstandard  # type: ignore
+    except ImportError:
+        raise HTTPException(
+            status_code=415, detail="Content-Encoding zstd is not supported"
+        )
+    reader = zstandard.ZstdDecompressor().stream_reader(body)
+    data = reader.read(max_size + 1)
+    if len(data) > max_size:
+        raise HTTPException(status_code=413, detail="Decompressed body is too large")
+    return data
+
+
+def decompress_body(body: bytes, content_encoding: str | None) -> bytes:
+    """
+    Decompress a request body according to its Content-Encoding header.
+    Raise an HTTPException if the encoding is not supported or the body is invalid.
+    """
+    if not content_encoding or content_encoding == "identity":
+        return body
+    max_size = config.MAX_DECOMPRESSED_BODY_SIZE
+    try:
+        if content_encoding == "gzip":
+            return _decompress_gzip(body, max_size)
+        if content_encoding == "zstd":
+            return _decompress_zstd(body, max_size)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.info(f"Error decompressing {content_encoding} request body: {e}")
+        raise HTTPException(
+            status_code=400, detail=f"Invalid {content_encoding} request body"
+        )
+    raise HTTPException(
+        status_code=415, detail=f"Content-Encoding {content_encoding} is not supported"
+    )
+
+
+def is_msgpack(content_type: str | None) -> bool:
+    if content_type is None:
+        return False
+    return content_type.split(";")[0].strip() in MSGPACK_CONTENT_TYPES
+
+
+class DecompressedRequest(Request):
+    """Request whose body is decompressed according to the Content-Encoding header,
+    and decoded from msgpack if the original Content-Type was msgpack."""
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            self._body = decompress_body(
+                body, self.headers.get("content-encoding", "").strip().lower()
+            )
+        return self._body
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            if self.scope.get("phospho_msgpack_body", False):
+                try:
+                    import msgpack  # type: ignore
+                except ImportError:
+                    raise HTTPException(
+                        status_code=415,
+                        detail="Content-Type application/msgpack is not supported",
+                    )
+                try:
+                    self._json = msgpack.unpackb(body)
+                except Exception as e:
+                    logger.info(f"Error decoding msgpack request body: {e}")
+                    raise HTTPException(
+                        status_code=400, detail="Invalid msgpack request body"
+                    )
+            else:
+                self._json = json.loads(body)
+        return self._json
+
+
+class DecompressedBodyRoute(APIRoute):
+    """
+    Route that accepts compressed (gzip, zstd) and msgpack request bodies.
+
+    Usage: `router = APIRouter(route_class=DecompressedBodyRoute)`
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            scope = request.scope
+            if is_msgpack(request.headers.get("content-type")):
+                # FastAPI only parses json bodies. The msgpack body is decoded
+                # in DecompressedRequest.json()
+                scope = dict(request.scope)
+                scope["headers"] = [
+                    (key, value)
+                    for key, value in request.scope["headers"]
+                    if key.lower() != b"content-type"
+                ] + [(b"content-type", b"application/json")]
+                scope["phospho_msgpack_body"] = True
+            request = DecompressedRequest(scope, request.receive)
+            return await original_route_handler(request)
+
+        return custom_route_handler
@@ -18,7 +18,10 @@ from phospho_backend.api.platform.models import (
 )
 from phospho_backend.api.platform.models.organizations import BillingStatsRequest
 from phospho_backend.core import config
-from phospho_backend.security.authentification import propelauth
+from phospho_backend.security.authentification import (
+    propelauth,
+    update_org_metadata,
+)
 from phospho_backend.services.mongo.emails import (
     email_user_onboarding,
     send_payment_issue_email,
@@ -204,13 +207,11 @@ async def post_init_org(
 
         # Set the initialized flag
         org_metadata["initialized"] = True
-        propelauth.update_org_metadata(org_id, metadata=org_metadata)
+        await update_org_metadata(org_id, metadata=org_metadata)
         if org_metadata.get("plan", "hobby") == "pro":
-            propelauth.update_org_metadata(org_id, max_users=config.PLAN_PRO_MAX_USERS)
+            await update_org_metadata(org_id, max_users=config.PLAN_PRO_MAX_USERS)
         elif org_metadata.get("plan", "hobby") == "hobby":
-            propelauth.update_org_metadata(
-                org_id, max_users=config.PLAN_HOBBY_MAX_USERS
-            )
+            await update_org_metadata(org_id, max_users=config.PLAN_HOBBY_MAX_USERS)
         return {
             **output,
             "status": "ok",
@@ -220,7 +221,7 @@ async def post_init_org(
     try:
         # Check if we are in self-hosted mode
         if config.ENVIRONMENT == "preview":
-            propelauth.update_org_metadata(
+            await update_org_metadata(
                 org_id,
                 max_users=config.PLAN_SELFHOSTED_MAX_USERS,
                 metadata={"plan": "self-hosted", "initialized": True},
@@ -232,7 +233,7 @@ async def post_init_org(
 
         # Otherwise, we are in the cloud mode
         # Initialize the organization with the hobby plan
-        propelauth.update_org_metadata(
+        await update_org_metadata(
             org_id,
             max_users=config.PLAN_HOBBY_MAX_USERS,
             metadata={"plan": "hobby", "initialized": True},
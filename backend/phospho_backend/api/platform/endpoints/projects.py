@@ -49,11 +49,15 @@ from phospho_backend.services.mongo.projects import (
     get_project_by_id,
     update_project,
 )
-from phospho_backend.services.mongo.sessions import get_all_sessions
-from phospho_backend.services.mongo.tasks import get_all_tasks
+from phospho_backend.services.mongo.sessions import (
+    get_all_sessions,
+    get_sessions_next_cursor,
+)
+from phospho_backend.services.mongo.tasks import get_all_tasks, get_tasks_next_cursor
 from phospho_backend.services.mongo.users import (
     fetch_users_metadata,
     get_nb_users_messages,
+    get_users_next_cursor,
 )
 from phospho_backend.services.slack import slack_notification
 from phospho_backend.services.universal_loader.universal_loader import universal_loader
@@ -153,7 +157,10 @@ async def post_sessions(
         pagination=query.pagination,
         sorting=query.sorting,
     )
-    return Sessions(sessions=sessions)
+    return Sessions(
+        sessions=sessions,
+        next_cursor=get_sessions_next_cursor(sessions, query.pagination, query.sorting),
+    )
 
 
 @router.get(
@@ -230,7 +237,10 @@ async def post_tasks(
         sorting=query.sorting,
         pagination=query.pagination,
     )
-    return Tasks(tasks=tasks)
+    return Tasks(
+        tasks=tasks,
+        next_cursor=get_tasks_next_cursor(tasks, query.pagination, query.sorting),
+    )
 
 
 @router.get(
@@ -383,7 +393,10 @@ async def get_users(
         pagination=query.pagination,
         user_id_search=query.user_id_search,
     )
-    return Users(users=users)
+    return Users(
+        users=users,
+        next_cursor=get_users_next_cursor(users, query.pagination, query.sorting),
+    )
 
 
 @router.get(
@@ -43,6 +43,8 @@ class DashboardMetricsFilter(BaseModel):
 class Pagination(BaseModel):
     page: int = 1
     per_page: int = 10
+    # Opaque cursor returned as next_cursor by the previous page. If set, page is ignored.
+    cursor: str | None = None
 
 
 class Sorting(BaseModel):
@@ -9,6 +9,7 @@ from phospho_backend.services.mongo.cron import (
     run_langsmith_sync_pipeline,
     run_postgresql_sync_pipeline,
 )
+from phospho_backend.services.mongo.usage import reconcile_usage_counters
 
 router = APIRouter(tags=["cron"])
 
@@ -31,6 +32,9 @@ async def run_sync_pipeline(
         # Only run the PostgreSQL sync pipeline once a day, at 10am
         if datetime.datetime.now().hour == 10:
             await run_postgresql_sync_pipeline()
+        # Recount the usage counters from the job_results once a day, at 3am
+        if datetime.datetime.now().hour == 3:
+            await reconcile_usage_counters()
         return {"status": "ok", "message": "Pipelines ran successfully"}
     except Exception as e:
         return {"status": "error", "message": f"Error running sync pipeline {e}"}
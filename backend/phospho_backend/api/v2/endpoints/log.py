@@ -5,6 +5,7 @@ from loguru import logger
 from propelauth_py.types.user import OrgApiKeyValidation  # type: ignore
 from pydantic import ValidationError
 
+from phospho_backend.api.compression import DecompressedBodyRoute
 from phospho_backend.api.v2.models import (
     LogError,
     LogEvent,
@@ -18,9 +19,10 @@ from phospho_backend.security import (
     verify_propelauth_org_owns_project_id,
 )
 from phospho_backend.services.log import create_task_and_process_logs
+from phospho_backend.services.log_queue import get_log_queue
 from phospho_backend.services.mongo.emails import send_quota_exceeded_email
 
-router = APIRouter(tags=["Logs"])
+router = APIRouter(tags=["Logs"], route_class=DecompressedBodyRoute)
 
 
 @router.post(
@@ -61,6 +63,9 @@ async def store_batch_of_log_events(
     )
     logs_to_process: list[LogEvent] = []
     extra_logs_to_save: list[LogEvent] = []
+    # Dumps of the log events, pushed to the log queue
+    log_dumps_to_process: list[dict] = []
+    extra_log_dumps_to_save: list[dict] = []
 
     for log_event_model in log_request.batched_log_events:
         # We now validate the logs
@@ -73,16 +78,22 @@ async def store_batch_of_log_events(
                     org, log_event_model.project_id
                 )
 
+            # The fields of the minimal log event are already validated: they are
+            # passed as is, without a dump, and the log event is validated once
             valid_log_event = LogEvent.model_validate(
-                log_event_model.model_dump(), strict=True
+                {**log_event_model.__dict__, **(log_event_model.model_extra or {})},
+                strict=True,
             )
+            # Dumped once: used for the size check and by the log queue. The consumers
+            # of the log queue don't validate it again.
+            log_event_dump = valid_log_event.model_dump()
 
             # Compute the object size in bytes
-            object_size = sys.getsizeof(valid_log_event.model_dump())
+            object_size = sys.getsizeof(log_event_dump)
             if object_size > 2_000_000:
                 logger.warning(
                     f"Large log event project {project_id}: {object_size} bytes"
-                    + f"\n{valid_log_event.model_dump()}"
+                    + f"\n{log_event_dump}"
                 )
 
             # Process this log only if the usage quota is not reached
@@ -91,11 +102,13 @@ async def store_batch_of_log_events(
             ):
                 current_usage += 1
                 logs_to_process.append(valid_log_event)
+                log_dumps_to_process.append(log_event_dump)
                 logged_events.append(valid_log_event)
             else:
                 logger.warning(f"Max usage quota reached for project: {project_id}")
                 background_tasks.add_task(send_quota_exceeded_email, project_id)
                 extra_logs_to_save.append(valid_log_event)
+                extra_log_dumps_to_save.append(log_event_dump)
                 logged_events.append(
                     LogError(
                         error_in_log=f"Max usage quota reached for project {project_id}: {current_usage}/{max_usage} logs"
@@ -117,6 +130,17 @@ async def store_batch_of_log_events(
         f"Project {project_id} replying to log request with {len(logged_events)}: {len(logs_to_process)} valid logs and {len(extra_logs_to_save)} extra logs to save."
     )
 
+    if config.LOG_INGESTION_MODE == "queue":
+        # Processed by the log queue consumers
+        if logs_to_process or extra_logs_to_save:
+            await get_log_queue().push(
+                project_id=project_id,
+                org_id=org.org.org_id,
+                logs_to_process=log_dumps_to_process,
+                extra_logs_to_save=extra_log_dumps_to_save,
+            )
+        return log_reply
+
     background_tasks.add_task(
         create_task_and_process_logs,
         logs_to_process=logs_to_process,
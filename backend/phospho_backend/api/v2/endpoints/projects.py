@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from propelauth_py.types.user import OrgApiKeyValidation  # type: ignore
 
+from phospho_backend.api.platform.models.explore import Pagination
 from phospho_backend.api.v2.models import (
     FlattenedTasks,
+    FlattenedTasksExportRequest,
     FlattenedTasksRequest,
     QuerySessionsTasksRequest,
     Sessions,
@@ -12,10 +15,21 @@ from phospho_backend.security import (
     authenticate_org_key,
     verify_propelauth_org_owns_project_id,
 )
-from phospho_backend.services.mongo.sessions import get_all_sessions
+from phospho_backend.services.export import (
+    EXPORT_MEDIA_TYPES,
+    encode_flattened_tasks_arrow,
+    encode_ndjson,
+)
+from phospho_backend.services.mongo.sessions import (
+    get_all_sessions,
+    get_sessions_next_cursor,
+)
 from phospho_backend.services.mongo.tasks import (
     fetch_flattened_tasks,
     get_all_tasks,
+    get_flattened_tasks_next_cursor,
+    get_tasks_next_cursor,
+    stream_flattened_tasks,
     update_from_flattened_tasks,
 )
 
@@ -30,11 +44,20 @@ router = APIRouter(tags=["Projects"])
 async def get_sessions(
     project_id: str,
     limit: int = 1000,
+    cursor: str | None = None,
     org: OrgApiKeyValidation = Depends(authenticate_org_key),
 ):
+    """
+    Fetch the sessions of a project, by pages of limit sessions.
+    To get the next page, pass the next_cursor of the response as cursor.
+    """
     await verify_propelauth_org_owns_project_id(org, project_id)
-    sessions = await get_all_sessions(project_id, limit)
-    return Sessions(sessions=sessions)
+    pagination = Pagination(page=0, per_page=limit, cursor=cursor)
+    sessions = await get_all_sessions(project_id, limit, pagination=pagination)
+    return Sessions(
+        sessions=sessions,
+        next_cursor=get_sessions_next_cursor(sessions, pagination),
+    )
 
 
 @router.post(
@@ -51,6 +74,8 @@ async def post_tasks(
     Fetch all the tasks of a project.
 
     The filters are combined as AND conditions on the different fields.
+    The tasks are returned by pages of limit tasks. To get the next page, pass the
+    next_cursor of the response as cursor.
     """
     await verify_propelauth_org_owns_project_id(org, project_id)
     if query is None:
@@ -60,13 +85,17 @@ async def post_tasks(
             query.filters.metadata = {}
         query.filters.metadata["user_id"] = query.filters.user_id
 
+    pagination = None
+    if query.limit is not None:
+        pagination = Pagination(page=0, per_page=query.limit, cursor=query.cursor)
     tasks = await get_all_tasks(
         project_id=project_id,
         limit=query.limit,
         validate_metadata=True,
         filters=query.filters,
+        pagination=pagination,
     )
-    return Tasks(tasks=tasks)
+    return Tasks(tasks=tasks, next_cursor=get_tasks_next_cursor(tasks, pagination))
 
 
 @router.post(
@@ -81,17 +110,64 @@ async def get_flattened_tasks(
 ) -> FlattenedTasks:
     """
     Get all the tasks of a project in a flattened format.
+    The tasks are returned by pages of limit tasks. To get the next page, pass the
+    next_cursor of the response as cursor.
     """
     await verify_propelauth_org_owns_project_id(org, project_id)
 
+    pagination = Pagination(
+        page=0,
+        per_page=flattened_tasks_request.limit,
+        cursor=flattened_tasks_request.cursor,
+    )
     flattened_tasks = await fetch_flattened_tasks(
         project_id=project_id,
         limit=flattened_tasks_request.limit,
+        pagination=pagination,
         with_events=flattened_tasks_request.with_events,
         with_sessions=flattened_tasks_request.with_sessions,
         keep_removed_events=flattened_tasks_request.with_removed_events,
     )
-    return FlattenedTasks(flattened_tasks=flattened_tasks)
+    return FlattenedTasks(
+        flattened_tasks=flattened_tasks,
+        next_cursor=get_flattened_tasks_next_cursor(flattened_tasks, pagination),
+    )
+
+
+@router.post(
+    "/projects/{project_id}/tasks/flat/export",
+    description="Stream all the tasks of a project in a flattened format, as NDJSON or Arrow",
+)
+async def export_flattened_tasks(
+    project_id: str,
+    export_request: FlattenedTasksExportRequest,
+    org: OrgApiKeyValidation = Depends(authenticate_org_key),
+) -> StreamingResponse:
+    """
+    Stream the tasks of a project in a flattened format, chunk by chunk.
+
+    - ndjson: one flattened task per line
+    - arrow: an Arrow IPC stream with one record batch per chunk. The task_metadata.{key}
+    fields are grouped in a task_metadata column, as a JSON object.
+    """
+    await verify_propelauth_org_owns_project_id(org, project_id)
+
+    chunks = stream_flattened_tasks(
+        project_id=project_id,
+        limit=export_request.limit,
+        with_events=export_request.with_events,
+        with_sessions=export_request.with_sessions,
+        keep_removed_events=export_request.with_removed_events,
+        filters=export_request.filters,
+        chunk_size=export_request.chunk_size,
+    )
+    if export_request.format == "arrow":
+        content = encode_flattened_tasks_arrow(chunks)
+    else:
+        content = encode_ndjson(chunks)
+    return StreamingResponse(
+        content, media_type=EXPORT_MEDIA_TYPES[export_request.format]
+    )
 
 
 @router.post(
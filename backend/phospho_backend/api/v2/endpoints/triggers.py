@@ -14,6 +14,7 @@ from phospho_backend.services.integrations.postgresql import (
 )
 from phospho_backend.services.mongo.ai_hub import AIHubClient, ClusteringRequest
 from phospho_backend.services.mongo.projects import get_project_by_id
+from phospho_backend.services.mongo.rollups import invalidate_daily_rollups
 from phospho_backend.services.mongo.triggers import aggregate_tasks_into_sessions
 
 router = APIRouter(tags=["Trigger"])
@@ -99,6 +100,8 @@ async def trigger_calculate_sessions(
             logger.info(
                 f"Inserted {len(sessions)} new sessions for project {project_id}"
             )
+            # The creation dates of the sessions changed
+            await invalidate_daily_rollups(project_id)
 
         return {
             "status": "ok",
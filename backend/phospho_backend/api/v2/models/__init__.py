@@ -30,6 +30,7 @@ from .log import (
 from .models import Model, ModelsResponse
 from .projects import (
     ComputeJobsRequest,
+    FlattenedTasksExportRequest,
     FlattenedTasksRequest,
     ProjectCreationRequest,
     Projects,
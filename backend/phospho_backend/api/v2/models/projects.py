@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
 from phospho_backend.db.models import (
@@ -47,6 +49,8 @@ class UserMetadata(BaseModel):
 
 class Users(BaseModel):
     users: list[UserMetadata]
+    # Cursor of the next page, None if it's the last page or the users are not paginated
+    next_cursor: str | None = None
 
 
 class FlattenedTasksRequest(BaseModel):
@@ -54,6 +58,20 @@ class FlattenedTasksRequest(BaseModel):
     with_events: bool = True
     with_sessions: bool = True
     with_removed_events: bool = False
+    # next_cursor of the previous page
+    cursor: str | None = None
+
+
+class FlattenedTasksExportRequest(BaseModel):
+    # None to export all the tasks
+    limit: int | None = None
+    with_events: bool = True
+    with_sessions: bool = True
+    with_removed_events: bool = False
+    filters: ProjectDataFilters = Field(default_factory=ProjectDataFilters)
+    format: Literal["ndjson", "arrow"] = "ndjson"
+    # Number of rows per chunk (ndjson) or record batch (arrow)
+    chunk_size: int = Field(default=1000, ge=1, le=10_000)
 
 
 class ComputeJobsRequest(BaseModel):
@@ -64,3 +82,5 @@ class ComputeJobsRequest(BaseModel):
 class QuerySessionsTasksRequest(BaseModel):
     filters: ProjectDataFilters = Field(default_factory=ProjectDataFilters)
     limit: int | None = 1000
+    # next_cursor of the previous page
+    cursor: str | None = None
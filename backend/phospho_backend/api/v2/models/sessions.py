@@ -5,6 +5,8 @@ from phospho_backend.db.models import Session
 
 class Sessions(BaseModel):
     sessions: list[Session]
+    # Cursor of the next page, None if it's the last page or the sessions are not paginated
+    next_cursor: str | None = None
 
 
 class SessionCreationRequest(BaseModel):
@@ -9,6 +9,8 @@ from phospho_backend.utils import generate_uuid
 
 class Tasks(BaseModel):
     tasks: list[Task]
+    # Cursor of the next page, None if it's the last page or the tasks are not paginated
+    next_cursor: str | None = None
 
 
 class TaskCreationRequest(BaseModel):
@@ -48,3 +50,5 @@ class TaskUpdateRequest(BaseModel):
 
 class FlattenedTasks(BaseModel):
     flattened_tasks: list[FlattenedTask]
+    # Cursor of the next page, None if it's the last page or the tasks are not paginated
+    next_cursor: str | None = None
@@ -18,7 +18,10 @@ from phospho_backend.security import (
     verify_propelauth_org_owns_project_id,
 )
 from phospho_backend.services.mongo.dataviz import breakdown_by_sum_of_metadata_field
-from phospho_backend.services.mongo.users import fetch_users_metadata
+from phospho_backend.services.mongo.users import (
+    fetch_users_metadata,
+    get_users_next_cursor,
+)
 from phospho_backend.utils import cast_datetime_or_timestamp_to_timestamp
 from propelauth_py.types.user import OrgApiKeyValidation  # type: ignore
 
@@ -101,4 +104,7 @@ async def get_users(
         pagination=query.pagination,
         user_id_search=query.user_id_search,
     )
-    return Users(users=users)
+    return Users(
+        users=users,
+        next_cursor=get_users_next_cursor(users, query.pagination, query.sorting),
+    )
@@ -3,6 +3,7 @@ from typing import Optional
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
 from loguru import logger
 from opentelemetry.proto.trace.v1.trace_pb2 import TracesData  # type: ignore
+from phospho_backend.api.compression import DecompressedBodyRoute
 from phospho_backend.api.v3.models.log import (
     LogError,
     LogReply,
@@ -20,7 +21,7 @@ from phospho_backend.services.mongo.emails import send_quota_exceeded_email
 from phospho_backend.services.mongo.extractor import ExtractorClient
 from propelauth_py.types.user import OrgApiKeyValidation  # type: ignore
 
-router = APIRouter(tags=["Log"])
+router = APIRouter(tags=["Log"], route_class=DecompressedBodyRoute)
 
 
 @router.post(
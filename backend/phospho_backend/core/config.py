@@ -32,8 +32,34 @@ if MONGODB_NAME == "production" and ENVIRONMENT != "production":
     raise Exception("MONGODB_NAME is set to 'production' in non-production environment")
 
 
+### CACHE ###
+# Cache of the project and organization metadata used by the authentification and quota checks
+# If REDIS_URL is set, the cache is shared by all the instances. Otherwise, it's in-process.
+REDIS_URL = os.getenv("REDIS_URL")
+# Number of seconds a cached value is kept. 0 disables the cache.
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", 60))
+
 IS_MAINTENANCE = os.getenv("IS_MAINTENANCE", "false") == "true"
 
+### LOG INGESTION ###
+# How the log events received by /log are processed:
+# - "background": in a background task of the API worker that received them
+# - "queue": stored in a durable queue (the log_queue collection), then processed by consumers
+LOG_INGESTION_MODE = os.getenv("LOG_INGESTION_MODE", "background")
+# Number of consumers of the log queue run by each API worker
+# Set it to 0 and run `python -m phospho_backend.services.log_queue` to scale them separately
+LOG_QUEUE_CONSUMERS = int(os.getenv("LOG_QUEUE_CONSUMERS", 2))
+# Maximum number of queued log requests processed together by a consumer
+LOG_QUEUE_BATCH_SIZE = int(os.getenv("LOG_QUEUE_BATCH_SIZE", 20))
+
+### DASHBOARDS ###
+# Maximum number of metrics of a dashboard request computed at the same time
+METRICS_CONCURRENCY = int(os.getenv("METRICS_CONCURRENCY", 4))
+# Number of seconds after which a metric is left out of the dashboard response
+METRIC_TIMEOUT = float(os.getenv("METRIC_TIMEOUT", 30))
+# Number of seconds after which a daily rollup is recomputed, even if not marked dirty
+ROLLUPS_TTL = int(os.getenv("ROLLUPS_TTL", 24 * 60 * 60))
+
 ### USAGE LIMITS ###
 PLAN_HOBBY_MAX_NB_DETECTIONS = 10
 
@@ -43,6 +69,11 @@ PLAN_SELFHOSTED_MAX_USERS = os.getenv("PLAN_SELFHOSTED_MAX_USERS", 100)
 
 QUERY_MAX_LEN_LIMIT = 2000  # Limit the number of returned rows for a query to run_analytics_query() service
 
+# Limit the size of compressed request bodies once decompressed (in bytes)
+MAX_DECOMPRESSED_BODY_SIZE = int(
+    os.getenv("MAX_DECOMPRESSED_BODY_SIZE", 100 * 1024 * 1024)
+)
+
 ### DOCUMENTATION ##
 
 ADMIN_EMAIL = "notifications@phospho.ai"  # Used when new users sign up
@@ -188,6 +219,19 @@ except Exception:
     TEMPORAL_MTLS_TLS_CERT = None
     TEMPORAL_MTLS_TLS_KEY = None
 
+# Fire-and-forget workflows of the same project started within this number of seconds
+# are started as a single workflow. Set it to 0 to start every workflow right away.
+EXTRACTOR_BATCH_WINDOW = float(os.getenv("EXTRACTOR_BATCH_WINDOW", 0.5))
+# Maximum number of items (tasks, logs) in a batched workflow
+EXTRACTOR_BATCH_MAX_SIZE = int(os.getenv("EXTRACTOR_BATCH_MAX_SIZE", 500))
+# Maximum size in bytes of the items of a batched workflow, below the 2 MB limit of the
+# Temporal payloads
+EXTRACTOR_BATCH_MAX_BYTES = int(os.getenv("EXTRACTOR_BATCH_MAX_BYTES", 1_000_000))
+# Number of attempts to start a batched workflow before giving up
+EXTRACTOR_BATCH_MAX_ATTEMPTS = int(os.getenv("EXTRACTOR_BATCH_MAX_ATTEMPTS", 3))
+# Number of seconds the billing context of an organization sent to the extractor is cached
+EXTRACTOR_CONTEXT_CACHE_TTL = int(os.getenv("EXTRACTOR_CONTEXT_CACHE_TTL", 30))
+
 API_TRIGGER_SECRET = os.getenv("API_TRIGGER_SECRET")
 if API_TRIGGER_SECRET is None:
     logger.warning("API_TRIGGER_SECRET is missing from the environment variables")
@@ -0,0 +1,136 @@
+"""
+Async TTL cache of the metadata read on every request: project -> org ownership,
+organization metadata and projects.
+
+The values must be JSON serializable. By default the cache is in-process. If
+config.REDIS_URL is set, it's stored in Redis and shared by all the instances of the
+backend, so that an invalidation on one instance is seen by the others.
+
+```python
+project_data = await get_or_set("project", project_id, load_project_data)
+# After updating the project
+await invalidate("project", project_id)
+```
+"""
+
+import json
+import time
+from typing import Any, Awaitable, Callable
+
+from loguru import logger
+
+from phospho_backend.core import config
+
+
+class InMemoryCache:
+    """TTL cache in the memory of the process"""
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        # key -> (expires_at, value)
+        self.values: dict[str, tuple[float, Any]] = {}
+
+    async def get(self, key: str) -> Any | None:
+        item = self.values.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            self.values.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        if len(self.values) >= self.max_size:
+            # Remove the expired values, then the oldest ones
+            now = time.time()
+            self.values = {k: v for k, v in self.values.items() if v[0] >= now}
+            while len(self.values) >= self.max_size:
+                self.values.pop(next(iter(self.values)))
+        self.values[key] = (time.time() + ttl, value)
+
+    async def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+
+class RedisCache:
+    """TTL cache in Redis (or any server compatible with the Redis protocol)"""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis  # type: ignore
+        except ImportError:
+            raise ImportError(
+                "The redis package is required to use REDIS_URL. Install it with `pip install redis`."
+            )
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Any | None:
+        value = await self.client.get(key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self.client.set(key, json.dumps(value), ex=max(int(ttl), 1))
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(key)
+
+
+cache: InMemoryCache | RedisCache | None = None
+
+
+def get_cache() -> InMemoryCache | RedisCache:
+    global cache
+    if cache is None:
+        if config.REDIS_URL:
+            cache = RedisCache(config.REDIS_URL)
+        else:
+            cache = InMemoryCache()
+    return cache
+
+
+def _cache_key(namespace: str, key: str) -> str:
+    return f"phospho:{namespace}:{key}"
+
+
+async def get_or_set(
+    namespace: str,
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    ttl: float | None = None,
+) -> Any:
+    """
+    Return the cached value of the key, or call loader() and cache its result.
+    None results are not cached. The cache errors are logged and the loader is used instead.
+    """
+    if ttl is None:
+        ttl = config.METADATA_CACHE_TTL
+    if ttl <= 0:
+        return await loader()
+
+    cache_key = _cache_key(namespace, key)
+    try:
+        value = await get_cache().get(cache_key)
+        if value is not None:
+            return value
+    except Exception as e:
+        logger.warning(f"Error reading {cache_key} from the cache: {e}")
+
+    value = await loader()
+    if value is not None:
+        try:
+            await get_cache().set(cache_key, value, ttl)
+        except Exception as e:
+            logger.warning(f"Error writing {cache_key} to the cache: {e}")
+    return value
+
+
+async def invalidate(namespace: str, key: str) -> None:
+    """Remove a value from the cache. Call this after updating the underlying data."""
+    cache_key = _cache_key(namespace, key)
+    try:
+        await get_cache().delete(cache_key)
+    except Exception as e:
+        logger.warning(f"Error removing {cache_key} from the cache: {e}")
@@ -204,6 +204,35 @@ async def connect_and_init_db():
                 ["project_id", "task_id"], background=True
             )
 
+            # Cache of the LLM calls of the extractor jobs. Expired documents are removed.
+            mongo_db[MONGODB_NAME]["llm_cache"].create_index(
+                "expires_at", expireAfterSeconds=0, background=True
+            )
+
+            # Queue of the log requests (LOG_INGESTION_MODE == "queue")
+            mongo_db[MONGODB_NAME]["log_queue"].create_index(
+                "id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["log_queue"].create_index(
+                ["status", "created_at"], background=True
+            )
+
+            # Daily rollups of the dashboard metrics
+            mongo_db[MONGODB_NAME]["daily_rollups"].create_index(
+                ["project_id", "date"], background=True
+            )
+
+            # Outbox of the webhooks sent by the extractor
+            mongo_db[MONGODB_NAME]["webhook_outbox"].create_index(
+                "id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["webhook_outbox"].create_index(
+                ["status", "next_attempt_at"], background=True
+            )
+            mongo_db[MONGODB_NAME]["webhook_outbox"].create_index(
+                "claim_id", background=True
+            )
+
         except Exception as e:
             logger.warning(f"Error while connecting to Mongo: {e}")
             raise e
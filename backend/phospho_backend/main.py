@@ -12,6 +12,11 @@ from phospho_backend.api.v3 import endpoints as v3_endpoints
 from phospho_backend.core import config
 from phospho_backend.db.mongo import close_mongo_db, connect_and_init_db
 from phospho_backend.services.integrations import check_health_argilla
+from phospho_backend.services.log_queue import (
+    start_log_queue_consumers,
+    stop_log_queue_consumers,
+)
+from phospho_backend.services.mongo.extractor import flush_workflow_batches
 
 logging.info(f"ENVIRONMENT : {config.ENVIRONMENT}")
 
@@ -104,8 +109,14 @@ app.add_middleware(
 # Database
 
 app.add_event_handler("startup", connect_and_init_db)
+app.add_event_handler("shutdown", stop_log_queue_consumers)
+# Start the workflows batched by the ExtractorClient
+app.add_event_handler("shutdown", flush_workflow_batches)
 app.add_event_handler("shutdown", close_mongo_db)
 
+# Consumers of the log queue (if LOG_INGESTION_MODE == "queue")
+app.add_event_handler("startup", start_log_queue_consumers)
+
 
 # Other services
 app.add_event_handler("startup", check_health_argilla)
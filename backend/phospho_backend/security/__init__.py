@@ -1,5 +1,7 @@
 from .authentification import (
     authenticate_org_key,
+    fetch_org_metadata,
+    fetch_project_org_id,
     propelauth,
     verify_if_propelauth_user_can_access_project,
     verify_propelauth_org_owns_project_id,
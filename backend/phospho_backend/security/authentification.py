@@ -12,6 +12,7 @@ from propelauth_fastapi import User, init_auth  # type: ignore
 from propelauth_py.types.user import OrgApiKeyValidation  # type: ignore
 
 from phospho_backend.core import config
+from phospho_backend.db.cache import get_or_set, invalidate
 from phospho_backend.db.mongo import get_mongo_db
 
 propelauth = init_auth(config.PROPELAUTH_URL, config.PROPELAUTH_API_KEY)
@@ -20,6 +21,48 @@ propelauth = init_auth(config.PROPELAUTH_URL, config.PROPELAUTH_API_KEY)
 bearer = HTTPBearer()
 
 
+async def fetch_project_org_id(project_id: str) -> str | None:
+    """
+    Get the org_id of a project, or None if the project doesn't exist or has no org_id.
+    Cached, since it's checked on every request with a project_id.
+    """
+
+    async def load() -> str | None:
+        mongo_db = await get_mongo_db()
+        project_data = await mongo_db["projects"].find_one(
+            {"id": project_id}, {"org_id": 1}
+        )
+        if not project_data:
+            return None
+        return project_data.get("org_id")
+
+    return await get_or_set("project_org_id", project_id, load)
+
+
+async def fetch_org_metadata(org_id: str) -> dict | None:
+    """
+    Get the metadata of an organization in propelauth (plan, customer_id...),
+    or None if the organization doesn't exist. Cached to avoid a call to propelauth.
+    """
+
+    async def load() -> dict | None:
+        org = propelauth.fetch_org(org_id)
+        if not org:
+            return None
+        return org.metadata or {}
+
+    return await get_or_set("org_metadata", org_id, load)
+
+
+async def update_org_metadata(org_id: str, **kwargs) -> None:
+    """
+    Update the organization in propelauth and invalidate its cached metadata.
+    Same arguments as propelauth.update_org_metadata
+    """
+    propelauth.update_org_metadata(org_id, **kwargs)
+    await invalidate("org_metadata", org_id)
+
+
 def is_org_in_alpha(org: OrgApiKeyValidation) -> bool:
     """
     Check if an organization is in the alpha program
@@ -121,14 +164,12 @@ async def verify_propelauth_org_owns_project_id(
     if not org_id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    mongo_db = await get_mongo_db()
-    project_data = await mongo_db["projects"].find_one({"id": project_id})
-    if not project_data:
+    org_id_of_project = await fetch_project_org_id(project_id)
+    if not org_id_of_project:
         raise HTTPException(
             status_code=404,
             detail=f"Project {project_id} not found",
         )
-    org_id_of_project = project_data.get("org_id")
 
     # Check that the org is the owner of the project
     if org_id != org_id_of_project:
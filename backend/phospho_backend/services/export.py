@@ -0,0 +1,120 @@
+"""
+Encoding of the streamed exports.
+
+The rows are received by chunks (see stream_flattened_tasks) and encoded chunk by chunk,
+so that the whole export is never held in memory:
+
+- ndjson: one JSON object per line
+- arrow: an Arrow IPC stream, with one record batch per chunk
+"""
+
+import io
+import json
+from typing import AsyncIterator, Callable, Literal, get_args, get_origin
+
+from phospho.models import FlattenedTask
+
+ExportFormat = Literal["ndjson", "arrow"]
+
+EXPORT_MEDIA_TYPES: dict[str, str] = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+async def encode_ndjson(chunks: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        yield "".join(json.dumps(row, default=str) + "\n" for row in chunk).encode(
+            "utf-8"
+        )
+
+
+def _to_int(value: object) -> int | None:
+    return None if value is None else int(value)  # type: ignore
+
+
+def _to_float(value: object) -> float | None:
+    return None if value is None else float(value)  # type: ignore
+
+
+def _to_str(value: object) -> str | None:
+    return None if value is None else str(value)
+
+
+def _flattened_task_arrow_columns() -> list[tuple[str, object, Callable]]:
+    """(name, arrow type, cast) of the columns of FlattenedTask, in order"""
+    import pyarrow as pa
+
+    columns: list[tuple[str, object, Callable]] = []
+    for name, field in FlattenedTask.model_fields.items():
+        # Optional[X] -> X
+        python_type = next(
+            (arg for arg in get_args(field.annotation) if arg is not type(None)),
+            field.annotation,
+        )
+        if python_type is bool:
+            columns.append((name, pa.bool_(), lambda value: value))
+        elif python_type is int:
+            columns.append((name, pa.int64(), _to_int))
+        elif python_type is float:
+            columns.append((name, pa.float64(), _to_float))
+        elif get_origin(python_type) is list:
+            columns.append((name, pa.list_(pa.string()), lambda value: value))
+        else:
+            columns.append((name, pa.string(), _to_str))
+    return columns
+
+
+async def encode_flattened_tasks_arrow(
+    chunks: AsyncIterator[list[dict]],
+) -> AsyncIterator[bytes]:
+    """
+    The schema of the stream is fixed: the columns of FlattenedTask, plus a task_metadata
+    column with the task_metadata.{key} fields of the row as a JSON object.
+    """
+    import pyarrow as pa
+
+    columns = _flattened_task_arrow_columns()
+    column_names = {name for name, _, _ in columns}
+    schema = pa.schema(
+        [pa.field(name, arrow_type) for name, arrow_type, _ in columns]
+        + [pa.field("task_metadata", pa.string())]
+    )
+
+    # The writer writes to the buffer, which is emptied after each record batch
+    buffer = io.BytesIO()
+    writer = pa.ipc.new_stream(buffer, schema)
+
+    def drain() -> bytes:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    async for chunk in chunks:
+        arrays = [
+            pa.array([cast(row.get(name)) for row in chunk], type=arrow_type)
+            for name, arrow_type, cast in columns
+        ]
+        arrays.append(
+            pa.array(
+                [
+                    json.dumps(
+                        {
+                            key.removeprefix("task_metadata."): value
+                            for key, value in row.items()
+                            if key not in column_names
+                        },
+                        default=str,
+                    )
+                    for row in chunk
+                ],
+                type=pa.string(),
+            )
+        )
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield drain()
+
+    # End of stream marker
+    writer.close()
+    yield drain()
@@ -1,23 +1,20 @@
-from datetime import datetime
-from typing import Literal
+import asyncio
+import contextlib
+import io
+from datetime import UTC, datetime
+from typing import AsyncIterator, Callable, Literal
 
-import pandas as pd
 from fastapi import HTTPException
 from loguru import logger
-from phospho.models import FlattenedTask, ProjectDataFilters
-from phospho_backend.api.platform.models import Pagination
+from phospho.models import ProjectDataFilters
 from phospho_backend.core import config, constants
 from phospho_backend.db.mongo import get_mongo_db
 from phospho_backend.services.mongo.dataviz import collect_unique_metadata_fields
-from phospho_backend.services.mongo.tasks import (
-    fetch_flattened_tasks,
-    get_total_nb_of_tasks,
-)
+from phospho_backend.services.mongo.tasks import stream_flattened_tasks
 from phospho_backend.utils import generate_uuid, slugify_string
 from pydantic import BaseModel, Field
 from sqlalchemy import create_engine
 from sqlalchemy.sql import text
-from tqdm import tqdm
 
 
 class PostgresqlCredentials(BaseModel, extra="allow"):
@@ -33,6 +30,172 @@ class PostgresqlCredentials(BaseModel, extra="allow"):
     # Projects that have finished exporting are stored here
     projects_finished: list[str] = Field(default_factory=list)
     last_updated: datetime | None = None
+    # Start of the last successful export of each project, by project_id
+    projects_last_updated: dict[str, datetime] = Field(default_factory=dict)
+
+
+def _escape_copy_text(value: str) -> str:
+    """Escape a value for the text format of COPY. Postgres text can't contain NUL."""
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\x00", "")
+    )
+
+
+def _encode_copy_text(value: object) -> str | None:
+    if value is None:
+        return None
+    return _escape_copy_text(str(value))
+
+
+def _encode_copy_float(value: object) -> str | None:
+    try:
+        return repr(float(value))  # type: ignore
+    except (TypeError, ValueError):
+        return None
+
+
+def _encode_copy_int(value: object) -> str | None:
+    try:
+        return str(int(value))  # type: ignore
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _encode_copy_bool(value: object) -> str | None:
+    if value is None:
+        return None
+    return "t" if value else "f"
+
+
+def _encode_copy_timestamp(value: object) -> str | None:
+    """The timestamps of the tasks are stored in seconds"""
+    try:
+        return (
+            datetime.fromtimestamp(float(value), UTC)  # type: ignore
+            .replace(tzinfo=None)
+            .isoformat(sep=" ")
+        )
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def _copy_encoder(data_type: str) -> Callable[[object], str | None]:
+    """Encoder of the values of a column, based on its Postgres data type"""
+    if data_type.startswith("timestamp"):
+        return _encode_copy_timestamp
+    if data_type in ("real", "double precision", "numeric"):
+        return _encode_copy_float
+    if data_type in ("bigint", "integer", "smallint"):
+        return _encode_copy_int
+    if data_type == "boolean":
+        return _encode_copy_bool
+    return _encode_copy_text
+
+
+def encode_copy_batch(rows: list[dict], column_types: dict[str, str]) -> bytes:
+    """
+    Encode rows in the text format of COPY, for the columns of column_types (in order).
+    The batch is built column by column, each column with the encoder of its type.
+    """
+    columns = []
+    for column, data_type in column_types.items():
+        encoder = _copy_encoder(data_type)
+        columns.append([encoder(row.get(column)) for row in rows])
+    lines = (
+        "\t".join("\\N" if value is None else value for value in line)
+        for line in zip(*columns)
+    )
+    return "".join(line + "\n" for line in lines).encode("utf-8")
+
+
+class PostgresqlCopyLoader:
+    """
+    Loads batches of flattened tasks into a table with COPY. The rows are first copied
+    into a temporary staging table, then replace the rows of the same tasks in the table,
+    so that the tasks exported again (because they changed) are not duplicated.
+
+    Blocking: run the methods in a worker thread.
+    """
+
+    def __init__(
+        self, connection_string: str, table_name: str, column_types: dict[str, str]
+    ):
+        self.engine = create_engine(connection_string)
+        self.table_name = table_name
+        self.staging_table_name = f"{table_name}_staging"
+        self.column_types = column_types
+        self.connection = None
+
+    def _columns(self) -> str:
+        return ", ".join(f'"{column}"' for column in self.column_types.keys())
+
+    def open(self):
+        self.connection = self.engine.raw_connection()
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {self.staging_table_name} (LIKE {self.table_name} INCLUDING DEFAULTS);"
+            )
+        self.connection.commit()
+
+    def load(self, data: bytes) -> None:
+        """Copy a batch encoded with encode_copy_batch, in a single transaction"""
+        if self.connection is None:
+            raise ValueError("The loader is not open")
+        columns = self._columns()
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {self.staging_table_name} ({columns}) FROM STDIN",
+                    io.BytesIO(data),
+                )
+                cursor.execute(
+                    f"DELETE FROM {self.table_name} USING (SELECT DISTINCT task_id FROM {self.staging_table_name}) AS staging WHERE {self.table_name}.task_id = staging.task_id;"
+                )
+                cursor.execute(
+                    f"INSERT INTO {self.table_name} ({columns}) SELECT {columns} FROM {self.staging_table_name} ON CONFLICT DO NOTHING;"
+                )
+                cursor.execute(f"TRUNCATE {self.staging_table_name};")
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.engine.dispose()
+
+
+async def group_rows_by_task(
+    chunks: AsyncIterator[list[dict]],
+) -> AsyncIterator[list[dict]]:
+    """
+    The rows of a task (one per event) are consecutive, but can be split between two
+    chunks. Move the rows of the last task of each chunk to the next one, so that
+    all the rows of a task are loaded together.
+    """
+    pending: list[dict] = []
+    async for chunk in chunks:
+        rows = pending + chunk
+        if not rows:
+            continue
+        last_task_id = rows[-1].get("task_id")
+        split = len(rows)
+        while split > 0 and rows[split - 1].get("task_id") == last_task_id:
+            split -= 1
+        if split == 0:
+            # A single task in the chunk
+            pending = rows
+            continue
+        pending = rows[split:]
+        yield rows[:split]
+    if pending:
+        yield pending
 
 
 class PostgresqlIntegration:
@@ -221,7 +384,10 @@ class PostgresqlIntegration:
                 {
                     "$pull": {"projects_started": self.project_id},
                     "$addToSet": {"projects_finished": self.project_id},
-                    "$set": {"last_updated": self.update_start_time},
+                    "$set": {
+                        "last_updated": self.update_start_time,
+                        f"projects_last_updated.{self.project_id}": self.update_start_time,
+                    },
                 },
                 return_document=True,
             )
@@ -389,16 +555,132 @@ class PostgresqlIntegration:
             columns = [column[0] for column in result]
         return columns
 
+    def get_table_column_types(self) -> dict[str, str]:
+        """
+        Get the columns of the table and their data types, in the order of the table.
+        """
+        engine = create_engine(self._connection_string())
+        with engine.connect() as connection:
+            result = connection.execute(
+                text(
+                    f"SELECT column_name, data_type FROM information_schema.columns WHERE table_name = '{self.table_name()}' ORDER BY ordinal_position;"
+                )
+            )
+            column_types = {column[0]: column[1] for column in result}
+        return column_types
+
+    def last_push(self) -> datetime | None:
+        """Start of the last successful export of the project"""
+        if self.credentials is None or self.project_id is None:
+            return None
+        last_push = self.credentials.projects_last_updated.get(self.project_id)
+        if last_push is None and self.project_id in self.credentials.projects_finished:
+            # Exported before the last update was tracked by project
+            last_push = self.credentials.last_updated
+        return last_push
+
+    async def _changed_tasks_ids(self, since: int) -> list[str]:
+        """
+        Ids of the tasks created, evaluated or with new events since the timestamp
+        """
+        mongo_db = await get_mongo_db()
+        tasks_ids: set[str] = set()
+        async for task in mongo_db["tasks"].find(
+            {
+                "project_id": self.project_id,
+                "$or": [
+                    {"created_at": {"$gte": since}},
+                    {"last_eval.created_at": {"$gte": since}},
+                ],
+            },
+            {"id": 1},
+        ):
+            tasks_ids.add(task["id"])
+        async for event in mongo_db["events"].find(
+            {
+                "project_id": self.project_id,
+                "created_at": {"$gte": since},
+                "task_id": {"$ne": None},
+            },
+            {"task_id": 1},
+        ):
+            tasks_ids.add(event["task_id"])
+        return sorted(tasks_ids)
+
+    async def _stream_tasks(
+        self, project_id: str, batch_size: int, since: int | None
+    ) -> AsyncIterator[list[dict]]:
+        """Rows of the tasks to export, by chunks. Only the changed tasks if since is set."""
+        if since is None:
+            async for chunk in stream_flattened_tasks(
+                project_id=project_id,
+                with_events=True,
+                with_sessions=True,
+                sort_get_most_recent=False,
+                chunk_size=batch_size,
+            ):
+                yield chunk
+            return
+
+        tasks_ids = await self._changed_tasks_ids(since)
+        logger.info(f"Exporting {len(tasks_ids)} tasks changed since {since}")
+        for i in range(0, len(tasks_ids), batch_size):
+            async for chunk in stream_flattened_tasks(
+                project_id=project_id,
+                with_events=True,
+                with_sessions=True,
+                sort_get_most_recent=False,
+                filters=ProjectDataFilters(tasks_ids=tasks_ids[i : i + batch_size]),
+                chunk_size=batch_size,
+            ):
+                yield chunk
+
+    async def _stream_stored_flattened_tasks(
+        self, batch_size: int
+    ) -> AsyncIterator[list[dict]]:
+        """
+        Rows of the collection flattened_tasks_{project_id}, by chunks.
+        You need to run the scripts/create_temp_table.ipynb to store the flattened_tasks before
+        """
+        mongo_db = await get_mongo_db()
+        chunk: list[dict] = []
+        async for task in mongo_db[f"flattened_tasks_{self.project_id}"].find(
+            {}, batch_size=batch_size
+        ):
+            # Remove the _id field
+            if "_id" in task.keys():
+                del task["_id"]
+            # Flatten the task_metadata field into multiple task_metadata.{key} fields
+            if "task_metadata" in task.keys():
+                for key, value in (task["task_metadata"] or {}).items():
+                    if not isinstance(value, dict) and not isinstance(value, list):
+                        task[f"task_metadata.{key}"] = value
+                    else:
+                        # TODO: Handle nested fields. For now, cast to string
+                        task[f"task_metadata.{key}"] = str(value)
+                del task["task_metadata"]
+            chunk.append(task)
+            if len(chunk) >= batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
     async def push(
         self,
-        batch_size: int = 256,
+        batch_size: int = 5000,
         only_new: bool = True,
         fetch_from_flattened_tasks: bool = False,
     ) -> Literal["success", "failure"]:
         """
         Export the project to the dedicated Postgres database.
 
-        This replaces the table if it already exists.
+        The rows of the exported tasks replace their previous rows in the table. If only_new
+        is True, only the tasks created, evaluated or with new events since the last
+        successful export are exported.
+
+        The Mongo cursor is streamed by batches of batch_size rows, and each batch is
+        loaded with COPY while the next one is fetched.
 
         The table name is the slugified project name.
         """
@@ -420,176 +702,59 @@ class PostgresqlIntegration:
         logger.info(
             f"Starting export of project {self.project_id} to dedicated Postgres {self.credentials.server}:{self.credentials.database}"
         )
-        # Create the filters
-        if only_new and self.credentials.last_updated is not None:
+        since: int | None = None
+        last_push = self.last_push()
+        if fetch_from_flattened_tasks:
             logger.info(
-                f"Exporting tasks created after {self.credentials.last_updated}"
-            )
-            filters = ProjectDataFilters(
-                created_at_start=int(self.credentials.last_updated.timestamp())
-                if self.credentials.last_updated is not None
-                else None
-            )
-        else:
-            logger.info("Exporting all tasks")
-            filters = ProjectDataFilters()
-
-        # Get the total number of tasks
-        if not fetch_from_flattened_tasks:
-            total_nb_tasks = await get_total_nb_of_tasks(
-                project_id=self.project_id,
-                filters=filters,
+                f"Exporting the existing flattened_tasks_{self.project_id} from Mongo"
             )
-            if total_nb_tasks is None or total_nb_tasks == 0:
-                logger.error("No tasks found in the project")
-                await self.update_status("finished")
-                return "success"
+            chunks = self._stream_stored_flattened_tasks(batch_size)
         else:
-            # This is the number of flattened tasks in the MongoDB
-            logger.info(
-                f"Fetching the existing flattened_tasks_{self.project_id} from Mongo"
-            )
-            mongo_db = await get_mongo_db()
-            total_nb_tasks = await mongo_db[
-                f"flattened_tasks_{self.project_id}"
-            ].count_documents({})
-            if not total_nb_tasks:
-                logger.error(
-                    f"No flattened tasks found in the project. Populate the collection flattened_tasks_{self.project_id} using the script create_temp_table.ipynb"
-                )
-                await self.update_status("failed")
-                return "failure"
+            if only_new and last_push is not None:
+                logger.info(f"Exporting tasks changed after {last_push}")
+                since = int(last_push.timestamp())
+            else:
+                logger.info("Exporting all tasks")
+            chunks = self._stream_tasks(self.project_id, batch_size, since=since)
 
-        logger.info(
-            f"Total number of tasks to export: {total_nb_tasks}. Batch size: {batch_size}"
-        )
         # Check if the table exists
         if not await self.table_exists():
             await self.create_table()
         else:
             await self.update_table_columns()
 
-        # Connect to Neon Postgres database, we add asyncpg for async support
-        debug = config.ENVIRONMENT == "test"
+        loader = PostgresqlCopyLoader(
+            self._connection_string(),
+            table_name=self.table_name(),
+            column_types=self.get_table_column_types(),
+        )
+        nb_rows = 0
+        # Load a batch while the next one is fetched from Mongo
+        loading: asyncio.Future | None = None
         try:
-            logger.debug(
-                f"Connected to Postgres {self.credentials.server}:{self.credentials.database}"
-            )
-            engine = create_engine(self._connection_string(), echo=debug)
-            nb_batches = total_nb_tasks // batch_size
-            columns = self.get_table_columns()
-            for i in tqdm(range(nb_batches + 1)):
-                if not fetch_from_flattened_tasks:
-                    raw_flattened_tasks = await fetch_flattened_tasks(
-                        project_id=self.project_id,
-                        limit=batch_size,
-                        with_events=True,
-                        with_sessions=True,
-                        pagination=Pagination(page=i, per_page=batch_size),
-                        sort_get_most_recent=False,
-                        filters=filters,
-                    )
-                    flattened_tasks = [
-                        task.model_dump() for task in raw_flattened_tasks
-                    ]
-                else:
-                    # Alternative: Directly fetch the flattened tasks from the database
-                    # You need to run the scripts/create_temp_table.ipynb to store the flattened_tasks before
-                    mongo_db = await get_mongo_db()
-                    stored_flattened_tasks = (
-                        await mongo_db[f"flattened_tasks_{self.project_id}"]
-                        .aggregate(
-                            [
-                                {"$skip": i * batch_size},
-                                {"$limit": batch_size},
-                            ]
-                        )
-                        .to_list(length=batch_size)
-                    )
-
-                    new_flattened_tasks = []
-                    for i, task in enumerate(stored_flattened_tasks):
-                        # Remove the _id field
-                        if "_id" in task.keys():
-                            del task["_id"]
-
-                        # Clean input and output
-                        if "task_input" in task.keys():
-                            task["task_input"] = task["task_input"].replace("\x00", "")
-                        if "task_output" in task.keys():
-                            task["task_output"] = task["task_output"].replace(
-                                "\x00", ""
-                            )
-
-                        # Flatten the task_metadata field into multiple task_metadata.{key} fields
-                        if "task_metadata" in task.keys():
-                            for key, value in task["task_metadata"].items():
-                                if not isinstance(value, dict) and not isinstance(
-                                    value, list
-                                ):
-                                    task[f"task_metadata.{key}"] = value
-                                else:
-                                    # TODO: Handle nested fields. For now, cast to string
-                                    task[f"task_metadata.{key}"] = str(value)
-                            del task["task_metadata"]
-
-                        # Convert to a FlattenedTask model
-                        new_task = FlattenedTask.model_validate(task)
-                        new_flattened_tasks.append(new_task.model_dump())
-
-                    flattened_tasks = new_flattened_tasks
-
-                # Cast event_categories to string (it's a list)
-                for task in flattened_tasks:
-                    if task["event_categories"] is not None:
-                        task["event_categories"] = str(task["event_categories"])
-
-                # Convert the list of FlattenedTask to a pandas dataframe
-                tasks_df = pd.DataFrame(flattened_tasks)
-
-                # Convert the timestamps to datetime
-                tasks_df["task_eval_at"] = pd.to_datetime(
-                    tasks_df["task_eval_at"], unit="s", errors="coerce"
-                )
-                tasks_df["task_created_at"] = pd.to_datetime(
-                    tasks_df["task_created_at"], unit="s", errors="coerce"
-                )
-                tasks_df["event_created_at"] = pd.to_datetime(
-                    tasks_df["event_created_at"], unit="s", errors="coerce"
-                )
-
-                # Filter out the rows with NaT values
-                tasks_df = tasks_df.dropna(
-                    subset=["task_eval_at", "task_created_at", "event_created_at"]
-                )
-
-                # Keep only the columns that are in the table
-                columns_in_common = list(set(columns).intersection(tasks_df.columns))
-                columns_in_df_not_in_table = list(set(tasks_df.columns) - set(columns))
-                if columns_in_df_not_in_table:
-                    logger.warning(
-                        f"Columns in the dataframe that are not in the table: {columns_in_df_not_in_table}"
-                    )
-                tasks_df = tasks_df[columns_in_common]
-
-                with engine.connect() as connection:
-                    # Note: to_sql is not async, we could use asyncpg directly: https://github.com/MagicStack/asyncpg
-                    pd.DataFrame.to_sql(
-                        tasks_df,
-                        self.table_name(),
-                        connection,
-                        if_exists="append",
-                        index=False,
-                    )
-
-            logger.info("Export finished")
+            await asyncio.to_thread(loader.open)
+            async for rows in group_rows_by_task(chunks):
+                data = encode_copy_batch(rows, loader.column_types)
+                if loading is not None:
+                    await loading
+                loading = asyncio.ensure_future(asyncio.to_thread(loader.load, data))
+                nb_rows += len(rows)
+            if loading is not None:
+                await loading
+
+            logger.info(f"Export finished: {nb_rows} rows")
             await self.update_status("finished")
             return "success"
         except Exception as e:
             logger.error(e)
-            raise e
             await self.update_status("failed")
-            return "failure"
+            raise e
+        finally:
+            # The connection can't be closed while a COPY is running in the thread
+            if loading is not None:
+                with contextlib.suppress(Exception):
+                    await loading
+            await asyncio.to_thread(loader.close)
 
 
 """
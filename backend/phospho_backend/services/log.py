@@ -3,14 +3,17 @@ from typing import Any
 from loguru import logger
 from phospho.lab.utils import get_tokenizer, num_tokens_from_messages
 from phospho.models import HumanEval, Session, Task
-from phospho.utils import filter_nonjsonable_keys, is_jsonable
+from phospho.utils import count_tokens, filter_nonjsonable_keys, is_jsonable
 from phospho_backend.api.v2.models import LogEvent
 from phospho_backend.db.mongo import get_mongo_db
 from phospho_backend.services.mongo.extractor import ExtractorClient
 from phospho_backend.services.mongo.projects import (
     project_check_automatic_analytics_monthly_limit,
 )
+from phospho_backend.services.mongo.rollups import mark_rollups_dirty
 from phospho_backend.utils import generate_timestamp, generate_uuid
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 
 async def create_task_and_process_logs(
@@ -18,7 +21,18 @@ async def create_task_and_process_logs(
     extra_logs_to_save: list[LogEvent],
     project_id: str,
     org_id: str,
+    log_ids: list[str] | None = None,
+    process_existing_tasks: bool = False,
 ):
+    """
+    Save the log events and create their tasks and sessions.
+
+    log_ids are the ids of the raw logs of logs_to_process + extra_logs_to_save. When they
+    are given, the logs are saved at most once, and the tasks already created are skipped
+    (with their session counters): the logs can be processed again safely. If
+    process_existing_tasks is True, the tasks already created are still sent to the
+    extractor, in case the previous processing failed before.
+    """
     mongo_db = await get_mongo_db()
 
     def log_is_error(log_event):
@@ -27,10 +41,14 @@ async def create_task_and_process_logs(
         return False
 
     nonerror_log_events = []
+    nonerror_log_ids = []
     error_log_events = []
-    for log_event in logs_to_process + extra_logs_to_save:
+    all_log_events = logs_to_process + extra_logs_to_save
+    for i, log_event in enumerate(all_log_events):
         if not log_is_error(log_event) and isinstance(log_event, LogEvent):
             nonerror_log_events.append(log_event)
+            if log_ids is not None:
+                nonerror_log_ids.append(log_ids[i])
         else:
             error_log_events.append(log_event)
 
@@ -39,10 +57,16 @@ async def create_task_and_process_logs(
     )
     # Save the non-error log events
     if len(nonerror_log_events) > 0:
+        logs_dump = [log_event.model_dump() for log_event in nonerror_log_events]
+        if log_ids is not None:
+            for log_dump, log_id in zip(logs_dump, nonerror_log_ids):
+                log_dump["_id"] = log_id
         try:
-            mongo_db["logs"].insert_many(
-                [log_event.model_dump() for log_event in nonerror_log_events]
-            )
+            await mongo_db["logs"].insert_many(logs_dump, ordered=False)
+        except BulkWriteError as e:
+            # The logs already saved by a previous processing are duplicates
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                logger.error(f"Error saving logs to the database: {e}")
         except Exception as e:
             error_mesagge = f"Error saving logs to the database: {e}"
             logger.error(error_mesagge)
@@ -73,6 +97,8 @@ async def create_task_and_process_logs(
             for log_event in logs_to_process
             if log_event.session_id is not None
         ],
+        skip_existing_tasks=log_ids is not None,
+        process_existing_tasks=process_existing_tasks,
     )
 
     if len(extra_logs_to_save) > 0:
@@ -93,6 +119,7 @@ async def create_task_and_process_logs(
                 if log_event.session_id is not None
             ],
             trigger_pipeline=False,
+            skip_existing_tasks=log_ids is not None,
         )
 
     return None
@@ -103,21 +130,47 @@ async def process_log_with_session_id(
     org_id: str,
     list_of_log_event: list[LogEvent],
     trigger_pipeline: bool = True,
+    skip_existing_tasks: bool = False,
+    process_existing_tasks: bool = False,
 ) -> None:
     """
     Process a list of log events with session_id
+
+    If skip_existing_tasks is True, the log events whose task already exists don't
+    increment their session again. If process_existing_tasks is True, these tasks are
+    still sent to the extractor.
     """
     if len(list_of_log_event) == 0:
         logger.debug("No log event with session_id to process")
         return None
 
+    existing_task_ids: list[str] = []
+    if skip_existing_tasks:
+        existing_task_ids = await get_existing_task_ids(
+            [log_event.task_id for log_event in list_of_log_event]
+        )
+        list_of_log_event = [
+            log_event
+            for log_event in list_of_log_event
+            if log_event.task_id not in existing_task_ids
+        ]
+        if not process_existing_tasks:
+            existing_task_ids = []
+        if len(list_of_log_event) == 0 and len(existing_task_ids) == 0:
+            logger.debug("All the tasks of the log events already exist")
+            return None
+
     logger.info(
         f"Project {project_id}: processing {len(list_of_log_event)} log events with session_id"
     )
     tasks_id_to_process: list[str] = []
     tasks_to_create: list[dict[str, object]] = []
+    # task_id -> created_at, to mark the rollups of the created tasks dirty
+    tasks_created_at: dict[str, int] = {}
     sessions_to_create: dict[str, dict[str, Any]] = {}
     sessions_to_earliest_task: dict[str, Task] = {}
+    # session_id -> field -> increment, for the sessions already in the database
+    session_increments: dict[str, dict[str, int]] = {}
 
     mongo_db = await get_mongo_db()
     sessions_ids_already_in_db = (
@@ -183,24 +236,10 @@ async def process_log_with_session_id(
             # Increment the session length of the session to create
             sessions_to_create[log_event.session_id]["session_length"] += 1
         elif log_event.session_id is not None and session_is_in_db:
-            # Increment the session length, total_tokens, prompt_tokens and completion_tokens in the database
-            mongo_db["sessions"].update_one(
-                {"id": log_event.session_id},
-                {
-                    "$inc": {
-                        "session_length": 1,
-                        "metadata.total_tokens": log_event_metadata.get("total_tokens")
-                        or 0,
-                        "metadata.prompt_tokens": log_event_metadata.get(
-                            "prompt_tokens"
-                        )
-                        or 0,
-                        "metadata.completion_tokens": log_event_metadata.get(
-                            "completion_tokens"
-                        )
-                        or 0,
-                    }
-                },
+            # Increment the session length, total_tokens, prompt_tokens and completion_tokens
+            # The increments of all the log events are written at once after the loop
+            add_session_increment(
+                session_increments, log_event.session_id, log_event_metadata
             )
         else:
             logger.info(
@@ -216,6 +255,7 @@ async def process_log_with_session_id(
         )
         tasks_id_to_process.append(task.id)
         tasks_to_create.append(task.model_dump())
+        tasks_created_at[task.id] = task.created_at
 
         # Update the session creation time if needed
         if log_event.session_id is not None:
@@ -229,10 +269,13 @@ async def process_log_with_session_id(
                 ):
                     sessions_to_earliest_task[log_event.session_id] = task
 
+    await update_sessions_counters(session_increments)
+
     # Create the tasks
     tasks_to_create, tasks_id_to_process = await ignore_existing_tasks(
         tasks_to_create, tasks_id_to_process
     )
+    tasks_id_to_process += existing_task_ids
     if len(tasks_to_create) > 0:
         try:
             await mongo_db["tasks"].insert_many(tasks_to_create, ordered=False)
@@ -283,6 +326,12 @@ async def process_log_with_session_id(
     else:
         logger.info("Logevent: no session to create")
 
+    # The new sessions are created at the time of their earliest new task
+    await mark_rollups_dirty(
+        project_id,
+        [tasks_created_at.get(str(task["id"])) for task in tasks_to_create],
+    )
+
     # Compute the task position
     await compute_task_position(
         project_id=project_id,
@@ -305,6 +354,49 @@ async def process_log_with_session_id(
     )
 
 
+def add_session_increment(
+    session_increments: dict[str, dict[str, int]],
+    session_id: str,
+    log_event_metadata: dict,
+) -> None:
+    """
+    Add the session length and tokens of a log event to the increments of its session
+    """
+    increments = session_increments.setdefault(
+        session_id,
+        {
+            "session_length": 0,
+            "metadata.total_tokens": 0,
+            "metadata.prompt_tokens": 0,
+            "metadata.completion_tokens": 0,
+        },
+    )
+    increments["session_length"] += 1
+    for key in ["total_tokens", "prompt_tokens", "completion_tokens"]:
+        increments[f"metadata.{key}"] += log_event_metadata.get(key) or 0
+
+
+async def update_sessions_counters(
+    session_increments: dict[str, dict[str, int]],
+) -> None:
+    """
+    Increment the counters of the sessions in the database, with a single bulk_write
+    """
+    if len(session_increments) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["sessions"].bulk_write(
+            [
+                UpdateOne({"id": session_id}, {"$inc": increments})
+                for session_id, increments in session_increments.items()
+            ],
+            ordered=False,
+        )
+    except Exception as e:
+        logger.error(f"Error updating the sessions in the database: {e}")
+
+
 def collect_metadata(log_event: LogEvent) -> dict:
     """
     Collect the metadata from the log event.
@@ -430,7 +522,7 @@ def get_nb_tokens_prompt_tokens(log_event: LogEvent, model: str | None) -> int |
     if isinstance(log_event.raw_input, list):
         if all(isinstance(x, str) for x in log_event.raw_input):
             # Handle the case where the input is a list of strings
-            return sum(len(tokenizer.encode(x)) for x in log_event.raw_input)  # type: ignore
+            return sum(count_tokens(log_event.raw_input, encoding=tokenizer))  # type: ignore
         if all(isinstance(x, dict) for x in log_event.raw_input):
             # Assume it's a list of messages
             return num_tokens_from_messages(
@@ -439,7 +531,7 @@ def get_nb_tokens_prompt_tokens(log_event: LogEvent, model: str | None) -> int |
                 tokenizer=tokenizer,
             )
     # Encode the string input
-    return len(tokenizer.encode(log_event.input))
+    return count_tokens([log_event.input], encoding=tokenizer)[0]
 
 
 def get_nb_tokens_completion_tokens(
@@ -477,13 +569,13 @@ def get_nb_tokens_completion_tokens(
             # Assume it's a list of str
             if all(isinstance(x, str) for x in raw_output_nonull):
                 tokenizer = get_tokenizer(model)
-                return sum(len(tokenizer.encode(x)) for x in raw_output_nonull)  # type: ignore
+                return sum(count_tokens(raw_output_nonull, encoding=tokenizer))  # type: ignore
             # If it's a list of dict, assume it's a list of streamed chunks
             if all(isinstance(x, dict) for x in raw_output_nonull):
                 return len(log_event.raw_output)
         if log_event.output is not None:
             tokenizer = get_tokenizer(model)
-            return len(tokenizer.encode(log_event.output))
+            return count_tokens([log_event.output], encoding=tokenizer)[0]
     except Exception as e:
         logger.error(
             f"Error in get_nb_tokens_completion_tokens with model: {model}, {e}"
@@ -492,6 +584,19 @@ def get_nb_tokens_completion_tokens(
     return None
 
 
+async def get_existing_task_ids(task_ids: list[str]) -> list[str]:
+    """
+    Ids of the tasks that already exist in the database
+    """
+    mongo_db = await get_mongo_db()
+    existing_tasks = (
+        await mongo_db["tasks"]
+        .find({"id": {"$in": task_ids}}, {"id": 1})
+        .to_list(length=len(task_ids))
+    )
+    return [task["id"] for task in existing_tasks]
+
+
 async def ignore_existing_tasks(
     tasks_to_create: list[dict[str, object]],
     tasks_id_to_process: list[str],
@@ -499,13 +604,9 @@ async def ignore_existing_tasks(
     """
     Filter out tasks that already exist in the database
     """
-    mongo_db = await get_mongo_db()
-    existing_tasks = (
-        await mongo_db["tasks"]
-        .find({"id": {"$in": [task["id"] for task in tasks_to_create]}})
-        .to_list(length=len(tasks_to_create))
+    existing_task_ids = await get_existing_task_ids(
+        [str(task["id"]) for task in tasks_to_create]
     )
-    existing_task_ids = [task["id"] for task in existing_tasks]
     new_tasks_to_create = []
     for task in tasks_to_create:
         if (
@@ -0,0 +1,314 @@
+"""
+Durable queue of the log events received by /log.
+
+When config.LOG_INGESTION_MODE is "queue", /log only validates the log events and appends
+them to the queue. Consumers then process the queued requests in batches with
+create_task_and_process_logs. The queued logs survive a restart of the API, and the
+consumers can be scaled independently:
+
+```bash
+LOG_QUEUE_CONSUMERS=8 python -m phospho_backend.services.log_queue
+```
+
+The logs are processed at least once: a request whose processing fails or whose consumer
+dies is processed again after LOG_QUEUE_VISIBILITY_TIMEOUT seconds. Processing a request
+again is idempotent: the session ids are generated when the request is queued, the raw
+logs are stored with the id of their item, and the tasks already created (with their
+session counters) are skipped.
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+
+import bson
+from loguru import logger
+from pymongo import ReturnDocument
+
+from phospho_backend.api.v2.models import LogEvent
+from phospho_backend.core import config
+from phospho_backend.db.mongo import get_mongo_db
+from phospho_backend.services.log import create_task_and_process_logs
+from phospho_backend.services.mongo.extractor import started_workflow_batches
+from phospho_backend.utils import generate_uuid
+
+LOG_QUEUE_COLLECTION = "log_queue"
+# Number of seconds after which a request claimed by a consumer can be claimed again
+LOG_QUEUE_VISIBILITY_TIMEOUT = 300
+# Number of attempts after which a request is marked as failed
+LOG_QUEUE_MAX_ATTEMPTS = 5
+# Number of seconds a consumer waits when the queue is empty
+LOG_QUEUE_POLL_INTERVAL = 1.0
+# Maximum size of the log events of an item, below the 16 MB limit of a Mongo document
+LOG_QUEUE_MAX_ITEM_BYTES = 8 * 1024 * 1024
+
+
+class LogQueue:
+    """
+    A queue of log requests. Subclass it to use another broker.
+    An item is a dict with the keys id, project_id, org_id, logs_to_process and extra_logs_to_save.
+    """
+
+    async def push(
+        self,
+        project_id: str,
+        org_id: str,
+        logs_to_process: list[dict],
+        extra_logs_to_save: list[dict],
+    ) -> None:
+        """
+        Push the dumps of validated log events. They are split in items smaller than
+        LOG_QUEUE_MAX_ITEM_BYTES.
+        """
+        # The sessions ids are generated once, so that a request processed again
+        # creates the same sessions
+        for log_event in logs_to_process + extra_logs_to_save:
+            if log_event.get("session_id") is None:
+                log_event["session_id"] = "session_" + generate_uuid()
+        await self.push_items(
+            project_id=project_id,
+            org_id=org_id,
+            chunks=split_log_events(logs_to_process, extra_logs_to_save),
+        )
+
+    async def push_items(
+        self,
+        project_id: str,
+        org_id: str,
+        chunks: list[tuple[list[dict], list[dict]]],
+    ) -> None:
+        """Push one item per (logs_to_process, extra_logs_to_save) chunk"""
+        raise NotImplementedError
+
+    async def claim(self, max_items: int) -> list[dict]:
+        """Claim at most max_items items. They are hidden from the other consumers."""
+        raise NotImplementedError
+
+    async def ack(self, item_ids: list[str]) -> None:
+        """Remove processed items from the queue"""
+        raise NotImplementedError
+
+    async def release(self, item_ids: list[str], error: str) -> None:
+        """Make items available again after a processing error"""
+        raise NotImplementedError
+
+
+class MongoLogQueue(LogQueue):
+    """Log queue stored in a Mongo collection"""
+
+    async def push_items(
+        self,
+        project_id: str,
+        org_id: str,
+        chunks: list[tuple[list[dict], list[dict]]],
+    ) -> None:
+        if not chunks:
+            return
+        mongo_db = await get_mongo_db()
+        now = time.time()
+        await mongo_db[LOG_QUEUE_COLLECTION].insert_many(
+            [
+                {
+                    "id": generate_uuid(),
+                    "project_id": project_id,
+                    "org_id": org_id,
+                    "logs_to_process": logs_to_process,
+                    "extra_logs_to_save": extra_logs_to_save,
+                    "status": "pending",
+                    "attempts": 0,
+                    "created_at": now,
+                    "locked_until": None,
+                }
+                for logs_to_process, extra_logs_to_save in chunks
+            ]
+        )
+
+    async def claim(self, max_items: int) -> list[dict]:
+        mongo_db = await get_mongo_db()
+        items: list[dict] = []
+        while len(items) < max_items:
+            now = time.time()
+            item = await mongo_db[LOG_QUEUE_COLLECTION].find_one_and_update(
+                {
+                    "$or": [
+                        {"status": "pending"},
+                        # The consumer which claimed it died
+                        {"status": "processing", "locked_until": {"$lt": now}},
+                    ]
+                },
+                {
+                    "$set": {
+                        "status": "processing",
+                        "locked_until": now + LOG_QUEUE_VISIBILITY_TIMEOUT,
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("created_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if item is None:
+                break
+            if item["attempts"] > LOG_QUEUE_MAX_ATTEMPTS:
+                logger.error(
+                    f"Log request {item['id']} of project {item['project_id']} failed {LOG_QUEUE_MAX_ATTEMPTS} times"
+                )
+                await mongo_db[LOG_QUEUE_COLLECTION].update_one(
+                    {"id": item["id"]}, {"$set": {"status": "failed"}}
+                )
+                continue
+            items.append(item)
+        return items
+
+    async def ack(self, item_ids: list[str]) -> None:
+        mongo_db = await get_mongo_db()
+        await mongo_db[LOG_QUEUE_COLLECTION].delete_many({"id": {"$in": item_ids}})
+
+    async def release(self, item_ids: list[str], error: str) -> None:
+        mongo_db = await get_mongo_db()
+        await mongo_db[LOG_QUEUE_COLLECTION].update_many(
+            {"id": {"$in": item_ids}},
+            {"$set": {"status": "pending", "locked_until": None, "last_error": error}},
+        )
+
+
+def split_log_events(
+    logs_to_process: list[dict],
+    extra_logs_to_save: list[dict],
+    max_bytes: int = LOG_QUEUE_MAX_ITEM_BYTES,
+) -> list[tuple[list[dict], list[dict]]]:
+    """
+    Split the log events in chunks of (logs_to_process, extra_logs_to_save) whose BSON
+    size is below max_bytes. A log event larger than max_bytes is alone in its chunk.
+    """
+    chunks: list[tuple[list[dict], list[dict]]] = []
+    chunk: tuple[list[dict], list[dict]] = ([], [])
+    chunk_bytes = 0
+    for is_extra, log_events in ((False, logs_to_process), (True, extra_logs_to_save)):
+        for log_event in log_events:
+            log_event_bytes = len(bson.encode(log_event))
+            if chunk_bytes + log_event_bytes > max_bytes and (chunk[0] or chunk[1]):
+                chunks.append(chunk)
+                chunk = ([], [])
+                chunk_bytes = 0
+            chunk[1 if is_extra else 0].append(log_event)
+            chunk_bytes += log_event_bytes
+    if chunk[0] or chunk[1]:
+        chunks.append(chunk)
+    return chunks
+
+
+log_queue: LogQueue = MongoLogQueue()
+
+
+def set_log_queue(queue: LogQueue) -> None:
+    """Use another broker for the log queue"""
+    global log_queue
+    log_queue = queue
+
+
+def get_log_queue() -> LogQueue:
+    return log_queue
+
+
+async def process_log_queue_batch(batch_size: int | None = None) -> int:
+    """
+    Claim queued log requests and process them, grouped by project.
+    Returns the number of requests processed.
+    """
+    if batch_size is None:
+        batch_size = config.LOG_QUEUE_BATCH_SIZE
+    queue = get_log_queue()
+    items = await queue.claim(batch_size)
+    if len(items) == 0:
+        return 0
+
+    items_per_project: dict[tuple[str, str], list[dict]] = defaultdict(list)
+    for item in items:
+        items_per_project[(item["project_id"], item["org_id"])].append(item)
+
+    for (project_id, org_id), project_items in items_per_project.items():
+        item_ids = [item["id"] for item in project_items]
+        # The log events were validated before being queued
+        logs_to_process = []
+        extra_logs_to_save = []
+        log_ids = []
+        for item in project_items:
+            for i, log_event in enumerate(item["logs_to_process"]):
+                logs_to_process.append(LogEvent.model_construct(**log_event))
+                log_ids.append(f"{item['id']}:{i}")
+        for item in project_items:
+            for i, log_event in enumerate(item["extra_logs_to_save"]):
+                extra_logs_to_save.append(LogEvent.model_construct(**log_event))
+                log_ids.append(f"{item['id']}:extra:{i}")
+        try:
+            # The workflows of the tasks must be started before the items are removed
+            async with started_workflow_batches():
+                await create_task_and_process_logs(
+                    logs_to_process=logs_to_process,
+                    extra_logs_to_save=extra_logs_to_save,
+                    project_id=project_id,
+                    org_id=org_id,
+                    log_ids=log_ids,
+                    # A previous attempt may have created the tasks without processing them
+                    process_existing_tasks=any(
+                        item["attempts"] > 1 for item in project_items
+                    ),
+                )
+        except Exception as e:
+            logger.error(f"Error processing queued logs of project {project_id}: {e}")
+            await queue.release(item_ids, error=str(e))
+            continue
+        await queue.ack(item_ids)
+
+    return len(items)
+
+
+async def run_log_queue_consumer() -> None:
+    """Process the log queue until cancelled"""
+    while True:
+        try:
+            nb_processed = await process_log_queue_batch()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error consuming the log queue: {e}")
+            nb_processed = 0
+        if nb_processed == 0:
+            await asyncio.sleep(LOG_QUEUE_POLL_INTERVAL)
+
+
+consumer_tasks: list[asyncio.Task] = []
+
+
+async def start_log_queue_consumers() -> None:
+    """Start the consumers of the log queue in this process, if the queue is used"""
+    if config.LOG_INGESTION_MODE != "queue" or config.LOG_QUEUE_CONSUMERS <= 0:
+        return
+    logger.info(f"Starting {config.LOG_QUEUE_CONSUMERS} log queue consumers")
+    for _ in range(config.LOG_QUEUE_CONSUMERS):
+        consumer_tasks.append(asyncio.create_task(run_log_queue_consumer()))
+
+
+async def stop_log_queue_consumers() -> None:
+    for task in consumer_tasks:
+        task.cancel()
+    await asyncio.gather(*consumer_tasks, return_exceptions=True)
+    consumer_tasks.clear()
+
+
+async def main() -> None:
+    from phospho_backend.db.mongo import close_mongo_db, connect_and_init_db
+    from phospho_backend.services.mongo.extractor import flush_workflow_batches
+
+    await connect_and_init_db()
+    nb_consumers = max(config.LOG_QUEUE_CONSUMERS, 1)
+    logger.info(f"Running {nb_consumers} log queue consumers")
+    try:
+        await asyncio.gather(*[run_log_queue_consumer() for _ in range(nb_consumers)])
+    finally:
+        await flush_workflow_batches()
+        await close_mongo_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
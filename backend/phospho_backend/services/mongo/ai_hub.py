@@ -18,11 +18,13 @@ from phospho_backend.api.v2.models import (
 )
 from phospho_backend.core import config
 from phospho_backend.db.mongo import get_mongo_db
-from phospho_backend.services.mongo.extractor import fetch_stripe_customer_id
+from phospho_backend.services.mongo.extractor import (
+    fetch_stripe_customer_id,
+    get_temporal_client,
+)
+from phospho_backend.services.mongo.usage import increment_usage_counters
 from phospho_backend.services.slack import slack_notification
-from phospho_backend.temporal.pydantic_converter import pydantic_data_converter
 from phospho_backend.utils import generate_uuid
-from temporalio.client import Client, TLSConfig
 from temporalio.exceptions import WorkflowAlreadyStartedError
 
 
@@ -104,37 +106,7 @@ class AIHubClient:
         data["customer_id"] = await fetch_stripe_customer_id(self.org_id)
 
         try:
-            if config.TEMPORAL_HOST_URL is None:
-                raise ValueError("TEMPORAL_HOST_URL is not set")
-            if config.TEMPORAL_NAMESPACE is None:
-                raise ValueError("TEMPORAL_NAMESPACE is not set")
-            if config.ENVIRONMENT in ["production", "staging"]:
-                client_cert = config.TEMPORAL_MTLS_TLS_CERT
-                client_key = config.TEMPORAL_MTLS_TLS_KEY
-
-                client: Client = await Client.connect(
-                    config.TEMPORAL_HOST_URL,
-                    namespace=config.TEMPORAL_NAMESPACE,
-                    tls=TLSConfig(
-                        client_cert=client_cert,
-                        client_private_key=client_key,
-                    ),
-                    data_converter=pydantic_data_converter,
-                )
-            elif config.ENVIRONMENT in ["preview", "test"]:
-                try:
-                    client = await Client.connect(
-                        config.TEMPORAL_HOST_URL,
-                        namespace=config.TEMPORAL_NAMESPACE,
-                        tls=False,
-                        data_converter=pydantic_data_converter,
-                    )
-                except Exception as e:
-                    logger.warning("Have you started a local Temporal server?")
-                    logger.error(f"Error connecting to Temporal: {e}")
-                    raise e
-            else:
-                raise ValueError(f"Unknown environment {config.ENVIRONMENT}")
+            client = await get_temporal_client()
 
             if hash_data_for_id:
                 # Hash the data to generate a unique determinist id
@@ -198,7 +170,9 @@ class AIHubClient:
             result_type=ResultType.dict,
         )
         mongo_db = await get_mongo_db()
-        await mongo_db["job_results"].insert_one(job_result.model_dump())
+        job_result_data = job_result.model_dump()
+        await mongo_db["job_results"].insert_one(job_result_data)
+        await increment_usage_counters([job_result_data])
 
     async def generate_embeddings(
         self, embedding_request: EmbeddingRequest
@@ -18,7 +18,9 @@ from phospho_backend.services.mongo.clustering import (
     get_last_clustering_composition,
 )
 from phospho_backend.services.mongo.events import get_all_events
+from phospho_backend.services.mongo.metrics import MetricCall, compute_metrics
 from phospho_backend.services.mongo.query_builder import QueryBuilder
+from phospho_backend.services.mongo.rollups import can_use_rollups, get_daily_rollups
 from phospho_backend.services.mongo.tasks import (
     get_all_tasks,
     get_total_nb_of_tasks,
@@ -490,16 +492,9 @@ def generate_date_range(
     return date_list
 
 
-async def get_nb_of_daily_tasks(
-    project_id: str,
-    filters: ProjectDataFilters,
-    **kwargs,
+async def _get_nb_of_daily_tasks_from_tasks(
+    project_id: str, filters: ProjectDataFilters
 ) -> list[dict]:
-    """
-    Get the number of daily tasks of a project.
-    """
-    # tasks = await get_all_tasks(project_id=project_id, limit=None, filters=filters)
-
     mongo_db = await get_mongo_db()
 
     with_events = any(
@@ -540,7 +535,28 @@ async def get_nb_of_daily_tasks(
         ]
     )
 
-    result = await mongo_db[collection].aggregate(pipeline).to_list(length=None)
+    return await mongo_db[collection].aggregate(pipeline).to_list(length=None)
+
+
+async def get_nb_of_daily_tasks(
+    project_id: str,
+    filters: ProjectDataFilters,
+    **kwargs,
+) -> list[dict]:
+    """
+    Get the number of daily tasks of a project.
+    """
+    if can_use_rollups(filters):
+        rollups = await get_daily_rollups(
+            project_id, start=filters.created_at_start, end=filters.created_at_end
+        )
+        result = [
+            {"date": date, "nb_tasks": stats["nb_tasks"]}
+            for date, stats in rollups.items()
+            if stats["nb_tasks"] > 0
+        ]
+    else:
+        result = await _get_nb_of_daily_tasks_from_tasks(project_id, filters)
     if len(result) == 0:
         return []
 
@@ -675,61 +691,52 @@ async def get_tasks_aggregated_metrics(
         hour=0, minute=0, second=0, microsecond=0
     )
 
-    output: dict[str, object] = {}
-
-    if "total_nb_tasks" in metrics:
-        output["total_nb_tasks"] = await get_total_nb_of_tasks(
-            project_id=project_id, filters=filters
-        )
-    if "global_success_rate" in metrics:
-        output["global_success_rate"] = await get_total_success_rate(
-            project_id=project_id, filters=filters
-        )
-    if "most_detected_event" in metrics:
-        output["most_detected_event"] = await get_most_detected_tagger_name(
+    # The metrics run concurrently: each one gets its own copy of the filters,
+    # as some of them edit the filters they receive
+    def metric_filters() -> ProjectDataFilters:
+        return filters.model_copy(deep=True)
+
+    metric_calls: dict[str, MetricCall] = {
+        "total_nb_tasks": lambda: get_total_nb_of_tasks(
+            project_id=project_id, filters=metric_filters()
+        ),
+        "global_success_rate": lambda: get_total_success_rate(
+            project_id=project_id, filters=metric_filters()
+        ),
+        "most_detected_event": lambda: get_most_detected_tagger_name(
             project_id=project_id,
             **filters.model_dump(),
-        )
-    if "nb_daily_tasks" in metrics:
-        output["nb_daily_tasks"] = await get_nb_of_daily_tasks(
-            project_id=project_id, filters=filters
-        )
-    if "events_ranking" in metrics:
-        output["events_ranking"] = await get_top_taggers_names_and_count(
+        ),
+        "nb_daily_tasks": lambda: get_nb_of_daily_tasks(
+            project_id=project_id, filters=metric_filters()
+        ),
+        "events_ranking": lambda: get_top_taggers_names_and_count(
             project_id=project_id,
             limit=5,
-            filters=filters,
-        )
-    if "daily_success_rate" in metrics:
-        output["daily_success_rate"] = await get_daily_success_rate(
+            filters=metric_filters(),
+        ),
+        "daily_success_rate": lambda: get_daily_success_rate(
             project_id=project_id,
-            filters=filters,
-        )
-    if "success_rate_per_task_position" in metrics:
-        output[
-            "success_rate_per_task_position"
-        ] = await get_success_rate_per_task_position(
-            project_id=project_id, filters=filters
-        )
-    if "date_last_clustering_timestamp" in metrics:
-        output[
-            "date_last_clustering_timestamp"
-        ] = await get_date_last_clustering_timestamp(project_id=project_id)
-    if "last_clustering_composition" in metrics:
-        output["last_clustering_composition"] = await get_last_clustering_composition(
+            filters=metric_filters(),
+        ),
+        "success_rate_per_task_position": lambda: get_success_rate_per_task_position(
+            project_id=project_id, filters=metric_filters()
+        ),
+        "date_last_clustering_timestamp": lambda: get_date_last_clustering_timestamp(
             project_id=project_id
-        )
-    return output
+        ),
+        "last_clustering_composition": lambda: get_last_clustering_composition(
+            project_id=project_id
+        ),
+    }
+    return await compute_metrics(
+        {name: call for name, call in metric_calls.items() if name in metrics}
+    )
 
 
-async def get_daily_success_rate(
-    project_id: str,
-    filters: ProjectDataFilters,
-    **kwargs,
-) -> list[dict]:
-    """
-    Get the daily success rate of a project.
-    """
+async def _get_daily_success_rate_from_tasks(
+    project_id: str, filters: ProjectDataFilters
+) -> pd.DataFrame:
     mongo_db = await get_mongo_db()
 
     query_builder = QueryBuilder(
@@ -754,11 +761,52 @@ async def get_daily_success_rate(
     result = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
 
     result_df = pd.DataFrame(result)
+    if result_df.empty:
+        return result_df
+
+    result_df["date"] = pd.to_datetime(
+        result_df["created_at"], unit="s", utc=True
+    ).dt.date
+    # Group by date and count
+    return (
+        result_df.groupby(["date"])[["is_success"]]
+        .mean()
+        .reset_index()[["date", "is_success"]]
+        .rename(columns={"is_success": "success_rate"})
+    )
+
+
+async def get_daily_success_rate(
+    project_id: str,
+    filters: ProjectDataFilters,
+    **kwargs,
+) -> list[dict]:
+    """
+    Get the daily success rate of a project.
+    """
+    if can_use_rollups(filters):
+        rollups = await get_daily_rollups(
+            project_id, start=filters.created_at_start, end=filters.created_at_end
+        )
+        daily_success_rate = pd.DataFrame(
+            [
+                {
+                    "date": datetime.date.fromisoformat(date),
+                    "success_rate": stats["nb_success"] / stats["nb_tasks"],
+                }
+                for date, stats in rollups.items()
+                if stats["nb_tasks"] > 0
+            ]
+        )
+    else:
+        daily_success_rate = await _get_daily_success_rate_from_tasks(
+            project_id, filters
+        )
 
     start_date_range, end_date_range = extract_date_range(filters)
     if start_date_range is None:
-        if not result_df.empty:
-            start_date_range = result_df["created_at"].min()
+        if not daily_success_rate.empty:
+            start_date_range = daily_success_rate["date"].min()
         else:
             start_date_range = datetime.datetime.now()
     if end_date_range is None:
@@ -768,18 +816,7 @@ async def get_daily_success_rate(
     complete_df = pd.DataFrame({"date": complete_date_range})
     complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
 
-    if not result_df.empty:
-        result_df["date"] = pd.to_datetime(
-            result_df["created_at"], unit="s", utc=True
-        ).dt.date
-        # Group by date and count
-        daily_success_rate = (
-            result_df.groupby(["date"])[["is_success"]]
-            .mean()
-            .reset_index()[["date", "is_success"]]
-            .rename(columns={"is_success": "success_rate"})
-        )
-
+    if not daily_success_rate.empty:
         # Add missing days
         daily_success_rate = pd.merge(
             complete_df, daily_success_rate, on="date", how="left"
@@ -981,13 +1018,9 @@ async def get_last_message_success_rate(
     return last_message_success_rate
 
 
-async def get_nb_sessions_per_day(
-    project_id: str,
-    filters: ProjectDataFilters,
+async def _get_nb_sessions_per_day_from_sessions(
+    project_id: str, filters: ProjectDataFilters
 ) -> list[dict]:
-    """
-    Get the nb of sessions per day of a project.
-    """
     mongo_db = await get_mongo_db()
 
     query_builder = QueryBuilder(
@@ -1014,7 +1047,27 @@ async def get_nb_sessions_per_day(
         ]
     )
 
-    result = await mongo_db["sessions"].aggregate(pipeline).to_list(length=None)
+    return await mongo_db["sessions"].aggregate(pipeline).to_list(length=None)
+
+
+async def get_nb_sessions_per_day(
+    project_id: str,
+    filters: ProjectDataFilters,
+) -> list[dict]:
+    """
+    Get the nb of sessions per day of a project.
+    """
+    # The sessions are filtered on last_message_ts, while the rollups count the
+    # sessions by created_at: they are only used without filters
+    if all(value is None for value in filters.model_dump().values()):
+        rollups = await get_daily_rollups(project_id)
+        result = [
+            {"date": date, "nb_sessions": stats["nb_sessions"]}
+            for date, stats in rollups.items()
+            if stats["nb_sessions"] > 0
+        ]
+    else:
+        result = await _get_nb_sessions_per_day_from_sessions(project_id, filters)
 
     # Add missing days in the date range
     results_df = pd.DataFrame(result)
@@ -1137,45 +1190,43 @@ async def get_sessions_aggregated_metrics(
         hour=0, minute=0, second=0, microsecond=0
     )
 
-    output: dict[str, object] = {}
+    def metric_filters() -> ProjectDataFilters:
+        return filters.model_copy(deep=True)
 
-    if "total_nb_sessions" in metrics:
-        output["total_nb_sessions"] = await get_total_nb_of_sessions(
+    metric_calls: dict[str, MetricCall] = {
+        "total_nb_sessions": lambda: get_total_nb_of_sessions(
             project_id=project_id,
-            filters=filters,
-        )
-    if "average_session_length" in metrics:
-        output["average_session_length"] = await get_global_average_session_length(
+            filters=metric_filters(),
+        ),
+        "average_session_length": lambda: get_global_average_session_length(
             project_id=project_id,
-            filters=filters,
-        )
-    if "last_task_success_rate" in metrics:
-        output["last_task_success_rate"] = await get_last_message_success_rate(
+            filters=metric_filters(),
+        ),
+        "last_task_success_rate": lambda: get_last_message_success_rate(
             project_id=project_id,
-            filters=filters,
-        )
-    if "nb_sessions_per_day" in metrics:
-        output["nb_sessions_per_day"] = await get_nb_sessions_per_day(
-            project_id=project_id, filters=filters
-        )
-    if "session_length_histogram" in metrics:
-        output["session_length_histogram"] = await get_nb_sessions_histogram(
+            filters=metric_filters(),
+        ),
+        "nb_sessions_per_day": lambda: get_nb_sessions_per_day(
+            project_id=project_id, filters=metric_filters()
+        ),
+        "session_length_histogram": lambda: get_nb_sessions_histogram(
             project_id=project_id,
-            filters=filters,
-        )
-    if "success_rate_per_task_position" in metrics:
-        output[
-            "success_rate_per_task_position"
-        ] = await get_success_rate_per_task_position(
-            project_id=project_id, quantile_filter=quantile_filter, filters=filters
-        )
-    if "nb_tasks_in_sessions" in metrics:
-        output["nb_tasks_in_sessions"] = await get_nb_tasks_in_sessions(
+            filters=metric_filters(),
+        ),
+        "success_rate_per_task_position": lambda: get_success_rate_per_task_position(
             project_id=project_id,
-            filters=filters,
+            quantile_filter=quantile_filter,
+            filters=metric_filters(),
+        ),
+        "nb_tasks_in_sessions": lambda: get_nb_tasks_in_sessions(
+            project_id=project_id,
+            filters=metric_filters(),
             limit=limit,
-        )
-    return output
+        ),
+    }
+    return await compute_metrics(
+        {name: call for name, call in metric_calls.items() if name in metrics}
+    )
 
 
 async def create_ab_tests_table(project_id: str, limit: int = 1000) -> list[ABTest]:
@@ -1587,20 +1638,24 @@ async def get_events_aggregated_metrics(
         metrics = [
             "success_rate_by_event_name",
         ]
-    output: dict[str, object] = {}
-    if "success_rate_by_event_name" in metrics:
-        output["success_rate_by_event_name"] = await get_success_rate_by_event_name(
-            project_id=project_id, filters=filters
-        )
-    if "total_nb_events" in metrics:
-        output["total_nb_events"] = await get_total_nb_of_detections(
-            project_id=project_id, filters=filters
-        )
-    if "category_distribution" in metrics:
-        logger.info("Getting category distribution")
-        output["category_distribution"] = await get_category_distribution(
-            project_id=project_id, filters=filters
-        )
+
+    def metric_filters() -> ProjectDataFilters:
+        return filters.model_copy(deep=True)
+
+    metric_calls: dict[str, MetricCall] = {
+        "success_rate_by_event_name": lambda: get_success_rate_by_event_name(
+            project_id=project_id, filters=metric_filters()
+        ),
+        "total_nb_events": lambda: get_total_nb_of_detections(
+            project_id=project_id, filters=metric_filters()
+        ),
+        "category_distribution": lambda: get_category_distribution(
+            project_id=project_id, filters=metric_filters()
+        ),
+    }
+    metric_calls = {
+        name: call for name, call in metric_calls.items() if name in metrics
+    }
 
     # Some metrics require y_pred and y_true
     performance_metrics = [
@@ -1615,10 +1670,20 @@ async def get_events_aggregated_metrics(
     ]
     intersection_metrics = list(set(metrics).intersection(set(performance_metrics)))
     if filters.event_id is not None and len(intersection_metrics) > 0:
-        y_pred, y_true = await get_y_pred_y_true(
+        # Fetched concurrently with the other metrics
+        metric_calls["y_pred_y_true"] = lambda: get_y_pred_y_true(
             project_id=project_id,
-            filters=filters,
+            filters=metric_filters(),
         )
+    elif filters.event_id is None and len(intersection_metrics) > 0:
+        logger.error(
+            f"Event ID is required to compute performance metrics: {intersection_metrics}"
+        )
+
+    output = await compute_metrics(metric_calls)
+
+    if "y_pred_y_true" in output:
+        y_pred, y_true = cast(tuple, output.pop("y_pred_y_true"))
         if y_pred is not None and y_true is not None:
             if "mean_squared_error" in metrics:
                 output["mean_squared_error"] = float(
@@ -1646,10 +1711,6 @@ async def get_events_aggregated_metrics(
                 )
         else:
             logger.info(f"No y_pred and y_true found for event {filters.event_id}")
-    elif filters.event_id is None and len(intersection_metrics) > 0:
-        logger.error(
-            f"Event ID is required to compute performance metrics: {intersection_metrics}"
-        )
 
     logger.debug(output)
     return output
@@ -1661,53 +1722,21 @@ async def graph_number_of_daily_tasks(project_id: str):
 
     Group tasks in 4 categories: success, failure, undefined, and total.
     """
-    mongo_db = await get_mongo_db()
     seven_days_ago_timestamp, today_timestamp = get_last_week_timestamps()
 
-    # Aggregation pipeline
-    pipeline = [
-        {
-            "$match": {
-                "project_id": project_id,
-                "created_at": {
-                    "$gte": seven_days_ago_timestamp,
-                    "$lte": today_timestamp,
-                },
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d",
-                        "date": {"$toDate": {"$multiply": ["$created_at", 1000]}},
-                    }
-                },
-                "success": {"$sum": {"$cond": [{"$eq": ["$flag", "success"]}, 1, 0]}},
-                "failure": {"$sum": {"$cond": [{"$eq": ["$flag", "failure"]}, 1, 0]}},
-                "total": {"$sum": 1},
-            }
-        },
-        {
-            "$addFields": {
-                "undefined": {
-                    "$subtract": ["$total", {"$add": ["$success", "$failure"]}]
-                },
-            }
-        },
-        {"$sort": {"_id": 1}},
+    rollups = await get_daily_rollups(
+        project_id, start=seven_days_ago_timestamp, end=today_timestamp
+    )
+    result = [
         {
-            "$project": {
-                "_id": 0,
-                "date": "$_id",
-                "success": 1,
-                "failure": 1,
-                "undefined": 1,
-            }
-        },
+            "date": date,
+            "success": stats["nb_success"],
+            "failure": stats["nb_failure"],
+            "undefined": stats["nb_tasks"] - stats["nb_success"] - stats["nb_failure"],
+        }
+        for date, stats in rollups.items()
+        if stats["nb_tasks"] > 0
     ]
-    # Query Mongo
-    result = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
     result_df = pd.DataFrame(result)
     # Add missing days to the result, and set the missing values to 0
     complete_date_range = pd.date_range(
@@ -1744,63 +1773,16 @@ async def get_events_per_day(project_id: str):
         "total": [count1, count2, ...],
     }
     """
-    mongo_db = await get_mongo_db()
     seven_days_ago_timestamp, today_timestamp = get_last_week_timestamps()
 
-    pipeline = [
-        # Filter tasks of the last week
-        {
-            "$match": {
-                "project_id": project_id,
-                "created_at": {
-                    "$gte": seven_days_ago_timestamp,
-                    "$lte": today_timestamp,
-                },
-                "removed": {"$ne": True},
-            }
-        },
-        {
-            "$addFields": {
-                "date": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d",
-                        "date": {"$toDate": {"$multiply": ["$created_at", 1000]}},
-                    },
-                }
-            },
-        },
-        {"$unwind": "$events"},
-        # Deduplicate based on event.event_name x task.id
-        {
-            "$group": {
-                "_id": {
-                    "date": "$date",
-                    "event_name": "$events.event_name",
-                    "task_id": "$id",
-                },
-            }
-        },
-        # Group by event name and date to get the number of events per day
-        {
-            "$group": {
-                "_id": {
-                    "date": "$_id.date",
-                    "event_name": "$_id.event_name",
-                },
-                "count": {"$sum": 1},
-            }
-        },
-        # Project the result
-        {
-            "$project": {
-                "_id": 0,
-                "date": "$_id.date",
-                "event_name": "$_id.event_name",
-                "count": 1,
-            }
-        },
+    rollups = await get_daily_rollups(
+        project_id, start=seven_days_ago_timestamp, end=today_timestamp
+    )
+    result = [
+        {"date": date, "event_name": event["event_name"], "count": event["count"]}
+        for date, stats in rollups.items()
+        for event in stats["events"]
     ]
-    result = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
     result = pd.DataFrame(result)
 
     # Get the list of event names
@@ -1850,15 +1832,15 @@ async def get_dashboard_aggregated_metrics(
         metrics = [
             "number_of_daily_tasks",
         ]
-    output: dict[str, object] = {}
-    if "number_of_daily_tasks" in metrics:
-        output["number_of_daily_tasks"] = await graph_number_of_daily_tasks(
+    metric_calls: dict[str, MetricCall] = {
+        "number_of_daily_tasks": lambda: graph_number_of_daily_tasks(
             project_id=project_id,
-        )
-    if "events_per_day" in metrics:
-        output["events_per_day"] = await get_events_per_day(project_id=project_id)
-
-    return output
+        ),
+        "events_per_day": lambda: get_events_per_day(project_id=project_id),
+    }
+    return await compute_metrics(
+        {name: call for name, call in metric_calls.items() if name in metrics}
+    )
 
 
 async def get_ab_tests_versions(
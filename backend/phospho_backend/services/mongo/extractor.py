@@ -1,6 +1,11 @@
+import asyncio
+import contextlib
 import hashlib
+import json
 import time
 import traceback
+from contextvars import ContextVar
+from typing import AsyncIterator
 
 import httpx
 import stripe
@@ -10,7 +15,8 @@ from phospho_backend.api.v2.models import LogEvent
 from phospho_backend.api.v3.models import MinimalLogEventForMessages
 from phospho_backend.api.v3.models.run import RoleContentMessage
 from phospho_backend.core import config
-from phospho_backend.security import propelauth
+from phospho_backend.db.cache import get_or_set
+from phospho_backend.security import fetch_org_metadata
 from phospho_backend.services.mongo.organizations import get_usage_quota
 from phospho_backend.services.slack import slack_notification
 from phospho_backend.temporal.pydantic_converter import pydantic_data_converter
@@ -42,8 +48,7 @@ async def bill_on_stripe(
     stripe.api_key = config.STRIPE_SECRET_KEY
 
     # Get the stripe customer id from the org metadata
-    org = propelauth.fetch_org(org_id)
-    org_metadata = org.metadata or {}
+    org_metadata = await fetch_org_metadata(org_id) or {}
     customer_id = org_metadata.get("customer_id", None)
 
     if customer_id:
@@ -68,11 +73,261 @@ async def fetch_stripe_customer_id(org_id: str) -> str | None:
         logger.debug("Preview environment, stripe billing disabled")
         return None
 
-    org = propelauth.fetch_org(org_id)
-    org_metadata = org.metadata or {}
+    org_metadata = await fetch_org_metadata(org_id) or {}
     return org_metadata.get("customer_id", None)
 
 
+async def fetch_extractor_context(org_id: str) -> dict:
+    """
+    Billing context of the organization sent with the workflows: customer_id, current_usage
+    and max_usage. Cached for config.EXTRACTOR_CONTEXT_CACHE_TTL seconds, as it's needed
+    for every workflow.
+    """
+
+    async def load() -> dict:
+        org_metadata = await fetch_org_metadata(org_id) or {}
+        org_plan = org_metadata.get("plan", "hobby")
+        usage_quota = await get_usage_quota(org_id, plan=org_plan, fetch_invoice=False)
+        return {
+            "customer_id": await fetch_stripe_customer_id(org_id),
+            "current_usage": usage_quota.current_usage,
+            "max_usage": usage_quota.max_usage,
+        }
+
+    return await get_or_set(
+        "extractor_context", org_id, load, ttl=config.EXTRACTOR_CONTEXT_CACHE_TTL
+    )
+
+
+temporal_client: Client | None = None
+temporal_client_lock = asyncio.Lock()
+
+
+async def get_temporal_client() -> Client:
+    """
+    The Temporal client of the process. It's connected on the first call, then shared
+    by all the ExtractorClient.
+    """
+    global temporal_client
+    if temporal_client is not None:
+        return temporal_client
+    async with temporal_client_lock:
+        if temporal_client is None:
+            temporal_client = await connect_temporal_client()
+    return temporal_client
+
+
+async def connect_temporal_client() -> Client:
+    """
+    Connects to the Temporal server
+    """
+    if config.TEMPORAL_HOST_URL is None:
+        raise Exception("TEMPORAL_HOST_URL is missing from the environment variables")
+    if config.TEMPORAL_NAMESPACE is None:
+        raise Exception("TEMPORAL_NAMESPACE is missing from the environment variables")
+
+    if config.ENVIRONMENT in ["production", "staging"]:
+        client_cert = config.TEMPORAL_MTLS_TLS_CERT
+        client_key = config.TEMPORAL_MTLS_TLS_KEY
+
+        return await Client.connect(
+            config.TEMPORAL_HOST_URL,
+            namespace=config.TEMPORAL_NAMESPACE,
+            tls=TLSConfig(
+                client_cert=client_cert,
+                client_private_key=client_key,
+            ),
+            data_converter=pydantic_data_converter,
+        )
+    elif config.ENVIRONMENT in ["test", "preview"]:
+        try:
+            return await Client.connect(
+                config.TEMPORAL_HOST_URL,
+                namespace=config.TEMPORAL_NAMESPACE,
+                tls=False,
+                data_converter=pydantic_data_converter,
+            )
+        except Exception as e:
+            logger.error("Have you started a local Temporal server?")
+            logger.error(f"Error connecting to Temporal: {e}")
+            raise e
+    else:
+        raise ValueError(f"Unknown environment {config.ENVIRONMENT}")
+
+
+class WorkflowBatcher:
+    """
+    Coalesces the fire-and-forget workflows started for the same project within
+    config.EXTRACTOR_BATCH_WINDOW seconds into a single workflow.
+
+    The workflows of a batch have the same endpoint and the same scalar arguments. Their
+    list arguments (tasks_id_to_process, logs_to_process...) are concatenated.
+    A batch is started when the window ends, when it reaches config.EXTRACTOR_BATCH_MAX_SIZE
+    items, or before its items would exceed config.EXTRACTOR_BATCH_MAX_BYTES.
+
+    Each batch has a future, resolved once its workflow is started (or failed to start).
+    Use `started_workflow_batches` to wait for the batches of some workflows.
+    """
+
+    def __init__(self):
+        # (org_id, project_id, endpoint, scalar arguments) -> batch
+        self.batches: dict[tuple, dict] = {}
+        self.flush_tasks: dict[tuple, asyncio.Task] = {}
+
+    async def add(
+        self,
+        client: "ExtractorClient",
+        endpoint: str,
+        data: dict,
+        list_keys: list[str],
+    ) -> None:
+        scalars = repr(sorted((k, v) for k, v in data.items() if k not in list_keys))
+        key = (client.org_id, client.project_id, endpoint, scalars)
+        nb_bytes = sum(len(json.dumps(data[k], default=str)) for k in list_keys)
+        batch = self.batches.get(key)
+        if (
+            batch is not None
+            and batch["nb_bytes"] + nb_bytes > config.EXTRACTOR_BATCH_MAX_BYTES
+        ):
+            # The items would make the workflow payload too big: start the batch first
+            await self._flush_and_report(key)
+            batch = self.batches.get(key)
+        if batch is None:
+            started: asyncio.Future = asyncio.get_running_loop().create_future()
+            # The error is reported by _flush_and_report even if no one waits for it
+            started.add_done_callback(lambda f: f.cancelled() or f.exception())
+            batch = {
+                "client": client,
+                "endpoint": endpoint,
+                "data": {k: list(v) if k in list_keys else v for k, v in data.items()},
+                "nb_bytes": nb_bytes,
+                "started": started,
+            }
+            self.batches[key] = batch
+            self.flush_tasks[key] = asyncio.create_task(self._flush_later(key))
+        else:
+            for k in list_keys:
+                batch["data"][k].extend(data[k])
+            batch["nb_bytes"] += nb_bytes
+        tracked = tracked_workflow_batches.get()
+        if tracked is not None and batch["started"] not in tracked:
+            tracked.append(batch["started"])
+
+        size = sum(len(batch["data"][k]) for k in list_keys)
+        if size >= config.EXTRACTOR_BATCH_MAX_SIZE:
+            await self._flush_and_report(key)
+
+    async def _flush_later(self, key: tuple) -> None:
+        await asyncio.sleep(config.EXTRACTOR_BATCH_WINDOW)
+        await self._flush_and_report(key)
+
+    async def _flush_and_report(self, key: tuple) -> None:
+        """Start the workflow of a batch, and report on Slack if it can't be started"""
+        try:
+            await self.flush(key)
+        except Exception as e:
+            # The error is also set on the future of the batch
+            error_message = (
+                f"Error starting the batched workflow {key[2]} "
+                + f"(project_id: {key[1]} organisation_id: {key[0]}): {e}"
+            )
+            logger.error(error_message)
+            if config.ENVIRONMENT == "production":
+                await slack_notification(error_message[:800])
+
+    async def flush(self, key: tuple) -> None:
+        """
+        Start the workflow of a batch. Retried up to config.EXTRACTOR_BATCH_MAX_ATTEMPTS
+        times, raises if it can't be started.
+        """
+        batch = self.batches.pop(key, None)
+        flush_task = self.flush_tasks.pop(key, None)
+        if flush_task is not None and flush_task is not asyncio.current_task():
+            flush_task.cancel()
+        if batch is None:
+            return
+        endpoint = batch["endpoint"]
+        started: asyncio.Future = batch["started"]
+        # The batches are unique: no need to hash their content for an id. The id is
+        # kept between the attempts, so that a retry doesn't start the workflow twice.
+        workflow_id = endpoint + generate_uuid()
+        try:
+            for attempt in range(config.EXTRACTOR_BATCH_MAX_ATTEMPTS):
+                try:
+                    await batch["client"]._post(
+                        endpoint,
+                        batch["data"],
+                        workflow_id=workflow_id,
+                        raise_errors=True,
+                    )
+                    started.set_result(None)
+                    return
+                except Exception as e:
+                    if attempt + 1 >= config.EXTRACTOR_BATCH_MAX_ATTEMPTS:
+                        started.set_exception(e)
+                        raise
+                    logger.warning(
+                        f"Error starting the batched workflow {endpoint}, retrying: {e}"
+                    )
+                    await asyncio.sleep(2**attempt)
+        finally:
+            if not started.done():
+                # Cancelled, eg on shutdown
+                started.cancel()
+
+    async def wait_started(self, futures: list[asyncio.Future]) -> None:
+        """
+        Start the pending batches of the futures, and wait until all their workflows are
+        started, including the batches already being started. Raises if one can't be
+        started.
+        """
+        keys = [
+            key for key, batch in self.batches.items() if batch["started"] in futures
+        ]
+        await asyncio.gather(*[self.flush(key) for key in keys], return_exceptions=True)
+        await asyncio.gather(*futures)
+
+    async def flush_all(self) -> None:
+        """Start the workflows of all the pending batches. Call it before shutdown."""
+        await asyncio.gather(
+            *[self.flush(key) for key in list(self.batches.keys())],
+            return_exceptions=True,
+        )
+
+
+workflow_batcher = WorkflowBatcher()
+
+# Futures of the batches the workflows are added to, in a started_workflow_batches block
+tracked_workflow_batches: ContextVar[list[asyncio.Future] | None] = ContextVar(
+    "tracked_workflow_batches", default=None
+)
+
+
+async def flush_workflow_batches() -> None:
+    await workflow_batcher.flush_all()
+
+
+@contextlib.asynccontextmanager
+async def started_workflow_batches() -> AsyncIterator[None]:
+    """
+    On exit, wait until the batched workflows started in the block are started, and raise
+    if one can't be started. Use it before acknowledging an item of a durable queue:
+
+    ```python
+    async with started_workflow_batches():
+        await create_task_and_process_logs(...)
+    await queue.ack(item_ids)
+    ```
+    """
+    tracked: list[asyncio.Future] = []
+    token = tracked_workflow_batches.set(tracked)
+    try:
+        yield
+    finally:
+        tracked_workflow_batches.reset(token)
+    await workflow_batcher.wait_started(tracked)
+
+
 class ExtractorClient:
     """
     A client to interact with the extractor server
@@ -96,53 +351,20 @@ class ExtractorClient:
 
     async def connect_temporal_client(self) -> None:
         """
-        Connects to the Temporal server
+        Connects to the Temporal server. The connection is shared by all the clients.
         """
         if self.temporal_client is not None:
             # Already connected
             return
-        if config.TEMPORAL_HOST_URL is None:
-            raise Exception(
-                "TEMPORAL_HOST_URL is missing from the environment variables"
-            )
-        if config.TEMPORAL_NAMESPACE is None:
-            raise Exception(
-                "TEMPORAL_NAMESPACE is missing from the environment variables"
-            )
-
-        if config.ENVIRONMENT in ["production", "staging"]:
-            client_cert = config.TEMPORAL_MTLS_TLS_CERT
-            client_key = config.TEMPORAL_MTLS_TLS_KEY
-
-            self.temporal_client: Client = await Client.connect(
-                config.TEMPORAL_HOST_URL,
-                namespace=config.TEMPORAL_NAMESPACE,
-                tls=TLSConfig(
-                    client_cert=client_cert,
-                    client_private_key=client_key,
-                ),
-                data_converter=pydantic_data_converter,
-            )
-        elif config.ENVIRONMENT in ["test", "preview"]:
-            try:
-                self.temporal_client = await Client.connect(
-                    config.TEMPORAL_HOST_URL,
-                    namespace=config.TEMPORAL_NAMESPACE,
-                    tls=False,
-                    data_converter=pydantic_data_converter,
-                )
-            except Exception as e:
-                logger.error("Have you started a local Temporal server?")
-                logger.error(f"Error connecting to Temporal: {e}")
-                raise e
-        else:
-            raise ValueError(f"Unknown environment {config.ENVIRONMENT}")
+        self.temporal_client = await get_temporal_client()
 
     async def _post(
         self,
         endpoint: str,  # Should be the name of the workflow
         data: dict,  # Should be just one pydantic model
         return_response: bool = False,
+        workflow_id: str | None = None,
+        raise_errors: bool = False,
     ) -> httpx.Response | None:
         """
         Post data to the extractor temporal worker.
@@ -150,6 +372,10 @@ class ExtractorClient:
         If return_response is True, the function will return the response from the workflow.
 
         If return_response is False, the function will return None. This is useful for fire-and-forget workflows.
+
+        workflow_id defaults to a hash of the data, so that the same workflow is not started twice.
+
+        If raise_errors is True, the errors are raised instead of being reported on Slack.
         """
         response = None
 
@@ -163,29 +389,23 @@ class ExtractorClient:
         if self.temporal_client is None:
             raise ValueError("Temporal client is not connected")
 
-        org = propelauth.fetch_org(self.org_id)
-        org_metadata = org.metadata or {}
-        org_plan = org_metadata.get("plan", "hobby")
-        usage_quota = await get_usage_quota(
-            self.org_id, plan=org_plan, fetch_invoice=False
-        )
-
         # We add this data for the extractor server
         data["org_id"] = self.org_id
         data["project_id"] = self.project_id
-        data["customer_id"] = await fetch_stripe_customer_id(self.org_id)
-        data["current_usage"] = usage_quota.current_usage
-        data["max_usage"] = usage_quota.max_usage
+        data.update(await fetch_extractor_context(self.org_id))
 
         try:
-            # Hash the data to generate a unique determinist id
-            unique_id = (
-                endpoint
-                + hashlib.md5(
-                    repr(sorted(data.items())).encode("utf-8"),
-                    usedforsecurity=False,
-                ).hexdigest()
-            )
+            if workflow_id is not None:
+                unique_id = workflow_id
+            else:
+                # Hash the data to generate a unique determinist id
+                unique_id = (
+                    endpoint
+                    + hashlib.md5(
+                        repr(sorted(data.items())).encode("utf-8"),
+                        usedforsecurity=False,
+                    ).hexdigest()
+                )
 
             if not return_response:
                 await self.temporal_client.start_workflow(
@@ -209,6 +429,8 @@ class ExtractorClient:
                 + f"{e}\n{traceback.format_exception(e)}"
             )
             logger.error(error_message)
+            if raise_errors:
+                raise
 
             traceback.print_exc()
             if config.ENVIRONMENT == "production":
@@ -220,6 +442,18 @@ class ExtractorClient:
 
         return response
 
+    async def _post_batched(
+        self, endpoint: str, data: dict, list_keys: list[str]
+    ) -> None:
+        """
+        Start a fire-and-forget workflow, batched with the other workflows of the project
+        with the same endpoint (see WorkflowBatcher).
+        """
+        if config.EXTRACTOR_BATCH_WINDOW <= 0:
+            await self._post(endpoint, data)
+            return
+        await workflow_batcher.add(self, endpoint, data, list_keys=list_keys)
+
     async def run_process_tasks(
         self, tasks_id_to_process: list[str], run_analytics: bool = False
     ) -> None:
@@ -235,12 +469,13 @@ class ExtractorClient:
             logger.debug(f"No tasks to process for project {self.project_id}")
             return
 
-        await self._post(
+        await self._post_batched(
             "run_process_tasks_workflow",
             {
                 "tasks_id_to_process": tasks_id_to_process,
                 "run_analytics": run_analytics,
             },
+            list_keys=["tasks_id_to_process"],
         )
 
     async def run_log_process_for_messages(
@@ -256,7 +491,7 @@ class ExtractorClient:
         if extra_logs_to_save is None:
             extra_logs_to_save = []
 
-        await self._post(
+        await self._post_batched(
             "run_process_logs_for_messages_workflow",
             {
                 "logs_to_process": [
@@ -267,6 +502,7 @@ class ExtractorClient:
                     for log_event in extra_logs_to_save
                 ],
             },
+            list_keys=["logs_to_process", "extra_logs_to_save"],
         )
 
     async def run_process_log_for_tasks(
@@ -310,7 +546,7 @@ class ExtractorClient:
 
                     del log_event.raw_output["intermediate_outputs"]
 
-        await self._post(
+        await self._post_batched(
             "run_process_logs_for_tasks_workflow",
             {
                 "logs_to_process": [
@@ -321,6 +557,7 @@ class ExtractorClient:
                     for log_event in extra_logs_to_save
                 ],
             },
+            list_keys=["logs_to_process", "extra_logs_to_save"],
         )
 
     async def run_main_pipeline_on_task(self, task: Task) -> PipelineResults:
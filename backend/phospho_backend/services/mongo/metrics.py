@@ -0,0 +1,78 @@
+"""
+Concurrent computation of the aggregated metrics of the dashboards.
+
+The metrics of a dashboard are independent queries: they are run concurrently, so that
+the response time is the one of the slowest metric instead of the sum of all of them.
+
+```python
+output = await compute_metrics(
+    {
+        "total_nb_tasks": lambda: get_total_nb_of_tasks(project_id, filters=filters),
+        "nb_daily_tasks": lambda: get_nb_of_daily_tasks(project_id, filters=filters),
+    }
+)
+```
+
+A metric that fails or takes more than config.METRIC_TIMEOUT seconds is missing from the
+output, the other ones are still returned. The duration of each metric and the errors
+are returned in output["metrics_metadata"].
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from phospho_backend.core import config
+
+METRICS_METADATA_KEY = "metrics_metadata"
+
+MetricCall = Callable[[], Awaitable[object]]
+
+_failed = object()
+
+
+async def compute_metrics(
+    metric_calls: dict[str, MetricCall],
+    concurrency: int | None = None,
+    timeout: float | None = None,
+) -> dict[str, object]:
+    """
+    Run the metric calls concurrently, with at most `concurrency` calls at the same time
+    and `timeout` seconds per call. Returns the results by metric name.
+    """
+    if concurrency is None:
+        concurrency = config.METRICS_CONCURRENCY
+    if timeout is None:
+        timeout = config.METRIC_TIMEOUT
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    timings: dict[str, float] = {}
+    errors: dict[str, str] = {}
+
+    async def run(name: str, call: MetricCall) -> object:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                return await asyncio.wait_for(call(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Metric {name} timed out after {timeout} seconds")
+                errors[name] = "timeout"
+            except Exception as e:
+                logger.error(f"Error computing metric {name}: {e}")
+                errors[name] = str(e)
+            finally:
+                timings[name] = round(time.perf_counter() - start, 3)
+            return _failed
+
+    results = await asyncio.gather(
+        *[run(name, call) for name, call in metric_calls.items()]
+    )
+
+    output: dict[str, object] = {
+        name: result
+        for name, result in zip(metric_calls.keys(), results)
+        if result is not _failed
+    }
+    output[METRICS_METADATA_KEY] = {"timings": timings, "errors": errors}
+    return output
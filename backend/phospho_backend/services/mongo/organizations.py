@@ -10,7 +10,11 @@ from phospho.models import Recipe, UsageQuota
 from phospho_backend.core import config
 from phospho_backend.db.models import Project
 from phospho_backend.db.mongo import get_mongo_db
-from phospho_backend.security.authentification import propelauth
+from phospho_backend.security.authentification import (
+    propelauth,
+    update_org_metadata,
+)
+from phospho_backend.services.mongo.usage import get_org_usage
 
 
 async def get_projects_from_org_id(org_id: str, limit: int = 1000) -> list[Project]:
@@ -113,10 +117,8 @@ async def get_usage_quota(
     Calculate the usage quota of an organization.
     The usage quota is the number of tasks logged by the organization.
     """
-    mongo_db = await get_mongo_db()
-
     # Get usage info for the orgnization
-    nb_tasks_logged = await mongo_db["job_results"].count_documents({"org_id": org_id})
+    nb_tasks_logged = await get_org_usage(org_id)
 
     # Default config (plan == "hobby")
     max_usage: int | None = config.PLAN_HOBBY_MAX_NB_DETECTIONS
@@ -201,7 +203,7 @@ def fetch_users_from_org(org_id: str):
     return users
 
 
-def change_organization_plan(
+async def change_organization_plan(
     org_id: str, plan: str = "usage_based", customer_id: str | None = None
 ) -> dict | None:
     """
@@ -219,7 +221,7 @@ def change_organization_plan(
         org_metadata["plan"] = plan
         # Set the customer_id
         org_metadata["customer_id"] = customer_id
-        propelauth.update_org_metadata(
+        await update_org_metadata(
             org_id, max_users=config.PLAN_PRO_MAX_USERS, metadata=org_metadata
         )
         stripe.api_key = config.STRIPE_SECRET_KEY
@@ -0,0 +1,142 @@
+"""
+Keyset (cursor) pagination of the aggregation pipelines.
+
+Paginating with $skip makes Mongo scan and discard all the documents before the page,
+so deep pages get slower and slower. With a cursor, the next page starts right after
+the last document of the previous page: the cursor encodes the values of the sort keys
+of this document, and the page is fetched with a $match on these values.
+
+```python
+sorting_dict = with_tiebreaker({"created_at": -1})
+pipeline += [{"$sort": sorting_dict}, *pagination_stages(sorting_dict, pagination)]
+documents = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
+next_cursor = get_next_cursor(documents, sorting_dict, pagination)
+```
+"""
+
+import base64
+import json
+
+from fastapi import HTTPException
+
+from phospho_backend.api.platform.models.explore import Pagination, Sorting
+
+
+def get_sorting_dict(
+    sorting: list[Sorting] | None, default: dict[str, int], id_field: str = "id"
+) -> dict[str, int]:
+    """
+    The $sort stage of the sorting, with id_field as the last key so that the
+    order of the documents is total.
+    """
+    if sorting is None:
+        sorting_dict = dict(default)
+    else:
+        sorting_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
+    return with_tiebreaker(sorting_dict, id_field=id_field)
+
+
+def with_tiebreaker(
+    sorting_dict: dict[str, int], id_field: str = "id"
+) -> dict[str, int]:
+    """Add id_field to the sort keys, to break ties between equal sort values"""
+    if id_field in sorting_dict:
+        return sorting_dict
+    last_direction = list(sorting_dict.values())[-1] if sorting_dict else -1
+    return {**sorting_dict, id_field: last_direction}
+
+
+def get_sort_value(document: dict, key: str) -> object:
+    """Value of a (dotted) sort key in a document"""
+    value: object = document
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def encode_cursor(document: dict, sorting_dict: dict[str, int]) -> str:
+    """Opaque cursor pointing right after the document"""
+    payload = {
+        "keys": list(sorting_dict.keys()),
+        "values": [get_sort_value(document, key) for key in sorting_dict.keys()],
+    }
+    return base64.urlsafe_b64encode(
+        json.dumps(payload, default=str).encode("utf-8")
+    ).decode("ascii")
+
+
+def decode_cursor(cursor: str, sorting_dict: dict[str, int]) -> list:
+    """Values of the sort keys encoded in the cursor"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        keys, values = payload["keys"], payload["values"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if keys != list(sorting_dict.keys()) or len(values) != len(keys):
+        raise HTTPException(
+            status_code=400,
+            detail="The pagination cursor was created with a different sorting",
+        )
+    return values
+
+
+def _after_condition(key: str, direction: int, value: object) -> dict | None:
+    """Condition on a sort key to be strictly after the value, None if nothing can be"""
+    if value is None:
+        # null is the smallest value: everything is after it in ascending order
+        return {key: {"$ne": None}} if direction == 1 else None
+    if direction == 1:
+        return {key: {"$gt": value}}
+    # Documents with a null value come last in descending order
+    return {"$or": [{key: {"$lt": value}}, {key: None}]}
+
+
+def cursor_match(cursor: str, sorting_dict: dict[str, int]) -> dict:
+    """$match stage of the documents after the cursor"""
+    values = decode_cursor(cursor, sorting_dict)
+    keys = list(sorting_dict.keys())
+    conditions: list[dict] = []
+    for i, key in enumerate(keys):
+        # Equal on the previous keys, strictly after on this one
+        after = _after_condition(key, sorting_dict[key], values[i])
+        if after is None:
+            continue
+        equal = [{keys[j]: values[j]} for j in range(i)]
+        conditions.append({"$and": [*equal, after]} if equal else after)
+    if not conditions:
+        # The cursor is after the last document
+        return {"$match": {"$expr": False}}
+    return {"$match": {"$or": conditions}}
+
+
+def pagination_stages(
+    sorting_dict: dict[str, int], pagination: Pagination | None
+) -> list[dict]:
+    """
+    Stages to add right after the $sort stage. If the pagination has a cursor, the
+    page starts after the cursor. Otherwise, it's selected with pagination.page.
+    """
+    if pagination is None:
+        return []
+    if pagination.cursor is not None:
+        return [
+            cursor_match(pagination.cursor, sorting_dict),
+            {"$limit": pagination.per_page},
+        ]
+    return [
+        {"$skip": pagination.page * pagination.per_page},
+        {"$limit": pagination.per_page},
+    ]
+
+
+def get_next_cursor(
+    documents: list[dict],
+    sorting_dict: dict[str, int],
+    pagination: Pagination | None,
+) -> str | None:
+    """Cursor of the page after the documents, None if it was the last page"""
+    if pagination is None or len(documents) < pagination.per_page:
+        return None
+    return encode_cursor(documents[-1], sorting_dict)
@@ -6,6 +6,7 @@ from phospho.lab.models import ResultType
 from phospho_backend.db.models import JobResult
 from phospho_backend.db.mongo import get_mongo_db
 from phospho_backend.services.mongo.extractor import bill_on_stripe
+from phospho_backend.services.mongo.usage import increment_usage_counters
 
 encoding = tiktoken.get_encoding("cl100k_base")
 
@@ -67,9 +68,9 @@ async def metered_prediction(
 
     logger.debug(f"jobresults: {jobresults}")
     mongo_db = await get_mongo_db()
-    mongo_db["job_results"].insert_many(
-        [jobresult.model_dump() for jobresult in jobresults]
-    )
+    jobresults_to_push_to_db = [jobresult.model_dump() for jobresult in jobresults]
+    mongo_db["job_results"].insert_many(jobresults_to_push_to_db)
+    await increment_usage_counters(jobresults_to_push_to_db)
 
     logger.info(
         f"{len(jobresults)} predictions made for org_id {org_id} with model_id {model_id}"
@@ -22,6 +22,7 @@ from phospho_backend.db.models import (
     Session,
     Task,
 )
+from phospho_backend.db.cache import get_or_set, invalidate
 from phospho_backend.db.mongo import get_mongo_db
 from phospho_backend.security.authentification import propelauth
 from phospho_backend.services.mongo.sessions import get_all_sessions
@@ -34,12 +35,40 @@ from phospho_backend.services.mongo.clustering import (
     fetch_all_clusterings,
 )
 from phospho_backend.services.mongo.users import fetch_users_metadata
+from phospho_backend.services.mongo.usage import get_project_monthly_analytics
 from phospho_backend.services.slack import slack_notification
 from phospho_backend.utils import generate_timestamp, generate_uuid
 from propelauth_fastapi import User  # type: ignore
 
 
 async def get_project_by_id(project_id: str) -> Project:
+    """
+    Get the project with its event definitions.
+    Cached for config.METADATA_CACHE_TTL seconds. Call invalidate_project after updating it.
+    """
+
+    async def load() -> dict:
+        project = await _fetch_project_by_id(project_id)
+        return project.model_dump(mode="json")
+
+    project_data = await get_or_set("project", project_id, load)
+    return Project.model_validate(project_data)
+
+
+async def invalidate_project(project_id: str) -> None:
+    """
+    Remove the project from the cache, after updating it or its event definitions.
+    Its config_version is incremented, so that the extractor workers reload it.
+    """
+    await invalidate("project", project_id)
+    await invalidate("project_org_id", project_id)
+    mongo_db = await get_mongo_db()
+    await mongo_db["projects"].update_one(
+        {"id": project_id}, {"$inc": {"config_version": 1}}
+    )
+
+
+async def _fetch_project_by_id(project_id: str) -> Project:
     mongo_db = await get_mongo_db()
 
     response = (
@@ -154,6 +183,7 @@ async def delete_project_from_id(project_id: str) -> bool:
     """
     mongo_db = await get_mongo_db()
     delete_result = await mongo_db["projects"].delete_one({"id": project_id})
+    await invalidate_project(project_id)
     status = delete_result.deleted_count > 0
     return status
 
@@ -289,6 +319,7 @@ async def update_project(project: Project, **kwargs) -> Project:
             {"id": project.id}, {"$set": updated_project.model_dump()}
         )
 
+    await invalidate_project(project.id)
     updated_project = await get_project_by_id(project.id)
     return updated_project
 
@@ -326,6 +357,7 @@ async def add_project_events(project_id: str, events: list[EventDefinition]) ->
     else:
         logger.warning("No events to add")
 
+    await invalidate_project(project_id)
     updated_project = await get_project_by_id(project_id)
     return updated_project
 
@@ -672,6 +704,7 @@ async def copy_template_project_to_new(
         await mongo_db["event_definitions"].insert_many(
             [event_definition.model_dump() for event_definition in event_definitions]
         )
+        await invalidate_project(project_id)
 
     # Add tasks to the project
     tasks_in_template = await get_all_tasks(
@@ -936,30 +969,8 @@ async def project_check_automatic_analytics_monthly_limit(
 
         nb_additional_analytics = nb_tasks_to_process * usage_per_log
 
-    start_of_this_month = (
-        datetime.datetime.now()
-        .replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        .timestamp()
-    )
-    mongo_db = await get_mongo_db()
-    # Count the number of analytics run this month: sentiment, language, event detection
-    filter = {
-        "$and": [
-            {"project_id": project_id},
-            {
-                "created_at": {
-                    "$gte": start_of_this_month,
-                }
-            },
-            {
-                "$or": [
-                    {"job_id": {"$in": ["sentiment", "language"]}},
-                    {"job_metadata.recipe_type": "event_detection"},
-                ]
-            },
-        ]
-    }
-    nb_analytics = await mongo_db["job_results"].count_documents(filter)
+    # Number of analytics run this month: sentiment, language, event detection
+    nb_analytics = await get_project_monthly_analytics(project_id)
     if nb_analytics + nb_additional_analytics >= project.settings.analytics_threshold:
         logger.warning(f"Project {project_id} reached its monthly limit")
         return True
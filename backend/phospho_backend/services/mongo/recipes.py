@@ -7,8 +7,15 @@ from phospho_backend.api.platform.models.explore import Pagination
 from phospho_backend.db.mongo import get_mongo_db
 from phospho_backend.services.mongo.events import get_event_definition_from_event_id
 from phospho_backend.services.mongo.extractor import ExtractorClient
-from phospho_backend.services.mongo.projects import get_project_by_id
-from phospho_backend.services.mongo.tasks import get_all_tasks, get_total_nb_of_tasks
+from phospho_backend.services.mongo.projects import (
+    get_project_by_id,
+    invalidate_project,
+)
+from phospho_backend.services.mongo.tasks import (
+    get_all_tasks,
+    get_tasks_next_cursor,
+    get_total_nb_of_tasks,
+)
 
 
 async def get_recipe_by_id(recipe_id: str) -> Recipe:
@@ -68,6 +75,7 @@ async def get_recipe_from_event_definition_id(
             {"id": event_definition_id},
             {"$set": {"recipe_id": recipe.id}},
         )
+        await invalidate_project(project_id)
         # Update the mongodb event definition
         await mongo_db["recipes"].insert_one(recipe.model_dump())
         return recipe
@@ -116,16 +124,21 @@ async def run_recipe_on_tasks_batched(
         project_id=project_id,
         org_id=org_id,
     )
-    for i in range(nb_batches + 1):
+    pagination = Pagination(page=0, per_page=batch_size)
+    for _ in range(nb_batches + 1):
         tasks = await get_all_tasks(
             project_id=project_id,
             filters=filters,
-            pagination=Pagination(page=i, per_page=batch_size),
+            pagination=pagination,
         )
         await extractor_client.run_recipe_on_tasks(
             tasks_ids=[task.id for task in tasks],
             recipe=recipe,
         )
+        # Continue after the last task of the batch
+        pagination.cursor = get_tasks_next_cursor(tasks, pagination)
+        if pagination.cursor is None:
+            break
 
 
 async def run_recipe_types_on_tasks(
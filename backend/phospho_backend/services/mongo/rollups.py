@@ -0,0 +1,393 @@
+"""
+Daily rollups of the tasks, sessions and events of the projects, used by the dashboards.
+
+Recomputing the daily metrics from the raw tasks on every dashboard load is slow for
+large projects. Instead, the collection `daily_rollups` stores one document per project
+and per day (UTC) with:
+
+- nb_tasks, nb_success, nb_failure: the tasks created that day, by flag
+- nb_sessions: the sessions created that day
+- events: the number of tasks created that day with each event, [{event_name, count}]
+
+When tasks, flags or events of a day change, the day is marked as dirty with
+`mark_rollups_dirty` (by the log ingestion, the extractor after each pipeline run and
+the edits of the users). Dirty days, and the days computed more than config.ROLLUPS_TTL
+seconds ago, are recomputed from the raw collections when read.
+
+The rollups of a project are backfilled in the background after their first read. Until
+the backfill is done, the stats are computed from the raw collections. A status document
+per project records the backfill, so that a single API worker runs it.
+"""
+
+import asyncio
+import datetime
+import time
+from typing import Iterable
+
+from loguru import logger
+from phospho.models import ProjectDataFilters
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from phospho_backend.core import config
+from phospho_backend.db.mongo import get_mongo_db
+
+DAILY_ROLLUPS_COLLECTION = "daily_rollups"
+DAY_SECONDS = 24 * 60 * 60
+# Number of seconds after which a backfill that didn't finish can be started again
+BACKFILL_TIMEOUT = 30 * 60
+
+# References to the running backfills, so that they are not garbage collected
+_backfill_tasks: set[asyncio.Task] = set()
+
+
+def get_day(timestamp: int | float) -> str:
+    """UTC day of a timestamp, as YYYY-MM-DD"""
+    return datetime.datetime.fromtimestamp(timestamp, datetime.UTC).strftime("%Y-%m-%d")
+
+
+def _day_start(day: str) -> int:
+    """Timestamp of the beginning of a YYYY-MM-DD UTC day"""
+    date = datetime.datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=datetime.UTC)
+    return int(date.timestamp())
+
+
+def _to_timestamp(value: int | float | datetime.datetime | None) -> float | None:
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return value
+
+
+def rollup_id(project_id: str, day: str) -> str:
+    return f"{project_id}:{day}"
+
+
+def _status_id(project_id: str) -> str:
+    return f"{project_id}:status"
+
+
+def empty_stats() -> dict:
+    return {
+        "nb_tasks": 0,
+        "nb_success": 0,
+        "nb_failure": 0,
+        "nb_sessions": 0,
+        "events": [],
+    }
+
+
+def can_use_rollups(filters: ProjectDataFilters | None) -> bool:
+    """The rollups can only answer queries filtered on the project and the creation date"""
+    if filters is None:
+        return True
+    return all(
+        value is None
+        for key, value in filters.model_dump().items()
+        if key not in ("created_at_start", "created_at_end")
+    )
+
+
+async def mark_rollups_dirty(
+    project_id: str, timestamps: Iterable[int | float | None]
+) -> None:
+    """
+    Mark the days of the timestamps as dirty: their rollups are recomputed on the next read.
+    Call this after creating or editing tasks, sessions or events created at these timestamps.
+    """
+    days = {get_day(timestamp) for timestamp in timestamps if timestamp is not None}
+    if not days:
+        return
+    now = time.time()
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db[DAILY_ROLLUPS_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": rollup_id(project_id, day)},
+                    {
+                        "$set": {"dirty": True, "dirty_at": now},
+                        "$setOnInsert": {"project_id": project_id, "date": day},
+                    },
+                    upsert=True,
+                )
+                for day in days
+            ],
+            ordered=False,
+        )
+    except Exception as e:
+        logger.error(f"Error marking the rollups of project {project_id} as dirty: {e}")
+
+
+def _date_of(field: str) -> dict:
+    return {
+        "$dateToString": {
+            "format": "%Y-%m-%d",
+            "date": {"$toDate": {"$multiply": [f"${field}", 1000]}},
+        }
+    }
+
+
+async def compute_daily_stats(
+    project_id: str, start: float | None = None, end: float | None = None
+) -> dict[str, dict]:
+    """Daily stats of the project between start and end (included), from the raw collections"""
+    mongo_db = await get_mongo_db()
+    match: dict[str, object] = {"project_id": project_id}
+    created_at: dict[str, float] = {}
+    if start is not None:
+        created_at["$gte"] = start
+    if end is not None:
+        created_at["$lte"] = end
+    if created_at:
+        match["created_at"] = created_at
+
+    tasks_pipeline = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": _date_of("created_at"),
+                "nb_tasks": {"$sum": 1},
+                "nb_success": {
+                    "$sum": {"$cond": [{"$eq": ["$flag", "success"]}, 1, 0]}
+                },
+                "nb_failure": {
+                    "$sum": {"$cond": [{"$eq": ["$flag", "failure"]}, 1, 0]}
+                },
+            }
+        },
+    ]
+    sessions_pipeline = [
+        {"$match": match},
+        {"$group": {"_id": _date_of("created_at"), "nb_sessions": {"$sum": 1}}},
+    ]
+    events_pipeline = [
+        {"$match": {**match, "removed": {"$ne": True}}},
+        {"$unwind": "$events"},
+        # Deduplicate based on event.event_name x task.id
+        {
+            "$group": {
+                "_id": {
+                    "date": _date_of("created_at"),
+                    "event_name": "$events.event_name",
+                    "task_id": "$id",
+                },
+            }
+        },
+        {
+            "$group": {
+                "_id": {"date": "$_id.date", "event_name": "$_id.event_name"},
+                "count": {"$sum": 1},
+            }
+        },
+    ]
+    tasks, sessions, events = await asyncio.gather(
+        mongo_db["tasks"].aggregate(tasks_pipeline).to_list(length=None),
+        mongo_db["sessions"].aggregate(sessions_pipeline).to_list(length=None),
+        mongo_db["tasks"].aggregate(events_pipeline).to_list(length=None),
+    )
+
+    stats: dict[str, dict] = {}
+    for item in tasks:
+        day_stats = stats.setdefault(item["_id"], empty_stats())
+        day_stats["nb_tasks"] = item["nb_tasks"]
+        day_stats["nb_success"] = item["nb_success"]
+        day_stats["nb_failure"] = item["nb_failure"]
+    for item in sessions:
+        stats.setdefault(item["_id"], empty_stats())["nb_sessions"] = item[
+            "nb_sessions"
+        ]
+    for item in events:
+        stats.setdefault(item["_id"]["date"], empty_stats())["events"].append(
+            {"event_name": item["_id"]["event_name"], "count": item["count"]}
+        )
+    return stats
+
+
+async def _refresh_daily_rollups(
+    project_id: str, dirty_at_per_day: dict[str, float | None]
+) -> dict[str, dict]:
+    """Recompute the rollups of the days, and store them if they were not marked dirty meanwhile"""
+    days = sorted(dirty_at_per_day.keys())
+    # One computation per range of consecutive days
+    ranges: list[tuple[int, int]] = []
+    for day in days:
+        day_start = _day_start(day)
+        if ranges and ranges[-1][1] + 1 == day_start:
+            ranges[-1] = (ranges[-1][0], day_start + DAY_SECONDS - 1)
+        else:
+            ranges.append((day_start, day_start + DAY_SECONDS - 1))
+    computed: dict[str, dict] = {}
+    for range_start, range_end in ranges:
+        computed.update(await compute_daily_stats(project_id, range_start, range_end))
+    stats = {day: computed.get(day, empty_stats()) for day in days}
+
+    mongo_db = await get_mongo_db()
+    await mongo_db[DAILY_ROLLUPS_COLLECTION].bulk_write(
+        [
+            UpdateOne(
+                # If the day was marked dirty during the computation, it stays dirty
+                {"_id": rollup_id(project_id, day), "dirty_at": dirty_at_per_day[day]},
+                {"$set": {**stats[day], "dirty": False, "computed_at": time.time()}},
+            )
+            for day in days
+        ],
+        ordered=False,
+    )
+    return stats
+
+
+async def invalidate_daily_rollups(project_id: str) -> None:
+    """
+    Delete the rollups of the project: they are backfilled again on the next read.
+    Call this after rewriting the tasks or sessions of a project.
+    """
+    mongo_db = await get_mongo_db()
+    await mongo_db[DAILY_ROLLUPS_COLLECTION].delete_many(
+        {"$or": [{"project_id": project_id}, {"_id": _status_id(project_id)}]}
+    )
+
+
+async def _claim_backfill(project_id: str) -> bool:
+    """Claim the backfill of the rollups of the project. False if another worker runs it"""
+    now = time.time()
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db[DAILY_ROLLUPS_COLLECTION].update_one(
+            {
+                "_id": _status_id(project_id),
+                "backfilled_at": {"$exists": False},
+                "$or": [
+                    {"backfill_started_at": {"$exists": False}},
+                    {"backfill_started_at": {"$lt": now - BACKFILL_TIMEOUT}},
+                ],
+            },
+            {"$set": {"backfill_started_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # The status exists but didn't match: already backfilled or being backfilled
+        return False
+    return True
+
+
+async def _run_backfill(project_id: str) -> None:
+    try:
+        await backfill_daily_rollups(project_id)
+    except Exception as e:
+        logger.error(f"Error backfilling the rollups of project {project_id}: {e}")
+        # Let the next read start it again
+        mongo_db = await get_mongo_db()
+        await mongo_db[DAILY_ROLLUPS_COLLECTION].update_one(
+            {"_id": _status_id(project_id)}, {"$unset": {"backfill_started_at": ""}}
+        )
+
+
+async def backfill_daily_rollups(project_id: str) -> None:
+    """Compute the rollups of all the days of the project"""
+    started_at = time.time()
+    stats = await compute_daily_stats(project_id)
+    mongo_db = await get_mongo_db()
+    updates = [
+        UpdateOne(
+            {"_id": rollup_id(project_id, day)},
+            {
+                "$set": {
+                    **day_stats,
+                    "project_id": project_id,
+                    "date": day,
+                    "dirty": False,
+                    "computed_at": started_at,
+                }
+            },
+            upsert=True,
+        )
+        for day, day_stats in stats.items()
+    ]
+    if updates:
+        await mongo_db[DAILY_ROLLUPS_COLLECTION].bulk_write(updates, ordered=False)
+    # Days marked dirty during the backfill are recomputed on read
+    await mongo_db[DAILY_ROLLUPS_COLLECTION].update_many(
+        {"project_id": project_id, "dirty_at": {"$gte": started_at}},
+        {"$set": {"dirty": True}},
+    )
+    await mongo_db[DAILY_ROLLUPS_COLLECTION].update_one(
+        {"_id": _status_id(project_id)},
+        {"$set": {"backfilled_at": started_at}},
+        upsert=True,
+    )
+    logger.info(f"Backfilled {len(stats)} daily rollups of project {project_id}")
+
+
+async def get_daily_rollups(
+    project_id: str,
+    start: int | float | datetime.datetime | None = None,
+    end: int | float | datetime.datetime | None = None,
+) -> dict[str, dict]:
+    """
+    Daily stats of the project between start and end (included), by day. Days without
+    data are missing. The days partially covered by the range are computed from the
+    raw collections, the others are read from the rollups.
+    """
+    start = _to_timestamp(start)
+    end = _to_timestamp(end)
+    mongo_db = await get_mongo_db()
+    status = await mongo_db[DAILY_ROLLUPS_COLLECTION].find_one(
+        {"_id": _status_id(project_id)}
+    )
+    if status is None or "backfilled_at" not in status:
+        if await _claim_backfill(project_id):
+            task = asyncio.create_task(_run_backfill(project_id))
+            _backfill_tasks.add(task)
+            task.add_done_callback(_backfill_tasks.discard)
+        # The rollups are not ready yet
+        return await compute_daily_stats(project_id, start, end)
+
+    # Days partially covered by the range
+    partial_ranges: list[tuple[float | None, float | None]] = []
+    first_full_day = last_full_day = None
+    if start is not None:
+        first_full_day = get_day(start)
+        if start > _day_start(first_full_day):
+            day_end = _day_start(first_full_day) + DAY_SECONDS - 1
+            partial_ranges.append(
+                (start, day_end if end is None else min(end, day_end))
+            )
+            first_full_day = get_day(day_end + 1)
+    # There is no data after now: a range ending after now covers all its last day
+    if end is not None and end < time.time():
+        last_full_day = get_day(end)
+        if end < _day_start(last_full_day) + DAY_SECONDS - 1:
+            if start is None or start < _day_start(last_full_day):
+                partial_ranges.append((_day_start(last_full_day), end))
+            last_full_day = get_day(_day_start(last_full_day) - 1)
+
+    date_filter: dict[str, str] = {}
+    if first_full_day is not None:
+        date_filter["$gte"] = first_full_day
+    if last_full_day is not None:
+        date_filter["$lte"] = last_full_day
+    rollups_filter: dict[str, object] = {"project_id": project_id}
+    if date_filter:
+        rollups_filter["date"] = date_filter
+    rollups = (
+        await mongo_db[DAILY_ROLLUPS_COLLECTION]
+        .find(rollups_filter)
+        .to_list(length=None)
+    )
+
+    stats: dict[str, dict] = {}
+    dirty_at_per_day: dict[str, float | None] = {}
+    expired_before = time.time() - config.ROLLUPS_TTL
+    for rollup in rollups:
+        if rollup.get("dirty") or (rollup.get("computed_at") or 0) < expired_before:
+            dirty_at_per_day[rollup["date"]] = rollup.get("dirty_at")
+        else:
+            stats[rollup["date"]] = {
+                key: rollup.get(key, default) for key, default in empty_stats().items()
+            }
+    if dirty_at_per_day:
+        stats.update(await _refresh_daily_rollups(project_id, dirty_at_per_day))
+    for partial_start, partial_end in partial_ranges:
+        stats.update(await compute_daily_stats(project_id, partial_start, partial_end))
+
+    return {day: stats[day] for day in sorted(stats.keys())}
@@ -8,7 +8,13 @@ from phospho.utils import is_jsonable
 from phospho_backend.api.platform.models.explore import Pagination, Sorting
 from phospho_backend.db.models import Event, EventDefinition, Session, Task
 from phospho_backend.db.mongo import get_mongo_db
+from phospho_backend.services.mongo.pagination import (
+    get_next_cursor,
+    get_sorting_dict,
+    pagination_stages,
+)
 from phospho_backend.services.mongo.query_builder import QueryBuilder
+from phospho_backend.services.mongo.rollups import mark_rollups_dirty
 
 
 async def create_session(
@@ -20,6 +26,7 @@ async def create_session(
     mongo_db = await get_mongo_db()
     new_session = Session(project_id=project_id, org_id=org_id, data=data)
     mongo_db["sessions"].insert_one(new_session.model_dump())
+    await mark_rollups_dirty(project_id, [new_session.created_at])
     return new_session
 
 
@@ -420,6 +427,23 @@ async def human_eval_session(
     return session_model
 
 
+def get_sessions_sorting_dict(sorting: list[Sorting] | None = None) -> dict[str, int]:
+    return get_sorting_dict(sorting, default={"last_message_ts": -1})
+
+
+def get_sessions_next_cursor(
+    sessions: list[Session],
+    pagination: Pagination | None,
+    sorting: list[Sorting] | None = None,
+) -> str | None:
+    """Cursor of the page of sessions after the ones returned by get_all_sessions"""
+    return get_next_cursor(
+        [session.model_dump() for session in sessions],
+        get_sessions_sorting_dict(sorting),
+        pagination,
+    )
+
+
 async def get_all_sessions(
     project_id: str,
     limit: int = 1000,
@@ -431,6 +455,9 @@ async def get_all_sessions(
 ) -> list[Session]:
     """
     Fetch all the sessions of a project.
+
+    If the pagination has a cursor, the page starts after it. Use get_sessions_next_cursor
+    to get the cursor of the next page.
     """
     mongo_db = await get_mongo_db()
 
@@ -446,10 +473,7 @@ async def get_all_sessions(
     pipeline = await query_builder.build()
 
     # To avoid the sort to OOM on Serverless MongoDB executor, we restrain the pipeline to the necessary fields...
-    if sorting is None:
-        sorting_dict = {"last_message_ts": -1}
-    else:
-        sorting_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
+    sorting_dict = get_sessions_sorting_dict(sorting)
     pipeline.extend(
         [
             {
@@ -465,12 +489,7 @@ async def get_all_sessions(
     # Add pagination
     if pagination:
         logger.info(f"Adding pagination: {pagination}")
-        pipeline.extend(
-            [
-                {"$skip": pagination.page * pagination.per_page},
-                {"$limit": pagination.per_page},
-            ]
-        )
+        pipeline.extend(pagination_stages(sorting_dict, pagination))
 
     # ... and then we add the lookup and the deduplication
     pipeline.extend(
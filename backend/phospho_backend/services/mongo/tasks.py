@@ -1,5 +1,5 @@
 from collections import defaultdict
-from typing import Literal, cast
+from typing import AsyncIterator, Literal, cast
 
 import pydantic
 from fastapi import HTTPException
@@ -9,7 +9,14 @@ from phospho.utils import filter_nonjsonable_keys
 from phospho_backend.api.platform.models.explore import Pagination, Sorting
 from phospho_backend.db.models import Eval, Event, EventDefinition, Task
 from phospho_backend.db.mongo import get_mongo_db
+from phospho_backend.services.mongo.pagination import (
+    get_next_cursor,
+    get_sorting_dict,
+    pagination_stages,
+    with_tiebreaker,
+)
 from phospho_backend.services.mongo.query_builder import QueryBuilder
+from phospho_backend.services.mongo.rollups import mark_rollups_dirty
 from phospho_backend.utils import generate_uuid
 from pymongo import InsertOne, UpdateOne
 
@@ -47,6 +54,7 @@ async def create_task(
     doc_creation = await mongo_db["tasks"].insert_one(task_data.model_dump())
     if not doc_creation:
         raise Exception("Failed to insert the task in database")
+    await mark_rollups_dirty(project_id, [task_data.created_at])
     return task_data
 
 
@@ -127,6 +135,7 @@ async def human_eval_task(
         raise HTTPException(
             status_code=500, detail=f"Failed to update Task {task_model.id}: {e}"
         )
+    await mark_rollups_dirty(task_model.project_id, [task_model.created_at])
     # Update the session object
 
     try:
@@ -213,6 +222,8 @@ async def update_task(
         raise HTTPException(
             status_code=500, detail=f"Failed to update Task {task_model.id}: {e}"
         )
+    if flag is not None:
+        await mark_rollups_dirty(task_model.project_id, [task_model.created_at])
 
     return task_model
 
@@ -268,6 +279,7 @@ async def add_event_to_task(
         score_range=score_range,
     )
     await mongo_db["events"].insert_one(detected_event_data.model_dump())
+    await mark_rollups_dirty(task.project_id, [task.created_at])
 
     if task.events is None:
         task.events = []
@@ -295,6 +307,7 @@ async def remove_event_from_task(task: Task, event_name: str) -> Task:
         )
         # Remove the event from the task
         task.events = [e for e in task.events if e.event_name != event_name]
+        await mark_rollups_dirty(task.project_id, [task.created_at])
 
     return task
 
@@ -410,6 +423,23 @@ async def label_sentiment_analysis(
     return None
 
 
+def get_tasks_sorting_dict(sorting: list[Sorting] | None = None) -> dict[str, int]:
+    return get_sorting_dict(sorting, default={"created_at": -1})
+
+
+def get_tasks_next_cursor(
+    tasks: list[Task],
+    pagination: Pagination | None,
+    sorting: list[Sorting] | None = None,
+) -> str | None:
+    """Cursor of the page of tasks after the ones returned by get_all_tasks"""
+    return get_next_cursor(
+        [task.model_dump() for task in tasks],
+        get_tasks_sorting_dict(sorting),
+        pagination,
+    )
+
+
 async def get_all_tasks(
     project_id: str,
     filters: ProjectDataFilters | None = None,
@@ -422,6 +452,9 @@ async def get_all_tasks(
 ) -> list[Task]:
     """
     Get all the tasks of a project.
+
+    If the pagination has a cursor, the page starts after it. Use get_tasks_next_cursor
+    to get the cursor of the next page.
     """
 
     mongo_db = await get_mongo_db()
@@ -448,10 +481,7 @@ async def get_all_tasks(
     )
 
     # To avoid the sort to OOM on Serverless MongoDB executor, we restrain the pipeline to the necessary fields...
-    if sorting is None:
-        sorting_dict = {"created_at": -1}
-    else:
-        sorting_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
+    sorting_dict = get_tasks_sorting_dict(sorting)
     pipeline.extend(
         [
             {
@@ -466,12 +496,7 @@ async def get_all_tasks(
 
     # Add pagination
     if pagination:
-        pipeline.extend(
-            [
-                {"$skip": pagination.page * pagination.per_page},
-                {"$limit": pagination.per_page},
-            ]
-        )
+        pipeline.extend(pagination_stages(sorting_dict, pagination))
         limit = None
 
     # ... and then we add the lookup and the deduplication
@@ -509,6 +534,31 @@ async def get_all_tasks(
     return valid_tasks
 
 
+def get_flattened_tasks_sorting_dict(sort_get_most_recent: bool = True) -> dict:
+    return with_tiebreaker({"created_at": -1 if sort_get_most_recent else 1})
+
+
+def get_flattened_tasks_next_cursor(
+    flattened_tasks: list[FlattenedTask],
+    pagination: Pagination | None,
+    sort_get_most_recent: bool = True,
+) -> str | None:
+    """Cursor of the page of tasks after the ones returned by fetch_flattened_tasks"""
+    # A task can span several rows (one per event)
+    tasks = {
+        flattened_task.task_id: {
+            "id": flattened_task.task_id,
+            "created_at": flattened_task.task_created_at,
+        }
+        for flattened_task in flattened_tasks
+    }
+    return get_next_cursor(
+        list(tasks.values()),
+        get_flattened_tasks_sorting_dict(sort_get_most_recent),
+        pagination,
+    )
+
+
 async def fetch_flattened_tasks(
     project_id: str,
     limit: int | None = 1000,
@@ -527,6 +577,7 @@ async def fetch_flattened_tasks(
     - limit parameter: the maximum number of tasks to return. Note: if with_events is True, as the result is flattened, the number of resulting
     rows can be higher than the limit (e.g. if a task has multiple events).
     - pagination parameter: to paginate the results. If pagination is provided, the limit parameter is ignored.
+    If the pagination has a cursor, the page starts after it (see get_flattened_tasks_next_cursor).
     Note: if with_events is True, the number of results can be higher than the per_page parameter of the pagination,
     as a task can have multiple events.
     - with_events parameter: if True, includes the events in the result.
@@ -539,6 +590,108 @@ async def fetch_flattened_tasks(
     - A list of FlattenedTask objects.
     """
 
+    # Create an aggregated table
+    mongo_db = await get_mongo_db()
+
+    pipeline = await _flattened_tasks_pipeline(
+        project_id=project_id,
+        limit=limit,
+        pagination=pagination,
+        with_events=with_events,
+        with_sessions=with_sessions,
+        keep_removed_events=keep_removed_events,
+        sort_get_most_recent=sort_get_most_recent,
+        filters=filters,
+    )
+
+    # Query Mongo
+    flattened_tasks = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
+
+    logger.info(f"Got: {len(flattened_tasks)} results")
+
+    new_flattened_tasks = []
+    for task in flattened_tasks:
+        # Convert to a FlattenedTask model
+        new_task = FlattenedTask.model_validate(_unnest_flattened_task(task))
+        new_flattened_tasks.append(new_task)
+
+    logger.info(f"Returning: {len(new_flattened_tasks)} unnested results")
+
+    return new_flattened_tasks
+
+
+async def stream_flattened_tasks(
+    project_id: str,
+    limit: int | None = None,
+    with_events: bool = True,
+    with_sessions: bool = True,
+    keep_removed_events: bool = False,
+    sort_get_most_recent: bool = True,
+    filters: ProjectDataFilters | None = None,
+    chunk_size: int = 1000,
+) -> AsyncIterator[list[dict]]:
+    """
+    Same rows as fetch_flattened_tasks, but iterates over the Mongo cursor and yields
+    them by chunks of chunk_size rows, as dicts. Use it to export large projects
+    without loading all their tasks in memory.
+
+    If limit is None, all the tasks matching the filters are returned.
+    """
+    mongo_db = await get_mongo_db()
+
+    pipeline = await _flattened_tasks_pipeline(
+        project_id=project_id,
+        limit=limit,
+        pagination=None,
+        with_events=with_events,
+        with_sessions=with_sessions,
+        keep_removed_events=keep_removed_events,
+        sort_get_most_recent=sort_get_most_recent,
+        filters=filters,
+    )
+
+    chunk: list[dict] = []
+    async for task in mongo_db["tasks"].aggregate(
+        pipeline, allowDiskUse=True, batchSize=chunk_size
+    ):
+        chunk.append(_unnest_flattened_task(task))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _unnest_flattened_task(task: dict) -> dict:
+    """Remove the _id field and flatten the task_metadata field into task_metadata.{key} fields"""
+    # Remove the _id field
+    if "_id" in task.keys():
+        del task["_id"]
+
+    # Flatten the task_metadata field into multiple task_metadata.{key} fields
+    if "task_metadata" in task.keys():
+        for key, value in (task["task_metadata"] or {}).items():
+            if not isinstance(value, dict) and not isinstance(value, list):
+                task[f"task_metadata.{key}"] = value
+            else:
+                # TODO: Handle nested fields. For now, cast to string
+                task[f"task_metadata.{key}"] = str(value)
+        del task["task_metadata"]
+    return task
+
+
+async def _flattened_tasks_pipeline(
+    project_id: str,
+    limit: int | None,
+    pagination: Pagination | None,
+    with_events: bool,
+    with_sessions: bool,
+    keep_removed_events: bool,
+    sort_get_most_recent: bool,
+    filters: ProjectDataFilters | None,
+) -> list[dict]:
+    """Aggregation pipeline of the tasks of a project, flattened for analytics"""
+
     if filters is None:
         filters = ProjectDataFilters()
 
@@ -547,9 +700,6 @@ async def fetch_flattened_tasks(
             "The with_removed_events parameter is ignored if with_events is False"
         )
 
-    # Create an aggregated table
-    mongo_db = await get_mongo_db()
-
     # Aggregation pipeline
     query = QueryBuilder(
         fetch_objects="tasks",
@@ -574,17 +724,12 @@ async def fetch_flattened_tasks(
     # pipeline += [{"$project": return_columns}]
 
     # Sort the pipeline
-    if sort_get_most_recent:
-        pipeline += [{"$sort": {"created_at": -1}}]
-    else:
-        pipeline += [{"$sort": {"created_at": 1}}]
+    sorting_dict = get_flattened_tasks_sorting_dict(sort_get_most_recent)
+    pipeline += [{"$sort": sorting_dict}]
 
     if pagination:
-        pipeline += [
-            {"$skip": pagination.page * pagination.per_page},
-            {"$limit": pagination.per_page},
-        ]
-    else:
+        pipeline += pagination_stages(sorting_dict, pagination)
+    elif limit is not None:
         pipeline += [{"$limit": limit}]
 
     if with_sessions:
@@ -643,34 +788,7 @@ async def fetch_flattened_tasks(
     pipeline += [{"$project": return_columns}]
 
     logger.info(f"Flatten task pipeline: {pipeline}")
-
-    # Query Mongo
-    flattened_tasks = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
-
-    logger.info(f"Got: {len(flattened_tasks)} results")
-
-    new_flattened_tasks = []
-    for task in flattened_tasks:
-        # Remove the _id field
-        if "_id" in task.keys():
-            del task["_id"]
-
-        # Flatten the task_metadata field into multiple task_metadata.{key} fields
-        if "task_metadata" in task.keys():
-            for key, value in task["task_metadata"].items():
-                if not isinstance(value, dict) and not isinstance(value, list):
-                    task[f"task_metadata.{key}"] = value
-                else:
-                    # TODO: Handle nested fields. For now, cast to string
-                    task[f"task_metadata.{key}"] = str(value)
-            del task["task_metadata"]
-        # Convert to a FlattenedTask model
-        new_task = FlattenedTask.model_validate(task)
-        new_flattened_tasks.append(new_task)
-
-    logger.info(f"Returning: {len(new_flattened_tasks)} unnested results")
-
-    return new_flattened_tasks
+    return pipeline
 
 
 async def update_from_flattened_tasks(
@@ -758,5 +876,13 @@ async def update_from_flattened_tasks(
         tasks_results = await mongo_db["tasks"].bulk_write(tasks_update_statements)
     if eval_create_statements:
         eval_results = await mongo_db["evals"].bulk_write(eval_create_statements)
+        await mark_rollups_dirty(
+            project_id,
+            [
+                task.task_created_at
+                for task in flattened_tasks
+                if task.task_id in task_update and "flag" in task_update[task.task_id]
+            ],
+        )
 
     return tasks_results.modified_count > 0 or eval_results.inserted_count > 0
@@ -0,0 +1,246 @@
+"""
+Usage counters of the organizations and projects.
+
+Counting the job_results of an organization on every request is slow once it has
+millions of them. Instead, the counters of the collection `usage_counters` are
+incremented when job_results are inserted, and read with a single find_one.
+
+- `org:{org_id}`: number of job_results of the organization (quota of the plan)
+- `project:{project_id}:{YYYY-MM}`: number of automatic analytics run on the project
+  this month (monthly analytics threshold)
+
+A counter is trusted once it was reconciled with the job_results collection. The
+first read of a counter counts the job_results, and `reconcile_usage_counters` is run
+periodically to fix any drift (eg job_results inserted without incrementing).
+"""
+
+import datetime
+from collections import defaultdict
+from typing import Iterable
+
+from loguru import logger
+from pymongo import ReturnDocument, UpdateOne
+
+from phospho_backend.db.mongo import get_mongo_db
+
+USAGE_COUNTERS_COLLECTION = "usage_counters"
+
+# job_results counted in the monthly analytics of a project
+ANALYTICS_JOB_IDS = ["sentiment", "language"]
+ANALYTICS_RECIPE_TYPES = ["event_detection"]
+
+
+def get_month(timestamp: int | float | None = None) -> str:
+    """Month bucket of a timestamp (now by default), as YYYY-MM"""
+    if timestamp is None:
+        date = datetime.datetime.now()
+    else:
+        date = datetime.datetime.fromtimestamp(timestamp)
+    return date.strftime("%Y-%m")
+
+
+def _month_range(month: str) -> tuple[float, float]:
+    """Start and end timestamps of a YYYY-MM month"""
+    start = datetime.datetime.strptime(month, "%Y-%m")
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start.timestamp(), end.timestamp()
+
+
+def org_counter_id(org_id: str) -> str:
+    return f"org:{org_id}"
+
+
+def project_counter_id(project_id: str, month: str) -> str:
+    return f"project:{project_id}:{month}"
+
+
+def is_analytics_job_result(job_result: dict) -> bool:
+    """Whether the job_result counts in the monthly analytics of its project"""
+    job_metadata = job_result.get("job_metadata") or {}
+    return (
+        job_result.get("job_id") in ANALYTICS_JOB_IDS
+        or job_metadata.get("recipe_type") in ANALYTICS_RECIPE_TYPES
+    )
+
+
+def _analytics_filter(project_id: str, month: str) -> dict:
+    start, end = _month_range(month)
+    return {
+        "project_id": project_id,
+        "created_at": {"$gte": start, "$lt": end},
+        "$or": [
+            {"job_id": {"$in": ANALYTICS_JOB_IDS}},
+            {"job_metadata.recipe_type": {"$in": ANALYTICS_RECIPE_TYPES}},
+        ],
+    }
+
+
+async def increment_usage_counters(job_results: Iterable[dict]) -> None:
+    """
+    Increment the usage counters with job_results that were just inserted.
+    Call this right after inserting job_results in the database.
+    """
+    nb_per_org: dict[str, int] = defaultdict(int)
+    nb_analytics_per_project: dict[tuple[str, str], int] = defaultdict(int)
+    for job_result in job_results:
+        org_id = job_result.get("org_id")
+        if org_id is not None:
+            nb_per_org[org_id] += 1
+        project_id = job_result.get("project_id")
+        if project_id is not None and is_analytics_job_result(job_result):
+            month = get_month(job_result.get("created_at"))
+            nb_analytics_per_project[(project_id, month)] += 1
+
+    updates = [
+        UpdateOne(
+            {"_id": org_counter_id(org_id)},
+            {"$inc": {"count": nb}, "$setOnInsert": {"org_id": org_id}},
+            upsert=True,
+        )
+        for org_id, nb in nb_per_org.items()
+    ] + [
+        UpdateOne(
+            {"_id": project_counter_id(project_id, month)},
+            {
+                "$inc": {"count": nb},
+                "$setOnInsert": {"project_id": project_id, "month": month},
+            },
+            upsert=True,
+        )
+        for (project_id, month), nb in nb_analytics_per_project.items()
+    ]
+    if not updates:
+        return
+
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db[USAGE_COUNTERS_COLLECTION].bulk_write(updates, ordered=False)
+    except Exception as e:
+        # The counters are fixed by the next reconciliation
+        logger.error(f"Error incrementing usage counters: {e}")
+
+
+async def _get_counter(counter_id: str, filter: dict, fields: dict) -> int:
+    """
+    Read a counter. If it was never reconciled, count the job_results matching the
+    filter and store the result.
+    """
+    mongo_db = await get_mongo_db()
+    counter = await mongo_db[USAGE_COUNTERS_COLLECTION].find_one({"_id": counter_id})
+    if counter is not None and counter.get("reconciled_at") is not None:
+        return counter["count"]
+
+    count = await mongo_db["job_results"].count_documents(filter)
+    # $max keeps the increments made while counting
+    counter = await mongo_db[USAGE_COUNTERS_COLLECTION].find_one_and_update(
+        {"_id": counter_id},
+        {
+            "$max": {"count": count},
+            "$set": {"reconciled_at": datetime.datetime.now(datetime.timezone.utc)},
+            "$setOnInsert": fields,
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["count"]
+
+
+async def get_org_usage(org_id: str) -> int:
+    """Number of job_results of the organization"""
+    return await _get_counter(
+        org_counter_id(org_id), {"org_id": org_id}, {"org_id": org_id}
+    )
+
+
+async def get_project_monthly_analytics(
+    project_id: str, month: str | None = None
+) -> int:
+    """Number of automatic analytics run on the project during the month (this month by default)"""
+    if month is None:
+        month = get_month()
+    return await _get_counter(
+        project_counter_id(project_id, month),
+        _analytics_filter(project_id, month),
+        {"project_id": project_id, "month": month},
+    )
+
+
+async def reconcile_usage_counters() -> dict:
+    """
+    Recount the usage counters of all the organizations, and the analytics of all the
+    projects this month, from the job_results collection.
+    """
+    mongo_db = await get_mongo_db()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    month = get_month()
+    start, end = _month_range(month)
+
+    org_counts = await (
+        mongo_db["job_results"]
+        .aggregate(
+            [
+                {"$match": {"org_id": {"$ne": None}}},
+                {"$group": {"_id": "$org_id", "count": {"$sum": 1}}},
+            ]
+        )
+        .to_list(length=None)
+    )
+    project_counts = await (
+        mongo_db["job_results"]
+        .aggregate(
+            [
+                {
+                    "$match": {
+                        "created_at": {"$gte": start, "$lt": end},
+                        "project_id": {"$ne": None},
+                        "$or": [
+                            {"job_id": {"$in": ANALYTICS_JOB_IDS}},
+                            {
+                                "job_metadata.recipe_type": {
+                                    "$in": ANALYTICS_RECIPE_TYPES
+                                }
+                            },
+                        ],
+                    }
+                },
+                {"$group": {"_id": "$project_id", "count": {"$sum": 1}}},
+            ]
+        )
+        .to_list(length=None)
+    )
+
+    updates = [
+        UpdateOne(
+            {"_id": org_counter_id(item["_id"])},
+            {
+                "$set": {
+                    "org_id": item["_id"],
+                    "count": item["count"],
+                    "reconciled_at": now,
+                }
+            },
+            upsert=True,
+        )
+        for item in org_counts
+    ] + [
+        UpdateOne(
+            {"_id": project_counter_id(item["_id"], month)},
+            {
+                "$set": {
+                    "project_id": item["_id"],
+                    "month": month,
+                    "count": item["count"],
+                    "reconciled_at": now,
+                }
+            },
+            upsert=True,
+        )
+        for item in project_counts
+    ]
+    if updates:
+        await mongo_db[USAGE_COUNTERS_COLLECTION].bulk_write(updates, ordered=False)
+
+    logger.info(
+        f"Reconciled usage counters of {len(org_counts)} organizations and {len(project_counts)} projects"
+    )
+    return {"nb_orgs": len(org_counts), "nb_projects": len(project_counts)}
@@ -7,9 +7,38 @@ from phospho.models import ProjectDataFilters
 from phospho_backend.api.platform.models import Pagination, Sorting
 from phospho_backend.api.v2.models.projects import UserMetadata
 from phospho_backend.db.mongo import get_mongo_db
+from phospho_backend.services.mongo.metrics import MetricCall, compute_metrics
+from phospho_backend.services.mongo.pagination import (
+    get_next_cursor,
+    pagination_stages,
+    with_tiebreaker,
+)
 from phospho_backend.services.mongo.query_builder import QueryBuilder
 
 
+def get_users_sorting_dict(sorting: list[Sorting] | None = None) -> dict[str, int]:
+    """The $sort stage of the users. The user_id is the _id of the grouped documents."""
+    if not sorting:
+        return {"last_message_ts": 1, "_id": -1}
+    sort_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
+    # Rename the id user_id by _id
+    sort_dict["_id"] = sort_dict.pop("user_id", 1)
+    return with_tiebreaker(sort_dict, id_field="_id")
+
+
+def get_users_next_cursor(
+    users: list[UserMetadata],
+    pagination: Pagination | None,
+    sorting: list[Sorting] | None = None,
+) -> str | None:
+    """Cursor of the page of users after the ones returned by fetch_users_metadata"""
+    return get_next_cursor(
+        [{**user.model_dump(), "_id": user.user_id} for user in users],
+        get_users_sorting_dict(sorting),
+        pagination,
+    )
+
+
 async def fetch_users_metadata(
     project_id: str,
     filters: ProjectDataFilters,
@@ -23,7 +52,8 @@ async def fetch_users_metadata(
     - project_id: str
     - filters: ProjectDataFilters
     - sorting: Optional[List[Sorting]]
-    - pagination: Optional[Pagination]
+    - pagination: Optional[Pagination] If it has a cursor, the page starts after it
+        (see get_users_next_cursor).
     - user_id_search: Optional[str] Search for a specific user_id.
         It uses a regex to match the user_id, so it can be a partial match.
 
@@ -119,21 +149,14 @@ async def fetch_users_metadata(
     # Apply the sorting
     if sorting:
         logger.info(f"Sorting by: {sorting}")
-        sort_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
-        # Rename the id user_id by _id
-        sort_dict["_id"] = sort_dict.pop("user_id", 1)
-        pipeline += [{"$sort": sort_dict}]
-    else:
-        pipeline += [{"$sort": {"last_message_ts": 1, "_id": -1}}]
+    sort_dict = get_users_sorting_dict(sorting)
+    pipeline += [{"$sort": sort_dict}]
 
     # Adds the pagination
     # TODO: All the steps above are pretty slow. Server-side pagination does not work well with this approach.
     # We should create a new collection to persist the user metadata and use it for pagination, like Sessions.
     if pagination:
-        pipeline += [
-            {"$skip": pagination.page * pagination.per_page},
-            {"$limit": pagination.per_page},
-        ]
+        pipeline += pagination_stages(sort_dict, pagination)
 
     # Adds the list of unique detected events.
     # This is a bit tricky because we need to deduplicate the events based on the event_definition.id
@@ -300,14 +323,7 @@ async def fetch_users_metadata(
     ]
 
     # group made us lose the order. We need to sort again
-    if sorting:
-        logger.info(f"Sorting by: {sorting}")
-        sort_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
-        # Rename the id user_id by _id
-        sort_dict["_id"] = sort_dict.pop("user_id", 1)
-        pipeline += [{"$sort": sort_dict}]
-    else:
-        pipeline += [{"$sort": {"last_message_ts": 1, "_id": -1}}]
+    pipeline += [{"$sort": sort_dict}]
 
     users = (
         await mongo_db["tasks"]
@@ -581,35 +597,33 @@ async def get_users_aggregated_metrics(
     if metrics is None:
         metrics = []
 
-    output: dict[str, object] = {}
-    if "nb_users" in metrics:
-        total_nb_users = (
-            await get_total_nb_of_users(
-                project_id=project_id,
-                filters=filters,
-            )
-            # If None, set to 0
-            or 0
-        )
-        output["nb_users"] = total_nb_users
+    # The metrics run concurrently: each one gets its own copy of the filters,
+    # as some of them edit the filters they receive
+    def metric_filters() -> ProjectDataFilters | None:
+        return filters.model_copy(deep=True) if filters is not None else None
 
-    if "avg_nb_tasks_per_user" in metrics:
-        output["avg_nb_tasks_per_user"] = await get_average_nb_tasks_per_user(
-            project_id=project_id, filters=filters
+    async def get_nb_users() -> int:
+        # If None, set to 0
+        return (
+            await get_total_nb_of_users(project_id=project_id, filters=metric_filters())
+            or 0
         )
 
-    if "nb_users_messages" in metrics:
+    metric_calls: dict[str, MetricCall] = {
+        "nb_users": get_nb_users,
+        "avg_nb_tasks_per_user": lambda: get_average_nb_tasks_per_user(
+            project_id=project_id, filters=metric_filters()
+        ),
         # Number of messages sent by users
-        output["nb_users_messages"] = await get_nb_users_messages(
+        "nb_users_messages": lambda: get_nb_users_messages(
             project_id=project_id,
-            filters=filters,
-        )
-
-    if "user_retention" in metrics:
-        # User retention
-        output["user_retention"] = await get_user_retention(
+            filters=metric_filters(),
+        ),
+        "user_retention": lambda: get_user_retention(
             project_id=project_id,
-            filters=filters,
-        )
-
-    return output
+            filters=metric_filters(),
+        ),
+    }
+    return await compute_metrics(
+        {name: call for name, call in metric_calls.items() if name in metrics}
+    )
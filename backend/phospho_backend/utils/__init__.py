@@ -5,8 +5,8 @@ import uuid
 from collections import Counter
 
 import httpx
-import tiktoken
 from loguru import logger
+from phospho.utils import get_number_of_tokens
 
 
 def get_most_common(items):
@@ -52,11 +52,7 @@ def fits_in_context_window(prompt: str, context_window_size: int) -> bool:
     Check if the prompt fits in the context window
     context_window_size is the number of tokens of the context window
     """
-    encoding = tiktoken.get_encoding("cl100k_base")
-
-    num_tokens = len(encoding.encode(prompt))
-
-    return num_tokens <= context_window_size
+    return get_number_of_tokens(prompt) <= context_window_size
 
 
 def get_last_week_timestamps() -> tuple[int, int]:
@@ -0,0 +1,22 @@
+import bson
+from phospho_backend.services.log_queue import split_log_events
+
+
+def test_split_log_events():
+    logs_to_process = [{"input": "a" * 1000, "task_id": str(i)} for i in range(10)]
+    extra_logs_to_save = [{"input": "b" * 1000, "task_id": "extra"}]
+    max_bytes = 3 * len(bson.encode(logs_to_process[0]))
+
+    chunks = split_log_events(logs_to_process, extra_logs_to_save, max_bytes=max_bytes)
+
+    assert [len(chunk[0]) + len(chunk[1]) for chunk in chunks] == [3, 3, 3, 2]
+    assert [log for chunk in chunks for log in chunk[0]] == logs_to_process
+    assert [log for chunk in chunks for log in chunk[1]] == extra_logs_to_save
+    for chunk_logs, chunk_extra_logs in chunks:
+        assert sum(len(bson.encode(log)) for log in chunk_logs + chunk_extra_logs) <= (
+            max_bytes
+        )
+
+    # A log event larger than the limit is alone in its item
+    chunks = split_log_events(logs_to_process[:2], [], max_bytes=10)
+    assert chunks == [([logs_to_process[0]], []), ([logs_to_process[1]], [])]
@@ -0,0 +1,95 @@
+import pytest
+from fastapi import HTTPException
+from phospho_backend.services.mongo.pagination import (
+    _after_condition,
+    cursor_match,
+    decode_cursor,
+    encode_cursor,
+    with_tiebreaker,
+)
+
+
+def matches(document: dict, condition: dict) -> bool:
+    """Evaluate the subset of the Mongo query language used by cursor_match"""
+    for key, value in condition.items():
+        if key == "$or":
+            if not any(matches(document, c) for c in value):
+                return False
+        elif key == "$and":
+            if not all(matches(document, c) for c in value):
+                return False
+        elif key == "$expr":
+            if not value:
+                return False
+        elif isinstance(value, dict):
+            field = document.get(key)
+            for operator, operand in value.items():
+                if operator == "$ne" and field == operand:
+                    return False
+                if operator == "$gt" and (field is None or not field > operand):
+                    return False
+                if operator == "$lt" and (field is None or not field < operand):
+                    return False
+        elif document.get(key) != value:
+            return False
+    return True
+
+
+def mongo_sort(documents: list[dict], sorting_dict: dict[str, int]) -> list[dict]:
+    """Sort like Mongo: null is the smallest value"""
+    for key, direction in reversed(sorting_dict.items()):
+        documents = sorted(
+            documents,
+            key=lambda d: (d.get(key) is not None, d.get(key) or 0),
+            reverse=direction == -1,
+        )
+    return documents
+
+
+DOCUMENTS = [
+    {"id": "a", "created_at": 3},
+    {"id": "b", "created_at": None},
+    {"id": "c", "created_at": 1},
+    {"id": "d", "created_at": 3},
+    {"id": "e", "created_at": None},
+    {"id": "f", "created_at": 2},
+]
+
+
+def test_cursor_round_trip():
+    sorting_dict = with_tiebreaker({"created_at": -1})
+    assert sorting_dict == {"created_at": -1, "id": -1}
+    cursor = encode_cursor({"id": "a", "created_at": 3}, sorting_dict)
+    assert decode_cursor(cursor, sorting_dict) == [3, "a"]
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+def test_cursor_match_pages(direction):
+    sorting_dict = with_tiebreaker({"created_at": direction})
+    documents = mongo_sort(DOCUMENTS, sorting_dict)
+    # The documents after each cursor are the next ones in the sort order, including
+    # the ties broken by id and the null values
+    for i, document in enumerate(documents):
+        match = cursor_match(encode_cursor(document, sorting_dict), sorting_dict)
+        after = [d for d in documents if matches(d, match["$match"])]
+        assert after == documents[i + 1 :]
+
+
+def test_after_condition_nulls():
+    # null is the smallest value
+    assert _after_condition("created_at", 1, None) == {"created_at": {"$ne": None}}
+    assert _after_condition("created_at", -1, None) is None
+    assert _after_condition("created_at", -1, 2) == {
+        "$or": [{"created_at": {"$lt": 2}}, {"created_at": None}]
+    }
+
+
+def test_cursor_from_another_sorting():
+    cursor = encode_cursor(DOCUMENTS[0], with_tiebreaker({"created_at": -1}))
+    with pytest.raises(HTTPException) as exc_info:
+        cursor_match(cursor, with_tiebreaker({"last_eval.created_at": -1}))
+    assert exc_info.value.status_code == 400
+
+    with pytest.raises(HTTPException) as exc_info:
+        cursor_match("not a cursor", with_tiebreaker({"created_at": -1}))
+    assert exc_info.value.status_code == 400
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from phospho_backend.core import config
+from phospho_backend.services.mongo import extractor
+from phospho_backend.services.mongo.extractor import (
+    WorkflowBatcher,
+    started_workflow_batches,
+)
+
+
+class FakeExtractorClient:
+    org_id = "org"
+    project_id = "project"
+
+    def __init__(self, nb_failures: int = 0):
+        self.posted: list[dict] = []
+        self.nb_failures = nb_failures
+
+    async def _post(self, endpoint, data, workflow_id=None, raise_errors=False):
+        if self.nb_failures > 0:
+            self.nb_failures -= 1
+            raise RuntimeError("Temporal is down")
+        self.posted.append(data)
+
+
+@pytest.fixture
+def batcher(monkeypatch):
+    batcher = WorkflowBatcher()
+    monkeypatch.setattr(extractor, "workflow_batcher", batcher)
+    monkeypatch.setattr(config, "EXTRACTOR_BATCH_WINDOW", 10)
+    monkeypatch.setattr(config, "EXTRACTOR_BATCH_MAX_SIZE", 500)
+    monkeypatch.setattr(config, "EXTRACTOR_BATCH_MAX_BYTES", 1_000_000)
+    monkeypatch.setattr(config, "EXTRACTOR_BATCH_MAX_ATTEMPTS", 1)
+    return batcher
+
+
+async def add_tasks(batcher, client, tasks_ids):
+    await batcher.add(
+        client,
+        "run_process_tasks_workflow",
+        {"tasks_id_to_process": tasks_ids, "run_analytics": True},
+        list_keys=["tasks_id_to_process"],
+    )
+
+
+@pytest.mark.asyncio
+async def test_workflow_batcher_coalesces(batcher):
+    client = FakeExtractorClient()
+    async with started_workflow_batches():
+        await add_tasks(batcher, client, ["task_1"])
+        await add_tasks(batcher, client, ["task_2", "task_3"])
+        assert client.posted == []
+    # Started on exit, without waiting for the window
+    assert len(client.posted) == 1
+    assert client.posted[0]["tasks_id_to_process"] == ["task_1", "task_2", "task_3"]
+    assert batcher.batches == {}
+
+
+@pytest.mark.asyncio
+async def test_workflow_batcher_max_bytes(batcher, monkeypatch):
+    monkeypatch.setattr(config, "EXTRACTOR_BATCH_MAX_BYTES", 30)
+    client = FakeExtractorClient()
+    async with started_workflow_batches():
+        await add_tasks(batcher, client, ["x" * 20])
+        # Would cross the limit: the first batch is started before
+        await add_tasks(batcher, client, ["y" * 20])
+        assert len(client.posted) == 1
+    assert [data["tasks_id_to_process"] for data in client.posted] == [
+        ["x" * 20],
+        ["y" * 20],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_workflow_batcher_raises_errors_of_started_batches(batcher, monkeypatch):
+    monkeypatch.setattr(config, "EXTRACTOR_BATCH_WINDOW", 0.01)
+    client = FakeExtractorClient(nb_failures=1)
+    with pytest.raises(RuntimeError):
+        async with started_workflow_batches():
+            await add_tasks(batcher, client, ["task_1"])
+            # The window ends, and the batch fails to start, before the block exits
+            await asyncio.sleep(0.05)
+            assert batcher.batches == {}
+    assert client.posted == []
+
+    # The batches of other blocks are not waited for
+    async with started_workflow_batches():
+        await add_tasks(batcher, client, ["task_2"])
+    assert client.posted == [{"tasks_id_to_process": ["task_2"], "run_analytics": True}]
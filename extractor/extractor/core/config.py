@@ -42,6 +42,49 @@ API_KEY_WAITING_TIME = 0.1  # in seconds
 ### OPENAI ###
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+### LLM RATE LIMITS ###
+# Rate limits of the LLM providers, shared by all the workloads of the worker
+# Format: {"openai": {"requests_per_minute": 5000, "tokens_per_minute": 800000}}
+LLM_RATE_LIMITS: dict = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+
+### LLM CACHE ###
+# If set, the LLM calls of the jobs are cached in Mongo for this number of seconds
+LLM_CACHE_TTL = (
+    int(os.getenv("LLM_CACHE_TTL", "")) if os.getenv("LLM_CACHE_TTL") else None
+)
+
+### PROJECT SNAPSHOTS ###
+# Number of seconds the configuration of a project (events, few-shot examples) is reused by
+# the pipelines before being reloaded. 0 reloads it for every pipeline.
+PROJECT_SNAPSHOT_TTL = int(os.getenv("PROJECT_SNAPSHOT_TTL", 30))
+
+### TASK CONTEXT ###
+# Maximum number of previous tasks of the session given as context to the jobs
+MAX_CONTEXT_TASKS = int(os.getenv("MAX_CONTEXT_TASKS", 30))
+# Maximum number of tokens (inputs and outputs) of these previous tasks
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", 8000))
+# Number of tasks whose context is fetched in a single query
+CONTEXT_BATCH_SIZE = 50
+
+### WEBHOOKS ###
+# Maximum number of webhook requests sent at the same time by a worker
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 20))
+# Maximum number of webhook requests sent at the same time to the same URL
+WEBHOOK_CONCURRENCY_PER_URL = int(os.getenv("WEBHOOK_CONCURRENCY_PER_URL", 4))
+# Timeout of a webhook request, in seconds
+WEBHOOK_TIMEOUT = int(os.getenv("WEBHOOK_TIMEOUT", 3))
+# Number of delivery attempts of a webhook before giving up
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 5))
+# Delay before the first retry of a failed webhook, in seconds. Doubled at each attempt.
+WEBHOOK_RETRY_BASE_DELAY = int(os.getenv("WEBHOOK_RETRY_BASE_DELAY", 10))
+# Number of seconds between two deliveries of the pending webhooks of the outbox
+WEBHOOK_DISPATCH_INTERVAL = int(os.getenv("WEBHOOK_DISPATCH_INTERVAL", 5))
+
+### CONNECTORS ###
+# Number of logs fetched, processed and checkpointed at once by the LangSmith and
+# Langfuse connectors
+CONNECTOR_PAGE_SIZE = int(os.getenv("CONNECTOR_PAGE_SIZE", 100))
+
 ### WATCHERS ###
 EVALUATION_SOURCE = "phospho-6"  # If phospho
 FEW_SHOT_MAX_NUMBER_OF_EXAMPLES = 10
@@ -83,6 +126,12 @@ if credentials_natural_language is not None:
         credentials=credentials
     )
 
+# Backend of the sentiment analysis and language detection: "google" (Google Cloud
+# Natural Language API) or "local" (lexicon and n-grams, runs on CPU without network)
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "google")
+# Maximum number of Google Natural Language API requests sent at the same time by a pipeline
+SENTIMENT_API_CONCURRENCY = int(os.getenv("SENTIMENT_API_CONCURRENCY", 10))
+
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 SLACK_URL = os.getenv("SLACK_URL")
 
@@ -1,8 +1,36 @@
-from typing import Optional
+"""
+Connectors import the logs of the projects from third party platforms (LangSmith, Langfuse).
+
+The synchronisation is a streaming pipeline: the logs are fetched by pages in a worker
+thread (the vendor clients are synchronous), and each page is dumped, converted and
+processed as soon as it arrives. After each page, a checkpoint is saved in the collection
+`connector_checkpoints`, so that a sync interrupted by a timeout or a crash resumes from
+the last processed page instead of restarting from scratch.
+
+The vendor APIs return the most recent logs first. A sync imports the logs started
+between the last extract (`since`) and the start of the sync (`until`). The checkpoint
+stores the start time of the oldest processed log (`cursor`): a resumed sync only fetches
+the logs started before it.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from extractor.db.mongo import get_mongo_db
+from extractor.models import LogEventForTasks
+from extractor.services.log.tasks import process_logs_for_tasks
+from extractor.services.project_snapshots import invalidate_project_snapshot
+
+CONNECTOR_CHECKPOINTS_COLLECTION = "connector_checkpoints"
 
 
 class BaseConnector:
     project_id: str
+    # Name of the third party platform
+    source: str = "base"
 
     def __init__(
         self,
@@ -22,29 +50,104 @@ class BaseConnector:
         """
         return
 
-    async def _dump(self):
+    async def _get_last_extract(self) -> Optional[datetime]:
         """
-        Dump the raw pulled data
+        Start time of the logs already imported by the previous syncs
+        """
+        raise NotImplementedError
+
+    async def _update_last_extract(self, last_extract: datetime):
+        """
+        Save the start time of the logs already imported
+        """
+        raise NotImplementedError
+
+    def fetch_pages(
+        self, since: Optional[datetime], until: datetime
+    ) -> Iterator[List[Any]]:
+        """
+        Pages of raw logs started in [since, until), the most recent first.
+        Blocking: this is iterated in a worker thread.
+        """
+        raise NotImplementedError
+
+    def get_start_time(self, item: Any) -> Optional[datetime]:
+        """
+        Start time of a raw log
         """
         raise NotImplementedError
 
-    async def pull(self):
+    def convert(self, item: Any, org_id: str) -> Optional[LogEventForTasks]:
         """
-        Pull the data
+        Convert a raw log to a log event. Returns None if it should be skipped.
         """
         raise NotImplementedError
 
-    async def process(
+    async def _dump(self, items: List[Any]):
+        """
+        Dump the raw pulled data
+        """
+        raise NotImplementedError
+
+    async def _get_checkpoint(self) -> Optional[Dict[str, Any]]:
+        mongo_db = await get_mongo_db()
+        return await mongo_db[CONNECTOR_CHECKPOINTS_COLLECTION].find_one(
+            {"_id": f"{self.project_id}:{self.source}"}
+        )
+
+    async def _save_checkpoint(self, checkpoint: Dict[str, Any]):
+        mongo_db = await get_mongo_db()
+        await mongo_db[CONNECTOR_CHECKPOINTS_COLLECTION].update_one(
+            {"_id": f"{self.project_id}:{self.source}"},
+            {"$set": checkpoint},
+            upsert=True,
+        )
+
+    async def _clear_checkpoint(self):
+        mongo_db = await get_mongo_db()
+        await mongo_db[CONNECTOR_CHECKPOINTS_COLLECTION].delete_one(
+            {"_id": f"{self.project_id}:{self.source}"}
+        )
+
+    async def process_page(
         self,
+        items: List[Any],
         org_id: str,
         current_usage: int,
         max_usage: Optional[int] = None,
     ) -> int:
         """
-        Push the data and process it
+        Push a page of raw logs and process it
         Return the number of logs processed
         """
-        raise NotImplementedError
+        await self._dump(items)
+
+        logs_to_process: List[LogEventForTasks] = []
+        extra_logs_to_save: List[LogEventForTasks] = []
+        for item in items:
+            try:
+                log_event = self.convert(item, org_id=org_id)
+            except Exception as e:
+                logger.error(
+                    f"Error processing {self.source} log for project id: {self.project_id}, {e}"
+                )
+                continue
+            if log_event is None:
+                continue
+            if max_usage is None or current_usage < max_usage:
+                logs_to_process.append(log_event)
+                current_usage += 1
+            else:
+                extra_logs_to_save.append(log_event)
+
+        if logs_to_process or extra_logs_to_save:
+            await process_logs_for_tasks(
+                project_id=self.project_id,
+                org_id=org_id,
+                logs_to_process=logs_to_process,
+                extra_logs_to_save=extra_logs_to_save,
+            )
+        return len(logs_to_process)
 
     async def sync(
         self,
@@ -54,15 +157,60 @@ class BaseConnector:
         **kwargs,
     ):
         await self.load_config(**kwargs)
-        await self.pull()
-        nb_job_results = await self.process(
-            org_id=org_id,
-            current_usage=current_usage,
-            max_usage=max_usage,
+
+        checkpoint = await self._get_checkpoint()
+        if checkpoint is not None:
+            checkpoint.pop("_id", None)
+            logger.info(
+                f"Resuming the {self.source} sync of project {self.project_id} from {checkpoint['cursor']}"
+            )
+        else:
+            checkpoint = {
+                "since": await self._get_last_extract(),
+                "until": datetime.now(),
+                "cursor": None,
+                "nb_job_results": 0,
+            }
+        # The logs processed before the interruption count in the usage
+        current_usage += checkpoint["nb_job_results"]
+
+        pages = self.fetch_pages(
+            since=checkpoint["since"],
+            until=checkpoint["cursor"] or checkpoint["until"],
         )
+        while True:
+            items = await asyncio.to_thread(next, pages, None)
+            if items is None:
+                break
+            if not items:
+                continue
+            nb_job_results = await self.process_page(
+                items,
+                org_id=org_id,
+                current_usage=current_usage,
+                max_usage=max_usage,
+            )
+            current_usage += nb_job_results
+            start_times = [
+                start_time
+                for start_time in (self.get_start_time(item) for item in items)
+                if start_time is not None
+            ]
+            if start_times:
+                checkpoint["cursor"] = min(start_times)
+            checkpoint["nb_job_results"] += nb_job_results
+            await self._save_checkpoint(checkpoint)
+
+        await self._update_last_extract(checkpoint["until"])
+        # The settings of the project changed
+        invalidate_project_snapshot(self.project_id)
+        await self._clear_checkpoint()
         await self.save_config(**kwargs)
+        logger.debug(
+            f"Finished the {self.source} sync of project {self.project_id}: {checkpoint['nb_job_results']} logs processed"
+        )
         return {
             "status": "ok",
             "message": "Synchronisation pipeline ran successfully",
-            "nb_job_results": nb_job_results,
+            "nb_job_results": checkpoint["nb_job_results"],
         }
@@ -1,26 +1,24 @@
 import base64
 from datetime import datetime
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 from Crypto import Random
 from Crypto.Cipher import AES
 from Crypto.Hash import SHA256
 from langfuse import Langfuse  # type: ignore
-from langfuse.client import ObservationsViews  # type: ignore
+from langfuse.api import ObservationsView  # type: ignore
 from loguru import logger
 
 from extractor.core import config
 from extractor.db.mongo import get_mongo_db
 from extractor.models import LogEventForTasks
 from extractor.services.connectors.base import BaseConnector
-from extractor.services.log.tasks import process_logs_for_tasks
 from extractor.services.projects import get_project_by_id
 
 
 class LangfuseConnector(BaseConnector):
     project_id: str
-    langfuse: Optional[Langfuse] = None
-    observations: Optional[ObservationsViews] = None
+    source = "langfuse"
 
     def __init__(
         self,
@@ -111,7 +109,7 @@ class LangfuseConnector(BaseConnector):
             upsert=True,
         )
 
-    async def _get_last_langfuse_extract(self) -> Optional[datetime]:
+    async def _get_last_extract(self) -> Optional[datetime]:
         """
         Get the last Langfuse extract date for a project
         """
@@ -134,40 +132,44 @@ class LangfuseConnector(BaseConnector):
             )
             return None
 
-    async def _dump(self):
+    async def _dump(self, items: List[ObservationsView]):
         # Dump to a dedicated db
         mongo_db = await get_mongo_db()
-        observations_list = [
-            observation.dict() for observation in self.observations.data
-        ]
+        observations_list = [observation.dict() for observation in items]
         if len(observations_list) > 0:
-            mongo_db["logs_langfuse"].insert_many(observations_list)
+            await mongo_db["logs_langfuse"].insert_many(observations_list)
 
-    async def pull(self):
+    def fetch_pages(
+        self, since: Optional[datetime], until: datetime
+    ) -> Iterator[List[ObservationsView]]:
         if self.langfuse_public_key is None or self.langfuse_secret_key is None:
             logger.info("No Langfuse credentials provided")
             return
 
-        self.langfuse = Langfuse(
+        langfuse = Langfuse(
             public_key=self.langfuse_public_key,
             secret_key=self.langfuse_secret_key,
         )
-        last_langfuse_extract = await self._get_last_langfuse_extract()
-        if last_langfuse_extract is None:
-            self.observations = self.langfuse.client.observations.get_many(
-                type="GENERATION"
-            )
-        else:
-            self.observations = self.langfuse.client.observations.get_many(
-                type="GENERATION",
-                from_start_time=last_langfuse_extract,
-            )
-
-        self.langfuse.shutdown()
-        # Save the raw data
-        await self._dump()
-
-    async def _update_last_langfuse_extract(self):
+        try:
+            page = 1
+            while True:
+                observations = langfuse.client.observations.get_many(
+                    type="GENERATION",
+                    page=page,
+                    limit=config.CONNECTOR_PAGE_SIZE,
+                    from_start_time=since,
+                    to_start_time=until,
+                )
+                if not observations.data:
+                    return
+                yield observations.data
+                if page >= observations.meta.total_pages:
+                    return
+                page += 1
+        finally:
+            langfuse.shutdown()
+
+    async def _update_last_extract(self, last_extract: datetime):
         """
         Change the last LangFuse extract for a project
         """
@@ -175,101 +177,67 @@ class LangfuseConnector(BaseConnector):
 
         await mongo_db["projects"].update_one(
             {"id": self.project_id},
-            {"$set": {"settings.last_langfuse_extract": datetime.now()}},
+            {"$set": {"settings.last_langfuse_extract": last_extract}},
         )
 
-    async def process(
-        self,
-        org_id: str,
-        current_usage: int,
-        max_usage: Optional[int] = None,
-    ) -> int:
-        logs_to_process: List[LogEventForTasks] = []
-        extra_logs_to_save: List[LogEventForTasks] = []
-
-        if self.observations is None:
+    def get_start_time(self, item: ObservationsView) -> Optional[datetime]:
+        return item.start_time
+
+    def convert(
+        self, item: ObservationsView, org_id: str
+    ) -> Optional[LogEventForTasks]:
+        observation = item
+        raw_input = observation.input
+        raw_output = observation.output
+
+        input = None
+        output = None
+        system_prompt = None
+
+        # Input processing
+        if isinstance(raw_input, str):
+            input = raw_input
+        if isinstance(raw_input, list):
+            # input is a list of messagess
+            user_messages = [
+                m for m in raw_input if isinstance(m, dict) and m.get("role") == "user"
+            ]
+            system_messages = [
+                m
+                for m in raw_input
+                if isinstance(m, dict) and m.get("role") == "system"
+            ]
+            if len(user_messages) > 0:
+                input = user_messages[-1].get("content", None)
+            if len(system_messages) > 0:
+                output = system_messages[-1].get("content", None)
+
+        # Output processing
+        if isinstance(raw_output, dict):
+            output = raw_output.get("content", None)
+        if isinstance(raw_output, str):
+            output = raw_output
+
+        if input is None:
+            logger.warning(
+                f"Langfuse connector: Found empty input in project {self.project_id} of orga {org_id}: input is None. Skipping. raw_input: {raw_input}"
+            )
+            return None
+        if not isinstance(input, str):
             logger.error(
-                f"No Langfuse observations to process for project id: {self.project_id}"
+                f"Langfuse connector: Found incompatible input while processing project {self.project_id} of orga {org_id}: input is not a string. Skipping. raw_input: {raw_input}"
             )
-            return 0
-
-        for observation in self.observations.data:
-            try:
-                raw_input = observation.input
-                raw_output = observation.output
-
-                input = None
-                output = None
-                system_prompt = None
-
-                # Input processing
-                if isinstance(raw_input, str):
-                    input = raw_input
-                if isinstance(raw_input, list):
-                    # input is a list of messagess
-                    user_messages = [
-                        m
-                        for m in raw_input
-                        if isinstance(m, dict) and m.get("role") == "user"
-                    ]
-                    system_messages = [
-                        m
-                        for m in raw_input
-                        if isinstance(m, dict) and m.get("role") == "system"
-                    ]
-                    if len(user_messages) > 0:
-                        input = user_messages[-1].get("content", None)
-                    if len(system_messages) > 0:
-                        output = system_messages[-1].get("content", None)
-
-                # Output processing
-                if isinstance(raw_output, dict):
-                    output = raw_output.get("content", None)
-                if isinstance(raw_output, str):
-                    output = raw_output
-
-                if input is None:
-                    logger.warning(
-                        f"Langfuse connector: Found empty input in project {self.project_id} of orga {org_id}: input is None. Skipping. raw_input: {raw_input}"
-                    )
-                    continue
-                if not isinstance(input, str):
-                    logger.error(
-                        f"Langfuse connector: Found incompatible input while processing project {self.project_id} of orga {org_id}: input is not a string. Skipping. raw_input: {raw_input}"
-                    )
-                    continue
-
-                log_event = LogEventForTasks(
-                    created_at=int(observation.start_time.timestamp()),
-                    input=input,
-                    output=output,
-                    session_id=str(observation.trace_id),
-                    project_id=self.project_id,
-                    metadata={
-                        "langsfuse_run_id": observation.id,
-                        "system_prompt": system_prompt,
-                        "source": "langfuse",
-                    },
-                )
-
-                if max_usage is None or (
-                    max_usage is not None and current_usage < max_usage
-                ):
-                    logs_to_process.append(log_event)
-                    current_usage += 1
-                else:
-                    extra_logs_to_save.append(log_event)
-            except Exception as e:
-                logger.error(
-                    f"Error processing langfuse run for project id: {self.project_id}, {e}"
-                )
+            return None
 
-        await self._update_last_langfuse_extract()
-        await process_logs_for_tasks(
+        return LogEventForTasks(
+            created_at=int(observation.start_time.timestamp()),
+            input=input,
+            output=output,
+            session_id=str(observation.trace_id),
             project_id=self.project_id,
-            org_id=org_id,
-            logs_to_process=logs_to_process,
-            extra_logs_to_save=extra_logs_to_save,
+            metadata={
+                "langsfuse_run_id": observation.id,
+                "system_prompt": system_prompt,
+                "source": "langfuse",
+            },
         )
-
-        return len(logs_to_process)
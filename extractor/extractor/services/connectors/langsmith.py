@@ -1,6 +1,7 @@
 import base64
 from datetime import datetime
-from typing import List, Optional
+from itertools import islice
+from typing import Iterator, List, Optional
 
 from Crypto import Random
 from Crypto.Cipher import AES
@@ -13,14 +14,12 @@ from extractor.core import config
 from extractor.db.mongo import get_mongo_db
 from extractor.models import LogEventForTasks
 from extractor.services.connectors.base import BaseConnector
-from extractor.services.log.tasks import process_logs_for_tasks
 from extractor.services.projects import get_project_by_id
 
 
 class LangsmithConnector(BaseConnector):
     project_id: str
-    client: Optional[Client] = None
-    runs: Optional[List[Run]] = None
+    source = "langsmith"
     langsmith_api_key: Optional[str] = None
     langsmith_project_name: Optional[str] = None
 
@@ -115,7 +114,7 @@ class LangsmithConnector(BaseConnector):
             upsert=True,
         )
 
-    async def _get_last_langsmith_extract(self) -> Optional[datetime]:
+    async def _get_last_extract(self) -> Optional[datetime]:
         """
         Get the last Langsmith extract date for a project
         """
@@ -133,122 +132,84 @@ class LangsmithConnector(BaseConnector):
             )
             return None
 
-    async def _dump(self):
+    async def _update_last_extract(self, last_extract: datetime):
+        """
+        Change the last Langsmith extract for a project
+        """
+        mongo_db = await get_mongo_db()
+
+        await mongo_db["projects"].update_one(
+            {"id": self.project_id},
+            {"$set": {"settings.last_langsmith_extract": last_extract}},
+        )
+
+    async def _dump(self, items: List[Run]):
         # Dump to a dedicated db
         mongo_db = await get_mongo_db()
         runs_as_dict = []
         try:
             # Runs are pydantic model v1
-            runs_as_dict = [run.dict() for run in self.runs]
+            runs_as_dict = [run.dict() for run in items]
         except Exception as e:
             logger.error(
                 f"Error converting runs to dict: {e}. Retrying with model_dump method"
             )
             # Try with pydantic model v2
-            runs_as_dict = [run.model_dump() for run in self.runs]
+            runs_as_dict = [run.model_dump() for run in items]
 
         if len(runs_as_dict) > 0:
-            mongo_db["logs_langsmith"].insert_many(runs_as_dict)
+            await mongo_db["logs_langsmith"].insert_many(runs_as_dict)
 
-    async def pull(self):
+    def fetch_pages(
+        self, since: Optional[datetime], until: datetime
+    ) -> Iterator[List[Run]]:
         if self.langsmith_api_key is None or self.langsmith_project_name is None:
             raise ValueError("Credentials not loaded")
 
-        self.client = Client(api_key=self.langsmith_api_key)
+        client = Client(api_key=self.langsmith_api_key)
+        # The client fetches the runs lazily, page by page
+        runs = client.list_runs(
+            project_name=self.langsmith_project_name,
+            run_type="llm",
+            start_time=since,
+            filter=f'lt(start_time, "{until.isoformat()}")',
+        )
+        while True:
+            page = list(islice(runs, config.CONNECTOR_PAGE_SIZE))
+            if not page:
+                return
+            yield page
+
+    def get_start_time(self, item: Run) -> Optional[datetime]:
+        return item.start_time
+
+    def convert(self, item: Run, org_id: str) -> Optional[LogEventForTasks]:
+        run = item
+        input = ""
+        for message in run.inputs["messages"]:
+            if "HumanMessage" in message["id"]:
+                input += message["kwargs"]["content"]
+
+        output = ""
+        if run.outputs:
+            generations = run.outputs.get("generations", [])
+            for generation in generations:
+                output += generation["text"]
+
+        if input == "" or output == "":
+            return None
 
-        last_langsmith_extract = await self._get_last_langsmith_extract()
-        if last_langsmith_extract is None:
-            self.runs = self.client.list_runs(
-                project_name=self.langsmith_project_name,
-                run_type="llm",
-            )
+        run_end_time = run.end_time
+        if run_end_time:
+            run_end_time_ts = int(run_end_time.timestamp())
         else:
-            self.runs = self.client.list_runs(
-                project_name=self.langsmith_project_name,
-                run_type="llm",
-                start_time=last_langsmith_extract,
-            )
-        # Save the raw data
-        await self._dump()
+            run_end_time_ts = None
 
-    async def _update_last_langsmith_extract(self):
-        """
-        Change the last Langsmith extract for a project
-        """
-        mongo_db = await get_mongo_db()
-
-        await mongo_db["projects"].update_one(
-            {"id": self.project_id},
-            {"$set": {"settings.last_langsmith_extract": datetime.now()}},
-        )
-
-    async def process(
-        self,
-        org_id: str,
-        current_usage: int,
-        max_usage: Optional[int] = None,
-    ) -> int:
-        logs_to_process: List[LogEventForTasks] = []
-        extra_logs_to_save: List[LogEventForTasks] = []
-
-        if self.runs is None:
-            logger.error(
-                f"No Langsmith runs to process for project id: {self.project_id}"
-            )
-            return 0
-
-        for run in self.runs:
-            try:
-                input = ""
-                for message in run.inputs["messages"]:
-                    if "HumanMessage" in message["id"]:
-                        input += message["kwargs"]["content"]
-
-                output = ""
-                if run.outputs:
-                    generations = run.outputs.get("generations", [])
-                    for generation in generations:
-                        output += generation["text"]
-
-                if input == "" or output == "":
-                    continue
-
-                run_end_time = run.end_time
-                if run_end_time:
-                    run_end_time_ts = int(run_end_time.timestamp())
-                else:
-                    run_end_time_ts = None
-
-                log_event = LogEventForTasks(
-                    created_at=run_end_time_ts,
-                    input=input,
-                    output=output,
-                    session_id=str(run.session_id),
-                    project_id=self.project_id,
-                    metadata={"langsmith_run_id": run.id},
-                )
-
-                if max_usage is None or (
-                    max_usage is not None and current_usage < max_usage
-                ):
-                    logs_to_process.append(log_event)
-                    current_usage += 1
-                else:
-                    extra_logs_to_save.append(log_event)
-            except Exception as e:
-                logger.error(
-                    f"Error processing langsmith run for project id: {self.project_id}, {e}"
-                )
-
-        await self._update_last_langsmith_extract()
-        await process_logs_for_tasks(
+        return LogEventForTasks(
+            created_at=run_end_time_ts,
+            input=input,
+            output=output,
+            session_id=str(run.session_id),
             project_id=self.project_id,
-            org_id=org_id,
-            logs_to_process=logs_to_process,
-            extra_logs_to_save=extra_logs_to_save,
-        )
-        logger.debug(
-            f"Finished processing langsmith runs for project id: {self.project_id}"
+            metadata={"langsmith_run_id": run.id},
         )
-
-        return len(logs_to_process)
@@ -2,44 +2,125 @@
 Data pipeline related code
 """
 
-from typing import List
+import asyncio
+from typing import Dict, List, Optional
 
 from phospho.models import Task
+from phospho.utils import count_tokens
 
+from extractor.core import config
 from extractor.db.mongo import get_mongo_db
 from extractor.services.tasks import get_task_by_id
 
 
-async def fetch_previous_tasks(task_id: str) -> List[Task]:
-    """
-    Fetch all the previous tasks until the task, if the task is linked to a session.
-    TODO : Query limits
-    """
-    # Get the document with a specific ID
-    mongo_db = await get_mongo_db()
-    task = await get_task_by_id(task_id)
+# Fields of the previous tasks used in the prompts
+CONTEXT_TASK_FIELDS = [
+    "id",
+    "created_at",
+    "org_id",
+    "project_id",
+    "session_id",
+    "input",
+    "output",
+]
 
-    if task.session_id is None:
-        return [task]
 
-    # Get the tasks of the session before the task
-    previous_tasks = (
-        await mongo_db["tasks"]
-        .find(
-            {
+def _previous_tasks_pipeline(task: Task, max_tasks: int) -> List[dict]:
+    """Aggregation stages fetching the last max_tasks tasks of the session before the task"""
+    return [
+        {
+            "$match": {
                 "project_id": task.project_id,
                 "session_id": task.session_id,
                 "created_at": {"$lt": task.created_at},
             }
-        )
-        .sort("created_at", -1)
-        .to_list(length=None)
+        },
+        {"$sort": {"created_at": -1}},
+        {"$limit": max_tasks},
+        {"$project": {"_id": 0, **{field: 1 for field in CONTEXT_TASK_FIELDS}}},
+        {"$addFields": {"_context_of": task.id}},
+    ]
+
+
+def _truncate_to_max_tokens(previous_tasks: List[Task], max_tokens: int) -> List[Task]:
+    """Keep the most recent tasks (the first ones) whose inputs and outputs fit in max_tokens"""
+    nb_tokens = count_tokens(
+        [f"{task.input} {task.output or ''}" for task in previous_tasks]
     )
-    if previous_tasks is None:
-        return [task]
-    previous_tasks_models = [Task.model_validate(data) for data in previous_tasks]
-    previous_tasks_models.append(task)
-    return previous_tasks_models
+    total_tokens = 0
+    for i, task_tokens in enumerate(nb_tokens):
+        total_tokens += task_tokens
+        if total_tokens > max_tokens:
+            return previous_tasks[:i]
+    return previous_tasks
+
+
+async def fetch_previous_tasks_batch(
+    tasks: List[Task],
+    max_tasks: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> Dict[str, List[Task]]:
+    """
+    Fetch the context of the tasks: the previous tasks of their session, in chronological order.
+    The context of a task is limited to its last max_tasks previous tasks, and to max_tokens
+    tokens of inputs and outputs. Only the fields of CONTEXT_TASK_FIELDS are fetched.
+
+    The contexts of CONTEXT_BATCH_SIZE tasks are fetched in a single query.
+
+    Returns a mapping task.id -> previous tasks
+    """
+    if max_tasks is None:
+        max_tasks = config.MAX_CONTEXT_TASKS
+    if max_tokens is None:
+        max_tokens = config.MAX_CONTEXT_TOKENS
+
+    previous_tasks: Dict[str, List[Task]] = {task.id: [] for task in tasks}
+    tasks_in_session = [task for task in tasks if task.session_id is not None]
+    if max_tasks <= 0 or len(tasks_in_session) == 0:
+        return previous_tasks
+
+    mongo_db = await get_mongo_db()
+
+    async def fetch_batch(batch: List[Task]) -> List[dict]:
+        # One sub-pipeline per task, each using the session index
+        pipeline = _previous_tasks_pipeline(batch[0], max_tasks)
+        for task in batch[1:]:
+            pipeline.append(
+                {
+                    "$unionWith": {
+                        "coll": "tasks",
+                        "pipeline": _previous_tasks_pipeline(task, max_tasks),
+                    }
+                }
+            )
+        return await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
+
+    batches = [
+        tasks_in_session[i : i + config.CONTEXT_BATCH_SIZE]
+        for i in range(0, len(tasks_in_session), config.CONTEXT_BATCH_SIZE)
+    ]
+    results = await asyncio.gather(*[fetch_batch(batch) for batch in batches])
+    for rows in results:
+        # The rows of a task are sorted from the most recent
+        for row in rows:
+            context_of = row.pop("_context_of")
+            previous_tasks[context_of].append(Task.model_validate(row))
+
+    for task_id, context in previous_tasks.items():
+        if max_tokens > 0 and len(context) > 0:
+            context = _truncate_to_max_tokens(context, max_tokens)
+        previous_tasks[task_id] = context[::-1]
+    return previous_tasks
+
+
+async def fetch_previous_tasks(task_id: str) -> List[Task]:
+    """
+    Fetch the previous tasks of the task in its session (see fetch_previous_tasks_batch),
+    followed by the task itself.
+    """
+    task = await get_task_by_id(task_id)
+    previous_tasks = await fetch_previous_tasks_batch([task])
+    return previous_tasks[task.id] + [task]
 
 
 def generate_task_transcript(
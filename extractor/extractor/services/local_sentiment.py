@@ -0,0 +1,413 @@
+"""
+Local sentiment analysis and language detection, without any remote API.
+
+- Sentiment: lexicon based. The valence of the words of the lexicon is summed, with the
+  negations ("not good") and the intensifiers ("very good") taken into account. Like the
+  Google Natural Language API, it returns a score in [-1, 1] and a magnitude >= 0.
+- Language: the script of the text for the non latin alphabets, otherwise the character
+  trigrams and the stopwords of the text are compared with the profiles of the supported
+  languages.
+
+Only uses the standard library, so that it runs on CPU in air-gapped deployments.
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?", re.UNICODE)
+
+# Valence of the words, from -3 (very negative) to 3 (very positive)
+LEXICON: Dict[str, float] = {
+    # English, positive
+    "good": 1.9,
+    "great": 3.0,
+    "excellent": 3.0,
+    "amazing": 2.8,
+    "awesome": 3.0,
+    "fantastic": 2.6,
+    "wonderful": 2.7,
+    "perfect": 2.7,
+    "nice": 1.8,
+    "love": 3.0,
+    "loved": 2.9,
+    "like": 1.5,
+    "liked": 1.5,
+    "enjoy": 2.2,
+    "enjoyed": 2.2,
+    "happy": 2.7,
+    "glad": 2.0,
+    "pleased": 1.9,
+    "thanks": 1.9,
+    "thank": 1.5,
+    "helpful": 1.8,
+    "useful": 1.9,
+    "best": 3.0,
+    "better": 1.9,
+    "cool": 1.3,
+    "fine": 0.8,
+    "correct": 1.3,
+    "right": 0.8,
+    "easy": 1.9,
+    "fast": 1.0,
+    "clear": 1.2,
+    "beautiful": 2.9,
+    "brilliant": 2.8,
+    "satisfied": 1.8,
+    "recommend": 1.5,
+    "works": 0.9,
+    "worked": 0.9,
+    "solved": 1.5,
+    "welcome": 2.0,
+    "yes": 0.8,
+    "ok": 0.9,
+    "okay": 0.9,
+    "fun": 2.3,
+    "interesting": 1.7,
+    "impressive": 2.3,
+    "appreciate": 2.1,
+    "success": 2.7,
+    "successful": 2.8,
+    # English, negative
+    "bad": -2.5,
+    "terrible": -2.1,
+    "awful": -2.0,
+    "horrible": -2.5,
+    "worst": -3.0,
+    "worse": -2.1,
+    "hate": -2.7,
+    "hated": -3.2,
+    "dislike": -1.6,
+    "poor": -2.1,
+    "wrong": -2.1,
+    "error": -1.7,
+    "errors": -1.4,
+    "bug": -1.4,
+    "bugs": -1.4,
+    "broken": -2.0,
+    "fail": -2.5,
+    "failed": -2.3,
+    "fails": -2.5,
+    "failure": -2.3,
+    "useless": -1.8,
+    "stupid": -2.4,
+    "annoying": -1.7,
+    "annoyed": -1.6,
+    "angry": -2.3,
+    "sad": -2.1,
+    "unhappy": -1.8,
+    "disappointed": -2.3,
+    "disappointing": -2.2,
+    "frustrated": -2.4,
+    "frustrating": -1.9,
+    "confusing": -1.3,
+    "confused": -1.3,
+    "slow": -1.0,
+    "problem": -1.7,
+    "problems": -1.7,
+    "issue": -1.0,
+    "issues": -1.0,
+    "sorry": -0.3,
+    "unfortunately": -1.6,
+    "difficult": -1.5,
+    "hard": -0.4,
+    "no": -1.2,
+    "nothing": -0.5,
+    "never": -0.4,
+    "crash": -1.7,
+    "crashed": -1.7,
+    "ugly": -2.3,
+    "boring": -1.3,
+    "waste": -1.8,
+    "incorrect": -1.4,
+    "nonsense": -1.7,
+    "scam": -2.6,
+    "ridiculous": -1.5,
+    "disgusting": -2.4,
+    "worried": -1.2,
+    "afraid": -2.0,
+    "pain": -2.3,
+    # French
+    "bien": 1.5,
+    "bon": 1.7,
+    "bonne": 1.7,
+    "super": 2.5,
+    "génial": 2.8,
+    "parfait": 2.7,
+    "merci": 1.9,
+    "aime": 2.5,
+    "adore": 3.0,
+    "content": 2.0,
+    "contente": 2.0,
+    "heureux": 2.7,
+    "utile": 1.8,
+    "facile": 1.9,
+    "mauvais": -2.5,
+    "mauvaise": -2.5,
+    "nul": -2.3,
+    "nulle": -2.3,
+    "déteste": -2.7,
+    "problème": -1.7,
+    "erreur": -1.7,
+    "faux": -1.7,
+    "lent": -1.0,
+    "triste": -2.1,
+    "déçu": -2.3,
+    "déçue": -2.3,
+    "énervé": -2.0,
+    "inutile": -1.8,
+    "difficile": -1.5,
+    # Spanish
+    "bueno": 1.9,
+    "buena": 1.9,
+    "genial": 2.8,
+    "gracias": 1.9,
+    "encanta": 3.0,
+    "feliz": 2.7,
+    "fácil": 1.9,
+    "malo": -2.5,
+    "mala": -2.5,
+    "odio": -2.7,
+    "problema": -1.7,
+    "lento": -1.0,
+    "difícil": -1.5,
+    # German
+    "gut": 1.9,
+    "toll": 2.5,
+    "danke": 1.9,
+    "liebe": 2.7,
+    "schön": 2.3,
+    "einfach": 1.2,
+    "schlecht": -2.5,
+    "fehler": -1.7,
+    "falsch": -2.1,
+    "langsam": -1.0,
+    "traurig": -2.1,
+    "schrecklich": -2.5,
+}
+
+NEGATIONS = {
+    "not",
+    "no",
+    "never",
+    "don't",
+    "doesn't",
+    "didn't",
+    "isn't",
+    "wasn't",
+    "aren't",
+    "can't",
+    "cannot",
+    "won't",
+    "without",
+    "ne",
+    "pas",
+    "jamais",
+    "sans",
+    "nunca",
+    "sin",
+    "nicht",
+    "kein",
+    "keine",
+}
+
+# Multiplier of the valence of the next word
+INTENSIFIERS: Dict[str, float] = {
+    "very": 1.3,
+    "really": 1.3,
+    "so": 1.2,
+    "extremely": 1.5,
+    "totally": 1.3,
+    "absolutely": 1.4,
+    "super": 1.3,
+    "quite": 1.1,
+    "slightly": 0.6,
+    "somewhat": 0.7,
+    "barely": 0.5,
+    "très": 1.3,
+    "vraiment": 1.3,
+    "muy": 1.3,
+    "sehr": 1.3,
+}
+
+# Normalization constant of the score, as in VADER: score = s / sqrt(s^2 + alpha)
+SCORE_ALPHA = 15.0
+# Scale of the magnitude, to match the range of the Google Natural Language API
+MAGNITUDE_SCALE = 0.25
+
+# Short samples of the supported languages, used to build their trigram profiles
+LANGUAGE_SAMPLES: Dict[str, str] = {
+    "en": (
+        "the and that have for not with you this but his from they say her she will "
+        "one all would there their what about which when make can like time just him "
+        "know take people into year your good some could them see other than then now "
+        "look only come its over think also back after use two how our work first well "
+        "way even new want because any these give day most us is are was were been has"
+    ),
+    "fr": (
+        "le la les de des du un une et est en que qui dans pour pas sur au avec il elle "
+        "ce ne se plus par je nous vous ils sont mais ou comme tout faire bien aussi "
+        "leur son sa ses cette être avoir peut fait très même quand où après avant "
+        "encore toujours rien chose monde merci bonjour pourquoi comment votre notre"
+    ),
+    "es": (
+        "el la los las de del un una y que en es por para con no se su sus al lo como "
+        "más pero le ya o este esta sí porque cuando muy sin sobre también me hasta hay "
+        "donde quien desde todo nos durante todos uno les ni contra otros ese eso ante "
+        "ellos esto mí antes algunos qué unos yo otro otras otra él tanto esa estos"
+    ),
+    "de": (
+        "der die das und ist nicht ein eine zu den von mit sich des auf für im dem "
+        "auch es an werden aus er hat dass sie nach wird bei einer um am sind noch wie "
+        "einem über einen so zum war haben nur oder aber vor zur bis mehr durch man "
+        "sein wurde sei in ich du wir ihr mein dein kann können schon wenn weil"
+    ),
+    "it": (
+        "il lo la i gli le di da in con su per tra fra un una uno e non che è sono "
+        "del della dei delle al alla ai anche come più ma se questo quello mi ti ci "
+        "si ha ho hanno essere fare molto tutto quando perché dove grazie ciao sempre"
+    ),
+    "pt": (
+        "o a os as de do da dos das um uma e que em no na nos nas por para com não "
+        "se mais mas como ao é foi são ser está muito também já eu ele ela você isso "
+        "este esta quando porque onde obrigado olá sempre ainda tudo fazer pode tem"
+    ),
+    "nl": (
+        "de het een en van in is dat op te zijn niet met voor aan er die maar om ook "
+        "als dan bij nog wel uit ze hij zij wij jij hebben heeft naar kan worden "
+        "wordt door over geen meer zo was waren dit deze omdat wanneer waar dank"
+    ),
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+
+def _trigrams(words: List[str]) -> Counter:
+    trigrams: Counter = Counter()
+    for word in words:
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            trigrams[padded[i : i + 3]] += 1
+    return trigrams
+
+
+def _normalize(counter: Counter) -> Dict[str, float]:
+    norm = math.sqrt(sum(value * value for value in counter.values()))
+    if norm == 0:
+        return {}
+    return {key: value / norm for key, value in counter.items()}
+
+
+LANGUAGE_STOPWORDS: Dict[str, set] = {
+    language: set(tokenize(sample)) for language, sample in LANGUAGE_SAMPLES.items()
+}
+LANGUAGE_PROFILES: Dict[str, Dict[str, float]] = {
+    language: _normalize(_trigrams(tokenize(sample)))
+    for language, sample in LANGUAGE_SAMPLES.items()
+}
+# Minimum score of a language to be detected
+MIN_LANGUAGE_SCORE = 0.2
+
+
+def analyze_sentiment(words: List[str]) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Score in [-1, 1] and magnitude >= 0 of the sentiment of the words.
+    Returns (None, None) if no word of the lexicon is found.
+    """
+    total = 0.0
+    total_abs = 0.0
+    found = False
+    for i, word in enumerate(words):
+        valence = LEXICON.get(word)
+        if valence is None:
+            continue
+        found = True
+        # Look at the previous words for intensifiers and negations
+        previous = words[max(0, i - 3) : i]
+        if previous and previous[-1] in INTENSIFIERS:
+            valence *= INTENSIFIERS[previous[-1]]
+        if any(previous_word in NEGATIONS for previous_word in previous):
+            valence *= -0.75
+        total += valence
+        total_abs += abs(valence)
+    if not found:
+        return None, None
+    score = total / math.sqrt(total * total + SCORE_ALPHA)
+    return score, total_abs * MAGNITUDE_SCALE
+
+
+def _script_language(text: str) -> Optional[str]:
+    """Language of the text based on its script, for the non latin alphabets"""
+    counts: Counter = Counter()
+    for char in text:
+        if not char.isalpha():
+            continue
+        name = unicodedata.name(char, "")
+        if name.startswith(("HIRAGANA", "KATAKANA")):
+            counts["ja"] += 1
+        elif name.startswith("HANGUL"):
+            counts["ko"] += 1
+        elif name.startswith("CJK"):
+            counts["zh"] += 1
+        elif name.startswith("CYRILLIC"):
+            counts["ru"] += 1
+        elif name.startswith("ARABIC"):
+            counts["ar"] += 1
+        elif name.startswith("HEBREW"):
+            counts["he"] += 1
+        elif name.startswith("GREEK"):
+            counts["el"] += 1
+        elif name.startswith("DEVANAGARI"):
+            counts["hi"] += 1
+        elif name.startswith("THAI"):
+            counts["th"] += 1
+        else:
+            counts["latin"] += 1
+    if not counts:
+        return None
+    # Japanese texts mix kanji (CJK) and kanas
+    if counts["ja"] > 0:
+        return "ja"
+    script, _ = counts.most_common(1)[0]
+    return script
+
+
+def detect_language(text: str, words: List[str]) -> Optional[str]:
+    """ISO 639-1 code of the language of the text, or None if it can't be detected"""
+    script = _script_language(text)
+    if script != "latin":
+        return script
+    if not words:
+        return None
+
+    trigrams = _normalize(_trigrams(words))
+    best_language, best_score = None, 0.0
+    for language, profile in LANGUAGE_PROFILES.items():
+        similarity = sum(
+            weight * profile.get(trigram, 0.0) for trigram, weight in trigrams.items()
+        )
+        stopwords_ratio = sum(
+            1 for word in words if word in LANGUAGE_STOPWORDS[language]
+        ) / len(words)
+        score = similarity + stopwords_ratio
+        if score > best_score:
+            best_language, best_score = language, score
+    if best_score < MIN_LANGUAGE_SCORE:
+        return None
+    return best_language
+
+
+def analyze_texts(
+    texts: List[str],
+) -> List[Tuple[Optional[float], Optional[float], Optional[str]]]:
+    """(score, magnitude, language) of each text"""
+    results = []
+    for text in texts:
+        words = tokenize(text)
+        score, magnitude = analyze_sentiment(words)
+        results.append((score, magnitude, detect_language(text, words)))
+    return results
@@ -2,6 +2,7 @@ from typing import Any, Dict, List, Literal, Optional, Tuple
 
 from loguru import logger
 from phospho.models import Session, Task
+from pymongo import UpdateOne
 
 from extractor.db.mongo import get_mongo_db
 from extractor.models import LogEventForTasks
@@ -13,10 +14,54 @@ from extractor.services.log.base import (
     get_time_created_at,
 )
 from extractor.services.pipelines import MainPipeline
+from extractor.services.rollups import mark_rollups_dirty
 from extractor.services.tasks import compute_task_position
 from extractor.utils import generate_uuid
 
 
+def add_session_increment(
+    session_increments: Dict[str, Dict[str, int]],
+    session_id: str,
+    log_event_metadata: dict,
+) -> None:
+    """
+    Add the session length and tokens of a log event to the increments of its session
+    """
+    increments = session_increments.setdefault(
+        session_id,
+        {
+            "session_length": 0,
+            "metadata.total_tokens": 0,
+            "metadata.prompt_tokens": 0,
+            "metadata.completion_tokens": 0,
+        },
+    )
+    increments["session_length"] += 1
+    for key in ["total_tokens", "prompt_tokens", "completion_tokens"]:
+        increments[f"metadata.{key}"] += log_event_metadata.get(key) or 0
+
+
+async def update_sessions_counters(
+    session_increments: Dict[str, Dict[str, int]],
+) -> None:
+    """
+    Increment the counters of the sessions in the database, with a single bulk_write
+    """
+    if len(session_increments) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["sessions"].bulk_write(
+            [
+                UpdateOne({"id": session_id}, {"$inc": increments})
+                for session_id, increments in session_increments.items()
+            ],
+            ordered=False,
+        )
+    except Exception as e:
+        logger.error(f"Error updating the sessions in the database: {e}")
+
+
 async def process_tasks_id(
     project_id: str,
     org_id: str,
@@ -129,6 +174,8 @@ async def process_log_without_session_id(
 
     tasks_id_to_process: List[str] = []
     tasks_to_create: List[Dict[str, object]] = []
+    # task_id -> created_at, to mark the rollups of the created tasks dirty
+    tasks_created_at: Dict[str, int] = {}
     for log_event in list_of_log_event:
         log_event_metadata = collect_metadata(log_event)
         # Generate a default session_id
@@ -141,6 +188,7 @@ async def process_log_without_session_id(
         )
         tasks_id_to_process.append(task.id)
         tasks_to_create.append(task.model_dump())
+        tasks_created_at[task.id] = task.created_at
 
     # Skip task creation if there is no task to create
     if len(tasks_to_create) == 0:
@@ -157,6 +205,10 @@ async def process_log_without_session_id(
         except Exception as e:
             error_mesagge = f"Error saving tasks to the database: {e}"
             logger.error(error_mesagge)
+    await mark_rollups_dirty(
+        project_id,
+        [tasks_created_at.get(str(task["id"])) for task in tasks_to_create],
+    )
 
     if trigger_pipeline:
         logger.info(f"Triggering pipeline for {len(tasks_id_to_process)} tasks")
@@ -199,8 +251,12 @@ async def process_log_with_session_id(
     )
     tasks_id_to_process: List[str] = []
     tasks_to_create: List[Dict[str, object]] = []
+    # task_id -> created_at, to mark the rollups of the created tasks dirty
+    tasks_created_at: Dict[str, int] = {}
     sessions_to_create: Dict[str, Dict[str, Any]] = {}
     sessions_to_earliest_task: Dict[str, Task] = {}
+    # session_id -> field -> increment, for the sessions already in the database
+    session_increments: Dict[str, Dict[str, int]] = {}
 
     mongo_db = await get_mongo_db()
     sessions_ids_already_in_db = (
@@ -266,24 +322,10 @@ async def process_log_with_session_id(
             # Increment the session length of the session to create
             sessions_to_create[log_event.session_id]["session_length"] += 1
         elif log_event.session_id is not None and session_is_in_db:
-            # Increment the session length, total_tokens, prompt_tokens and completion_tokens in the database
-            mongo_db["sessions"].update_one(
-                {"id": log_event.session_id},
-                {
-                    "$inc": {
-                        "session_length": 1,
-                        "metadata.total_tokens": log_event_metadata.get("total_tokens")
-                        or 0,
-                        "metadata.prompt_tokens": log_event_metadata.get(
-                            "prompt_tokens"
-                        )
-                        or 0,
-                        "metadata.completion_tokens": log_event_metadata.get(
-                            "completion_tokens"
-                        )
-                        or 0,
-                    }
-                },
+            # Increment the session length, total_tokens, prompt_tokens and completion_tokens
+            # The increments of all the log events are written at once after the loop
+            add_session_increment(
+                session_increments, log_event.session_id, log_event_metadata
             )
         else:
             logger.info(
@@ -299,6 +341,7 @@ async def process_log_with_session_id(
         )
         tasks_id_to_process.append(task.id)
         tasks_to_create.append(task.model_dump())
+        tasks_created_at[task.id] = task.created_at
 
         # Update the session creation time if needed
         if log_event.session_id is not None:
@@ -312,6 +355,8 @@ async def process_log_with_session_id(
                 ):
                     sessions_to_earliest_task[log_event.session_id] = task
 
+    await update_sessions_counters(session_increments)
+
     # Create the tasks
     tasks_to_create, tasks_id_to_process = await ignore_existing_tasks(
         tasks_to_create, tasks_id_to_process
@@ -368,6 +413,12 @@ async def process_log_with_session_id(
     else:
         logger.info("Logevent: no session to create")
 
+    # The new sessions are created at the time of their earliest new task
+    await mark_rollups_dirty(
+        project_id,
+        [tasks_created_at.get(str(task["id"])) for task in tasks_to_create],
+    )
+
     # Compute the task position
     await compute_task_position(
         project_id=project_id,
@@ -1,4 +1,3 @@
-import asyncio
 import time
 import traceback
 from collections import defaultdict
@@ -11,7 +10,6 @@ from phospho.models import (
     EventDefinition,
     JobResult,
     LlmCall,
-    Message,
     PipelineResults,
     Project,
     Recipe,
@@ -20,16 +18,22 @@ from phospho.models import (
     SessionStats,
     Task,
 )
+from pymongo import UpdateOne
 
 from extractor.db.mongo import get_mongo_db
 from extractor.models import RoleContentMessage
-from extractor.services.data import fetch_previous_tasks
-from extractor.services.projects import get_project_by_id
-from extractor.services.sentiment_analysis import call_sentiment_and_language_api
-from extractor.services.webhook import trigger_webhook
+from extractor.services.data import fetch_previous_tasks_batch
+from extractor.services.project_snapshots import (
+    ProjectSnapshot,
+    get_project_snapshot,
+    invalidate_project_snapshot,
+)
+from extractor.services.rollups import mark_rollups_dirty
+from extractor.services.sentiment_analysis import get_sentiment_backend
+from extractor.services.usage import increment_usage_counters
+from extractor.services.webhook import enqueue_webhooks
 from extractor.utils import generate_uuid, get_most_common
 
-PHOSPHO_EVENT_MODEL_NAMES = ["phospho-6", "owner", "phospho-4"]
 PHOSPHO_EVAL_MODEL_NAMES = ["phospho", "phospho-4"]
 
 
@@ -41,13 +45,16 @@ class EventConfig(lab.JobConfig):
 class MainPipeline:
     project_id: str
     project: Optional[Project] = None
+    snapshot: Optional[ProjectSnapshot] = None
     messages: List[lab.Message]
 
     def __init__(self, project_id: str, org_id: str):
         self.project_id = project_id
         self.org_id = org_id
         self.project = None
+        self.snapshot = None
         self.messages = []
+        self.input_tasks_created_at: List[int] = []
 
     async def set_input(
         self,
@@ -60,207 +67,14 @@ class MainPipeline:
         Set the input for the pipeline.
         """
 
-        self.project = await get_project_by_id(self.project_id)
+        self.snapshot = await get_project_snapshot(self.project_id)
+        self.project = self.snapshot.project
 
         mongo_db = await get_mongo_db()
-        llm_based_events = []
-        for event_name, event in self.project.settings.events.items():
-            if event.detection_engine == "llm_detection":
-                llm_based_events.append(event_name)
-
-        # Matches at most one successful example per event_name
-        successful_events = (
-            await mongo_db["events"]
-            .aggregate(
-                [
-                    {
-                        "$match": {
-                            "project_id": self.project_id,
-                            "source": {"$in": PHOSPHO_EVENT_MODEL_NAMES},
-                            "confirmed": True,
-                            "removed": False,
-                            "event_name": {
-                                "$in": llm_based_events
-                            },  # filter by event names in project.settings.event
-                        }
-                    },
-                    {
-                        "$facet": {
-                            "event_names": [{"$group": {"_id": "$event_name"}}],
-                            "events": [
-                                {"$sort": {"created_at": -1}},
-                                {
-                                    "$group": {
-                                        "_id": "$event_name",
-                                        "first_event": {"$first": "$$ROOT"},
-                                    }
-                                },
-                                {"$replaceRoot": {"newRoot": "$first_event"}},
-                                {
-                                    "$lookup": {
-                                        "from": "tasks",
-                                        "localField": "task_id",
-                                        "foreignField": "id",
-                                        "as": "task",
-                                    }
-                                },
-                                {"$unwind": "$task"},
-                                {
-                                    "$addFields": {
-                                        "event_name": "$event_name",
-                                        "output": "$task.output",
-                                        "input": "$task.input",
-                                    }
-                                },
-                                {
-                                    "$project": {
-                                        "input": 1,
-                                        "output": 1,
-                                        "event_name": 1,
-                                    }
-                                },
-                            ],
-                        }
-                    },
-                    {
-                        "$project": {
-                            "events": {
-                                "$setDifference": [
-                                    "$events",
-                                    {
-                                        "$map": {
-                                            "input": "$event_names",
-                                            "as": "event_name",
-                                            "in": {
-                                                "$filter": {
-                                                    "input": "$events",
-                                                    "as": "event",
-                                                    "cond": {
-                                                        "$eq": [
-                                                            "$$event.event_name",
-                                                            "$$event_name._id",
-                                                        ]
-                                                    },
-                                                }
-                                            },
-                                        }
-                                    },
-                                ]
-                            }
-                        }
-                    },
-                    {"$unwind": "$events"},
-                    {"$replaceRoot": {"newRoot": "$events"}},
-                ]
-            )
-            .to_list(length=None)
-        )
-
-        # Matches at most one unsuccessful example per event_name
-        unsuccessful_events = (
-            await mongo_db["events"]
-            .aggregate(
-                [
-                    {
-                        "$match": {
-                            "project_id": self.project_id,
-                            "removed": True,
-                            "confirmed": False,
-                            "source": {"$in": PHOSPHO_EVENT_MODEL_NAMES},
-                            "removal_reason": {"$regex": "removed_by_user"},
-                            "event_name": {"$in": llm_based_events},
-                        }
-                    },
-                    {
-                        "$facet": {
-                            "event_names": [{"$group": {"_id": "$event_name"}}],
-                            "events": [
-                                {"$sort": {"created_at": -1}},
-                                {
-                                    "$group": {
-                                        "_id": "$event_name",
-                                        "first_event": {"$first": "$$ROOT"},
-                                    }
-                                },
-                                {"$replaceRoot": {"newRoot": "$first_event"}},
-                                {
-                                    "$lookup": {
-                                        "from": "tasks",
-                                        "localField": "task_id",
-                                        "foreignField": "id",
-                                        "as": "task",
-                                    }
-                                },
-                                {"$unwind": "$task"},
-                                {
-                                    "$addFields": {
-                                        "event_name": "$event_name",
-                                        "output": "$task.output",
-                                        "input": "$task.input",
-                                    }
-                                },
-                                {
-                                    "$project": {
-                                        "input": 1,
-                                        "output": 1,
-                                        "event_name": 1,
-                                    }
-                                },
-                            ],
-                        }
-                    },
-                    {
-                        "$project": {
-                            "events": {
-                                "$setDifference": [
-                                    "$events",
-                                    {
-                                        "$map": {
-                                            "input": "$event_names",
-                                            "as": "event_name",
-                                            "in": {
-                                                "$filter": {
-                                                    "input": "$events",
-                                                    "as": "event",
-                                                    "cond": {
-                                                        "$eq": [
-                                                            "$$event.event_name",
-                                                            "$$event_name._id",
-                                                        ]
-                                                    },
-                                                }
-                                            },
-                                        }
-                                    },
-                                ]
-                            }
-                        }
-                    },
-                    {"$unwind": "$events"},
-                    {"$replaceRoot": {"newRoot": "$events"}},
-                ]
-            )
-            .to_list(length=None)
-        )
-
-        metadata = {
-            "successful_events": successful_events,
-            "unsuccessful_events": unsuccessful_events,
-        }
+        # Few-shot examples of the LLM based events
+        metadata = dict(self.snapshot.few_shot_examples)
 
         self.messages = []
-        if task:
-            # Get the data of all the tasks before task[task_id]
-            previous_tasks = await fetch_previous_tasks(task.id)
-            if len(previous_tasks) > 1:
-                task_context = previous_tasks[:-1]
-            else:
-                task_context = []
-            self.messages.append(
-                lab.Message.from_task(
-                    task=task, metadata=metadata, previous_tasks=task_context
-                )
-            )
         if tasks_ids:
             # Fetch the tasks from the database
             raw_tasks_from_ids = (
@@ -274,17 +88,21 @@ class MainPipeline:
             if tasks is None:
                 tasks = []
             tasks.extend(valid_tasks_from_ids)
+        input_tasks: List[Task] = []
+        if task:
+            input_tasks.append(task)
         if tasks:
-            for task in tasks:
-                # Get the data of all the tasks before task[task_id]
-                previous_tasks = await fetch_previous_tasks(task.id)
-                if len(previous_tasks) > 1:
-                    task_context = previous_tasks[:-1]
-                else:
-                    task_context = []
+            input_tasks.extend(tasks)
+        self.input_tasks_created_at = [task.created_at for task in input_tasks]
+        if input_tasks:
+            # Get the data of the tasks before each task, in a single query per batch
+            previous_tasks = await fetch_previous_tasks_batch(input_tasks)
+            for input_task in input_tasks:
                 self.messages.append(
                     lab.Message.from_task(
-                        task=task, metadata=metadata, previous_tasks=task_context
+                        task=input_task,
+                        metadata=metadata,
+                        previous_tasks=previous_tasks[input_task.id],
                     )
                 )
         if messages:
@@ -319,7 +137,8 @@ class MainPipeline:
         Run the main event detection pipeline on the messages
         """
         if self.project is None:
-            self.project = await get_project_by_id(self.project_id)
+            self.snapshot = await get_project_snapshot(self.project_id)
+            self.project = self.snapshot.project
 
         if not self.project.settings.run_event_detection:
             logger.info(
@@ -334,7 +153,9 @@ class MainPipeline:
             self.workload.org_id = recipe.org_id
             self.workload.project_id = recipe.project_id
         else:
-            self.workload = lab.Workload.from_phospho_project_config(self.project)
+            if self.snapshot is None:
+                self.snapshot = await get_project_snapshot(self.project_id)
+            self.workload = self.snapshot.workload()
         logger.info(
             f"Running event detection pipeline for project {self.project_id} on {len(self.messages)} messages with {len(self.workload.jobs)} jobs"
         )
@@ -349,6 +170,7 @@ class MainPipeline:
 
         events_per_task_to_return: Dict[str, List[Event]] = defaultdict(list)
         events_to_push_to_db: List[dict] = []
+        webhooks_to_send: List[dict] = []
         job_results_to_push_to_db: List[dict] = []
         llm_calls_to_push_to_db: List[dict] = []
 
@@ -407,10 +229,14 @@ class MainPipeline:
                         and event_definition.webhook != ""
                     ):
                         logger.info(f"Webhook url: {event_definition.webhook}")
-                        await trigger_webhook(
-                            url=event_definition.webhook,
-                            json=detected_event_data.model_dump(),
-                            headers=event_definition.webhook_headers,
+                        webhooks_to_send.append(
+                            {
+                                "url": event_definition.webhook,
+                                "headers": event_definition.webhook_headers,
+                                "payload": detected_event_data.model_dump(),
+                                "project_id": self.project_id,
+                                "org_id": self.org_id,
+                            }
                         )
                     events_to_push_to_db.append(detected_event_data.model_dump())
 
@@ -436,14 +262,18 @@ class MainPipeline:
         if len(job_results_to_push_to_db) > 0:
             try:
                 await mongo_db["job_results"].insert_many(job_results_to_push_to_db)
+                await increment_usage_counters(job_results_to_push_to_db)
             except Exception as e:
                 logger.error(f"Error saving job results to the database: {e}")
+        # The webhooks are delivered in the background by the webhook dispatcher
+        await enqueue_webhooks(webhooks_to_send)
 
         return events_per_task_to_return
 
     async def update_version_id(self) -> None:
         if self.project is None:
-            self.project = await get_project_by_id(self.project_id)
+            self.snapshot = await get_project_snapshot(self.project_id)
+            self.project = self.snapshot.project
 
         mongo_db = await get_mongo_db()
         tasks_ids = [
@@ -588,7 +418,8 @@ class MainPipeline:
         mongo_db = await get_mongo_db()
 
         if not self.project:
-            self.project = await get_project_by_id(self.project_id)
+            self.snapshot = await get_project_snapshot(self.project_id)
+            self.project = self.snapshot.project
 
         if (
             self.project.settings is not None
@@ -603,77 +434,73 @@ class MainPipeline:
         # Default values
         score_threshold = 0.3
         magnitude_threshold = 0.6
-        # Try to replace with project settings
+        # Try to replace with project settings, and save the default values if missing
+        missing_settings: Dict[str, object] = {}
         if self.project.settings.sentiment_threshold is not None:
             if self.project.settings.sentiment_threshold.score is not None:
                 score_threshold = self.project.settings.sentiment_threshold.score
             else:
-                mongo_db["projects"].update_one(
-                    {"id": self.project_id},
-                    {
-                        "$set": {
-                            "settings.sentiment_threshold.score": 0.3,
-                        }
-                    },
-                )
+                missing_settings["settings.sentiment_threshold.score"] = 0.3
 
             if self.project.settings.sentiment_threshold.magnitude is not None:
                 magnitude_threshold = (
                     self.project.settings.sentiment_threshold.magnitude
                 )
             else:
-                mongo_db["projects"].update_one(
-                    {"id": self.project_id},
-                    {
-                        "$set": {
-                            "settings.sentiment_threshold.magnitude": 0.6,
-                        }
-                    },
-                )
+                missing_settings["settings.sentiment_threshold.magnitude"] = 0.6
         else:
-            mongo_db["projects"].update_one(
-                {"id": self.project_id},
-                {
-                    "$set": {
-                        "settings.sentiment_threshold": {
-                            "score": 0.3,
-                            "magnitude": 0.6,
-                        }
-                    }
-                },
+            missing_settings["settings.sentiment_threshold"] = {
+                "score": 0.3,
+                "magnitude": 0.6,
+            }
+        if missing_settings:
+            await mongo_db["projects"].update_one(
+                {"id": self.project_id}, {"$set": missing_settings}
             )
+            invalidate_project_snapshot(self.project_id)
 
         logger.info(
             f"Running sentiment analysis pipeline for project {self.project_id} for {len(self.messages)} messages"
         )
         job_results_to_push_to_db: List[dict] = []
 
-        async def process_message(
-            message: Message,
-        ) -> Tuple[str, Optional[SentimentObject], Optional[str]]:
+        # Run the sentiment analysis on the task input, or on the message content
+        tasks: List[Optional[Task]] = []
+        texts: List[str] = []
+        for message in self.messages:
             if "task" in message.metadata:
-                # Run the sentiment analysis on the task input
-                task = Task.model_validate(message.metadata.get("task", None))
-                text = task.input
+                message_task = Task.model_validate(message.metadata["task"])
+                tasks.append(message_task)
+                texts.append(message_task.input)
             else:
-                # Run the sentiment analysis on the message content
-                text = message.content
+                tasks.append(None)
+                texts.append(message.content)
 
-            sentiment_object: Optional[SentimentObject] = None
-            sentiment_object, language = await call_sentiment_and_language_api(
-                text, score_threshold, magnitude_threshold
-            )
-            if not self.project or not self.project.settings:
+        results = await get_sentiment_backend().analyze(
+            texts, score_threshold, magnitude_threshold
+        )
+
+        results_sentiment: Dict[str, Optional[SentimentObject]] = {}
+        results_language: Dict[str, Optional[str]] = {}
+        tasks_updates: List[UpdateOne] = []
+        for message, task, (analyzed_sentiment, language) in zip(
+            self.messages, tasks, results
+        ):
+            sentiment_object: Optional[SentimentObject] = analyzed_sentiment
+            if not self.project.settings:
                 language = None
                 sentiment_object = None
             elif not self.project.settings.run_language:
                 language = None
             elif not self.project.settings.run_sentiment:
                 sentiment_object = None
+            results_sentiment[message.id] = sentiment_object
+            results_language[message.id] = language
 
-            if "task" in message.metadata:
-                # Update the task item
-                mongo_db["tasks"].update_one(
+            if task is None:
+                continue
+            tasks_updates.append(
+                UpdateOne(
                     {
                         "id": task.id,
                         "project_id": task.project_id,
@@ -697,7 +524,7 @@ class MainPipeline:
                         }
                     },
                 )
-
+            )
             if sentiment_object:
                 job_result = JobResult(
                     org_id=task.org_id,
@@ -723,21 +550,18 @@ class MainPipeline:
                 )
                 job_results_to_push_to_db.append(job_result.model_dump())
 
-            return message.id, sentiment_object, language
-
-        tasks = [process_message(message) for message in self.messages]
-        results = await asyncio.gather(*tasks)
-
-        results_sentiment: Dict[str, Optional[SentimentObject]] = {}
-        results_language: Dict[str, Optional[str]] = {}
-        for message_id, sentiment, language in results:
-            results_sentiment[message_id] = sentiment
-            results_language[message_id] = language
+        # Update the tasks in a single request
+        if tasks_updates:
+            try:
+                await mongo_db["tasks"].bulk_write(tasks_updates, ordered=False)
+            except Exception as e:
+                logger.error(f"Error saving the sentiment of the tasks: {e}")
 
         # Save the job results in the database
         if len(job_results_to_push_to_db) > 0:
             try:
                 await mongo_db["job_results"].insert_many(job_results_to_push_to_db)
+                await increment_usage_counters(job_results_to_push_to_db)
             except Exception as e:
                 logger.error(f"Error saving job results to the database: {e}")
 
@@ -799,6 +623,8 @@ class MainPipeline:
             await self.update_version_id()
         except Exception as e:
             logger.error(f"Error updating the version id: {e}")
+        # The events and flags of the input tasks changed
+        await mark_rollups_dirty(self.project_id, self.input_tasks_created_at)
 
         logger.info("Main pipeline completed")
         return PipelineResults(
@@ -0,0 +1,255 @@
+"""
+Snapshots of the configuration of the projects, shared by the pipelines.
+
+The same project is processed many times per minute with the same configuration. Its
+settings, the compiled event detection workload and the few-shot examples are loaded once
+and reused for config.PROJECT_SNAPSHOT_TTL seconds. The workload is only compiled again
+when the version of the configuration changes.
+
+The backend increments the `config_version` field of the project when it edits its
+settings or events (invalidate_project). It's checked on every read, so that the edits
+are used right away by all the workers. The few-shot examples, which come from the events
+of the tasks, can be up to config.PROJECT_SNAPSHOT_TTL seconds old.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+from phospho import lab
+from phospho.models import Project
+
+from extractor.core import config
+from extractor.db.mongo import get_mongo_db
+from extractor.services.projects import get_project_by_id
+
+PHOSPHO_EVENT_MODEL_NAMES = ["phospho-6", "owner", "phospho-4"]
+
+# Maximum number of projects kept in memory
+MAX_PROJECT_SNAPSHOTS = 1000
+
+
+def get_project_config_version(project: Project) -> str:
+    """Hash of the configuration of the project. It changes when the settings or events change."""
+    serialized = json.dumps(project.model_dump(mode="json"), sort_keys=True)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+async def _fetch_last_event_per_name(match: dict) -> List[dict]:
+    """The input, output and event_name of the last event matching the filter, for each event_name"""
+    mongo_db = await get_mongo_db()
+    return (
+        await mongo_db["events"]
+        .aggregate(
+            [
+                {"$match": match},
+                {
+                    "$facet": {
+                        "event_names": [{"$group": {"_id": "$event_name"}}],
+                        "events": [
+                            {"$sort": {"created_at": -1}},
+                            {
+                                "$group": {
+                                    "_id": "$event_name",
+                                    "first_event": {"$first": "$$ROOT"},
+                                }
+                            },
+                            {"$replaceRoot": {"newRoot": "$first_event"}},
+                            {
+                                "$lookup": {
+                                    "from": "tasks",
+                                    "localField": "task_id",
+                                    "foreignField": "id",
+                                    "as": "task",
+                                }
+                            },
+                            {"$unwind": "$task"},
+                            {
+                                "$addFields": {
+                                    "event_name": "$event_name",
+                                    "output": "$task.output",
+                                    "input": "$task.input",
+                                }
+                            },
+                            {
+                                "$project": {
+                                    "input": 1,
+                                    "output": 1,
+                                    "event_name": 1,
+                                }
+                            },
+                        ],
+                    }
+                },
+                {
+                    "$project": {
+                        "events": {
+                            "$setDifference": [
+                                "$events",
+                                {
+                                    "$map": {
+                                        "input": "$event_names",
+                                        "as": "event_name",
+                                        "in": {
+                                            "$filter": {
+                                                "input": "$events",
+                                                "as": "event",
+                                                "cond": {
+                                                    "$eq": [
+                                                        "$$event.event_name",
+                                                        "$$event_name._id",
+                                                    ]
+                                                },
+                                            }
+                                        },
+                                    }
+                                },
+                            ]
+                        }
+                    }
+                },
+                {"$unwind": "$events"},
+                {"$replaceRoot": {"newRoot": "$events"}},
+            ]
+        )
+        .to_list(length=None)
+    )
+
+
+async def fetch_few_shot_examples(project: Project) -> Dict[str, List[dict]]:
+    """
+    The last confirmed and the last removed example of each LLM based event of the project,
+    used as few-shot examples by the event detection.
+    """
+    llm_based_events = []
+    for event_name, event in project.settings.events.items():
+        if event.detection_engine == "llm_detection":
+            llm_based_events.append(event_name)
+
+    # Matches at most one successful example per event_name
+    successful_events = await _fetch_last_event_per_name(
+        {
+            "project_id": project.id,
+            "source": {"$in": PHOSPHO_EVENT_MODEL_NAMES},
+            "confirmed": True,
+            "removed": False,
+            "event_name": {
+                "$in": llm_based_events
+            },  # filter by event names in project.settings.event
+        }
+    )
+    # Matches at most one unsuccessful example per event_name
+    unsuccessful_events = await _fetch_last_event_per_name(
+        {
+            "project_id": project.id,
+            "removed": True,
+            "confirmed": False,
+            "source": {"$in": PHOSPHO_EVENT_MODEL_NAMES},
+            "removal_reason": {"$regex": "removed_by_user"},
+            "event_name": {"$in": llm_based_events},
+        }
+    )
+    return {
+        "successful_events": successful_events,
+        "unsuccessful_events": unsuccessful_events,
+    }
+
+
+async def fetch_project_config_version(project_id: str) -> int:
+    """The config_version of the project, incremented by the backend when it's edited"""
+    mongo_db = await get_mongo_db()
+    project = await mongo_db["projects"].find_one(
+        {"id": project_id}, {"_id": 0, "config_version": 1}
+    )
+    return (project or {}).get("config_version", 0)
+
+
+class ProjectSnapshot:
+    """
+    The configuration of a project, as used by the pipelines. It's shared by all the
+    pipelines of the project: don't modify it.
+    """
+
+    def __init__(
+        self,
+        project: Project,
+        few_shot_examples: Dict[str, List[dict]],
+        workload: Optional[lab.Workload] = None,
+        config_version: int = 0,
+    ):
+        self.project = project
+        self.config_version = config_version
+        self.version = get_project_config_version(project)
+        self.few_shot_examples = few_shot_examples
+        self.loaded_at = time.monotonic()
+        self._workload = workload
+
+    def is_expired(self) -> bool:
+        return time.monotonic() - self.loaded_at >= config.PROJECT_SNAPSHOT_TTL
+
+    def is_valid(self, config_version: int) -> bool:
+        """Not expired, and loaded after the last edit of the project"""
+        return not self.is_expired() and self.config_version >= config_version
+
+    def workload(self) -> lab.Workload:
+        """
+        A new workload with the event detection jobs of the project, ready to run.
+        The jobs are compiled once per version of the configuration.
+        """
+        if self._workload is None:
+            self._workload = lab.Workload.from_phospho_project_config(self.project)
+        return self._workload.copy()
+
+
+_snapshots: Dict[str, ProjectSnapshot] = {}
+# Only one task loads the snapshot of a project at a time
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def get_project_snapshot(project_id: str) -> ProjectSnapshot:
+    """
+    The snapshot of the configuration of the project. It's loaded from the database if
+    it's missing, older than config.PROJECT_SNAPSHOT_TTL seconds, or if the project was
+    edited since.
+    """
+    # Read before loading the project: an edit made during the load is seen next time
+    config_version = await fetch_project_config_version(project_id)
+    snapshot = _snapshots.get(project_id)
+    if snapshot is not None and snapshot.is_valid(config_version):
+        return snapshot
+
+    lock = _locks.setdefault(project_id, asyncio.Lock())
+    async with lock:
+        # The snapshot may have been loaded while waiting for the lock
+        snapshot = _snapshots.get(project_id)
+        if snapshot is not None and snapshot.is_valid(config_version):
+            return snapshot
+
+        project = await get_project_by_id(project_id)
+        few_shot_examples = await fetch_few_shot_examples(project)
+        new_snapshot = ProjectSnapshot(
+            project, few_shot_examples, config_version=config_version
+        )
+        if snapshot is not None and snapshot.version == new_snapshot.version:
+            # Same configuration: keep the compiled workload
+            new_snapshot._workload = snapshot._workload
+        else:
+            logger.debug(
+                f"Loaded configuration version {new_snapshot.version[:8]} of project {project_id}"
+            )
+
+        if project_id not in _snapshots and len(_snapshots) >= MAX_PROJECT_SNAPSHOTS:
+            # Remove the oldest snapshot
+            oldest_project_id = next(iter(_snapshots))
+            del _snapshots[oldest_project_id]
+            _locks.pop(oldest_project_id, None)
+        _snapshots[project_id] = new_snapshot
+        return new_snapshot
+
+
+def invalidate_project_snapshot(project_id: str) -> None:
+    """Reload the configuration of the project on the next pipeline"""
+    _snapshots.pop(project_id, None)
@@ -0,0 +1,53 @@
+"""
+Daily rollups of the dashboard metrics. The days whose tasks, sessions or events changed
+are marked as dirty here, and recomputed by the backend when they are read
+(phospho_backend.services.mongo.rollups).
+"""
+
+import datetime
+import time
+from typing import Iterable, Optional, Union
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from extractor.db.mongo import get_mongo_db
+
+DAILY_ROLLUPS_COLLECTION = "daily_rollups"
+
+
+def get_day(timestamp: Union[int, float]) -> str:
+    """UTC day of a timestamp, as YYYY-MM-DD"""
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime(
+        "%Y-%m-%d"
+    )
+
+
+async def mark_rollups_dirty(
+    project_id: str, timestamps: Iterable[Optional[Union[int, float]]]
+) -> None:
+    """
+    Mark the days of the timestamps as dirty: their rollups are recomputed on the next read.
+    """
+    days = {get_day(timestamp) for timestamp in timestamps if timestamp is not None}
+    if not days:
+        return
+    now = time.time()
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db[DAILY_ROLLUPS_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": f"{project_id}:{day}"},
+                    {
+                        "$set": {"dirty": True, "dirty_at": now},
+                        "$setOnInsert": {"project_id": project_id, "date": day},
+                    },
+                    upsert=True,
+                )
+                for day in days
+            ],
+            ordered=False,
+        )
+    except Exception as e:
+        logger.error(f"Error marking the rollups of project {project_id} as dirty: {e}")
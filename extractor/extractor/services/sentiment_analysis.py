@@ -1,10 +1,46 @@
-from typing import Optional
+"""
+Sentiment analysis and language detection of the messages.
+
+Two backends are available, selected with config.SENTIMENT_BACKEND:
+- google: the Google Cloud Natural Language API, one request per text
+- local: a lexicon and n-grams based analysis (extractor.services.local_sentiment),
+  which runs on CPU without any network call
+"""
+
+import asyncio
+from typing import List, Optional, Tuple
 
 from google.cloud import language_v2
 from loguru import logger
 from phospho.models import SentimentObject
 
-from extractor.core.config import GCP_ASYNC_SENTIMENT_CLIENT
+from extractor.core import config
+from extractor.services.local_sentiment import analyze_texts
+
+# Maximum number of characters analyzed per text (approx the limit of 512 tokens)
+MAX_TEXT_LENGTH = 512
+
+
+def label_sentiment(
+    sentiment: SentimentObject, score_threshold: float, magnitude_threshold: float
+) -> SentimentObject:
+    """Set the label of the sentiment based on its score and magnitude"""
+    # We interpret the sentiment score as follows:
+    if sentiment.score is None:
+        return SentimentObject()
+    elif sentiment.score > score_threshold:
+        sentiment.label = "positive"
+    elif sentiment.score < -score_threshold:
+        sentiment.label = "negative"
+    else:
+        if (
+            sentiment.magnitude is not None
+            and sentiment.magnitude < magnitude_threshold
+        ):
+            sentiment.label = "neutral"
+        else:
+            sentiment.label = "mixed"
+    return sentiment
 
 
 async def call_sentiment_and_language_api(
@@ -22,12 +58,11 @@ async def call_sentiment_and_language_api(
     Args:
       text_content: The text content to analyze.
     """
-    if GCP_ASYNC_SENTIMENT_CLIENT is None:
+    if config.GCP_ASYNC_SENTIMENT_CLIENT is None:
         logger.warning("No client available for sentiment analysis")
         return SentimentObject(), None
 
-    # crop the text to 512 characters (approx the limit of 512 tokens)
-    text = text[:512]
+    text = text[:MAX_TEXT_LENGTH]
 
     try:
         # Available types: PLAIN_TEXT, HTML
@@ -46,7 +81,7 @@ async def call_sentiment_and_language_api(
         # See https://cloud.google.com/natural-language/docs/reference/rest/v2/EncodingType.
         encoding_type = language_v2.EncodingType.UTF8
 
-        response = await GCP_ASYNC_SENTIMENT_CLIENT.analyze_sentiment(
+        response = await config.GCP_ASYNC_SENTIMENT_CLIENT.analyze_sentiment(
             request={"document": document, "encoding_type": encoding_type},
             timeout=10,
         )
@@ -60,21 +95,9 @@ async def call_sentiment_and_language_api(
             response.language_code if response.language_code is not None else None
         )
 
-        # We interpret the sentiment score as follows:
-        if sentiment_response.score is None:
-            sentiment_response = SentimentObject()
-        elif sentiment_response.score > score_threshold:
-            sentiment_response.label = "positive"
-        elif sentiment_response.score < -score_threshold:
-            sentiment_response.label = "negative"
-        else:
-            if (
-                sentiment_response.magnitude is not None
-                and sentiment_response.magnitude < magnitude_threshold
-            ):
-                sentiment_response.label = "neutral"
-            else:
-                sentiment_response.label = "mixed"
+        sentiment_response = label_sentiment(
+            sentiment_response, score_threshold, magnitude_threshold
+        )
 
     except Exception as e:
         if "Cannot determine the language of the document." in str(e):
@@ -86,3 +109,76 @@ async def call_sentiment_and_language_api(
         language = None
 
     return sentiment_response, language
+
+
+class SentimentBackend:
+    """Analyzes the sentiment and the language of batches of texts"""
+
+    async def analyze(
+        self,
+        texts: List[str],
+        score_threshold: float,
+        magnitude_threshold: float,
+    ) -> List[Tuple[SentimentObject, Optional[str]]]:
+        """Returns the sentiment and the language of each text, in the same order"""
+        raise NotImplementedError
+
+
+class GoogleSentimentBackend(SentimentBackend):
+    """Google Cloud Natural Language API, with a bounded number of concurrent requests"""
+
+    def __init__(self, concurrency: Optional[int] = None):
+        self.concurrency = concurrency or config.SENTIMENT_API_CONCURRENCY
+
+    async def analyze(
+        self,
+        texts: List[str],
+        score_threshold: float,
+        magnitude_threshold: float,
+    ) -> List[Tuple[SentimentObject, Optional[str]]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def analyze_text(text: str) -> Tuple[SentimentObject, Optional[str]]:
+            async with semaphore:
+                return await call_sentiment_and_language_api(
+                    text, score_threshold, magnitude_threshold
+                )
+
+        return await asyncio.gather(*[analyze_text(text) for text in texts])
+
+
+class LocalSentimentBackend(SentimentBackend):
+    """Lexicon and n-grams based analysis, run on CPU in a thread"""
+
+    async def analyze(
+        self,
+        texts: List[str],
+        score_threshold: float,
+        magnitude_threshold: float,
+    ) -> List[Tuple[SentimentObject, Optional[str]]]:
+        # The whole batch is analyzed in a single thread, to not block the event loop
+        results = await asyncio.to_thread(
+            analyze_texts, [text[:MAX_TEXT_LENGTH] for text in texts]
+        )
+        return [
+            (
+                label_sentiment(
+                    SentimentObject(score=score, magnitude=magnitude),
+                    score_threshold,
+                    magnitude_threshold,
+                ),
+                language,
+            )
+            for score, magnitude, language in results
+        ]
+
+
+def get_sentiment_backend() -> SentimentBackend:
+    """The sentiment backend set in config.SENTIMENT_BACKEND"""
+    if config.SENTIMENT_BACKEND == "local":
+        return LocalSentimentBackend()
+    if config.SENTIMENT_BACKEND != "google":
+        logger.warning(
+            f"Unknown SENTIMENT_BACKEND {config.SENTIMENT_BACKEND}, using google"
+        )
+    return GoogleSentimentBackend()
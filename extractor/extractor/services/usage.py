@@ -0,0 +1,82 @@
+"""
+Usage counters of the organizations and projects, incremented when job_results are
+inserted. They are read and reconciled by the backend (phospho_backend.services.mongo.usage).
+"""
+
+import datetime
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from extractor.db.mongo import get_mongo_db
+
+USAGE_COUNTERS_COLLECTION = "usage_counters"
+
+# job_results counted in the monthly analytics of a project
+ANALYTICS_JOB_IDS = ["sentiment", "language"]
+ANALYTICS_RECIPE_TYPES = ["event_detection"]
+
+
+def get_month(timestamp: Optional[Union[int, float]] = None) -> str:
+    """Month bucket of a timestamp (now by default), as YYYY-MM"""
+    if timestamp is None:
+        date = datetime.datetime.now()
+    else:
+        date = datetime.datetime.fromtimestamp(timestamp)
+    return date.strftime("%Y-%m")
+
+
+def is_analytics_job_result(job_result: dict) -> bool:
+    """Whether the job_result counts in the monthly analytics of its project"""
+    job_metadata = job_result.get("job_metadata") or {}
+    return (
+        job_result.get("job_id") in ANALYTICS_JOB_IDS
+        or job_metadata.get("recipe_type") in ANALYTICS_RECIPE_TYPES
+    )
+
+
+async def increment_usage_counters(job_results: Iterable[dict]) -> None:
+    """
+    Increment the usage counters with job_results that were just inserted.
+    Call this right after inserting job_results in the database.
+    """
+    nb_per_org: Dict[str, int] = defaultdict(int)
+    nb_analytics_per_project: Dict[Tuple[str, str], int] = defaultdict(int)
+    for job_result in job_results:
+        org_id = job_result.get("org_id")
+        if org_id is not None:
+            nb_per_org[org_id] += 1
+        project_id = job_result.get("project_id")
+        if project_id is not None and is_analytics_job_result(job_result):
+            month = get_month(job_result.get("created_at"))
+            nb_analytics_per_project[(project_id, month)] += 1
+
+    updates = [
+        UpdateOne(
+            {"_id": f"org:{org_id}"},
+            {"$inc": {"count": nb}, "$setOnInsert": {"org_id": org_id}},
+            upsert=True,
+        )
+        for org_id, nb in nb_per_org.items()
+    ] + [
+        UpdateOne(
+            {"_id": f"project:{project_id}:{month}"},
+            {
+                "$inc": {"count": nb},
+                "$setOnInsert": {"project_id": project_id, "month": month},
+            },
+            upsert=True,
+        )
+        for (project_id, month), nb in nb_analytics_per_project.items()
+    ]
+    if not updates:
+        return
+
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db[USAGE_COUNTERS_COLLECTION].bulk_write(updates, ordered=False)
+    except Exception as e:
+        # The counters are fixed by the next reconciliation of the backend
+        logger.error(f"Error incrementing usage counters: {e}")
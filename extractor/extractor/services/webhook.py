@@ -1,13 +1,65 @@
-from typing import Optional
+"""
+Webhooks of the detected events.
+
+The pipelines don't call the webhooks themselves: they add them to the outbox (the
+webhook_outbox collection) with enqueue_webhooks, and the webhook dispatcher of the worker
+delivers them in the background. This way, a slow webhook endpoint doesn't slow down the
+pipelines, and the webhooks are not lost if the delivery fails.
+
+The dispatcher claims the pending webhooks by batches and delivers them concurrently:
+- all the requests go through a single aiohttp session (connection pool)
+- at most config.WEBHOOK_CONCURRENCY requests at the same time, and
+  config.WEBHOOK_CONCURRENCY_PER_URL to the same URL
+- a failed webhook is retried after config.WEBHOOK_RETRY_BASE_DELAY seconds, doubled at
+  each attempt, up to config.WEBHOOK_MAX_ATTEMPTS attempts
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
 
 import aiohttp
 from aiohttp import ClientTimeout
 from loguru import logger
+from pymongo import UpdateOne
+
+from extractor.core import config
+from extractor.db.mongo import get_mongo_db
+from extractor.utils import generate_uuid
+
+WEBHOOK_OUTBOX_COLLECTION = "webhook_outbox"
+# Number of seconds after which a webhook claimed by a dispatcher can be claimed again
+WEBHOOK_VISIBILITY_TIMEOUT = 300
+# Maximum number of webhooks claimed at once by a dispatcher
+WEBHOOK_DISPATCH_BATCH_SIZE = 200
+
+session: Optional[aiohttp.ClientSession] = None
+
+
+def get_webhook_session() -> aiohttp.ClientSession:
+    """The HTTP session shared by all the webhook requests of the worker"""
+    global session
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=config.WEBHOOK_CONCURRENCY,
+                limit_per_host=config.WEBHOOK_CONCURRENCY_PER_URL,
+            )
+        )
+    return session
+
+
+async def close_webhook_session() -> None:
+    global session
+    if session is not None and not session.closed:
+        await session.close()
+    session = None
 
 
 async def trigger_webhook(
-    url: str, json: dict, timeout: int = 3, headers: Optional[dict] = None
-) -> None:
+    url: str, json: dict, timeout: Optional[int] = None, headers: Optional[dict] = None
+) -> bool:
     """
     Async function to trigger a webhook. Sends a POST request to the given URL
     with the given data.
@@ -15,27 +67,205 @@ async def trigger_webhook(
     :param url: The URL to trigger the webhook on.
     :param data: The data to send to the webhook.
     :param timeout: The timeout for the request, an int in seconds.
+    :return: Whether the webhook was delivered.
     """
+    if timeout is None:
+        timeout = config.WEBHOOK_TIMEOUT
     # Filter empty values from the headers (where str is "")
     headers = {k: v for k, v in (headers or {}).items() if v is not None and v != ""}
 
     # If the url is not set, return early
     if url == "":
         logger.warning("No webhook URL set, skipping webhook trigger")
-        return None
+        return False
 
     try:
         logger.info(f"Triggering webhook: {url}")
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url, json=json, timeout=ClientTimeout(total=timeout), headers=headers
-            ) as response:
-                response.raise_for_status()
-                logger.info(f"Webhook triggered successfully: {response.status}")
-                await response.text()
-            await session.close()
-        return None
-    except aiohttp.ClientError as e:
+        async with get_webhook_session().post(
+            url, json=json, timeout=ClientTimeout(total=timeout), headers=headers
+        ) as response:
+            response.raise_for_status()
+            logger.info(f"Webhook triggered successfully: {response.status}")
+            await response.text()
+        return True
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Error sending webhook to {url}: {e}")
-        await session.close()
-        return None
+        return False
+
+
+async def enqueue_webhooks(webhooks: List[Dict]) -> None:
+    """
+    Add webhooks to the outbox. A webhook is a dict with the keys url, headers, payload,
+    project_id and org_id.
+    """
+    if not webhooks:
+        return
+    now = time.time()
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db[WEBHOOK_OUTBOX_COLLECTION].insert_many(
+            [
+                {
+                    "id": generate_uuid(),
+                    "url": webhook["url"],
+                    "headers": webhook.get("headers"),
+                    "payload": webhook["payload"],
+                    "project_id": webhook.get("project_id"),
+                    "org_id": webhook.get("org_id"),
+                    "status": "pending",
+                    "attempts": 0,
+                    "created_at": now,
+                    "next_attempt_at": now,
+                    "locked_until": None,
+                }
+                for webhook in webhooks
+            ]
+        )
+    except Exception as e:
+        logger.error(f"Error adding {len(webhooks)} webhooks to the outbox: {e}")
+        return
+    # Deliver them right away
+    wakeup_event.set()
+
+
+async def claim_webhooks(max_items: int) -> List[Dict]:
+    """Claim at most max_items webhooks due for delivery"""
+    now = time.time()
+    claimable = {
+        "$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            # The dispatcher which claimed it died
+            {"status": "processing", "locked_until": {"$lt": now}},
+        ]
+    }
+    mongo_db = await get_mongo_db()
+    candidates = (
+        await mongo_db[WEBHOOK_OUTBOX_COLLECTION]
+        .find(claimable, {"id": 1})
+        .sort("created_at", 1)
+        .limit(max_items)
+        .to_list(length=max_items)
+    )
+    if not candidates:
+        return []
+    claim_id = generate_uuid()
+    # The claimable filter is checked again: the webhooks claimed meanwhile by another
+    # dispatcher are left out
+    await mongo_db[WEBHOOK_OUTBOX_COLLECTION].update_many(
+        {"id": {"$in": [item["id"] for item in candidates]}, **claimable},
+        {
+            "$set": {
+                "status": "processing",
+                "claim_id": claim_id,
+                "locked_until": now + WEBHOOK_VISIBILITY_TIMEOUT,
+            },
+            "$inc": {"attempts": 1},
+        },
+    )
+    return (
+        await mongo_db[WEBHOOK_OUTBOX_COLLECTION]
+        .find({"claim_id": claim_id})
+        .to_list(length=None)
+    )
+
+
+async def _complete_webhooks(delivered: List[Dict], failed: List[Dict]) -> None:
+    """Remove the delivered webhooks from the outbox, schedule the retries of the failed ones"""
+    mongo_db = await get_mongo_db()
+    if delivered:
+        await mongo_db[WEBHOOK_OUTBOX_COLLECTION].delete_many(
+            {"id": {"$in": [item["id"] for item in delivered]}}
+        )
+    if not failed:
+        return
+    now = time.time()
+    updates = []
+    for item in failed:
+        if item["attempts"] >= config.WEBHOOK_MAX_ATTEMPTS:
+            logger.error(
+                f"Webhook {item['id']} to {item['url']} of project {item.get('project_id')} failed {item['attempts']} times"
+            )
+            update: Dict[str, object] = {"status": "failed", "locked_until": None}
+        else:
+            delay = config.WEBHOOK_RETRY_BASE_DELAY * 2 ** (item["attempts"] - 1)
+            update = {
+                "status": "pending",
+                "locked_until": None,
+                "next_attempt_at": now + delay,
+            }
+        updates.append(UpdateOne({"id": item["id"]}, {"$set": update}))
+    await mongo_db[WEBHOOK_OUTBOX_COLLECTION].bulk_write(updates, ordered=False)
+
+
+async def dispatch_webhooks(batch_size: int = WEBHOOK_DISPATCH_BATCH_SIZE) -> int:
+    """
+    Claim the webhooks due for delivery and deliver them, grouped by URL.
+    Returns the number of webhooks claimed.
+    """
+    items = await claim_webhooks(batch_size)
+    if not items:
+        return 0
+
+    items_per_url: Dict[str, List[Dict]] = defaultdict(list)
+    for item in items:
+        items_per_url[item["url"]].append(item)
+
+    semaphore = asyncio.Semaphore(config.WEBHOOK_CONCURRENCY)
+
+    async def deliver_url(url_items: List[Dict]) -> List[bool]:
+        url_semaphore = asyncio.Semaphore(config.WEBHOOK_CONCURRENCY_PER_URL)
+
+        async def deliver(item: Dict) -> bool:
+            async with url_semaphore, semaphore:
+                try:
+                    return await trigger_webhook(
+                        url=item["url"], json=item["payload"], headers=item["headers"]
+                    )
+                except Exception as e:
+                    # Eg an invalid URL or headers: counted as a failed attempt, so that
+                    # the other webhooks of the batch are completed
+                    logger.error(f"Error sending webhook {item['id']}: {e}")
+                    return False
+
+        return await asyncio.gather(*[deliver(item) for item in url_items])
+
+    delivered: List[Dict] = []
+    failed: List[Dict] = []
+    results_per_url = await asyncio.gather(
+        *[deliver_url(url_items) for url_items in items_per_url.values()]
+    )
+    for url_items, results in zip(items_per_url.values(), results_per_url):
+        for item, is_delivered in zip(url_items, results):
+            (delivered if is_delivered else failed).append(item)
+
+    await _complete_webhooks(delivered, failed)
+    return len(items)
+
+
+wakeup_event = asyncio.Event()
+
+
+async def run_webhook_dispatcher() -> None:
+    """
+    Deliver the webhooks of the outbox until cancelled. Woken up by enqueue_webhooks,
+    and every config.WEBHOOK_DISPATCH_INTERVAL seconds for the retries.
+    """
+    try:
+        while True:
+            wakeup_event.clear()
+            try:
+                nb_claimed = await dispatch_webhooks()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error dispatching the webhooks: {e}")
+                nb_claimed = 0
+            if nb_claimed == 0:
+                try:
+                    await asyncio.wait_for(
+                        wakeup_event.wait(), timeout=config.WEBHOOK_DISPATCH_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        await close_webhook_session()
@@ -29,7 +29,7 @@ from extractor.services.log.tasks import (
     process_tasks_id,
 )
 from extractor.services.pipelines import MainPipeline
-from extractor.services.projects import get_project_by_id
+from extractor.services.project_snapshots import get_project_snapshot
 
 
 @activity.defn(name="bill_on_stripe")
@@ -54,7 +54,7 @@ async def bill_on_stripe(
     )
     usage_per_log: int = 0
     try:
-        project = await get_project_by_id(request.project_id)
+        project = (await get_project_snapshot(request.project_id)).project
     except ValueError as e:
         logger.error(f"Project {request.project_id} error: {e}")
         return
@@ -113,6 +113,8 @@ class ExtractLangSmithDataWorkflow(BaseWorkflow):
         super().__init__(
             activity_func=extract_langsmith_data,
             request_class=PipelineLangsmithRequest,
+            # The sync resumes from its last checkpoint when retried
+            max_retries=3,
         )
 
     @workflow.run
@@ -126,6 +128,8 @@ class ExtractLangfuseDataWorkflow(BaseWorkflow):
         super().__init__(
             activity_func=extract_langfuse_data,
             request_class=PipelineLangfuseRequest,
+            # The sync resumes from its last checkpoint when retried
+            max_retries=3,
         )
 
     @workflow.run
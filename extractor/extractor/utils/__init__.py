@@ -5,7 +5,7 @@ import uuid
 from collections import Counter
 from typing import Tuple
 
-import tiktoken
+from phospho.utils import get_number_of_tokens
 
 
 def generate_uuid() -> str:
@@ -46,11 +46,7 @@ def fits_in_context_window(prompt: str, context_window_size: int) -> bool:
     Check if the prompt fits in the context window
     context_window_size is the number of tokens of the context window
     """
-    encoding = tiktoken.get_encoding("cl100k_base")
-
-    num_tokens = len(encoding.encode(prompt))
-
-    return num_tokens <= context_window_size
+    return get_number_of_tokens(prompt) <= context_window_size
 
 
 def get_last_week_timestamps() -> Tuple[int, int]:
@@ -5,6 +5,7 @@ import os
 import aiohealthcheck  # type: ignore
 import sentry_sdk
 from loguru import logger
+from phospho import lab
 from temporalio.client import Client, TLSConfig
 from temporalio.worker import Worker
 from temporalio.worker.workflow_sandbox import (
@@ -13,8 +14,9 @@ from temporalio.worker.workflow_sandbox import (
 )
 
 from extractor.core import config
-from extractor.db.mongo import close_mongo_db, connect_and_init_db
+from extractor.db.mongo import close_mongo_db, connect_and_init_db, get_mongo_db
 from extractor.sentry.interceptor import SentryInterceptor
+from extractor.services.webhook import run_webhook_dispatcher
 from extractor.temporal.activities import (
     bill_on_stripe,
     extract_langfuse_data,
@@ -78,6 +80,20 @@ async def main() -> None:
 
     await connect_and_init_db()
 
+    for provider, rate_limit in config.LLM_RATE_LIMITS.items():
+        logger.info(f"Rate limit for {provider}: {rate_limit}")
+        lab.set_rate_limit(provider, **rate_limit)
+
+    if config.LLM_CACHE_TTL is not None:
+        logger.info(f"Caching the LLM calls for {config.LLM_CACHE_TTL}s")
+        mongo_db = await get_mongo_db()
+        lab.set_llm_cache(
+            lab.MongoLLMCache(mongo_db["llm_cache"], ttl=config.LLM_CACHE_TTL)
+        )
+
+    # Deliver the webhooks of the detected events in the background
+    webhook_dispatcher = asyncio.create_task(run_webhook_dispatcher())
+
     client: Client
     if config.ENVIRONMENT in ["production", "staging"]:
         client_cert = config.TEMPORAL_MTLS_TLS_CERT
@@ -139,6 +155,8 @@ async def main() -> None:
     ):
         logger.info("Worker started")
         await interrupt_event.wait()
+        webhook_dispatcher.cancel()
+        await asyncio.gather(webhook_dispatcher, return_exceptions=True)
         await close_mongo_db()
         logger.info("Shutting down")
 
@@ -0,0 +1,35 @@
+from extractor.services.local_sentiment import analyze_texts
+
+
+def test_local_sentiment():
+    (positive, _, _), (negative, _, _), (negated, _, _), (unknown, magnitude, _) = (
+        analyze_texts(
+            [
+                "This is really great, thanks!",
+                "This answer is wrong and useless",
+                "This is not good",
+                "The meeting is at 10",
+            ]
+        )
+    )
+    assert positive is not None and positive > 0.3
+    assert negative is not None and negative < -0.3
+    assert negated is not None and negated < 0
+    assert unknown is None and magnitude is None
+
+
+def test_local_language():
+    languages = [
+        language
+        for _, _, language in analyze_texts(
+            [
+                "What is the price of this product?",
+                "Bonjour, je ne comprends pas pourquoi cela ne marche pas",
+                "Hola, quiero saber el precio de los productos",
+                "Ich habe eine Frage zu meiner Rechnung",
+                "Привет, как дела?",
+                "1234",
+            ]
+        )
+    ]
+    assert languages == ["en", "fr", "es", "de", "ru", None]
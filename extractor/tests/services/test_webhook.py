@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from extractor.core import config
+from extractor.services import webhook
+from extractor.services.webhook import (
+    WEBHOOK_OUTBOX_COLLECTION,
+    dispatch_webhooks,
+    enqueue_webhooks,
+)
+
+assert config.ENVIRONMENT != "production"
+
+
+@pytest.mark.asyncio
+async def test_webhook_outbox(db, monkeypatch):
+    async for mongo_db in db:
+        await mongo_db[WEBHOOK_OUTBOX_COLLECTION].delete_many(
+            {"project_id": "test_webhook_outbox"}
+        )
+        sent_urls = []
+
+        async def fake_trigger_webhook(url, json, timeout=None, headers=None):
+            sent_urls.append(url)
+            if url == "https://invalid.test":
+                raise ValueError("Invalid URL")
+            return True
+
+        monkeypatch.setattr(webhook, "trigger_webhook", fake_trigger_webhook)
+        await enqueue_webhooks(
+            [
+                {
+                    "url": url,
+                    "headers": None,
+                    "payload": {"event": "test"},
+                    "project_id": "test_webhook_outbox",
+                }
+                for url in ["https://valid.test", "https://invalid.test"]
+            ]
+        )
+
+        assert await dispatch_webhooks() == 2
+        assert sorted(sent_urls) == ["https://invalid.test", "https://valid.test"]
+
+        # The delivered webhook is removed, the failed one is retried later
+        items = (
+            await mongo_db[WEBHOOK_OUTBOX_COLLECTION]
+            .find({"project_id": "test_webhook_outbox"})
+            .to_list(length=None)
+        )
+        assert len(items) == 1
+        assert items[0]["url"] == "https://invalid.test"
+        assert items[0]["status"] == "pending"
+        assert items[0]["attempts"] == 1
+        assert items[0]["next_attempt_at"] > time.time()
+
+        await mongo_db[WEBHOOK_OUTBOX_COLLECTION].delete_many(
+            {"project_id": "test_webhook_outbox"}
+        )
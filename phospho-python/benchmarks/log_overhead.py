@@ -0,0 +1,141 @@
+"""
+Micro-benchmark of the overhead of phospho.log() on the hot path.
+
+It measures the conversion of a typical OpenAI request/response to loggable content,
+compared to the previous implementation (one json.dumps per recursion level), and the
+total time spent in phospho.log(). No request is sent to the backend.
+
+Usage: python benchmarks/log_overhead.py
+"""
+
+import json
+import os
+import timeit
+from typing import Any
+
+import pydantic
+
+import phospho
+from phospho.utils import convert_content_to_loggable_content
+
+NB_CALLS = 2000
+
+
+def legacy_convert_content_to_loggable_content(content: Any) -> Any:
+    """The previous implementation, serializing the content at every level"""
+
+    def is_jsonable(x: Any) -> bool:
+        try:
+            json.dumps(x)
+            return True
+        except TypeError:
+            return False
+
+    if is_jsonable(content):
+        return content
+    if isinstance(content, dict):
+        return {
+            key: legacy_convert_content_to_loggable_content(value)
+            for key, value in content.items()
+        }
+    elif isinstance(content, list):
+        return str([legacy_convert_content_to_loggable_content(x) for x in content])
+    elif isinstance(content, pydantic.BaseModel):
+        return content.model_dump()
+    elif isinstance(content, bytes):
+        return json.loads(content.decode())
+    return str(content)
+
+
+class Usage(pydantic.BaseModel):
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+
+
+def make_openai_query(nb_messages: int = 20) -> dict:
+    return {
+        "model": "gpt-4o",
+        "temperature": 0.2,
+        "messages": [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"Message number {i}. "
+                + "Lorem ipsum dolor sit amet. " * 20,
+            }
+            for i in range(nb_messages)
+        ],
+        "tools": [
+            {
+                "type": "function",
+                "function": {
+                    "name": f"tool_{i}",
+                    "parameters": {"type": "object", "properties": {"x": {}}},
+                },
+            }
+            for i in range(5)
+        ],
+    }
+
+
+def make_metadata() -> dict:
+    return {
+        "user_id": "user@example.com",
+        "usage": Usage(prompt_tokens=100, completion_tokens=20, total_tokens=120),
+        "tags": ["a", "b", "c"],
+        "nested": {"level1": {"level2": {"level3": [1, 2, 3]}}},
+    }
+
+
+def report(name: str, seconds: float) -> None:
+    print(f"{name:<50} {seconds / NB_CALLS * 1e6:>10.1f} µs/call")
+
+
+def main() -> None:
+    query = make_openai_query()
+    metadata = make_metadata()
+
+    report(
+        "legacy convert (query)",
+        timeit.timeit(
+            lambda: legacy_convert_content_to_loggable_content(query), number=NB_CALLS
+        ),
+    )
+    report(
+        "convert (query)",
+        timeit.timeit(
+            lambda: convert_content_to_loggable_content(query), number=NB_CALLS
+        ),
+    )
+    report(
+        "legacy convert (metadata with a pydantic model)",
+        timeit.timeit(
+            lambda: legacy_convert_content_to_loggable_content(metadata),
+            number=NB_CALLS,
+        ),
+    )
+    report(
+        "convert (metadata with a pydantic model)",
+        timeit.timeit(
+            lambda: convert_content_to_loggable_content(metadata), number=NB_CALLS
+        ),
+    )
+
+    os.environ.setdefault("PHOSPHO_API_KEY", "benchmark")
+    os.environ.setdefault("PHOSPHO_PROJECT_ID", "benchmark")
+    phospho.init(base_url="http://127.0.0.1:1", tick=0.01)
+    # Stop the consumer, so that nothing is sent during the benchmark
+    phospho.consumer.stop()
+    report(
+        "phospho.log()",
+        timeit.timeit(
+            lambda: phospho.log(
+                input=query, output="Hello, how can I help you?", **metadata
+            ),
+            number=NB_CALLS,
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import asyncio
 import inspect
 import logging
 from contextlib import contextmanager
@@ -12,6 +13,7 @@ from typing import (
     Dict,
     Generator,
     Iterable,
+    Iterator,
     List,
     Literal,
     Optional,
@@ -23,6 +25,8 @@ import pydantic
 from . import config, integrations, models, utils
 from ._version import __version__ as __version__
 from .client import Client as Client
+from .client import Compression, Serialization
+from .consumer import AsyncConsumer as AsyncConsumer
 from .consumer import Consumer as Consumer
 from .extractor import (
     RawDataType,
@@ -30,7 +34,8 @@ from .extractor import (
     extract_data_from_output,
     extract_metadata_from_input_output,
 )
-from .log_queue import Event, LogQueue
+from .log_queue import Event, LogQueue, OverflowPolicy
+from .spool import DiskSpool, FsyncPolicy
 from .tasks import TaskEntity
 from .testing import PhosphoTest
 from .utils import (
@@ -42,6 +47,7 @@ from .utils import (
     generate_uuid,
     generate_version_id,
     is_jsonable,
+    register_loggable_converter,
 )
 
 try:
@@ -51,7 +57,7 @@ except ImportError:
 
 client = None
 log_queue = None
-consumer = None
+consumer: Optional[Union[Consumer, AsyncConsumer]] = None
 
 latest_task_id: Optional[str] = None
 latest_session_id: Optional[str] = None
@@ -75,6 +81,20 @@ def init(
     tick: float = 0.5,
     raise_error_on_fail_to_send: bool = False,
     version_id: Optional[str] = None,
+    max_queue_events: Optional[int] = None,
+    max_queue_bytes: Optional[int] = None,
+    queue_overflow_policy: OverflowPolicy = "drop_oldest",
+    queue_block_timeout: float = 1.0,
+    spill_dir: Optional[str] = None,
+    max_batch_events: Optional[int] = 256,
+    max_batch_bytes: Optional[int] = 4 * 1024 * 1024,
+    compression: Optional[Compression] = None,
+    serialization: Serialization = "json",
+    spool_dir: Optional[str] = None,
+    spool_max_bytes: Optional[int] = None,
+    spool_fsync: FsyncPolicy = "segment",
+    use_asyncio: bool = False,
+    flush_threshold: int = 64,
 ) -> None:
     """
     Initialize the phospho logging module.
@@ -88,6 +108,37 @@ def init(
     :param raise_error_on_fail_to_send: whether to raise an error if the consumer fails to send logs
     :param version_id: the version of the code that generated the logs. If None, the version_id
         will be set to the current date.
+    :param max_queue_events: maximum number of log events kept in memory before they're sent.
+        If None, the log queue is unbounded.
+    :param max_queue_bytes: maximum (estimated) size in bytes of the log events kept in memory.
+        If None, the log queue is unbounded.
+    :param queue_overflow_policy: what to do when the log queue is full. One of "block" (wait
+        up to queue_block_timeout seconds for room), "drop_oldest", "drop_newest" or
+        "spill_to_disk" (write the oldest events to a file in spill_dir).
+    :param queue_block_timeout: with the "block" policy, how long phospho.log waits for room
+        in the queue before dropping the event (in seconds)
+    :param spill_dir: with the "spill_to_disk" policy, the directory where events are written.
+        Defaults to a temporary directory.
+    :param max_batch_events: maximum number of log events sent in a single request.
+    :param max_batch_bytes: maximum (estimated, uncompressed) size in bytes of a single request.
+    :param compression: compress the requests sent to the backend. One of None, "gzip" or "zstd"
+        (requires the `zstandard` package).
+    :param serialization: how the requests are serialized. One of "json" or "msgpack"
+        (requires the `msgpack` package).
+    :param spool_dir: if set, the log events that couldn't be sent (eg if the backend is
+        unreachable, or when the process exits) are stored in this directory instead of in
+        memory. They are sent once the backend is reachable again, including after the next
+        phospho.init() with the same spool_dir. With the "spill_to_disk" policy, events
+        evicted from the log queue are also stored there.
+    :param spool_max_bytes: maximum size of the spool on disk. If None, the spool is unbounded.
+    :param spool_fsync: when to flush the spool to disk. One of "always", "segment" (when a
+        segment file is full) or "never".
+    :param use_asyncio: if true, logs are sent by an asyncio task in the running event loop
+        instead of a separate thread. phospho.init must then be called from a running event
+        loop (eg in the startup of your app). Use `await phospho.aflush()` to flush.
+        Requires `httpx`: `pip install phospho[async]`.
+    :param flush_threshold: with use_asyncio, logs are sent as soon as this many log events
+        are ready, or at the latest after `tick` seconds.
 
     """
 
@@ -103,20 +154,60 @@ def init(
     global task_id_override
     global tracing_initialized
 
+    if use_asyncio:
+        # Checked now: if it fails later in the consumer, the logs are retried forever
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "phospho.init(use_asyncio=True) requires the `httpx` package. "
+                + "Install it using `pip install phospho[async]`"
+            )
+
     if version_id is None:
         version_id = generate_version_id()
 
     default_version_id = version_id
     client = Client(api_key=api_key, project_id=project_id, base_url=base_url)
-    log_queue = LogQueue()
-    consumer = Consumer(
+    spool = None
+    if spool_dir is not None:
+        spool = DiskSpool(
+            directory=spool_dir, max_bytes=spool_max_bytes, fsync=spool_fsync
+        )
+    log_queue = LogQueue(
+        max_events=max_queue_events,
+        max_bytes=max_queue_bytes,
+        overflow_policy=queue_overflow_policy,
+        block_timeout=queue_block_timeout,
+        spill_dir=spill_dir,
+        spool=spool,
+    )
+    consumer_kwargs: Dict[str, Any] = dict(
         log_queue=log_queue,
         client=client,
-        tick=tick,
         raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+        max_batch_events=max_batch_events,
+        max_batch_bytes=max_batch_bytes,
+        compression=compression,
+        serialization=serialization,
+        spool=spool,
     )
-    # Start the consumer on a separate thread (this will periodically send logs to backend)
-    consumer.start()
+    if use_asyncio:
+        consumer = AsyncConsumer(
+            max_delay=tick, flush_threshold=flush_threshold, **consumer_kwargs
+        )
+        # Start the consumer as a task in the running event loop
+        try:
+            consumer.start()
+        except RuntimeError as e:
+            raise RuntimeError(
+                "phospho.init(use_asyncio=True) must be called from a running event loop. "
+                + "Call it in an async function, eg at the startup of your app."
+            ) from e
+    else:
+        consumer = Consumer(tick=tick, **consumer_kwargs)
+        # Start the consumer on a separate thread (this will periodically send logs to backend)
+        consumer.start()
 
     # Reset the task_id and session_id
     session_id_override = None
@@ -288,13 +379,13 @@ def _log_single_event(
         **local_metadata_override,
     }
 
-    logger.debug(f"Existing task_id: {list(log_queue.events.keys())}")
     logger.debug(f"Current task_id: {task_id}")
 
-    if task_id in log_queue.events.keys():
+    existing_event = log_queue.events.get(task_id)
+    if existing_event is not None:
         # If the task_id already exists in log_queue, update the existing event content
         # Update the dict inplace
-        existing_log_content = log_queue.events[task_id].content
+        existing_log_content = existing_event.content
 
         # Concatenate the log event output strings, unless if everything is None
         if existing_log_content["output"] is None and log_content["output"] is None:
@@ -359,8 +450,8 @@ def _log_single_event(
         # Update the dict inplace
         existing_log_content.update(fused_log_content)
         log_content = existing_log_content
-        # Update the to_log status of event
-        log_queue.events[task_id].to_log = to_log
+        # Update the to_log status and the size of the event
+        log_queue.update(task_id, to_log=to_log)
     else:
         # Append event to log_queue
         log_queue.append(event=Event(id=task_id, content=log_content, to_log=to_log))
@@ -991,9 +1082,36 @@ def flush() -> None:
         logger.warning(
             "phospho.flush() was called but the global variable consumer was not found. Make sure that phospho.init() was called."
         )
+    elif isinstance(consumer, AsyncConsumer):
+        logger.warning(
+            "phospho.flush() was called with phospho.init(use_asyncio=True). Use `await phospho.aflush()` instead."
+        )
+        consumer.send_batch_sync()
     else:
         consumer.send_batch()
 
+    _flush_tracing()
+
+
+async def aflush() -> None:
+    """
+    Flush the log_queue from an async function. This will send all the logs to phospho.
+    """
+    global consumer
+
+    if consumer is None:
+        logger.warning(
+            "phospho.aflush() was called but the global variable consumer was not found. Make sure that phospho.init() was called."
+        )
+    elif isinstance(consumer, AsyncConsumer):
+        await consumer.flush()
+    else:
+        await asyncio.to_thread(consumer.send_batch)
+
+    _flush_tracing()
+
+
+def _flush_tracing() -> None:
     if tracing_initialized:
         from .tracing import batch_span_processor, global_batch_span_processor
 
@@ -1172,8 +1290,59 @@ try:
             with_sessions=with_sessions,
             with_removed_events=with_removed_events,
         ).get("flattened_tasks", [])
-        tasks_df = pd.DataFrame(flattened_tasks)
+        return _format_tasks_df(
+            pd.DataFrame(flattened_tasks),
+            with_events=with_events,
+            with_sessions=with_sessions,
+        )
+
+    def tasks_df_chunks(
+        limit: Optional[int] = None,
+        with_events: bool = True,
+        with_sessions: bool = True,
+        with_removed_events: bool = False,
+        filters: Optional[models.ProjectDataFilters] = None,
+        chunk_size: int = 10_000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Get the tasks of a project as pandas DataFrames of at most chunk_size rows.
+
+        The tasks are streamed from the phospho API, so that projects with millions of
+        tasks can be exported without holding them all in memory. The DataFrames have
+        the same format as the one returned by `phospho.tasks_df()`.
+
+        ```
+        for chunk_df in phospho.tasks_df_chunks():
+            chunk_df.to_csv("tasks.csv", mode="a", header=False)
+        ```
+
+        :param limit: The maximum number of tasks to return. None to return all the tasks.
+        :param filters: Filters to apply to the tasks.
+        :param chunk_size: The maximum number of rows of each DataFrame.
+        """
+        global client
+        if client is None:
+            raise ValueError(
+                "Call phospho.init() before calling phospho.tasks_df_chunks()"
+            )
 
+        for flattened_tasks in client.tasks_flat_stream(
+            limit=limit,
+            with_events=with_events,
+            with_sessions=with_sessions,
+            with_removed_events=with_removed_events,
+            filters=filters,
+            chunk_size=chunk_size,
+        ):
+            yield _format_tasks_df(
+                pd.DataFrame(flattened_tasks),
+                with_events=with_events,
+                with_sessions=with_sessions,
+            )
+
+    def _format_tasks_df(
+        tasks_df: pd.DataFrame, with_events: bool, with_sessions: bool
+    ) -> pd.DataFrame:
         # Convert timestamps to datetime
         for col in [
             "task_created_at",
@@ -1252,6 +1421,18 @@ except ImportError:
             "phospho.tasks_df() requires the pandas library. Install it with `pip install pandas`."
         )
 
+    def tasks_df_chunks(
+        limit: Optional[int] = None,
+        with_events: bool = True,
+        with_sessions: bool = True,
+        with_removed_events: bool = False,
+        filters: Optional[models.ProjectDataFilters] = None,
+        chunk_size: int = 10_000,
+    ) -> None:
+        raise ImportError(
+            "phospho.tasks_df_chunks() requires the pandas library. Install it with `pip install pandas`."
+        )
+
     def push_tasks_df(tasks_df) -> None:
         raise ImportError(
             "phospho.push_tasks_df() requires the pandas library. Install it with `pip install pandas`."
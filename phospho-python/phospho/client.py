@@ -2,9 +2,12 @@
 phospho client to interact with the phospho API
 """
 
+import asyncio
+import gzip
+import json
 import logging
 import os
-from typing import Dict, List, Literal, Optional
+from typing import TYPE_CHECKING, Dict, Iterator, List, Literal, Optional, Tuple
 
 import requests
 
@@ -17,10 +20,18 @@ from phospho.models import (
 )
 from phospho.sessions import SessionCollection
 from phospho.tasks import TaskCollection, TaskEntity
+from phospho.utils import dumps_json
+
+if TYPE_CHECKING:
+    import httpx
 
 logger = logging.getLogger(__name__)
 
 
+Compression = Literal["gzip", "zstd"]
+Serialization = Literal["json", "msgpack"]
+
+
 class PhosphoServerSideError(Exception):
     pass
 
@@ -29,6 +40,51 @@ class PhosphoClientSideError(Exception):
     pass
 
 
+def encode_payload(
+    payload: Optional[Dict[str, object]],
+    compression: Optional[Compression] = None,
+    serialization: Serialization = "json",
+) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Serialize and compress a payload. Returns the body and the headers to send with it.
+
+    zstd compression requires the `zstandard` package, and msgpack serialization
+    requires the `msgpack` package.
+    """
+    headers: Dict[str, str] = {}
+    if serialization == "msgpack":
+        try:
+            import msgpack  # type: ignore
+        except ImportError:
+            raise ImportError(
+                "Please install the `msgpack` package to send logs serialized with msgpack."
+            )
+        body: bytes = msgpack.packb(payload, default=str)
+        headers["content-type"] = "application/msgpack"
+    elif serialization == "json":
+        body = dumps_json(payload)
+        headers["content-type"] = "application/json"
+    else:
+        raise ValueError(f"Unknown serialization: {serialization}")
+
+    if compression == "gzip":
+        body = gzip.compress(body, compresslevel=6)
+        headers["content-encoding"] = "gzip"
+    elif compression == "zstd":
+        try:
+            import zstandard  # type: ignore
+        except ImportError:
+            raise ImportError(
+                "Please install the `zstandard` package to send logs compressed with zstd."
+            )
+        body = zstandard.ZstdCompressor().compress(body)
+        headers["content-encoding"] = "zstd"
+    elif compression is not None:
+        raise ValueError(f"Unknown compression: {compression}")
+
+    return body, headers
+
+
 class Client:
     """Standard client for calls to the phospho backend"""
 
@@ -40,6 +96,8 @@ class Client:
     ) -> None:
         self.__api_key = api_key
         self.__project_id = project_id
+        self.__async_http_client: Optional["httpx.AsyncClient"] = None
+        self.__async_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
         # If no api_key is provided, verify that there is an environment variable
         if not api_key:
             self._api_key()
@@ -125,27 +183,85 @@ class Client:
             )
 
     def _post(
-        self, path: str, payload: Optional[Dict[str, object]] = None
+        self,
+        path: str,
+        payload: Optional[Dict[str, object]] = None,
+        compression: Optional[Compression] = None,
+        serialization: Serialization = "json",
     ) -> requests.Response:
         # Defaults to V2 API
         url = f"{self.base_url}/v2{path}"
-        response = requests.post(url, headers=self._headers(), json=payload)
+        body, encoding_headers = encode_payload(
+            payload, compression=compression, serialization=serialization
+        )
+        response = requests.post(
+            url, headers={**self._headers(), **encoding_headers}, data=body
+        )
+        self._check_post_response(url, response.status_code, response.text)
+        return response
 
-        if response.status_code >= 200 and response.status_code < 300:
-            return response
-        elif response.status_code >= 400 and response.status_code < 500:
+    def _check_post_response(self, url: str, status_code: int, text: str) -> None:
+        if status_code >= 200 and status_code < 300:
+            return
+        elif status_code >= 400 and status_code < 500:
             raise PhosphoClientSideError(
-                f"Error {response.status_code} POST {url} with API key {self._displayable_api_key()} : {response.text}."
+                f"Error {status_code} POST {url} with API key {self._displayable_api_key()} : {text}."
                 + "\nThere is likely an issue with your config. Make sure you have the correct API key and project id: https://platform.phospho.ai"
             )
-        elif response.status_code >= 500:
-            raise PhosphoServerSideError(
-                f"Error {response.status_code} POST {url}: {response.text}"
-            )
+        elif status_code >= 500:
+            raise PhosphoServerSideError(f"Error {status_code} POST {url}: {text}")
         else:
-            raise ValueError(
-                f"Uknown error {response.status_code} POST {url}: {response.text}"
+            raise ValueError(f"Uknown error {status_code} POST {url}: {text}")
+
+    def _async_http_client(self) -> "httpx.AsyncClient":
+        """
+        The pooled async HTTP client, created on first use. A new one is created
+        if the event loop changed.
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError(
+                "Please install the `httpx` package to send logs with asyncio: "
+                + "`pip install phospho[async]`"
             )
+        loop = asyncio.get_running_loop()
+        if (
+            self.__async_http_client is None
+            or self.__async_http_client_loop is not loop
+        ):
+            self.__async_http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+            self.__async_http_client_loop = loop
+        return self.__async_http_client
+
+    async def _apost(
+        self,
+        path: str,
+        payload: Optional[Dict[str, object]] = None,
+        compression: Optional[Compression] = None,
+        serialization: Serialization = "json",
+    ) -> "httpx.Response":
+        """Async version of _post, using a pooled connection"""
+        # Defaults to V2 API
+        url = f"{self.base_url}/v2{path}"
+        body, encoding_headers = encode_payload(
+            payload, compression=compression, serialization=serialization
+        )
+        response = await self._async_http_client().post(
+            url, headers={**self._headers(), **encoding_headers}, content=body
+        )
+        self._check_post_response(url, response.status_code, response.text)
+        return response
+
+    async def aclose(self) -> None:
+        """Close the pooled async HTTP client"""
+        if self.__async_http_client is not None:
+            await self.__async_http_client.aclose()
+            self.__async_http_client = None
+            self.__async_http_client_loop = None
 
     @property
     def sessions(self) -> SessionCollection:
@@ -215,6 +331,56 @@ class Client:
         )
         return response.json()
 
+    def tasks_flat_stream(
+        self,
+        limit: Optional[int] = None,
+        with_events: bool = True,
+        with_sessions: bool = True,
+        with_removed_events: bool = False,
+        filters: Optional[ProjectDataFilters] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator[List[dict]]:
+        """
+        Stream the tasks of a project in a flattened format, by chunks of chunk_size rows.
+
+        The rows are read from the response as they arrive, so only one chunk is held in
+        memory at a time. If limit is None, all the tasks of the project are exported.
+        """
+        if filters is None:
+            filters = ProjectDataFilters()
+        url = f"{self.base_url}/v2/projects/{self._project_id()}/tasks/flat/export"
+        body, encoding_headers = encode_payload(
+            {
+                "limit": limit,
+                "with_events": with_events,
+                "with_sessions": with_sessions,
+                "with_removed_events": with_removed_events,
+                "filters": filters.model_dump(),
+                "format": "ndjson",
+                "chunk_size": chunk_size,
+            }
+        )
+        with requests.post(
+            url,
+            headers={**self._headers(), **encoding_headers},
+            data=body,
+            stream=True,
+        ) as response:
+            # The body is only read on errors: reading it before iterating would load
+            # the whole export in memory
+            if response.status_code < 200 or response.status_code >= 300:
+                self._check_post_response(url, response.status_code, response.text)
+            chunk: List[dict] = []
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk.append(json.loads(line))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
     def update_tasks_flat(self, flattened_tasks: List[FlattenedTask]) -> None:
         """
         Update the tasks of a project using a flattened format.
@@ -1,35 +1,80 @@
+import asyncio
 import atexit
 import logging
 import os
 import time
 from threading import Thread
+from typing import Dict, List, Optional
 
-from .client import Client, PhosphoClientSideError
-from .log_queue import LogQueue
+from .client import Client, Compression, PhosphoClientSideError, Serialization
+from .log_queue import LogQueue, estimate_size
+from .spool import DiskSpool
 
 logger = logging.getLogger(__name__)
 
 
-class Consumer(Thread):
-    """Every tick, the consumer tries to send the accumulated logs to the backend."""
+def split_batch(
+    batch: List[Dict[str, object]],
+    max_batch_events: Optional[int] = None,
+    max_batch_bytes: Optional[int] = None,
+) -> List[List[Dict[str, object]]]:
+    """
+    Split a batch of log events into smaller batches of at most max_batch_events events
+    and max_batch_bytes (estimated, uncompressed) bytes. A single event bigger than
+    max_batch_bytes is sent alone.
+    """
+    chunks: List[List[Dict[str, object]]] = []
+    current_chunk: List[Dict[str, object]] = []
+    current_chunk_bytes = 0
+    for event in batch:
+        event_bytes = estimate_size(event) if max_batch_bytes is not None else 0
+        if current_chunk and (
+            (max_batch_events is not None and len(current_chunk) >= max_batch_events)
+            or (
+                max_batch_bytes is not None
+                and current_chunk_bytes + event_bytes > max_batch_bytes
+            )
+        ):
+            chunks.append(current_chunk)
+            current_chunk = []
+            current_chunk_bytes = 0
+        current_chunk.append(event)
+        current_chunk_bytes += event_bytes
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+class BaseConsumer:
+    """Logic shared by the consumers, independent of how the requests are sent."""
 
     def __init__(
         self,
         log_queue: LogQueue,
         client: Client,
-        tick: float = 0.5,  # How often to try to send logs
+        tick: float = 0.5,
         raise_error_on_fail_to_send: bool = False,
+        max_batch_events: Optional[int] = 256,
+        max_batch_bytes: Optional[int] = 4 * 1024 * 1024,
+        compression: Optional[Compression] = None,
+        serialization: Serialization = "json",
+        spool: Optional[DiskSpool] = None,
     ) -> None:
         self.running = True
         self.log_queue = log_queue
         self.client = client
         self.tick = tick
         self.raise_error_on_fail_to_send = raise_error_on_fail_to_send
+        # Big batches are split into several requests
+        self.max_batch_events = max_batch_events
+        self.max_batch_bytes = max_batch_bytes
+        # How the requests body is encoded
+        self.compression = compression
+        self.serialization = serialization
+        # If set, the events that couldn't be sent are stored on disk instead of in memory
+        self.spool = spool
         self.nb_consecutive_errors = 0
 
-        Thread.__init__(self, daemon=True)
-        atexit.register(self.stop)
-
     def get_wait_time(self) -> float:
         """
         Get the time to wait before sending the next batch of logs.
@@ -39,6 +84,103 @@ class Consumer(Thread):
             return self.tick
         return min(self.tick * (2 ** (self.nb_consecutive_errors - 1)), 60)
 
+    def _prepare_batch(
+        self, batch: List[Dict[str, object]]
+    ) -> Optional[List[Dict[str, object]]]:
+        """Returns the batch to send, or None if nothing should be sent."""
+        if len(batch) == 0:
+            return None
+
+        logger.debug(f"Sending {len(batch)} log events to {self.client.base_url}")
+
+        PHOSPHO_TEST_ID = os.getenv("PHOSPHO_TEST_ID")
+        PHOSPHO_TEST_METRIC = os.getenv("PHOSPHO_TEST_METRIC")
+        if PHOSPHO_TEST_ID is not None:
+            # Test mode: send logs only if we are in the right metric
+            if PHOSPHO_TEST_METRIC != "evaluate":
+                return None
+            # Add the test_id to the log events
+            for event in batch:
+                event["test_id"] = PHOSPHO_TEST_ID
+        return batch
+
+    def _split_batch(
+        self, batch: List[Dict[str, object]]
+    ) -> List[List[Dict[str, object]]]:
+        return split_batch(
+            batch,
+            max_batch_events=self.max_batch_events,
+            max_batch_bytes=self.max_batch_bytes,
+        )
+
+    def _handle_send_error(self, e: Exception) -> None:
+        """Raise the error if we shouldn't retry, otherwise increase the backoff."""
+        if isinstance(e, PhosphoClientSideError):
+            # If the error is a client-side error, we don't want to retry
+            raise e
+        if self.raise_error_on_fail_to_send:
+            raise e
+        # Retry with an exponential backoff
+        self.nb_consecutive_errors += 1
+        logger.warning(
+            f"Error sending phospho log events: {e}. Retrying in {self.get_wait_time()}s"
+        )
+
+    def _store_events_not_sent(self, events_not_sent: List[Dict[str, object]]) -> None:
+        # Put all the events not sent back into the spool or the log queue,
+        # so they are logged next tick
+        if self.spool is not None:
+            self.spool.write(events_not_sent)
+        else:
+            self.log_queue.add_batch(events_not_sent)
+
+    def _handle_spool_segment_result(
+        self,
+        segment: str,
+        batch: List[Dict[str, object]],
+        events_not_sent: Optional[List[Dict[str, object]]],
+    ) -> None:
+        assert self.spool is not None
+        if events_not_sent is None:
+            self.spool.commit(segment)
+        elif len(events_not_sent) == len(batch):
+            self.spool.release(segment)
+        else:
+            # Only keep the events not sent, to avoid sending the others twice
+            self.spool.write(events_not_sent)
+            self.spool.commit(segment)
+
+
+class Consumer(BaseConsumer, Thread):
+    """Every tick, the consumer tries to send the accumulated logs to the backend."""
+
+    def __init__(
+        self,
+        log_queue: LogQueue,
+        client: Client,
+        tick: float = 0.5,  # How often to try to send logs
+        raise_error_on_fail_to_send: bool = False,
+        max_batch_events: Optional[int] = 256,
+        max_batch_bytes: Optional[int] = 4 * 1024 * 1024,
+        compression: Optional[Compression] = None,
+        serialization: Serialization = "json",
+        spool: Optional[DiskSpool] = None,
+    ) -> None:
+        BaseConsumer.__init__(
+            self,
+            log_queue=log_queue,
+            client=client,
+            tick=tick,
+            raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+            max_batch_events=max_batch_events,
+            max_batch_bytes=max_batch_bytes,
+            compression=compression,
+            serialization=serialization,
+            spool=spool,
+        )
+        Thread.__init__(self, daemon=True)
+        atexit.register(self.stop)
+
     def run(self) -> None:
         while self.running:
             self.send_batch()
@@ -46,47 +188,268 @@ class Consumer(Thread):
 
         self.send_batch()
 
+    def _post_batch(self, batch: List[Dict[str, object]]) -> None:
+        self.client._post(
+            f"/log/{self.client._project_id()}",
+            {"batched_log_events": batch},
+            compression=self.compression,
+            serialization=self.serialization,
+        )
+
     def send_batch(self) -> None:
-        batch = self.log_queue.get_batch()
+        batch = self._prepare_batch(self.log_queue.get_batch())
+
+        if batch is not None:
+            events_not_sent = self._send_chunks(batch)
+            if events_not_sent is not None:
+                self._store_events_not_sent(events_not_sent)
+                return
 
-        if len(batch) > 0:
-            logger.debug(f"Sending {len(batch)} log events to {self.client.base_url}")
+        if self.spool is not None:
+            self.send_spool()
 
+    def _send_chunks(
+        self, batch: List[Dict[str, object]]
+    ) -> Optional[List[Dict[str, object]]]:
+        """
+        Send a batch of log events, split in several requests if needed.
+        Returns the events that couldn't be sent, or None if everything was sent.
+        """
+        chunks = self._split_batch(batch)
+        for i, chunk in enumerate(chunks):
             try:
-                PHOSPHO_TEST_ID = os.getenv("PHOSPHO_TEST_ID")
-                PHOSPHO_TEST_METRIC = os.getenv("PHOSPHO_TEST_METRIC")
-                if PHOSPHO_TEST_ID is None:
-                    # Normal behaviour : send logs to backend
-                    self.client._post(
-                        f"/log/{self.client._project_id()}",
-                        {"batched_log_events": batch},
-                    )
-                    self.nb_consecutive_errors = 0
-                elif PHOSPHO_TEST_ID is not None:
-                    # Test mode: send logs if we are in the right metric
-                    if PHOSPHO_TEST_METRIC == "evaluate":
-                        # Add the test_id to the log events
-                        for event in batch:
-                            event["test_id"] = PHOSPHO_TEST_ID
-                        self.client._post(
-                            f"/log/{self.client._project_id()}",
-                            {"batched_log_events": batch},
-                        )
-                        self.nb_consecutive_errors = 0
-            except PhosphoClientSideError as e:
-                # If the error is a client-side error, we don't want to retry
-                raise e
+                self._post_batch(chunk)
+                self.nb_consecutive_errors = 0
             except Exception as e:
-                if self.raise_error_on_fail_to_send:
-                    raise e
-                # Retry with an exponential backoff
-                self.nb_consecutive_errors += 1
-                logger.warning(
-                    f"Error sending phospho log events: {e}. Retrying in {self.get_wait_time()}s"
-                )
-                # Put all the events back into the log queue, so they are logged next tick
-                self.log_queue.add_batch(batch)
+                self._handle_send_error(e)
+                return [event for chunk in chunks[i:] for event in chunk]
+        return None
+
+    def send_spool(self) -> None:
+        """Send the oldest segment of the spool, if the spool is not empty."""
+        if self.spool is None:
+            return
+        claimed = self.spool.claim_segment()
+        if claimed is None:
+            return
+        segment, batch = claimed
+        logger.debug(f"Sending {len(batch)} spooled log events from {segment}")
+        try:
+            events_not_sent = self._send_chunks(batch)
+        except Exception as e:
+            self.spool.release(segment)
+            raise e
+        self._handle_spool_segment_result(segment, batch, events_not_sent)
 
     def stop(self):
         self.running = False
-        self.join()
+        if self.is_alive():
+            self.join()
+        if self.spool is not None:
+            self.spool.close()
+
+
+class AsyncConsumer(BaseConsumer):
+    """
+    Consumer running as an asyncio task in the event loop, instead of a thread.
+
+    Logs are sent as soon as `flush_threshold` events are ready, or at the latest
+    `max_delay` seconds after the first event was queued. Requests reuse a pooled
+    async HTTP connection (requires `httpx`).
+
+    Start it from a running event loop with `consumer.start()`.
+    """
+
+    def __init__(
+        self,
+        log_queue: LogQueue,
+        client: Client,
+        max_delay: float = 0.5,
+        flush_threshold: int = 64,
+        raise_error_on_fail_to_send: bool = False,
+        max_batch_events: Optional[int] = 256,
+        max_batch_bytes: Optional[int] = 4 * 1024 * 1024,
+        compression: Optional[Compression] = None,
+        serialization: Serialization = "json",
+        spool: Optional[DiskSpool] = None,
+    ) -> None:
+        super().__init__(
+            log_queue=log_queue,
+            client=client,
+            tick=max_delay,
+            raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+            max_batch_events=max_batch_events,
+            max_batch_bytes=max_batch_bytes,
+            compression=compression,
+            serialization=serialization,
+            spool=spool,
+        )
+        self.max_delay = max_delay
+        self.flush_threshold = flush_threshold
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task: Optional["asyncio.Task[None]"] = None
+        # Set when events are ready to be sent
+        self.events_ready: Optional[asyncio.Event] = None
+        # Set when enough events are ready to be sent without waiting for max_delay
+        self.threshold_reached: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        """Start the consumer in the running event loop."""
+        self.loop = asyncio.get_running_loop()
+        self.events_ready = asyncio.Event()
+        self.threshold_reached = asyncio.Event()
+        self.log_queue.ready_listeners.append(self._on_events_ready)
+        self.running = True
+        self.task = self.loop.create_task(self.run())
+        atexit.register(self.send_batch_sync)
+
+    def _on_events_ready(self, nb_ready_events: int) -> None:
+        """Called by the log queue, possibly from another thread"""
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._wake_up, nb_ready_events)
+        except RuntimeError:
+            # The loop is closed
+            pass
+
+    def _wake_up(self, nb_ready_events: int) -> None:
+        if self.events_ready is not None:
+            self.events_ready.set()
+        if self.threshold_reached is not None and (
+            nb_ready_events >= self.flush_threshold
+        ):
+            self.threshold_reached.set()
+
+    async def _wait_for_events(self) -> None:
+        """Wait until events are ready, then until the threshold or max_delay is reached."""
+        assert self.events_ready is not None and self.threshold_reached is not None
+        if self.spool is None or self.spool.is_empty():
+            await self.events_ready.wait()
+        try:
+            await asyncio.wait_for(
+                self.threshold_reached.wait(), timeout=self.max_delay
+            )
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self) -> None:
+        while self.running:
+            try:
+                await self._wait_for_events()
+                await self.send_batch()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error in phospho async consumer: {e}")
+            if self.log_queue.ready_ids and self.events_ready is not None:
+                # Some events were queued while sending
+                self.events_ready.set()
+            if self.nb_consecutive_errors > 0:
+                await asyncio.sleep(self.get_wait_time())
+
+    async def _post_batch(self, batch: List[Dict[str, object]]) -> None:
+        await self.client._apost(
+            f"/log/{self.client._project_id()}",
+            {"batched_log_events": batch},
+            compression=self.compression,
+            serialization=self.serialization,
+        )
+
+    async def send_batch(self) -> None:
+        if self.events_ready is not None:
+            self.events_ready.clear()
+        if self.threshold_reached is not None:
+            self.threshold_reached.clear()
+        batch = self._prepare_batch(self.log_queue.get_batch())
+
+        if batch is not None:
+            events_not_sent = await self._send_chunks(batch)
+            if events_not_sent is not None:
+                if self.spool is not None:
+                    await asyncio.to_thread(self.spool.write, events_not_sent)
+                else:
+                    self.log_queue.add_batch(events_not_sent)
+                return
+
+        if self.spool is not None:
+            await self.send_spool()
+
+    async def _send_chunks(
+        self, batch: List[Dict[str, object]]
+    ) -> Optional[List[Dict[str, object]]]:
+        """
+        Send a batch of log events, split in several requests if needed.
+        Returns the events that couldn't be sent, or None if everything was sent.
+        """
+        chunks = self._split_batch(batch)
+        for i, chunk in enumerate(chunks):
+            try:
+                await self._post_batch(chunk)
+                self.nb_consecutive_errors = 0
+            except Exception as e:
+                self._handle_send_error(e)
+                return [event for chunk in chunks[i:] for event in chunk]
+        return None
+
+    async def send_spool(self) -> None:
+        """Send the oldest segment of the spool, if the spool is not empty."""
+        if self.spool is None:
+            return
+        claimed = await asyncio.to_thread(self.spool.claim_segment)
+        if claimed is None:
+            return
+        segment, batch = claimed
+        logger.debug(f"Sending {len(batch)} spooled log events from {segment}")
+        try:
+            events_not_sent = await self._send_chunks(batch)
+        except Exception as e:
+            self.spool.release(segment)
+            raise e
+        await asyncio.to_thread(
+            self._handle_spool_segment_result, segment, batch, events_not_sent
+        )
+
+    async def flush(self) -> None:
+        """Send all the events ready to be sent now."""
+        await self.send_batch()
+
+    async def stop(self) -> None:
+        """Stop the consumer and send the remaining events."""
+        self.running = False
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.send_batch()
+        if self._on_events_ready in self.log_queue.ready_listeners:
+            self.log_queue.ready_listeners.remove(self._on_events_ready)
+        await self.client.aclose()
+        if self.spool is not None:
+            self.spool.close()
+
+    def send_batch_sync(self) -> None:
+        """
+        Send the events ready to be sent synchronously, without the event loop.
+        This is used at exit, when the event loop is usually closed.
+        """
+        batch = self._prepare_batch(self.log_queue.get_batch())
+        if batch is None:
+            return
+        chunks = self._split_batch(batch)
+        for i, chunk in enumerate(chunks):
+            try:
+                self.client._post(
+                    f"/log/{self.client._project_id()}",
+                    {"batched_log_events": chunk},
+                    compression=self.compression,
+                    serialization=self.serialization,
+                )
+            except Exception as e:
+                logger.warning(f"Error sending phospho log events: {e}")
+                if self.spool is not None:
+                    self.spool.write([event for chunk in chunks[i:] for event in chunk])
+                return
@@ -2,6 +2,13 @@ from . import job_library as job_library
 from . import utils as utils
 from .lab import Job, Workload
 from .language_models import get_async_client, get_provider_and_model, get_sync_client
+from .llm_cache import (
+    InMemoryLLMCache,
+    LLMCache,
+    MongoLLMCache,
+    SQLiteLLMCache,
+    set_llm_cache,
+)
 from .models import (
     EventConfig,
     EventDefinition,
@@ -11,3 +18,4 @@ from .models import (
     Project,
     ResultType,
 )
+from .scheduler import RateLimiter, set_rate_limit
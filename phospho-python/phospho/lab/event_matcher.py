@@ -0,0 +1,276 @@
+"""
+Matching of the keyword and regex events.
+
+The keywords and regexes of all the events of a workload are compiled once in an
+EventMatcher. The keywords of all the events are then looked for in a single scan of
+each text, instead of one regex search per event.
+"""
+
+import functools
+import logging
+import re
+from typing import Dict, List, Literal, Optional, Set, Tuple, Union
+
+from phospho.models import DetectionScope, JobResult, Message, ResultType, Task
+
+logger = logging.getLogger(__name__)
+
+# A keyword is matched if it's between two of these characters
+SEPARATORS = " ,.:'/\n\r\t+="
+# Or at the start of the text followed by one of these, or at the end preceded by one of these
+EDGE_SEPARATORS = " ,:'/.\n\r\t"
+REGEX_SPECIAL_CHARACTERS = set(".^$*+?{}[]\\|()")
+
+_WORD_REGEX = re.compile(f"[^{re.escape(SEPARATORS)}]+")
+
+# Maximum number of (message, scope) results kept by an EventMatcher
+MAX_CACHED_RESULTS = 10_000
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_pattern(pattern: str) -> "re.Pattern[str]":
+    """Compile a regex pattern. The compiled patterns are cached."""
+    return re.compile(pattern)
+
+
+def keywords_to_regex_pattern(keywords: str) -> str:
+    """
+    Regex pattern matching any of the comma separated keywords, as a separate word.
+    The text to search must be lowercased.
+    """
+    # [ ,.:'/\n\r\t+=]{1} is used to match the keyword only if it is a separate word, because we don't want to match substrings
+    keywordlist = [
+        "[ ,.:'/\n\r\t+=]{1}"
+        + keyword.strip().lower()  # we match the keyword in the middle of the text
+        + "[ ,.:'/\n\r\t+=]{1}|^"
+        + keyword.strip().lower()  # we match the keyword at the beginning of the text
+        + "[ ,:'/.\n\r\t]{1}"
+        + "|[ ,:'/.\n\r\t]{1}"
+        + keyword.strip().lower()  # we match the keyword at the end of the text
+        + "$"
+        for keyword in keywords.split(",")
+    ]
+    return "|".join(keywordlist)
+
+
+def get_texts_to_search(
+    message: Message, event_scope: DetectionScope
+) -> Union[List[str], JobResult]:
+    """
+    The texts of the message in which to look for an event, depending on the event_scope.
+    Returns an error JobResult if the texts can't be found.
+    """
+    if event_scope == "task":
+        return [message.latest_interaction()]
+    elif event_scope == "task_input_only":
+        message_list = message.as_list()
+        # Filter to keep only the user messages
+        return [" " + m.content + " " for m in message_list if m.role.lower() == "user"]
+    elif event_scope == "task_output_only":
+        message_list = message.as_list()
+        # Filter to keep only the assistant messages
+        return [
+            " " + m.content + " " for m in message_list if m.role.lower() == "assistant"
+        ]
+    elif event_scope == "session":
+        return [message.transcript(with_role=True, with_previous_messages=True)]
+    elif event_scope == "system_prompt":
+        message_task: Optional[Task] = message.metadata.get("task")
+        if not isinstance(message_task, Task):
+            return JobResult(
+                result_type=ResultType.error,
+                value=None,
+                logs=["No task in the message"],
+            )
+        if not isinstance(message_task.metadata, dict):
+            return JobResult(
+                result_type=ResultType.error,
+                value=None,
+                logs=["No metadata in the task"],
+            )
+        system_prompt_in_message = message_task.metadata.get("system_prompt", None)
+        if system_prompt_in_message is None:
+            return JobResult(
+                result_type=ResultType.error,
+                value=None,
+                logs=["No system_prompt in the task metadata"],
+            )
+        if not isinstance(system_prompt_in_message, str):
+            return JobResult(
+                result_type=ResultType.error,
+                value=None,
+                logs=["system_prompt in the message is not a string"],
+            )
+        return [system_prompt_in_message]
+    else:
+        raise ValueError(
+            f"Unknown event_scope : {event_scope}. Valid values are: {DetectionScope.__args__}"
+        )
+
+
+def _is_literal_keyword(keyword: str) -> bool:
+    """The keyword can be matched without a regex"""
+    return (
+        keyword != ""
+        and keyword[0] not in SEPARATORS
+        and keyword[-1] not in SEPARATORS
+        and not any(c in REGEX_SPECIAL_CHARACTERS for c in keyword)
+    )
+
+
+class KeywordSet:
+    """
+    Keywords of several events, matched as separate words like `keywords_to_regex_pattern`.
+
+    The literal keywords are indexed by their first word, so that all of them are looked
+    for in a single scan of the words of the text. The keywords with regex syntax are
+    matched with their compiled regex.
+    """
+
+    def __init__(self) -> None:
+        # first word of the keyword -> [(keyword, event id)]
+        self.keywords_by_first_word: Dict[str, List[Tuple[str, str]]] = {}
+        # event id -> compiled regex of its non literal keywords
+        self.regexes: Dict[str, "re.Pattern[str]"] = {}
+
+    def add(self, event_id: str, keywords: str) -> None:
+        """Add the comma separated keywords of an event. Raises re.error if a keyword is an invalid regex."""
+        non_literal_keywords = []
+        literal_keywords = []
+        for keyword in keywords.split(","):
+            keyword = keyword.strip().lower()
+            if _is_literal_keyword(keyword):
+                literal_keywords.append(keyword)
+            else:
+                non_literal_keywords.append(keyword)
+
+        if non_literal_keywords:
+            self.regexes[event_id] = compile_pattern(
+                keywords_to_regex_pattern(",".join(non_literal_keywords))
+            )
+        for keyword in literal_keywords:
+            first_word = _WORD_REGEX.match(keyword)
+            assert first_word is not None
+            self.keywords_by_first_word.setdefault(first_word.group(), []).append(
+                (keyword, event_id)
+            )
+
+    @staticmethod
+    def _is_separate_word(text: str, start: int, end: int) -> bool:
+        """Same conditions as the regex of keywords_to_regex_pattern"""
+        before = text[start - 1] if start > 0 else None
+        after = text[end] if end < len(text) else None
+        if before is not None and after is not None:
+            return before in SEPARATORS and after in SEPARATORS
+        if before is None and after is not None:
+            return after in EDGE_SEPARATORS
+        if before is not None and after is None:
+            return before in EDGE_SEPARATORS
+        return False
+
+    def search(self, text: str) -> Set[str]:
+        """The ids of the events with a keyword in the lowercased text"""
+        found: Set[str] = set()
+        if self.keywords_by_first_word:
+            for word in _WORD_REGEX.finditer(text):
+                candidates = self.keywords_by_first_word.get(word.group())
+                if candidates is None:
+                    continue
+                start = word.start()
+                for keyword, event_id in candidates:
+                    if event_id in found or not text.startswith(keyword, start):
+                        continue
+                    if self._is_separate_word(text, start, start + len(keyword)):
+                        found.add(event_id)
+        for event_id, regex in self.regexes.items():
+            if event_id not in found and regex.search(text) is not None:
+                found.add(event_id)
+        return found
+
+
+EventKind = Literal["keywords", "regex"]
+
+
+class EventMatcher:
+    """
+    The keyword and regex events of a workload, compiled once.
+
+    For a message and a detection scope, all the events are evaluated at once, and the
+    result is cached for the other events of the same message.
+    """
+
+    def __init__(self) -> None:
+        # event id -> (kind, pattern, scope) as compiled
+        self.events: Dict[str, Tuple[EventKind, str, DetectionScope]] = {}
+        self.keyword_sets: Dict[DetectionScope, KeywordSet] = {}
+        self.regexes: Dict[DetectionScope, Dict[str, "re.Pattern[str]"]] = {}
+        # (message id, scope, kind) -> (searched text, ids of the events found)
+        self._results: Dict[
+            Tuple[str, DetectionScope, EventKind],
+            Union[JobResult, Tuple[str, Set[str]]],
+        ] = {}
+
+    def add_keywords(
+        self, event_id: str, keywords: str, event_scope: DetectionScope = "task"
+    ) -> None:
+        try:
+            keyword_set = self.keyword_sets.setdefault(event_scope, KeywordSet())
+            keyword_set.add(event_id, keywords)
+        except re.error as e:
+            # The event is evaluated on its own, to report the error
+            logger.debug(f"Invalid keywords for event {event_id}: {e}")
+            return
+        self.events[event_id] = ("keywords", keywords, event_scope)
+
+    def add_regex(
+        self, event_id: str, regex_pattern: str, event_scope: DetectionScope = "task"
+    ) -> None:
+        try:
+            regex = compile_pattern(regex_pattern)
+        except re.error as e:
+            logger.debug(f"Invalid regex for event {event_id}: {e}")
+            return
+        self.regexes.setdefault(event_scope, {})[event_id] = regex
+        self.events[event_id] = ("regex", regex_pattern, event_scope)
+
+    def has_event(
+        self, event_id: str, kind: EventKind, pattern: str, event_scope: DetectionScope
+    ) -> bool:
+        """The event was compiled in the matcher with this pattern and scope"""
+        return self.events.get(event_id) == (kind, pattern, event_scope)
+
+    def clear_cache(self) -> None:
+        self._results = {}
+
+    def search(
+        self, message: Message, event_scope: DetectionScope, kind: EventKind
+    ) -> Union[JobResult, Tuple[str, Set[str]]]:
+        """
+        Evaluate all the events of this kind and scope on the message.
+        Returns the searched text and the ids of the events found, or an error JobResult.
+        """
+        key = (message.id, event_scope, kind)
+        result = self._results.get(key)
+        if result is not None:
+            return result
+
+        texts_to_search = get_texts_to_search(message, event_scope)
+        if isinstance(texts_to_search, JobResult):
+            result = texts_to_search
+        else:
+            text = " ".join(texts_to_search)
+            if kind == "keywords":
+                text = text.lower()
+                found = self.keyword_sets[event_scope].search(text)
+            else:
+                found = {
+                    event_id
+                    for event_id, regex in self.regexes[event_scope].items()
+                    if regex.search(text) is not None
+                }
+            result = (text, found)
+
+        if len(self._results) >= MAX_CACHED_RESULTS:
+            self.clear_cache()
+        self._results[key] = result
+        return result
@@ -8,9 +8,10 @@ import logging
 import math
 import os
 import random
+import re
 import time
 from collections import defaultdict
-from typing import List, Literal, Optional, Tuple, cast
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, cast
 
 from phospho.models import (
     DetectionScope,
@@ -29,7 +30,20 @@ except ImportError:
     pass
 
 
+from .event_matcher import (
+    EventKind,
+    EventMatcher,
+    compile_pattern,
+    get_texts_to_search,
+    keywords_to_regex_pattern,
+)
 from .language_models import get_async_client, get_provider_and_model, get_sync_client
+from .llm_cache import (
+    LLMCache,
+    create_chat_completion,
+    get_llm_cache,
+    make_llm_cache_key,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -151,6 +165,7 @@ async def event_detection(
     score_range_settings: Optional[ScoreRangeSettings] = None,
     detection_scope: DetectionScope = "task",
     model: str = "azure:gpt-4o",
+    llm_cache: Optional[LLMCache] = None,
     **kwargs,
 ) -> JobResult:
     """
@@ -413,7 +428,9 @@ If the event '{event_name}' is not present in the {the_interaction} or you can't
             # Despite the docs saying it does: https://learn.microsoft.com/en-us/azure/ai-services/openai/reference#request-body-2
             # Issue: https://learn.microsoft.com/en-us/answers/questions/1692045/does-gpt-4-1106-preview-support-logprobs
             try:
-                response = await async_openai_client.chat.completions.create(
+                response = await create_chat_completion(
+                    async_openai_client,
+                    llm_cache,
                     model=model_name,
                     messages=[
                         {
@@ -433,7 +450,9 @@ If the event '{event_name}' is not present in the {the_interaction} or you can't
                 # Fallback to OpenAI API
                 if model_name == "gpt-4o":
                     model_name = "gpt-4o-mini"
-                response = await async_openai_client.chat.completions.create(
+                response = await create_chat_completion(
+                    async_openai_client,
+                    llm_cache,
                     model=model_name,
                     messages=[
                         {
@@ -448,7 +467,9 @@ If the event '{event_name}' is not present in the {the_interaction} or you can't
                     top_logprobs=20,
                 )
         else:
-            response = await async_openai_client.chat.completions.create(
+            response = await create_chat_completion(
+                async_openai_client,
+                llm_cache,
                 model=model_name,
                 messages=[
                     {
@@ -717,6 +738,7 @@ If the event '{event_name}' is not present in the {the_interaction} or you can't
 async def evaluate_task(
     message: Message,
     model: str = "openai:gpt-4o",
+    llm_cache: Optional[LLMCache] = None,
     **kwargs,
 ) -> JobResult:
     """
@@ -748,7 +770,13 @@ async def evaluate_task(
     max_tokens_input_lenght = 128 * 1000 - 1000
 
     merged_examples = successful_evals + unsuccessful_evals
-    random.shuffle(merged_examples)
+    if llm_cache is not None or get_llm_cache() is not None:
+        # Shuffle the same examples in the same order, so that the prompt can be cached
+        random.Random(make_llm_cache_key(examples=merged_examples)).shuffle(
+            merged_examples
+        )
+    else:
+        random.shuffle(merged_examples)
 
     # Additional metadata
     api_call_time: Optional[float] = None
@@ -772,7 +800,9 @@ async def evaluate_task(
             return None
 
         start_time = time.time()
-        response = await async_openai_client.chat.completions.create(
+        response = await create_chat_completion(
+            async_openai_client,
+            llm_cache,
             model=model_name,
             messages=[
                 {
@@ -895,106 +925,62 @@ def get_nb_tokens(
     )
 
 
-async def keyword_event_detection(
+def _search_event(
     message: Message,
-    event_name: str,
-    keywords: str,
-    event_scope: DetectionScope = "task",
-    **kwargs,
+    kind: EventKind,
+    pattern: str,
+    event_scope: DetectionScope,
+    job: Optional[Any] = None,
+    workload: Optional[Any] = None,
 ) -> JobResult:
     """
-    Uses regexes to detect if an event is present in a message.
-    """
-    from re import search
+    Look for the keywords or the regex pattern in the texts of the message.
 
-    listExchangeToSearch: List[str] = []
-    if event_scope == "task":
-        listExchangeToSearch = [message.latest_interaction()]
-    elif event_scope == "task_input_only":
-        message_list = message.as_list()
-        # Filter to keep only the user messages
-        listExchangeToSearch = [
-            " " + m.content + " " for m in message_list if m.role.lower() == "user"
-        ]
-    elif event_scope == "task_output_only":
-        message_list = message.as_list()
-        # Filter to keep only the assistant messages
-        listExchangeToSearch = [
-            " " + m.content + " " for m in message_list if m.role.lower() == "assistant"
-        ]
-    elif event_scope == "session":
-        listExchangeToSearch = [
-            message.transcript(with_role=True, with_previous_messages=True)
-        ]
-    elif event_scope == "system_prompt":
-        message_task: Optional[Task] = message.metadata.get("task")
-        if not isinstance(message_task, Task):
-            return JobResult(
-                result_type=ResultType.error,
-                value=None,
-                logs=["No task in the message"],
-            )
-        if not isinstance(message_task.metadata, dict):
-            return JobResult(
-                result_type=ResultType.error,
-                value=None,
-                logs=["No metadata in the task"],
-            )
-        system_prompt_in_message = message_task.metadata.get("system_prompt", None)
-        if system_prompt_in_message is None:
-            return JobResult(
-                result_type=ResultType.error,
-                value=None,
-                logs=["No system_prompt in the task metadata"],
-            )
-        if not isinstance(system_prompt_in_message, str):
-            return JobResult(
-                result_type=ResultType.error,
-                value=None,
-                logs=["system_prompt in the message is not a string"],
-            )
-        listExchangeToSearch = [system_prompt_in_message]
+    If the job is part of a workload, the event is evaluated with the workload EventMatcher,
+    along with all the other keyword or regex events of the workload.
+    """
+    if kind == "keywords":
+        evaluation_source = "phospho-keywords"
+        regex_pattern = keywords_to_regex_pattern(pattern)
     else:
-        raise ValueError(
-            f"Unknown event_scope : {event_scope}. Valid values are: {DetectionScope.__args__}"
-        )
-
-    # text to look into for the keywords
-    text = " ".join(listExchangeToSearch).lower()
-
-    # [ ,.:'/\n\r\t+=]{1} is used to match the keyword only if it is a separate word, because we don't want to match substrings
-    keywordlist = [
-        "[ ,.:'/\n\r\t+=]{1}"
-        + keyword.strip().lower()  # we match the keyword in the middle of the text
-        + "[ ,.:'/\n\r\t+=]{1}|^"
-        + keyword.strip().lower()  # we match the keyword at the beginning of the text
-        + "[ ,:'/.\n\r\t]{1}"
-        + "|[ ,:'/.\n\r\t]{1}"
-        + keyword.strip().lower()  # we match the keyword at the end of the text
-        + "$"
-        for keyword in keywords.split(",")
-    ]
-
-    # we use a regex pattern to match the keywords in the text
-    regex_pattern = "|".join(keywordlist)
+        evaluation_source = "phospho-regex"
+        regex_pattern = pattern
 
     try:
-        result = search(regex_pattern, text)
-        found = result is not None
+        matcher: Optional[EventMatcher] = None
+        if job is not None and workload is not None:
+            matcher = workload.event_matcher
+        if matcher is not None and matcher.has_event(
+            job.id, kind, pattern, event_scope
+        ):
+            search_result = matcher.search(message, event_scope, kind)
+            if isinstance(search_result, JobResult):
+                # The cached result is shared by the events of the message
+                return search_result.model_copy()
+            text, found_event_ids = search_result
+            found = job.id in found_event_ids
+        else:
+            texts_to_search = get_texts_to_search(message, event_scope)
+            if isinstance(texts_to_search, JobResult):
+                return texts_to_search
+            text = " ".join(texts_to_search)
+            if kind == "keywords":
+                text = text.lower()
+            found = compile_pattern(regex_pattern).search(text) is not None
 
         return JobResult(
             result_type=ResultType.bool,
             value=found,
             logs=[text, regex_pattern],
             metadata={
-                "evaluation_source": "phospho-keywords",
+                "evaluation_source": evaluation_source,
                 "score_range": ScoreRange(
                     score_type="confidence", max=1, min=0, value=1 if found else 0
                 ),
             },
         )
 
-    except Exception as e:
+    except re.error as e:
         return JobResult(
             result_type=ResultType.error,
             value=None,
@@ -1002,92 +988,83 @@ async def keyword_event_detection(
         )
 
 
-async def regex_event_detection(
+async def keyword_event_detection(
     message: Message,
     event_name: str,
-    regex_pattern: str,
+    keywords: str,
     event_scope: DetectionScope = "task",
+    job: Optional[Any] = None,
+    workload: Optional[Any] = None,
     **kwargs,
 ) -> JobResult:
     """
     Uses regexes to detect if an event is present in a message.
     """
-    from re import search
+    return _search_event(
+        message, "keywords", keywords, event_scope, job=job, workload=workload
+    )
 
-    listExchangeToSearch: List[str] = []
-    if event_scope == "task":
-        listExchangeToSearch = [message.latest_interaction()]
 
-    elif event_scope == "task_input_only":
-        message_list = message.as_list()
-        # Filter to keep only the user messages
-        listExchangeToSearch = [
-            " " + m.content + " " for m in message_list if m.role.lower() == "user"
-        ]
-    elif event_scope == "task_output_only":
-        message_list = message.as_list()
-        # Filter to keep only the assistant messages
-        listExchangeToSearch = [
-            " " + m.content + " " for m in message_list if m.role.lower() == "assistant"
-        ]
-    elif event_scope == "session":
-        listExchangeToSearch = [
-            message.transcript(with_role=True, with_previous_messages=True)
-        ]
-    elif event_scope == "system_prompt":
-        message_task: Optional[Task] = message.metadata.get("task")
-        if not isinstance(message_task, Task):
-            return JobResult(
-                result_type=ResultType.error,
-                value=None,
-                logs=["No task in the message"],
-            )
-        if not isinstance(message_task.metadata, dict):
-            return JobResult(
-                result_type=ResultType.error,
-                value=None,
-                logs=["No metadata in the task"],
-            )
-        system_prompt_in_message = message_task.metadata.get("system_prompt", None)
-        if system_prompt_in_message is None:
-            return JobResult(
-                result_type=ResultType.error,
-                value=None,
-                logs=["No system_prompt in the task metadata"],
-            )
-        if not isinstance(system_prompt_in_message, str):
-            return JobResult(
-                result_type=ResultType.error,
-                value=None,
-                logs=["system_prompt in the message is not a string"],
-            )
-        listExchangeToSearch = [system_prompt_in_message]
-    else:
-        raise ValueError(
-            f"Unknown event_scope : {event_scope}. Valid values are: {DetectionScope.__args__}"
+async def batched_keyword_event_detection(
+    messages: List[Message],
+    event_name: str,
+    keywords: str,
+    event_scope: DetectionScope = "task",
+    job: Optional[Any] = None,
+    workload: Optional[Any] = None,
+    **kwargs,
+) -> List[JobResult]:
+    """
+    Batched version of keyword_event_detection.
+    """
+    return [
+        _search_event(
+            message, "keywords", keywords, event_scope, job=job, workload=workload
         )
+        for message in messages
+    ]
 
-    text = " ".join(listExchangeToSearch)
 
-    try:
-        result = search(regex_pattern, text)
-        found = result is not None
+async def regex_event_detection(
+    message: Message,
+    event_name: str,
+    regex_pattern: str,
+    event_scope: DetectionScope = "task",
+    job: Optional[Any] = None,
+    workload: Optional[Any] = None,
+    **kwargs,
+) -> JobResult:
+    """
+    Uses regexes to detect if an event is present in a message.
+    """
+    return _search_event(
+        message, "regex", regex_pattern, event_scope, job=job, workload=workload
+    )
 
-        return JobResult(
-            result_type=ResultType.bool,
-            value=found,
-            logs=[text, regex_pattern],
-            metadata={
-                "evaluation_source": "phospho-regex",
-                "score_range": ScoreRange(
-                    score_type="confidence", max=1, min=0, value=1 if found else 0
-                ),
-            },
-        )
 
-    except Exception as e:
-        return JobResult(
-            result_type=ResultType.error,
-            value=None,
-            logs=[str(e)],
+async def batched_regex_event_detection(
+    messages: List[Message],
+    event_name: str,
+    regex_pattern: str,
+    event_scope: DetectionScope = "task",
+    job: Optional[Any] = None,
+    workload: Optional[Any] = None,
+    **kwargs,
+) -> List[JobResult]:
+    """
+    Batched version of regex_event_detection.
+    """
+    return [
+        _search_event(
+            message, "regex", regex_pattern, event_scope, job=job, workload=workload
         )
+        for message in messages
+    ]
+
+
+# Batched versions of the jobs. A Job created with one of these job functions runs
+# the batched version on many messages at once.
+BATCHED_JOB_FUNCTIONS: Dict[Callable, Callable] = {
+    keyword_event_detection: batched_keyword_event_detection,
+    regex_event_detection: batched_regex_event_detection,
+}
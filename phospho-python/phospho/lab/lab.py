@@ -1,14 +1,17 @@
 import asyncio
 import concurrent.futures
+import copy
 import itertools
 import logging
 import random
 from typing import (
     Any,
+    AsyncIterator,
     Awaitable,
     Callable,
     Dict,
     Iterable,
+    Iterator,
     List,
     Literal,
     Optional,
@@ -34,6 +37,9 @@ from .models import (
     Recipe,
     ResultType,
 )
+from .event_matcher import EventMatcher
+from .llm_cache import LLMCache
+from .scheduler import iter_job_results, run_job
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -55,6 +61,17 @@ class Job:
     # Stores all the possible config from the model
     alternative_configs: List[JobConfig]
 
+    # Optional version of job_function that runs on a list of messages
+    batched_job_function: Optional[
+        Union[
+            Callable[..., List[JobResult]],
+            Callable[..., Awaitable[List[JobResult]]],
+        ]
+    ] = None
+    batch_size: int = 100
+    # Cache of the LLM calls of the job_function. If None, the cache of the process is used.
+    llm_cache: Optional[LLMCache] = None
+
     metadata: Optional[Dict[str, Any]] = None
     workload: Optional["Workload"] = None
     sample: float = 1
@@ -73,6 +90,14 @@ class Job:
         metadata: Optional[Dict[str, Any]] = None,
         workload: Optional["Workload"] = None,
         sample: float = 1.0,
+        batched_job_function: Optional[
+            Union[
+                Callable[..., List[JobResult]],
+                Callable[..., Awaitable[List[JobResult]]],
+            ]
+        ] = None,
+        batch_size: int = 100,
+        llm_cache: Optional[LLMCache] = None,
     ):
         """
         A job is a function that takes a message and a set of parameters and returns a result.
@@ -109,6 +134,12 @@ class Job:
         :param metadata: Extra metadata to store with the job.
         :param workload: The workload to which the job belongs. This is useful to access the results of other jobs.
         :param sample: The sample rate of the job. If the sample rate is 0.5, the job will run on 50% of the messages.
+        :param batched_job_function: Optional version of the job_function that takes a list of messages as first argument,
+        and returns a list of results in the same order. A Workload uses it to run the job on up to `batch_size` messages
+        at once. If not provided, the batched version of the job_library functions is used, if any.
+        :param batch_size: The maximum number of messages passed to the batched_job_function.
+        :param llm_cache: Cache of the LLM calls, passed to the job_function if it has an `llm_cache` parameter.
+        If not provided, the cache set with `lab.set_llm_cache` is used.
         :param recipe_id: The id of the recipe that created the job. This is useful to track the origin of the job.
         :param recipe_type: The type of the recipe that created the job.
         """
@@ -152,28 +183,38 @@ class Job:
         self.workload = workload
         self.sample = sample
 
-    async def async_run(self, message: Message) -> JobResult:
-        """
-        Asynchronously run the job on a single message.
-        """
-        logger.debug(f"Running job {self.id} on message {message.id}.")
+        if batched_job_function is None:
+            try:
+                batched_job_function = job_library.BATCHED_JOB_FUNCTIONS.get(
+                    job_function
+                )
+            except TypeError:
+                # Unhashable callable
+                pass
+        self.batched_job_function = batched_job_function
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+        self.batch_size = batch_size
+        self.llm_cache = llm_cache
+
+    def _job_params(self, job_function: Callable) -> Dict[str, Any]:
         params = self.config.model_dump()
 
         # if 'job' is in the job_function signature, we pass the self object
         # Don't override the job parameter if it's already in the params
-        if "job" in self.job_function.__code__.co_varnames and "job" not in params:
+        if "job" in job_function.__code__.co_varnames and "job" not in params:
             params["job"] = self
+        if "workload" in job_function.__code__.co_varnames and "workload" not in params:
+            params["workload"] = self.workload
         if (
-            "workload" in self.job_function.__code__.co_varnames
-            and "workload" not in params
+            self.llm_cache is not None
+            and "llm_cache" in job_function.__code__.co_varnames
+            and "llm_cache" not in params
         ):
-            params["workload"] = self.workload
-
-        if asyncio.iscoroutinefunction(self.job_function):
-            result = await self.job_function(message, **params)
-        else:
-            result = self.job_function(message, **params)
+            params["llm_cache"] = self.llm_cache
+        return params
 
+    def _store_result(self, message: Message, result: Optional[JobResult]) -> JobResult:
         if result is None:
             logger.error(f"Job {self.id} returned None for message {message.id}.")
             result = JobResult(
@@ -186,9 +227,49 @@ class Job:
         result.job_metadata = self.metadata
         # Store the result
         self.results[message.id] = result
-
         return result
 
+    async def async_run(self, message: Message) -> JobResult:
+        """
+        Asynchronously run the job on a single message.
+        """
+        logger.debug(f"Running job {self.id} on message {message.id}.")
+        params = self._job_params(self.job_function)
+
+        if asyncio.iscoroutinefunction(self.job_function):
+            result = await self.job_function(message, **params)
+        else:
+            result = self.job_function(message, **params)
+
+        return self._store_result(message, result)
+
+    async def async_run_batch(self, messages: List[Message]) -> List[JobResult]:
+        """
+        Asynchronously run the job on a list of messages, with the batched_job_function if
+        there is one. Otherwise, the job is run on every message.
+        """
+        if self.batched_job_function is None:
+            return [await self.async_run(message) for message in messages]
+
+        logger.debug(f"Running job {self.id} on a batch of {len(messages)} messages.")
+        params = self._job_params(self.batched_job_function)
+
+        if asyncio.iscoroutinefunction(self.batched_job_function):
+            results = await self.batched_job_function(messages, **params)
+        else:
+            results = self.batched_job_function(messages, **params)
+
+        if results is None or len(results) != len(messages):
+            logger.error(
+                f"Job {self.id} returned {'None' if results is None else len(results)} results for a batch of {len(messages)} messages."
+            )
+            results = [None] * len(messages)
+
+        return [
+            self._store_result(message, result)
+            for message, result in zip(messages, results)
+        ]
+
     async def async_run_on_alternative_configurations(
         self, message: Message
     ) -> List[Dict[str, JobResult]]:
@@ -317,6 +398,8 @@ class Workload:
     _results: Optional[Dict[str, Dict[str, JobResult]]]
 
     _valid_project_events: Optional[Dict[str, EventDefinition]] = None
+    # The keyword and regex events of the jobs, compiled once
+    _event_matcher: Optional[EventMatcher] = None
 
     project_id: Optional[str] = None
     org_id: Optional[str] = None
@@ -384,6 +467,28 @@ class Workload:
             job.metadata = job_metadata
 
         self.jobs[job.id] = job
+        # Compile the events again with the new job
+        self._event_matcher = None
+
+    @property
+    def event_matcher(self) -> EventMatcher:
+        """
+        The keyword and regex events of the jobs, compiled once. They are evaluated together,
+        in a single scan of the text of each message.
+        """
+        if self._event_matcher is None:
+            matcher = EventMatcher()
+            for job in self.jobs.values():
+                params = job.config.model_dump()
+                event_scope = params.get("event_scope", "task")
+                if job.job_function is job_library.keyword_event_detection:
+                    if isinstance(params.get("keywords"), str):
+                        matcher.add_keywords(job.id, params["keywords"], event_scope)
+                elif job.job_function is job_library.regex_event_detection:
+                    if isinstance(params.get("regex_pattern"), str):
+                        matcher.add_regex(job.id, params["regex_pattern"], event_scope)
+            self._event_matcher = matcher
+        return self._event_matcher
 
     @classmethod
     def from_config(cls, config: dict) -> "Workload":
@@ -584,88 +689,111 @@ class Workload:
         project_config = phospho_client.project_config()
         return cls.from_phospho_project_config(project_config)
 
-    async def async_run(
+    def _batches(
         self,
-        messages: Iterable[Message],
-        executor_type: Literal["parallel", "sequential", "parallel_jobs"] = "parallel",
-        max_parallelism: int = 10,
-    ) -> Dict[str, Dict[str, JobResult]]:
+        messages: List[Message],
+        executor_type: Literal["parallel", "sequential", "parallel_jobs"],
+    ) -> Iterator[Tuple[List[Message], Job]]:
         """
-        Runs all the jobs on the message.
+        The (messages, job) batches to run, after sampling. Jobs with a batched_job_function
+        are run on batches of up to batch_size messages, the others on one message at a time.
 
-        Args:
-        :param messages: The messages to run the jobs on.
-        :param executor_type: The type of executor to use. Can be "parallel" or "sequential".
-        :param max_parallelism: The maximum number of parallel jobs to run per seconds.
-            Use this to adhere to rate limits. Only used if executor_type is "parallel" or "parallel_jobs".
-
-        Returns: a mapping of message.id -> job_id -> job_result
+        With "parallel_jobs", the batched jobs are started first, then all the jobs of a message
+        are started before the next message. Otherwise, a job is started on all the messages
+        before the next job.
         """
 
-        # Run the jobs sequentially on every message
-        # TODO : For Jobs, implement a batched_run method that takes a list of messages
-        if executor_type == "parallel":
-            for job_id, job in self.jobs.items():
-                # Await all the results
-                semaphore = asyncio.Semaphore(max_parallelism)
-                # Create a progress bar
-                if hasattr(messages, "__len__"):
-                    t = tqdm(total=len(messages))
-                else:
-                    t = tqdm()
+        def is_sampled(job: Job) -> bool:
+            return job.sample >= 1 or random.random() < job.sample
 
-                async def job_limit_wrap(message: Message):
-                    # Account for the semaphore (rate limit, max_parallelism)
-                    async with semaphore:
-                        if job.sample >= 1 or random.random() < job.sample:
-                            await job.async_run(message)
-                        # Update the progress bar
-                        t.update()
+        def job_batches(job: Job) -> Iterator[Tuple[List[Message], Job]]:
+            sampled_messages = [message for message in messages if is_sampled(job)]
+            if job.batched_job_function is None:
+                for message in sampled_messages:
+                    yield [message], job
+            else:
+                for i in range(0, len(sampled_messages), job.batch_size):
+                    yield sampled_messages[i : i + job.batch_size], job
 
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    # Submit tasks to the executor
-                    executor_results = executor.map(job_limit_wrap, messages)
+        if executor_type != "parallel_jobs":
+            for job in self.jobs.values():
+                yield from job_batches(job)
+            return
 
-                t.display()
-                await asyncio.gather(*executor_results)
-                t.close()
-        elif executor_type == "parallel_jobs":
-            # Create a progress bar
-            if isinstance(messages, list):
-                t = tqdm(total=len(messages) * len(self.jobs))
+        other_jobs = []
+        for job in self.jobs.values():
+            if job.batched_job_function is not None:
+                yield from job_batches(job)
             else:
-                t = tqdm()
-
-            messages_and_jobs = itertools.product(messages, self.jobs.values())
-            semaphore = asyncio.Semaphore(max_parallelism)
+                other_jobs.append(job)
+        for message, job in itertools.product(messages, other_jobs):
+            if is_sampled(job):
+                yield [message], job
 
-            async def message_job_limit_wrap(message_and_job: Tuple[Message, Job]):
-                message, job = message_and_job
-                if job.sample >= 1 or random.random() < job.sample:
-                    await job.async_run(message)
-                # Update the progress bar
-                t.update()
+    async def async_iter_results(
+        self,
+        messages: Iterable[Message],
+        executor_type: Literal["parallel", "sequential", "parallel_jobs"] = "parallel",
+        max_parallelism: int = 10,
+    ) -> AsyncIterator[Tuple[str, str, JobResult]]:
+        """
+        Runs all the jobs on the messages, and yields the results as soon as they are available.
 
-            async with semaphore:
-                # Account for the semaphore (rate limit, max_parallelism)
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    # Submit tasks to the executor
-                    executor_results = executor.map(
-                        message_job_limit_wrap, messages_and_jobs
-                    )
+        Args:
+        :param messages: The messages to run the jobs on.
+        :param executor_type: The order in which the jobs are started. See `async_run`.
+        :param max_parallelism: The maximum number of jobs running at the same time.
 
-            t.display()
-            await asyncio.gather(*executor_results)
-            t.close()
-        elif executor_type == "sequential":
-            for job_id, job in self.jobs.items():
-                for one_message in tqdm(messages):
-                    if job.sample >= 1 or random.random() < job.sample:
-                        await job.async_run(one_message)
-        else:
+        Yields: (message.id, job_id, job_result)
+        """
+        if executor_type not in ["parallel", "sequential", "parallel_jobs"]:
             raise NotImplementedError(
                 f"Executor type {executor_type} is not implemented"
             )
+        messages = list(messages)
+        if executor_type == "sequential":
+            max_parallelism = 1
+        # The messages may have changed since the last run
+        self.event_matcher.clear_cache()
+
+        async for message, job, job_result in iter_job_results(
+            self._batches(messages, executor_type),
+            max_parallelism=max_parallelism,
+        ):
+            yield message.id, job.id, job_result
+
+    async def async_run(
+        self,
+        messages: Iterable[Message],
+        executor_type: Literal["parallel", "sequential", "parallel_jobs"] = "parallel",
+        max_parallelism: int = 10,
+    ) -> Dict[str, Dict[str, JobResult]]:
+        """
+        Runs all the jobs on the message.
+
+        All the (message, job) pairs share a single pool of at most `max_parallelism` concurrent
+        jobs. Jobs calling an LLM provider also respect the rate limits set with `lab.set_rate_limit`.
+        Jobs with a batched_job_function are run on batches of messages.
+
+        Args:
+        :param messages: The messages to run the jobs on.
+        :param executor_type: The type of executor to use.
+            - "parallel": a job is started on all the messages before the next job.
+            - "parallel_jobs": all the jobs are started on a message before the next message.
+            - "sequential": one job at a time. Use it if a job needs the results of the previous jobs.
+        :param max_parallelism: The maximum number of jobs running at the same time.
+            Only used if executor_type is "parallel" or "parallel_jobs".
+
+        Returns: a mapping of message.id -> job_id -> job_result
+        """
+        messages = list(messages)
+        t = tqdm(total=len(messages) * len(self.jobs))
+        async for _ in self.async_iter_results(
+            messages, executor_type=executor_type, max_parallelism=max_parallelism
+        ):
+            # Update the progress bar
+            t.update()
+        t.close()
 
         # Collect the results:
         # Result is a mapping of message.id -> job_id -> job_result
@@ -731,6 +859,9 @@ class Workload:
         Returns: a mapping of message.id -> job_id -> job_result
         """
 
+        # The messages may have changed since the last run
+        self.event_matcher.clear_cache()
+
         # Run the jobs sequentially on every message
         # TODO : For Jobs, implement a batched_run method that takes a list of messages
         if executor_type == "parallel":
@@ -744,7 +875,7 @@ class Workload:
                 def job_limit_wrap(message: Message):
                     # Account for the semaphore (rate limit, max_parallelism)
                     if job.sample >= 1 or random.random() < job.sample:
-                        asyncio.run(job.async_run(message))
+                        asyncio.run(run_job(message, job))
                     # Update the progress bar
                     t.update()
 
@@ -768,7 +899,7 @@ class Workload:
             def message_job_limit_wrap(message_and_job: Tuple[Message, Job]):
                 message, job = message_and_job
                 if job.sample >= 1 or random.random() < job.sample:
-                    asyncio.run(job.async_run(message))
+                    asyncio.run(run_job(message, job))
                 # Update the progress bar
                 t.update()
 
@@ -785,7 +916,7 @@ class Workload:
             for job_id, job in self.jobs.items():
                 for one_message in tqdm(messages):
                     if job.sample >= 1 or random.random() < job.sample:
-                        asyncio.run(job.async_run(one_message))
+                        asyncio.run(run_job(one_message, job))
         else:
             raise NotImplementedError(
                 f"Executor type {executor_type} is not implemented"
@@ -804,6 +935,26 @@ class Workload:
         self._results = results
         return results
 
+    def copy(self) -> "Workload":
+        """
+        A new workload with the same jobs, without their results.
+
+        The keyword and regex events are compiled once and shared with the copy. Use it to
+        run the same workload several times concurrently, since the jobs store their results.
+        """
+        workload = Workload()
+        for job_id, job in self.jobs.items():
+            job_copy = copy.copy(job)
+            job_copy.results = {}
+            job_copy.alternative_configs = list(job.alternative_configs)
+            job_copy.alternative_results = [{} for _ in job.alternative_configs]
+            job_copy.workload = workload
+            workload.jobs[job_id] = job_copy
+        workload._event_matcher = self.event_matcher
+        workload.project_id = self.project_id
+        workload.org_id = self.org_id
+        return workload
+
     def optimize_jobs(
         self, accuracy_threshold: float = 1.0, min_count: int = 10
     ) -> None:
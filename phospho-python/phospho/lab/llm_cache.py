@@ -0,0 +1,241 @@
+"""
+Content-addressed cache of the LLM calls of the jobs.
+
+The key of a call is a hash of the request: endpoint, model, messages and parameters.
+The same request (eg when re-running a recipe on the same tasks) is then answered from the
+cache instead of calling the LLM again.
+
+```python
+from phospho import lab
+
+# For all the jobs of the process
+lab.set_llm_cache(lab.InMemoryLLMCache(max_size=10_000, ttl=24 * 3600))
+# Or for a single job
+job = lab.Job(name="event_detection", llm_cache=lab.SQLiteLLMCache("llm_cache.db"))
+```
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def make_llm_cache_key(**request: Any) -> str:
+    """Hash of the request, independent of the order of the parameters"""
+    serialized = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Base class of the LLM caches. Subclasses implement `_get` and `_set`.
+
+    :param ttl: number of seconds after which a cached response expires. If None, the
+        responses never expire.
+    """
+
+    def __init__(self, ttl: Optional[float] = None) -> None:
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def _set(self, key: str, value: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = await self._get(key)
+        except Exception as e:
+            # A cache failure must not fail the job
+            logger.warning(f"Error reading the LLM cache: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        try:
+            await self._set(key, value)
+        except Exception as e:
+            logger.warning(f"Error writing to the LLM cache: {e}")
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of the lookups answered by the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def _expires_at(self) -> Optional[float]:
+        return time.time() + self.ttl if self.ttl is not None else None
+
+
+class InMemoryLLMCache(LLMCache):
+    """LRU cache of the LLM responses, in memory"""
+
+    def __init__(self, max_size: int = 10_000, ttl: Optional[float] = None) -> None:
+        super().__init__(ttl=ttl)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # key -> (expires_at, value)
+        self.values: "OrderedDict[str, Tuple[Optional[float], Dict[str, Any]]]" = (
+            OrderedDict()
+        )
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            item = self.values.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.time():
+                del self.values[key]
+                return None
+            self.values.move_to_end(key)
+            return value
+
+    async def _set(self, key: str, value: Dict[str, Any]) -> None:
+        with self.lock:
+            self.values[key] = (self._expires_at(), value)
+            self.values.move_to_end(key)
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+
+
+class SQLiteLLMCache(LLMCache):
+    """Cache of the LLM responses in a SQLite database, shared by the processes of a machine"""
+
+    def __init__(self, path: str, ttl: Optional[float] = None) -> None:
+        super().__init__(ttl=ttl)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def _get_sync(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < time.time():
+                with self.connection:
+                    self.connection.execute(
+                        "DELETE FROM llm_cache WHERE key = ?", (key,)
+                    )
+                return None
+        return json.loads(value)
+
+    def _set_sync(self, key: str, value: Dict[str, Any]) -> None:
+        serialized = json.dumps(value, default=str)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, serialized, self._expires_at()),
+            )
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def _set(self, key: str, value: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._set_sync, key, value)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class MongoLLMCache(LLMCache):
+    """
+    Cache of the LLM responses in a MongoDB collection, shared by all the workers.
+
+    :param collection: an async (motor) collection. The expired documents are removed by
+        Mongo if the collection has a TTL index: `create_index("expires_at", expireAfterSeconds=0)`
+    """
+
+    def __init__(self, collection: Any, ttl: Optional[float] = None) -> None:
+        super().__init__(ttl=ttl)
+        self.collection = collection
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        document = await self.collection.find_one({"_id": key})
+        if document is None:
+            return None
+        expires_at = document.get("expires_at")
+        if expires_at is not None and expires_at < datetime.datetime.now(
+            datetime.timezone.utc
+        ).replace(tzinfo=None):
+            # Mongo removes the expired documents in the background
+            return None
+        return document["value"]
+
+    async def _set(self, key: str, value: Dict[str, Any]) -> None:
+        expires_at = self._expires_at()
+        document: Dict[str, Any] = {"value": value}
+        if expires_at is not None:
+            document["expires_at"] = datetime.datetime.fromtimestamp(
+                expires_at, datetime.timezone.utc
+            ).replace(tzinfo=None)
+        await self.collection.replace_one({"_id": key}, document, upsert=True)
+
+
+# Cache used by the jobs that don't have their own
+_default_llm_cache: Optional[LLMCache] = None
+
+
+def set_llm_cache(llm_cache: Optional[LLMCache]) -> None:
+    """Set the LLM cache of all the jobs of the process. None disables it."""
+    global _default_llm_cache
+    _default_llm_cache = llm_cache
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    return _default_llm_cache
+
+
+async def create_chat_completion(
+    async_client: Any, llm_cache: Optional[LLMCache] = None, **kwargs: Any
+) -> Any:
+    """
+    Call `async_client.chat.completions.create(**kwargs)`, or return the cached response
+    of the same request. If llm_cache is None, the cache of the process is used, if any.
+    """
+    if llm_cache is None:
+        llm_cache = _default_llm_cache
+    if llm_cache is None:
+        return await async_client.chat.completions.create(**kwargs)
+
+    from openai.types.chat import ChatCompletion
+
+    # The same model name can be served by different providers
+    key = make_llm_cache_key(
+        base_url=str(getattr(async_client, "base_url", "")), **kwargs
+    )
+    cached_response = await llm_cache.get(key)
+    if cached_response is not None:
+        try:
+            return ChatCompletion.model_validate(cached_response)
+        except Exception as e:
+            logger.warning(f"Invalid cached LLM response: {e}")
+
+    response = await async_client.chat.completions.create(**kwargs)
+    await llm_cache.set(key, response.model_dump(mode="json"))
+    return response
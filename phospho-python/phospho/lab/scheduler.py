@@ -0,0 +1,244 @@
+"""
+Scheduling of the jobs of a Workload: a bounded pool of concurrent (messages, job) runs,
+with per provider rate limits.
+
+The rate limits are shared by all the workloads of the process. Set them once, eg at startup:
+
+```python
+from phospho import lab
+
+lab.set_rate_limit("openai", requests_per_minute=5000, tokens_per_minute=800_000)
+```
+"""
+
+import asyncio
+import inspect
+import logging
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .language_models import get_provider_and_model
+from .models import JobResult, Message
+
+if TYPE_CHECKING:
+    from .lab import Job
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the number of requests and of tokens per minute.
+
+    Callers reserve capacity in the bucket, and then wait until the reservation is
+    covered. This is thread safe and independent of the event loop, so the same limiter
+    can be shared by workloads running in different threads.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.lock = threading.Lock()
+        # The buckets start full, and can go negative when capacity is reserved
+        self.available_requests = requests_per_minute or 0.0
+        self.available_tokens = tokens_per_minute or 0.0
+        self.last_refill = time.monotonic()
+
+    def _refill(self) -> None:
+        """The lock must be held"""
+        now = time.monotonic()
+        elapsed_minutes = (now - self.last_refill) / 60
+        self.last_refill = now
+        if self.requests_per_minute is not None:
+            self.available_requests = min(
+                self.requests_per_minute,
+                self.available_requests + elapsed_minutes * self.requests_per_minute,
+            )
+        if self.tokens_per_minute is not None:
+            self.available_tokens = min(
+                self.tokens_per_minute,
+                self.available_tokens + elapsed_minutes * self.tokens_per_minute,
+            )
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Reserve one request and `tokens` tokens. Returns the number of seconds to wait
+        before sending the request.
+        """
+        with self.lock:
+            self._refill()
+            wait_time = 0.0
+            if self.requests_per_minute is not None:
+                self.available_requests -= 1
+                if self.available_requests < 0:
+                    wait_time = max(
+                        wait_time,
+                        -self.available_requests * 60 / self.requests_per_minute,
+                    )
+            if self.tokens_per_minute is not None and tokens > 0:
+                # A request bigger than the bucket would never be sent otherwise
+                self.available_tokens -= min(tokens, self.tokens_per_minute)
+                if self.available_tokens < 0:
+                    wait_time = max(
+                        wait_time, -self.available_tokens * 60 / self.tokens_per_minute
+                    )
+            return wait_time
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Wait until a request of `tokens` tokens can be sent"""
+        wait_time = self.reserve(tokens)
+        if wait_time > 0:
+            logger.debug(f"Rate limit reached, waiting {wait_time:.2f}s")
+            await asyncio.sleep(wait_time)
+
+
+# provider -> RateLimiter
+RATE_LIMITERS: Dict[str, RateLimiter] = {}
+
+
+def set_rate_limit(
+    provider: str,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+) -> None:
+    """
+    Limit the rate of the jobs calling the LLM provider (eg "openai", "azure", "mistral").
+    The limits apply to all the workloads of the process.
+
+    If both limits are None, the rate limit of the provider is removed.
+    """
+    if requests_per_minute is None and tokens_per_minute is None:
+        RATE_LIMITERS.pop(provider, None)
+        return
+    RATE_LIMITERS[provider] = RateLimiter(
+        requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute
+    )
+
+
+def get_job_provider(job: "Job") -> Optional[str]:
+    """
+    The LLM provider called by the job, from the `model` of its config or the default
+    `model` of its job_function. None if the job doesn't call an LLM.
+    """
+    model = getattr(job.config, "model", None)
+    if model is None:
+        try:
+            parameter = inspect.signature(job.job_function).parameters.get("model")
+        except (TypeError, ValueError):
+            parameter = None
+        if parameter is not None and isinstance(parameter.default, str):
+            model = parameter.default
+    if not isinstance(model, str):
+        return None
+    try:
+        provider, _ = get_provider_and_model(model)
+    except ValueError:
+        return None
+    return provider
+
+
+def estimate_nb_tokens(message: Message) -> int:
+    """Number of tokens of the message and of its previous messages"""
+    from phospho.utils import get_number_of_tokens
+
+    try:
+        return get_number_of_tokens(message.transcript(with_previous_messages=True))
+    except Exception as e:
+        logger.debug(f"Couldn't count the tokens of message {message.id}: {e}")
+        return 0
+
+
+async def _acquire_rate_limit(messages: List[Message], job: "Job") -> None:
+    """Wait for the rate limit of the job provider, for one request on the messages"""
+    if not RATE_LIMITERS:
+        return
+    provider = get_job_provider(job)
+    rate_limiter = RATE_LIMITERS.get(provider) if provider is not None else None
+    if rate_limiter is None:
+        return
+    tokens = 0
+    if rate_limiter.tokens_per_minute is not None:
+        tokens = sum(estimate_nb_tokens(message) for message in messages)
+    await rate_limiter.acquire(tokens)
+
+
+async def run_job(message: Message, job: "Job") -> JobResult:
+    """Run a job on a message, once the rate limit of its provider allows it"""
+    await _acquire_rate_limit([message], job)
+    return await job.async_run(message)
+
+
+async def run_job_batch(messages: List[Message], job: "Job") -> List[JobResult]:
+    """
+    Run a job on a list of messages, with its batched_job_function if it has one.
+    A batch counts as a single request for the rate limit.
+    """
+    if job.batched_job_function is None:
+        return [await run_job(message, job) for message in messages]
+    await _acquire_rate_limit(messages, job)
+    return await job.async_run_batch(messages)
+
+
+_DONE = object()
+
+
+async def iter_job_results(
+    batches: Iterable[Tuple[List[Message], "Job"]],
+    max_parallelism: int = 10,
+) -> AsyncIterator[Tuple[Message, "Job", JobResult]]:
+    """
+    Run the jobs on the batches of messages, with at most `max_parallelism` batches running
+    at the same time. The (message, job, result) are yielded as soon as they complete.
+
+    The batches are consumed lazily. If a job raises, the other jobs are cancelled and
+    the exception is raised.
+    """
+    if max_parallelism < 1:
+        raise ValueError(f"max_parallelism must be at least 1, got {max_parallelism}")
+
+    batches_iterator = iter(batches)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def worker() -> None:
+        # The workers share the same iterator: a worker picks the next batch when it's free
+        for messages, job in batches_iterator:
+            job_results = await run_job_batch(messages, job)
+            for message, result in zip(messages, job_results):
+                results.put_nowait((message, job, result))
+
+    async def run_workers() -> None:
+        workers = [asyncio.ensure_future(worker()) for _ in range(max_parallelism)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker_task in workers:
+                worker_task.cancel()
+            raise
+        finally:
+            results.put_nowait(_DONE)
+
+    runner = asyncio.ensure_future(run_workers())
+    try:
+        while True:
+            item = await results.get()
+            if item is _DONE:
+                break
+            yield item
+        # Raise the exception of a failed job, if any
+        await runner
+    finally:
+        if not runner.done():
+            runner.cancel()
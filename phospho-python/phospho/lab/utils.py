@@ -30,13 +30,11 @@ def get_literal_values(model_class: type) -> dict:
 try:
     import tiktoken
 
+    from phospho.utils import count_tokens, get_encoding
+
     def get_tokenizer(model: Optional[str]) -> tiktoken.Encoding:
-        if model is None:
-            return tiktoken.get_encoding("cl100k_base")
-        try:
-            return tiktoken.encoding_for_model(model)
-        except KeyError:
-            return tiktoken.get_encoding("cl100k_base")
+        # The encodings are cached, so this is cheap to call for every log event
+        return get_encoding(model)
 
     def num_tokens_from_messages(
         messages: List[dict],
@@ -86,12 +84,15 @@ try:
             tokens_per_message = 3
             tokens_per_name = 1
         num_tokens = 0
+        values = []
         for message in messages:
             num_tokens += tokens_per_message
             for key, value in message.items():
-                num_tokens += len(tokenizer.encode(value))
+                values.append(value)
                 if key == "name":
                     num_tokens += tokens_per_name
+        # Encode all the values in one batch
+        num_tokens += sum(count_tokens(values, encoding=tokenizer))
         num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
         return num_tokens
 
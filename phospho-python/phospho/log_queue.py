@@ -1,9 +1,23 @@
+import json
+import logging
+import os
+import tempfile
 import threading
-from typing import Dict, List
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Literal, Optional
 
 import pydantic
 
-from .utils import generate_uuid
+from .spool import DiskSpool
+from .utils import dumps_json, generate_uuid
+
+logger = logging.getLogger(__name__)
+
+OverflowPolicy = Literal["block", "drop_oldest", "drop_newest", "spill_to_disk"]
+
+# Number of spilled events read back from disk at once
+SPILL_READ_CHUNK_SIZE = 256
 
 
 class Event(pydantic.BaseModel, extra="allow"):
@@ -12,21 +26,293 @@ class Event(pydantic.BaseModel, extra="allow"):
     to_log: bool = True
 
 
+def estimate_size(content: object) -> int:
+    """
+    Cheap estimate of the size in bytes of a loggable content, once serialized.
+
+    This avoids a full json.dumps on the hot path: only the length of strings
+    is counted, plus a small overhead per container item.
+    """
+    if content is None or isinstance(content, bool):
+        return 4
+    if isinstance(content, str):
+        return len(content) + 2
+    if isinstance(content, (int, float)):
+        return 8
+    if isinstance(content, dict):
+        return 2 + sum(
+            len(str(key)) + 4 + estimate_size(value) for key, value in content.items()
+        )
+    if isinstance(content, (list, tuple)):
+        return 2 + sum(estimate_size(value) + 1 for value in content)
+    return len(str(content))
+
+
+class _DiskOverflow:
+    """Events evicted from a full LogQueue, written as json lines to a file on disk.
+
+    Events are read back in order, oldest first, when the queue has room again.
+    """
+
+    def __init__(self, spill_dir: Optional[str] = None) -> None:
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(
+            prefix="phospho_spill_", suffix=".jsonl", dir=spill_dir
+        )
+        os.close(fd)
+        self.read_offset = 0
+        self.nb_events = 0
+
+    def write(self, events_content: List[Dict[str, object]]) -> None:
+        with open(self.path, "ab") as f:
+            for content in events_content:
+                f.write(dumps_json(content) + b"\n")
+        self.nb_events += len(events_content)
+
+    def read(
+        self, max_events: int, max_bytes: Optional[int] = None
+    ) -> List[Dict[str, object]]:
+        """Read up to max_events events. If max_bytes is set, stop before the event
+        that would make their estimated size exceed it: it stays on disk."""
+        if self.nb_events == 0 or max_events <= 0:
+            return []
+        events_content: List[Dict[str, object]] = []
+        nb_bytes = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            f.seek(self.read_offset)
+            while len(events_content) < max_events:
+                line = f.readline()
+                if not line:
+                    break
+                content = json.loads(line)
+                if max_bytes is not None:
+                    nb_bytes += estimate_size(content)
+                    if nb_bytes > max_bytes:
+                        break
+                events_content.append(content)
+                self.read_offset = f.tell()
+        self.nb_events -= len(events_content)
+        if self.nb_events == 0:
+            # Everything was read back: truncate the file
+            open(self.path, "w").close()
+            self.read_offset = 0
+        return events_content
+
+    def close(self) -> None:
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
 class LogQueue:
-    """Queue logs here to group them in batchs"""
+    """Queue logs here to group them in batchs
+
+    By default, the queue is unbounded. Set `max_events` and/or `max_bytes` to bound it.
+    When the queue is full, the `overflow_policy` decides what happens to new events:
+
+    - "block": `append` waits up to `block_timeout` seconds for the consumer to make room,
+        then drops the new event.
+    - "drop_oldest": the oldest events are dropped to make room for the new one.
+    - "drop_newest": the new event is dropped.
+    - "spill_to_disk": the oldest events are written to a file in `spill_dir` (a temporary
+        directory by default) and put back in the queue when there is room again. If a
+        `spool` is passed, they are written to the spool instead, and sent from there.
+    """
+
+    def __init__(
+        self,
+        max_events: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        overflow_policy: OverflowPolicy = "drop_oldest",
+        block_timeout: float = 1.0,
+        spill_dir: Optional[str] = None,
+        spool: Optional[DiskSpool] = None,
+    ) -> None:
+        if overflow_policy not in (
+            "block",
+            "drop_oldest",
+            "drop_newest",
+            "spill_to_disk",
+        ):
+            raise ValueError(f"Unknown overflow_policy: {overflow_policy}")
 
-    def __init__(self) -> None:
         self.lock = threading.Lock()
+        # Notified every time room is made in the queue
+        self.not_full = threading.Condition(self.lock)
         # The queue itself is a dictionary. Each event has a unique id.
-        self.events: Dict[str, Event] = {}
+        # Insertion order is kept, so the first events are the oldest.
+        self.events: Dict[str, Event] = OrderedDict()
+        # Ids of the events marked as to_log, in the order they should be sent
+        self.ready_ids: Dict[str, None] = OrderedDict()
+        self.sizes: Dict[str, int] = {}
+        self.nb_bytes = 0
+        self.nb_dropped_events = 0
+
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir
+        self.spool = spool
+        self.disk_overflow: Optional[_DiskOverflow] = None
+        # Called with the number of events ready to be sent, every time an event is ready.
+        # Listeners are called with the lock held, so they must be fast.
+        self.ready_listeners: List[Callable[[int], None]] = []
+
+    @property
+    def is_bounded(self) -> bool:
+        return self.max_events is not None or self.max_bytes is not None
+
+    def __len__(self) -> int:
+        nb_spilled = self.disk_overflow.nb_events if self.disk_overflow else 0
+        return len(self.events) + nb_spilled
+
+    def _event_size(self, event: Event) -> int:
+        """The size is only estimated if the queue is bounded in bytes, as it's costly"""
+        if self.max_bytes is None:
+            return 0
+        return estimate_size(event.content)
+
+    def _has_room(self, size: int) -> bool:
+        if self.max_events is not None and len(self.events) >= self.max_events:
+            return False
+        if self.max_bytes is not None and self.nb_bytes + size > self.max_bytes:
+            # Always accept at least one event, even if it's bigger than max_bytes
+            return len(self.events) == 0
+        return True
+
+    def _insert(self, event: Event, size: Optional[int] = None) -> None:
+        """Insert or replace an event. The lock must be held."""
+        if event.id in self.events:
+            self._remove(event.id)
+        if size is None:
+            size = self._event_size(event)
+        self.events[event.id] = event
+        self.sizes[event.id] = size
+        self.nb_bytes += size
+        if event.to_log:
+            self.ready_ids[event.id] = None
+            self._notify_ready()
+
+    def _notify_ready(self) -> None:
+        """The lock must be held"""
+        for listener in self.ready_listeners:
+            listener(len(self.ready_ids))
+
+    def _remove(self, event_id: str) -> Optional[Event]:
+        """Remove an event from the queue. The lock must be held."""
+        event = self.events.pop(event_id, None)
+        if event is None:
+            return None
+        self.nb_bytes -= self.sizes.pop(event_id, 0)
+        self.ready_ids.pop(event_id, None)
+        return event
+
+    def _evict_oldest(self) -> bool:
+        """Make room by evicting the oldest event, preferably one ready to be sent.
+        The lock must be held. Returns False if there is nothing to evict."""
+        if self.ready_ids:
+            event_id = next(iter(self.ready_ids))
+        elif self.events:
+            event_id = next(iter(self.events))
+        else:
+            return False
+        event = self._remove(event_id)
+        if event is None:
+            return False
+        if self.overflow_policy == "spill_to_disk" and event.to_log:
+            if self.spool is not None:
+                self.spool.write([event.content])
+            else:
+                if self.disk_overflow is None:
+                    self.disk_overflow = _DiskOverflow(spill_dir=self.spill_dir)
+                self.disk_overflow.write([event.content])
+        else:
+            self.nb_dropped_events += 1
+            logger.warning(
+                f"phospho log queue is full, dropping the oldest log event {event_id}"
+            )
+        return True
+
+    def _make_room(self, size: int, wait: bool) -> bool:
+        """Apply the overflow policy until the event of this size fits in the queue.
+        The lock must be held. Returns False if the event should be dropped."""
+        if not self.is_bounded or self._has_room(size):
+            return True
+        if self.overflow_policy in ("drop_oldest", "spill_to_disk"):
+            while not self._has_room(size):
+                if not self._evict_oldest():
+                    break
+            return True
+        if self.overflow_policy == "block" and wait:
+            deadline = time.monotonic() + self.block_timeout
+            while not self._has_room(size):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.not_full.wait(remaining)
+            if self._has_room(size):
+                return True
+        # drop_newest, or block timed out
+        self.nb_dropped_events += 1
+        logger.warning("phospho log queue is full, dropping the new log event")
+        return False
+
+    def _fit_max_bytes(self, event_id: str) -> None:
+        """Apply the overflow policy after an event in the queue grew. The lock must be held."""
+        if self.max_bytes is None:
+            return
+        if self.overflow_policy in ("drop_oldest", "spill_to_disk"):
+            # Always keep at least one event, even if it's bigger than max_bytes
+            while self.nb_bytes > self.max_bytes and len(self.events) > 1:
+                if not self._evict_oldest():
+                    break
+        elif self.nb_bytes > self.max_bytes and len(self.events) > 1:
+            # drop_newest, or block: updates can't wait for the consumer
+            self._remove(event_id)
+            self.nb_dropped_events += 1
+            logger.warning(
+                f"phospho log queue is full, dropping the updated log event {event_id}"
+            )
 
     def append(self, event: Event) -> None:
         with self.lock:
-            self.events[event.id] = event
+            if event.id in self.events:
+                self._insert(event)
+                return
+            size = self._event_size(event)
+            if self._make_room(size, wait=True):
+                self._insert(event, size=size)
+
+    def update(self, event_id: str, to_log: Optional[bool] = None) -> None:
+        """Call this after modifying inplace the content of an event already in the queue,
+        to update its size and optionally its to_log status."""
+        with self.lock:
+            event = self.events.get(event_id)
+            if event is None:
+                return
+            if to_log is not None:
+                event.to_log = to_log
+            # Re-insert to update the size and the ready status. Insertion order is kept.
+            new_size = self._event_size(event)
+            self.nb_bytes += new_size - self.sizes.get(event_id, 0)
+            self.sizes[event_id] = new_size
+            if event.to_log:
+                self.ready_ids.setdefault(event_id, None)
+                self._notify_ready()
+            else:
+                self.ready_ids.pop(event_id, None)
+            self._fit_max_bytes(event_id)
 
     def extend(self, events_queue: Dict[str, Event]) -> None:
         with self.lock:
-            self.events.update(events_queue)
+            for event in events_queue.values():
+                if event.id in self.events or self._make_room(
+                    self._event_size(event), wait=False
+                ):
+                    self._insert(event)
 
     def add_batch(self, events_content_list: List[Dict[str, object]]) -> None:
         """This is used to add back events to the log queue, eg when they
@@ -38,26 +324,54 @@ class LogQueue:
                 task_id = str(event.get("task_id", generate_uuid()))
                 return task_id
 
-            new_events: Dict[str, Event] = {
-                get_event_id(event_content): Event(
+            for event_content in events_content_list:
+                event = Event(
                     to_log=True,  # We will send them in the next batch
                     id=get_event_id(event_content),
                     content=event_content,
                 )
-                for event_content in events_content_list
-            }
-            self.events.update(new_events)
+                # Never block here: this is called by the consumer, which makes room
+                if event.id in self.events or self._make_room(
+                    self._event_size(event), wait=False
+                ):
+                    self._insert(event)
 
-    def get_batch(self) -> List[Dict[str, object]]:
+    def _refill_from_disk(self) -> None:
+        """Put spilled events back in the queue while there is room. The lock must be held."""
+        if self.disk_overflow is None or self.disk_overflow.nb_events == 0:
+            return
+        nb_to_read = SPILL_READ_CHUNK_SIZE
+        if self.max_events is not None:
+            nb_to_read = min(nb_to_read, self.max_events - len(self.events))
+        bytes_to_read = None
+        if self.max_bytes is not None:
+            bytes_to_read = self.max_bytes - self.nb_bytes
+        events_content = self.disk_overflow.read(nb_to_read, bytes_to_read)
+        if not events_content and not self.events:
+            # Always accept at least one event, even if it's bigger than max_bytes
+            events_content = self.disk_overflow.read(1)
+        for event_content in events_content:
+            task_id = str(event_content.get("task_id", generate_uuid()))
+            self._insert(Event(id=task_id, content=event_content, to_log=True))
+
+    def get_batch(self, max_events: Optional[int] = None) -> List[Dict[str, object]]:
+        """Pop the events marked as to_log, oldest first. Events not marked as to_log
+        stay in queue. Only the popped events are visited."""
         if self.lock.acquire(False):  # non-blocking
             try:
-                # The batch is only made of events marked as to_log
-                events_to_log = filter(lambda e: e.to_log, self.events.values())
-                # Events not marked as to_log will stay in queue
-                self.events = dict(
-                    filter(lambda pair: not pair[1].to_log, self.events.items())
-                )
-                return [e.content for e in events_to_log]
+                if not self.ready_ids:
+                    self._refill_from_disk()
+                batch: List[Dict[str, object]] = []
+                while self.ready_ids and (
+                    max_events is None or len(batch) < max_events
+                ):
+                    event_id = next(iter(self.ready_ids))
+                    event = self._remove(event_id)
+                    if event is not None:
+                        batch.append(event.content)
+                if batch:
+                    self.not_full.notify_all()
+                return batch
             finally:
                 self.lock.release()
         else:
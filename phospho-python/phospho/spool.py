@@ -0,0 +1,263 @@
+"""
+Durable on-disk spool for the log events that couldn't be sent to phospho.
+
+The spool is a directory of append-only segment files. Each segment is a json lines file
+of log events. Segments are sent oldest first, then deleted. Segments left by a previous
+process (eg after a crash or a backend outage) are sent after the next `phospho.init()`.
+
+A segment is written with the suffix `.open`, which is removed when the segment is sealed
+(when it's full, claimed or when the spool is closed). Only sealed segments are sent.
+
+Several processes can share the same spool directory: a segment is claimed by renaming it
+before being sent, so it's only sent by one process. The open segments of the processes that
+are no longer running are sealed by the next process using the directory.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Literal, Optional, Tuple
+
+from .utils import dumps_json
+
+logger = logging.getLogger(__name__)
+
+FsyncPolicy = Literal["always", "segment", "never"]
+
+SEGMENT_SUFFIX = ".jsonl"
+CLAIMED_SUFFIX = ".claimed"
+OPEN_SUFFIX = ".open"
+
+
+def _pid_is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DiskSpool:
+    """
+    Append-only spool of log events, stored in segment files in `directory`.
+
+    :param directory: where the segment files are stored. Created if it doesn't exist.
+    :param max_segment_bytes: a new segment is started when the current one is bigger.
+    :param max_bytes: maximum size of the spool on disk. When exceeded, the oldest
+        segments are deleted. If None, the spool is unbounded.
+    :param fsync: when to flush the segments to disk. "always" after every write,
+        "segment" when a segment is closed, "never" leaves it to the OS.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_segment_bytes: int = 8 * 1024 * 1024,
+        max_bytes: Optional[int] = None,
+        fsync: FsyncPolicy = "segment",
+    ) -> None:
+        if fsync not in ("always", "segment", "never"):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_segment_bytes = max_segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.nb_dropped_segments = 0
+
+        self.lock = threading.Lock()
+        # The segment currently written to
+        self.current_segment: Optional[str] = None
+        self.current_segment_bytes = 0
+        self.segment_counter = 0
+        # Estimated size of the spool on disk. Only refreshed from the disk when it exceeds
+        # max_bytes, as the segments may be sent and deleted by other processes.
+        self.total_bytes = 0
+
+        self._recover_stale_claims()
+        if self.max_bytes is not None:
+            self.total_bytes = sum(self._segment_sizes().values())
+
+    def _segment_name(self) -> str:
+        # Segments are sorted by name: the name starts with the creation time
+        self.segment_counter += 1
+        return f"{time.time_ns():020d}_{os.getpid()}_{self.segment_counter:06d}{SEGMENT_SUFFIX}"
+
+    def _path(self, segment: str) -> str:
+        return os.path.join(self.directory, segment)
+
+    def _recover_stale_claims(self) -> None:
+        """
+        Release the segments claimed by processes that are no longer running, and seal
+        the segments they were writing to
+        """
+        for filename in os.listdir(self.directory):
+            if filename.endswith(OPEN_SUFFIX):
+                # Format: {time}_{pid}_{counter}.jsonl.open
+                segment = filename[: -len(OPEN_SUFFIX)]
+                pid = segment.split("_")[1] if segment.count("_") == 2 else ""
+                if pid.isdigit() and _pid_is_alive(int(pid)):
+                    continue
+                try:
+                    os.rename(self._path(filename), self._path(segment))
+                except OSError:
+                    pass
+                continue
+            if not filename.endswith(CLAIMED_SUFFIX):
+                continue
+            # Format: {segment}.{pid}.claimed
+            segment, pid, _ = filename.rsplit(".", 2)
+            if not pid.isdigit() or _pid_is_alive(int(pid)):
+                continue
+            try:
+                os.rename(self._path(filename), self._path(segment))
+            except OSError:
+                # Another process recovered it first
+                pass
+
+    def _segments(self) -> List[str]:
+        """Sealed segments not claimed, oldest first"""
+        return sorted(
+            filename
+            for filename in os.listdir(self.directory)
+            if filename.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _segment_sizes(self) -> Dict[str, int]:
+        """Size of the sealed and open segments not claimed"""
+        sizes = {}
+        for filename in os.listdir(self.directory):
+            if not filename.endswith((SEGMENT_SUFFIX, OPEN_SUFFIX)):
+                continue
+            try:
+                sizes[filename] = os.path.getsize(self._path(filename))
+            except OSError:
+                pass
+        return sizes
+
+    def _close_current_segment(self) -> None:
+        """Seal the current segment. The lock must be held"""
+        if self.current_segment is None:
+            return
+        open_path = self._path(self.current_segment + OPEN_SUFFIX)
+        if self.fsync == "segment":
+            try:
+                with open(open_path, "rb+") as f:
+                    os.fsync(f.fileno())
+            except OSError:
+                pass
+        try:
+            os.rename(open_path, self._path(self.current_segment))
+        except OSError:
+            pass
+        self.current_segment = None
+        self.current_segment_bytes = 0
+
+    def _enforce_max_bytes(self) -> None:
+        """Delete the oldest segments until the spool fits in max_bytes. The lock must be held"""
+        if self.max_bytes is None or self.total_bytes <= self.max_bytes:
+            return
+        # The estimate is over the limit: compute the actual size of the spool
+        sizes = self._segment_sizes()
+        self.total_bytes = sum(sizes.values())
+        # Only the sealed segments are dropped
+        for segment in sorted(s for s in sizes if s.endswith(SEGMENT_SUFFIX)):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(segment))
+            except OSError:
+                continue
+            self.total_bytes -= sizes[segment]
+            self.nb_dropped_segments += 1
+            logger.warning(
+                f"phospho spool {self.directory} is full, dropping the oldest segment {segment}"
+            )
+
+    def write(self, events_content: List[Dict[str, object]]) -> None:
+        """Append log events to the spool"""
+        if not events_content:
+            return
+        data = b"".join(dumps_json(content) + b"\n" for content in events_content)
+        with self.lock:
+            if self.current_segment is None:
+                self.current_segment = self._segment_name()
+            with open(self._path(self.current_segment + OPEN_SUFFIX), "ab") as f:
+                f.write(data)
+                if self.fsync == "always":
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.current_segment_bytes += len(data)
+            self.total_bytes += len(data)
+            if self.current_segment_bytes >= self.max_segment_bytes:
+                self._close_current_segment()
+            self._enforce_max_bytes()
+
+    def claim_segment(self) -> Optional[Tuple[str, List[Dict[str, object]]]]:
+        """
+        Claim the oldest sealed segment of the spool and read its events. Returns None if
+        the spool is empty. Once sent, call `commit(segment)` to delete it, or
+        `release(segment)` to give it back to the spool.
+        """
+        with self.lock:
+            segments = self._segments()
+            if not segments and self.current_segment is not None:
+                # Stop writing to the current segment, so it can be sent
+                self._close_current_segment()
+                segments = self._segments()
+            for segment in segments:
+                claimed = f"{segment}.{os.getpid()}{CLAIMED_SUFFIX}"
+                try:
+                    os.rename(self._path(segment), self._path(claimed))
+                except OSError:
+                    # Claimed by another process
+                    continue
+                return claimed, self._read(claimed)
+        return None
+
+    def _read(self, segment: str) -> List[Dict[str, object]]:
+        events_content: List[Dict[str, object]] = []
+        with open(self._path(segment), "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events_content.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn write, eg if the process crashed while writing
+                    logger.warning(
+                        f"Skipping a corrupted line in phospho spool {segment}"
+                    )
+        return events_content
+
+    def commit(self, segment: str) -> None:
+        """Delete a claimed segment, once its events were sent"""
+        try:
+            size = os.path.getsize(self._path(segment))
+            os.remove(self._path(segment))
+        except OSError:
+            return
+        with self.lock:
+            self.total_bytes = max(0, self.total_bytes - size)
+
+    def release(self, segment: str) -> None:
+        """Give back a claimed segment to the spool, eg if its events couldn't be sent"""
+        original_segment = segment.rsplit(".", 2)[0]
+        try:
+            os.rename(self._path(segment), self._path(original_segment))
+        except OSError:
+            pass
+
+    def is_empty(self) -> bool:
+        """True if there is no segment to send, including the segment being written"""
+        return self.current_segment is None and len(self._segments()) == 0
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_current_segment()
@@ -1,8 +1,12 @@
 import datetime
+import functools
+import hashlib
 import json
 import logging
+import threading
 import time
 import uuid
+from collections import OrderedDict
 from random import choice
 from typing import (
     Any,
@@ -10,12 +14,21 @@ from typing import (
     Callable,
     Dict,
     Generator,
+    List,
     Literal,
     Optional,
+    Tuple,
     Union,
+    cast,
 )
 
 import pydantic
+from pydantic import v1 as pydantic_v1
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None  # type: ignore
 
 logger = logging.getLogger(__name__)
 
@@ -115,14 +128,49 @@ def generate_version_id(with_date: bool = True) -> str:
         return f"{choice(adjectives)}-{choice(animals)}"
 
 
+# Types serialized as is by json.dumps. They're also the types accepted as dict keys.
+JSON_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def _is_jsonable(x: Any) -> bool:
+    if type(x) in JSON_SCALAR_TYPES or isinstance(x, (str, int, float)):
+        return True
+    if isinstance(x, dict):
+        return all(
+            isinstance(key, JSON_SCALAR_TYPES) and _is_jsonable(value)
+            for key, value in x.items()
+        )
+    if isinstance(x, (list, tuple)):
+        return all(_is_jsonable(value) for value in x)
+    return False
+
+
 def is_jsonable(x: Any) -> bool:
+    """
+    Check if x is json serializable with json.dumps. The types are checked
+    without serializing x.
+    """
     try:
-        json.dumps(x)
-        return True
-    except TypeError:
+        return _is_jsonable(x)
+    except RecursionError:
+        # Circular references
         return False
 
 
+def dumps_json(content: Any) -> bytes:
+    """
+    Serialize content to json bytes. Uses orjson if it's installed.
+    Objects that aren't json serializable are converted to str.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Eg integers bigger than 64 bits
+            pass
+    return json.dumps(content, default=str).encode("utf-8")
+
+
 def filter_nonjsonable_keys(arg_dict: dict, verbose: bool = False) -> Dict[str, object]:
     if not isinstance(arg_dict, dict):
         raise TypeError(f"Expected a dict, got {type(arg_dict)}")
@@ -141,37 +189,98 @@ def filter_nonjsonable_keys(arg_dict: dict, verbose: bool = False) -> Dict[str,
     return new_arg_dict
 
 
+# Converters used by convert_content_to_loggable_content, by type.
+# Subclasses of a registered type use its converter.
+LOGGABLE_CONVERTERS: Dict[type, Callable[[Any], Any]] = {}
+
+
+def register_loggable_converter(
+    content_type: type, converter: Callable[[Any], Any]
+) -> None:
+    """
+    Register how to convert objects of a given type (and its subclasses) before
+    logging them. The converted value is then converted recursively.
+
+    Example: `register_loggable_converter(datetime.datetime, lambda d: d.isoformat())`
+    """
+    LOGGABLE_CONVERTERS[content_type] = converter
+    _find_converter.cache_clear()
+
+
+@functools.lru_cache(maxsize=1024)
+def _find_converter(content_type: type) -> Optional[Callable[[Any], Any]]:
+    for parent_type in content_type.__mro__:
+        converter = LOGGABLE_CONVERTERS.get(parent_type)
+        if converter is not None:
+            return converter
+    return None
+
+
+def _bytes_to_loggable(content: bytes) -> Any:
+    # Probably a byte representation of json
+    return json.loads(content.decode())
+
+
+register_loggable_converter(pydantic.BaseModel, lambda content: content.model_dump())
+register_loggable_converter(pydantic_v1.BaseModel, lambda content: content.dict())
+register_loggable_converter(bytes, _bytes_to_loggable)
+
+
+def _to_loggable(content: Any) -> Tuple[Any, bool]:
+    """
+    Returns the loggable content, and whether the original content was already
+    json serializable (in which case it's returned as is).
+    """
+    content_type = type(content)
+    if content_type in JSON_SCALAR_TYPES:
+        return content, True
+
+    if content_type is dict or isinstance(content, dict):
+        new_content = {}
+        all_jsonable = True
+        for key, value in content.items():
+            new_value, jsonable = _to_loggable(value)
+            new_content[key] = new_value
+            if not jsonable or not isinstance(key, JSON_SCALAR_TYPES):
+                all_jsonable = False
+        if all_jsonable:
+            return content, True
+        return new_content, False
+
+    if content_type is list or isinstance(content, (list, tuple)):
+        items = [_to_loggable(x) for x in content]
+        if all(jsonable for _, jsonable in items):
+            return content, True
+        if isinstance(content, list):
+            # Special case for list
+            return str([new_value for new_value, _ in items]), False
+        return str(content), False
+
+    if isinstance(content, (str, int, float)):
+        # Subclasses of scalar types, eg enums
+        return content, True
+
+    converter = _find_converter(content_type)
+    if converter is not None:
+        new_content, _ = _to_loggable(converter(content))
+        return new_content, False
+
+    # Fallback to str
+    logger.debug("Unknwon type %s for content. Fallback to str.", content_type)
+    return str(content), False
+
+
 def convert_content_to_loggable_content(
     content: Any,
 ) -> Union[Dict[str, object], str, None]:
     """
     Convert objects to json serializable content. Notably, nested dicts and lists are converted.
-    """
-    if is_jsonable(content):
-        return content
 
-    if isinstance(content, dict):
-        new_content = {
-            key: convert_content_to_loggable_content(value)
-            for key, value in content.items()
-        }
-        return new_content
-    elif isinstance(content, list):
-        # Special case for list
-        return str([convert_content_to_loggable_content(x) for x in content])
-    elif isinstance(content, pydantic.BaseModel):
-        return content.model_dump()
-    elif isinstance(content, pydantic.v1.BaseModel):
-        return content.dict()
-    elif isinstance(content, bytes):
-        # Probably a byte representation of json
-        return json.loads(content.decode())
-    else:
-        # Fallback to str
-        logger.debug(
-            f"Unknwon type {type(content)} for content {content}. Fallback to str."
-        )
-        return str(content)
+    The content is visited once. Custom types can be converted with
+    `register_loggable_converter`.
+    """
+    new_content, _ = _to_loggable(content)
+    return new_content
 
 
 class MutableGenerator:
@@ -220,36 +329,119 @@ class MutableAsyncGenerator:
         return value
 
 
-def fits_in_context_window(prompt: str, context_window_size: int) -> bool:
-    """
-    Check if the prompt fits in the context window
-    context_window_size is the number of tokens of the context window
-    """
+def _import_tiktoken(function_name: str):
     try:
         import tiktoken
     except ImportError:
         raise ImportError(
-            "Please install the `tiktoken` package to use the `fits_in_context_window` function."
+            f"Please install the `tiktoken` package to use the `{function_name}` function."
         )
+    return tiktoken
+
 
-    encoding = tiktoken.get_encoding("cl100k_base")
-    num_tokens = len(encoding.encode(prompt))
-    return num_tokens <= context_window_size
+DEFAULT_ENCODING_NAME = "cl100k_base"
 
 
-def get_number_of_tokens(prompt: str) -> int:
+@functools.lru_cache(maxsize=128)
+def get_encoding(model: Optional[str] = None):
     """
-    Get the number of tokens in a string
+    Get the tiktoken encoding of a model. The encodings are loaded once per process.
+    Unknown models (or None) use the cl100k_base encoding.
     """
-    try:
-        import tiktoken
-    except ImportError:
-        raise ImportError(
-            "Please install the `tiktoken` package to use the `get_number_of_tokens` function."
-        )
+    tiktoken = _import_tiktoken("get_encoding")
+    if model is not None:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+    return tiktoken.get_encoding(DEFAULT_ENCODING_NAME)
+
+
+# LRU cache of token counts, keyed by (encoding name, hash of the text). Repeated texts,
+# such as system prompts, are only encoded once. The texts are hashed so that the cache
+# doesn't keep long texts in memory.
+TOKEN_COUNT_CACHE_SIZE = 4096
+_token_count_cache: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+_token_count_cache_lock = threading.Lock()
+
+
+def _token_count_key(encoding_name: str, text: str) -> Tuple[str, bytes]:
+    return (
+        encoding_name,
+        hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(),
+    )
+
+
+# Below this number of texts to encode, threads cost more than they save
+MIN_TEXTS_FOR_THREADS = 16
+
+
+def count_tokens(
+    texts: List[str],
+    model: Optional[str] = None,
+    encoding: Optional[Any] = None,
+    num_threads: int = 8,
+) -> List[int]:
+    """
+    Get the number of tokens of each text.
+
+    The texts that weren't counted recently are encoded in a single batch, across
+    `num_threads` threads.
+
+    :param texts: the texts to count the tokens of.
+    :param model: the model used to pick the encoding. Ignored if encoding is set.
+    :param encoding: the tiktoken encoding to use. Defaults to the encoding of the model.
+    :param num_threads: the number of threads used to encode big batches.
+    """
+    if encoding is None:
+        encoding = get_encoding(model)
+
+    counts: List[Optional[int]] = [None] * len(texts)
+    # Text to encode -> indexes in texts
+    missing: Dict[str, List[int]] = {}
+    keys = [_token_count_key(encoding.name, text) for text in texts]
+    with _token_count_cache_lock:
+        for i, (text, key) in enumerate(zip(texts, keys)):
+            count = _token_count_cache.get(key)
+            if count is not None:
+                _token_count_cache.move_to_end(key)
+                counts[i] = count
+            else:
+                missing.setdefault(text, []).append(i)
+
+    if missing:
+        missing_texts = list(missing.keys())
+        if len(missing_texts) >= MIN_TEXTS_FOR_THREADS and num_threads > 1:
+            tokens = encoding.encode_batch(missing_texts, num_threads=num_threads)
+        else:
+            tokens = [encoding.encode(text) for text in missing_texts]
+        with _token_count_cache_lock:
+            for text, text_tokens in zip(missing_texts, tokens):
+                count = len(text_tokens)
+                for i in missing[text]:
+                    counts[i] = count
+                _token_count_cache[keys[missing[text][0]]] = count
+            while len(_token_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+                _token_count_cache.popitem(last=False)
+
+    return cast(List[int], counts)
+
+
+def fits_in_context_window(prompt: str, context_window_size: int) -> bool:
+    """
+    Check if the prompt fits in the context window
+    context_window_size is the number of tokens of the context window
+    """
+    _import_tiktoken("fits_in_context_window")
+    return get_number_of_tokens(prompt) <= context_window_size
+
 
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(prompt))
+def get_number_of_tokens(prompt: str, model: Optional[str] = None) -> int:
+    """
+    Get the number of tokens in a string
+    """
+    _import_tiktoken("get_number_of_tokens")
+    return count_tokens([prompt], model=model)[0]
 
 
 def shorten_text(
@@ -261,21 +453,16 @@ def shorten_text(
     """
     Shorten the prompt to fit in the max_length by only keeping some part of the text.
     """
-    try:
-        import tiktoken
-    except ImportError:
-        raise ImportError(
-            "Please install the `tiktoken` package to use the `shorten_text` function."
-        )
+    _import_tiktoken("shorten_text")
 
     if prompt is None:
         return ""
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(prompt)
-    number_of_tokens = len(tokens)
+    number_of_tokens = get_number_of_tokens(prompt)
     if number_of_tokens <= max_length:
         return prompt
     else:
+        encoding = get_encoding()
+        tokens = encoding.encode(prompt)
         if how == "left":
             return encoding.decode(tokens[: max_length - margin])
         elif how == "right":
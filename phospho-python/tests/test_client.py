@@ -0,0 +1,44 @@
+import io
+import json
+from unittest.mock import patch
+
+import requests
+import requests_mock
+
+from phospho.client import Client
+
+BASE_URL = "http://phospho.test"
+
+
+def test_tasks_flat_stream():
+    client = Client(api_key="key", project_id="project", base_url=BASE_URL)
+    rows = [{"task_id": f"task_{i}", "task_input": "hello"} for i in range(5)]
+    ndjson = "".join(json.dumps(row) + "\n" for row in rows)
+
+    with requests_mock.Mocker() as m:
+        m.post(f"{BASE_URL}/v2/projects/project/tasks/flat/export", text=ndjson)
+        chunks = list(client.tasks_flat_stream(chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [row for chunk in chunks for row in chunk] == rows
+    payload = json.loads(m.request_history[0].body)
+    assert payload["format"] == "ndjson"
+    assert payload["chunk_size"] == 2
+    assert payload["limit"] is None
+
+
+def test_tasks_flat_stream_reads_lazily():
+    client = Client(api_key="key", project_id="project", base_url=BASE_URL)
+    rows = [{"task_id": f"task_{i}", "task_input": "hello"} for i in range(200)]
+    ndjson = "".join(json.dumps(row) + "\n" for row in rows).encode()
+    # requests_mock buffers the body, so the response is built on a raw stream
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(ndjson)
+
+    with patch("phospho.client.requests.post", return_value=response):
+        chunks = client.tasks_flat_stream(chunk_size=2)
+        assert next(chunks) == rows[:2]
+        # Only the beginning of the body has been read
+        assert response.raw.tell() < len(ndjson) // 2
+        assert [row for chunk in chunks for row in chunk] == rows[2:]
@@ -0,0 +1,186 @@
+import asyncio
+import gzip
+import json
+import os
+import sys
+
+import pytest
+import requests_mock
+
+import phospho
+from phospho.client import Client
+from phospho.consumer import AsyncConsumer, Consumer, split_batch
+from phospho.log_queue import LogQueue
+from phospho.spool import DiskSpool
+
+BASE_URL = "http://phospho.test"
+
+
+def make_events(n: int, text: str = "hello"):
+    return [{"task_id": f"task_{i}", "input": text} for i in range(n)]
+
+
+def test_split_batch():
+    batch = make_events(10)
+    assert split_batch(batch) == [batch]
+    assert [len(c) for c in split_batch(batch, max_batch_events=4)] == [4, 4, 2]
+
+    big_batch = make_events(10, text="x" * 100)
+    chunks = split_batch(big_batch, max_batch_bytes=300)
+    assert sum(len(c) for c in chunks) == 10
+    assert all(len(c) <= 2 for c in chunks)
+
+    # An event bigger than max_batch_bytes is sent alone
+    assert split_batch(make_events(2, "x" * 1000), max_batch_bytes=10) == [
+        [e] for e in make_events(2, "x" * 1000)
+    ]
+
+
+def test_send_batch_compressed():
+    client = Client(api_key="key", project_id="project", base_url=BASE_URL)
+    log_queue = LogQueue()
+    log_queue.add_batch(make_events(5))
+    consumer = Consumer(
+        log_queue=log_queue, client=client, max_batch_events=2, compression="gzip"
+    )
+
+    with requests_mock.Mocker() as m:
+        m.post(f"{BASE_URL}/v2/log/project", json={"logged_events": []})
+        consumer.send_batch()
+
+    assert m.call_count == 3
+    request = m.request_history[0]
+    assert request.headers["content-encoding"] == "gzip"
+    payload = json.loads(gzip.decompress(request.body))
+    assert [e["task_id"] for e in payload["batched_log_events"]] == [
+        "task_0",
+        "task_1",
+    ]
+    assert len(log_queue) == 0
+
+
+def test_send_batch_requeue_on_error():
+    client = Client(api_key="key", project_id="project", base_url=BASE_URL)
+    log_queue = LogQueue()
+    log_queue.add_batch(make_events(5))
+    consumer = Consumer(log_queue=log_queue, client=client, max_batch_events=2)
+
+    with requests_mock.Mocker() as m:
+        m.post(
+            f"{BASE_URL}/v2/log/project",
+            [{"json": {"logged_events": []}}, {"status_code": 500}],
+        )
+        consumer.send_batch()
+
+    # The first chunk was sent, the others are back in the queue
+    assert sorted(log_queue.events.keys()) == ["task_2", "task_3", "task_4"]
+    assert consumer.nb_consecutive_errors == 1
+
+
+def test_spool(tmp_path):
+    spool = DiskSpool(directory=str(tmp_path), max_segment_bytes=100)
+    spool.write(make_events(3))
+    spool.write(make_events(3))
+
+    segment, events = spool.claim_segment()
+    assert len(events) == 3
+    spool.release(segment)
+    # Released segments are claimed again, oldest first
+    assert spool.claim_segment()[0] == segment
+    spool.commit(segment)
+    _, events = spool.claim_segment()
+    assert len(events) == 3
+    assert spool.claim_segment() is None
+
+
+def test_spool_claims_sealed_segments(tmp_path):
+    writer = DiskSpool(directory=str(tmp_path), max_segment_bytes=10_000)
+    writer.write(make_events(3))
+    # The segment being written by another spool is not claimed
+    reader = DiskSpool(directory=str(tmp_path))
+    assert reader.is_empty()
+    assert reader.claim_segment() is None
+
+    writer.close()
+    _, events = reader.claim_segment()
+    assert len(events) == 3
+
+
+def test_spool_max_bytes(tmp_path):
+    events = make_events(3)
+    spool = DiskSpool(directory=str(tmp_path), max_segment_bytes=1, max_bytes=300)
+    for _ in range(10):
+        spool.write(events)
+    assert spool.nb_dropped_segments > 0
+    assert spool.total_bytes <= 300
+    assert spool.total_bytes == sum(
+        os.path.getsize(os.path.join(tmp_path, f)) for f in os.listdir(tmp_path)
+    )
+
+
+def test_send_batch_spool_on_error(tmp_path):
+    client = Client(api_key="key", project_id="project", base_url=BASE_URL)
+    log_queue = LogQueue()
+    log_queue.add_batch(make_events(5))
+    spool = DiskSpool(directory=str(tmp_path))
+    consumer = Consumer(log_queue=log_queue, client=client, spool=spool)
+
+    with requests_mock.Mocker() as m:
+        m.post(f"{BASE_URL}/v2/log/project", status_code=503)
+        consumer.send_batch()
+    # The events are stored on disk, not in memory
+    assert len(log_queue) == 0
+    assert not spool.is_empty()
+    # The process stops: its segment is sealed
+    consumer.stop()
+
+    # A new consumer, eg after a restart, sends the spooled events
+    consumer = Consumer(
+        log_queue=LogQueue(), client=client, spool=DiskSpool(directory=str(tmp_path))
+    )
+    with requests_mock.Mocker() as m:
+        m.post(f"{BASE_URL}/v2/log/project", json={"logged_events": []})
+        consumer.send_batch()
+    assert m.call_count == 1
+    assert len(m.request_history[0].json()["batched_log_events"]) == 5
+    assert spool.is_empty()
+
+
+async def test_async_consumer(monkeypatch):
+    client = Client(api_key="key", project_id="project", base_url=BASE_URL)
+    log_queue = LogQueue()
+    consumer = AsyncConsumer(
+        log_queue=log_queue, client=client, max_delay=10, flush_threshold=3
+    )
+    sent_batches = []
+
+    async def fake_post_batch(batch):
+        sent_batches.append(batch)
+
+    monkeypatch.setattr(consumer, "_post_batch", fake_post_batch)
+    consumer.start()
+
+    # Below the threshold, nothing is sent before max_delay
+    log_queue.add_batch(make_events(2))
+    await asyncio.sleep(0.1)
+    assert sent_batches == []
+
+    # The threshold is reached: the batch is sent right away
+    log_queue.add_batch([{"task_id": "task_3", "input": "hello"}])
+    await asyncio.sleep(0.1)
+    assert len(sent_batches) == 1
+    assert len(sent_batches[0]) == 3
+
+    log_queue.add_batch([{"task_id": "task_4", "input": "hello"}])
+    await consumer.flush()
+    assert len(sent_batches) == 2
+
+    await consumer.stop()
+    assert consumer.task is None
+
+
+def test_init_asyncio_requires_httpx(monkeypatch):
+    # Fails right away instead of retrying the logs forever
+    monkeypatch.setitem(sys.modules, "httpx", None)
+    with pytest.raises(ImportError):
+        phospho.init(api_key="key", project_id="project", use_asyncio=True)
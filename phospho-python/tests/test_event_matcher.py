@@ -0,0 +1,86 @@
+import random
+import re
+
+from phospho import lab
+from phospho.lab.event_matcher import (
+    EventMatcher,
+    KeywordSet,
+    keywords_to_regex_pattern,
+)
+
+
+def test_keyword_set_matches_regex():
+    """The single scan gives the same results as the regex of each event"""
+    keywords_by_event = {
+        "refund": "refund, money back",
+        "greeting": "hello,hi",
+        "tech": "node.js, c++, e-mail",
+        "price": "price",
+    }
+    keyword_set = KeywordSet()
+    for event_id, keywords in keywords_by_event.items():
+        keyword_set.add(event_id, keywords)
+
+    rng = random.Random(0)
+    words = ["refund", "money", "back", "hello", "hi", "node.js", "e-mail", "c++"]
+    words += ["price", "prices", "x", "", " ", ".", ",", "\n", "+", "=", "'", "-"]
+    for _ in range(2000):
+        text = "".join(
+            rng.choice(words) + rng.choice(["", " ", ".", "\n", ","])
+            for _ in range(rng.randint(0, 6))
+        )
+        expected = {
+            event_id
+            for event_id, keywords in keywords_by_event.items()
+            if re.search(keywords_to_regex_pattern(keywords), text) is not None
+        }
+        assert keyword_set.search(text) == expected, repr(text)
+
+
+def test_event_matcher_caches_results():
+    matcher = EventMatcher()
+    matcher.add_keywords("refund", "refund")
+    matcher.add_regex("order", r"order #\d+")
+    matcher.add_regex("invalid", "(")
+    assert matcher.has_event("refund", "keywords", "refund", "task")
+    assert not matcher.has_event("refund", "keywords", "money", "task")
+    # Invalid regexes are not compiled in the matcher
+    assert not matcher.has_event("invalid", "regex", "(", "task")
+
+    message = lab.Message(id="1", role="User", content="Refund order #12")
+    assert matcher.search(message, "task", "keywords")[1] == {"refund"}
+    assert matcher.search(message, "task", "regex")[1] == {"order"}
+    assert matcher.search(message, "task", "keywords") is matcher.search(
+        message, "task", "keywords"
+    )
+
+
+async def test_workload_event_matcher():
+    workload = lab.Workload.from_phospho_events(
+        [
+            lab.EventDefinition(
+                project_id="project",
+                event_name="refund",
+                description="Refund",
+                detection_engine="keyword_detection",
+                keywords="refund, money back",
+            ),
+            lab.EventDefinition(
+                project_id="project",
+                event_name="invalid",
+                description="Invalid regex",
+                detection_engine="regex_detection",
+                regex_pattern="(",
+            ),
+        ]
+    )
+    assert set(workload.event_matcher.events) == {"refund"}
+
+    messages = [
+        lab.Message(id="1", role="User", content="I want my money back"),
+        lab.Message(id="2", role="User", content="Thanks"),
+    ]
+    results = await workload.async_run(messages)
+    assert results["1"]["refund"].value is True
+    assert results["2"]["refund"].value is False
+    assert results["1"]["invalid"].result_type == lab.ResultType.error
@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+
+from phospho import lab
+from phospho.lab.scheduler import RATE_LIMITERS, RateLimiter, get_job_provider
+
+
+def make_messages(n: int):
+    return [lab.Message(id=f"message_{i}", content=f"Hello {i}") for i in range(n)]
+
+
+async def test_async_run_max_parallelism():
+    running = 0
+    max_running = 0
+
+    async def slow_job(message: lab.Message) -> lab.JobResult:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return lab.JobResult(result_type=lab.ResultType.bool, value=True)
+
+    workload = lab.Workload()
+    workload.add_job(slow_job, job_id="job_1")
+    workload.add_job(lab.Job(id="job_2", job_function=slow_job))
+
+    results = await workload.async_run(
+        make_messages(20), executor_type="parallel_jobs", max_parallelism=4
+    )
+    assert max_running == 4
+    assert len(results) == 20
+    assert all(set(r.keys()) == {"job_1", "job_2"} for r in results.values())
+
+
+async def test_async_iter_results_streams():
+    async def job(message: lab.Message) -> lab.JobResult:
+        # The first message is the slowest
+        await asyncio.sleep(0.05 if message.id == "message_0" else 0)
+        return lab.JobResult(result_type=lab.ResultType.literal, value=message.id)
+
+    workload = lab.Workload(jobs=[job])
+    message_ids = [
+        message_id
+        async for message_id, job_id, result in workload.async_iter_results(
+            make_messages(3)
+        )
+    ]
+    assert message_ids[-1] == "message_0"
+    assert sorted(message_ids) == ["message_0", "message_1", "message_2"]
+
+
+async def test_async_run_raises():
+    async def failing_job(message: lab.Message) -> lab.JobResult:
+        raise ValueError("failed")
+
+    workload = lab.Workload(jobs=[failing_job])
+    with pytest.raises(ValueError):
+        await workload.async_run(make_messages(5))
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+    assert rate_limiter.reserve() == 0
+    # 600 tokens were available, 500 were reserved
+    assert rate_limiter.reserve(tokens=500) == 0
+    # 100 tokens are missing: at 10 tokens per second, wait 10s
+    assert rate_limiter.reserve(tokens=200) == pytest.approx(10, abs=0.1)
+
+
+def test_get_job_provider():
+    def job_with_model(message: lab.Message, model: str = "mistral:mistral-large"):
+        pass
+
+    assert get_job_provider(lab.Job(job_function=job_with_model)) == "mistral"
+    assert (
+        get_job_provider(
+            lab.Job(
+                job_function=job_with_model,
+                config=lab.JobConfig(model="openai:gpt-4o"),
+            )
+        )
+        == "openai"
+    )
+    assert get_job_provider(lab.Job(name="keyword_event_detection")) is None
+
+
+async def test_rate_limit_applied():
+    def job(message: lab.Message, model: str = "mistral:mistral-large"):
+        return lab.JobResult(result_type=lab.ResultType.bool, value=True)
+
+    lab.set_rate_limit("mistral", requests_per_minute=2)
+    try:
+        workload = lab.Workload(jobs=[job])
+        await workload.async_run(make_messages(2))
+        # The bucket is now empty
+        assert RATE_LIMITERS["mistral"].reserve() > 0
+    finally:
+        lab.set_rate_limit("mistral")
+    assert "mistral" not in RATE_LIMITERS
+
+
+async def test_batched_job():
+    batch_sizes = []
+
+    def batched_job(messages, **kwargs):
+        batch_sizes.append(len(messages))
+        return [
+            lab.JobResult(result_type=lab.ResultType.literal, value=message.id)
+            for message in messages
+        ]
+
+    def job(message: lab.Message) -> lab.JobResult:
+        raise AssertionError("The batched version should be used")
+
+    workload = lab.Workload()
+    workload.add_job(
+        lab.Job(
+            id="batched",
+            job_function=job,
+            batched_job_function=batched_job,
+            batch_size=4,
+        )
+    )
+    results = await workload.async_run(make_messages(10))
+    assert batch_sizes == [4, 4, 2]
+    assert all(r["batched"].value == message_id for message_id, r in results.items())
+    assert results["message_0"]["batched"].job_id == "batched"
+
+
+async def test_batched_event_detection():
+    messages = [
+        lab.Message(id="1", role="User", content="I want a refund"),
+        lab.Message(id="2", role="User", content="Hello there"),
+        lab.Message(id="3", role="User", content="Refund please."),
+    ]
+    keyword_job = lab.Job(
+        id="refund",
+        name="keyword_event_detection",
+        config=lab.JobConfig(event_name="refund", keywords="refund, money back"),
+    )
+    regex_job = lab.Job(
+        id="hello",
+        name="regex_event_detection",
+        config=lab.JobConfig(event_name="hello", regex_pattern="Hel+o"),
+    )
+    assert keyword_job.batched_job_function is not None
+
+    workload = lab.Workload(jobs=[keyword_job, regex_job])
+    results = await workload.async_run(messages, executor_type="parallel_jobs")
+    assert [results[m.id]["refund"].value for m in messages] == [True, False, True]
+    assert [results[m.id]["hello"].value for m in messages] == [False, True, False]
+
+    # Same results as the per message job
+    for message in messages:
+        result = await lab.job_library.keyword_event_detection(
+            message, event_name="refund", keywords="refund, money back"
+        )
+        assert result.value == results[message.id]["refund"].value
+
+
+async def test_workload_copy():
+    workload = lab.Workload(
+        jobs=[
+            lab.Job(
+                id="refund",
+                name="keyword_event_detection",
+                config=lab.JobConfig(event_name="refund", keywords="refund"),
+            )
+        ]
+    )
+    workload_copy = workload.copy()
+    assert workload_copy.event_matcher is workload.event_matcher
+    assert workload_copy.jobs["refund"] is not workload.jobs["refund"]
+    assert workload_copy.jobs["refund"].workload is workload_copy
+    # One result dict per alternative config, as in the original
+    assert len(workload_copy.jobs["refund"].alternative_results) == len(
+        workload.jobs["refund"].alternative_configs
+    )
+
+    messages = [lab.Message(id="1", role="User", content="I want a refund")]
+    results = await workload_copy.async_run(messages)
+    assert results["1"]["refund"].value is True
+    # The results are not shared with the original workload
+    assert workload.jobs["refund"].results == {}
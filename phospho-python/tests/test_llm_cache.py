@@ -0,0 +1,103 @@
+import asyncio
+
+from openai.types.chat import ChatCompletion
+
+from phospho import lab
+from phospho.lab.llm_cache import (
+    InMemoryLLMCache,
+    SQLiteLLMCache,
+    create_chat_completion,
+    make_llm_cache_key,
+)
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.nb_calls = 0
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        self.nb_calls += 1
+        return ChatCompletion.model_validate(
+            {
+                "id": f"completion_{self.nb_calls}",
+                "object": "chat.completion",
+                "created": 0,
+                "model": kwargs["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Yes"},
+                    }
+                ],
+            }
+        )
+
+
+class FakeAsyncClient:
+    base_url = "https://llm.test/v1/"
+
+    def __init__(self):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = FakeCompletions()
+
+
+def test_make_llm_cache_key():
+    messages = [{"role": "user", "content": "hello"}]
+    assert make_llm_cache_key(model="a", messages=messages) == make_llm_cache_key(
+        messages=messages, model="a"
+    )
+    assert make_llm_cache_key(model="a", messages=messages) != make_llm_cache_key(
+        model="b", messages=messages
+    )
+
+
+async def test_create_chat_completion_cached(tmp_path):
+    for llm_cache in [
+        InMemoryLLMCache(),
+        SQLiteLLMCache(str(tmp_path / "llm_cache.db")),
+    ]:
+        client = FakeAsyncClient()
+        kwargs = {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi"}]}
+        response = await create_chat_completion(client, llm_cache, **kwargs)
+        cached_response = await create_chat_completion(client, llm_cache, **kwargs)
+        assert client.chat.completions.nb_calls == 1
+        assert cached_response.id == response.id
+        assert cached_response.choices[0].message.content == "Yes"
+        assert llm_cache.hit_rate == 0.5
+
+        # Another request is not cached
+        await create_chat_completion(client, llm_cache, **{**kwargs, "model": "o1"})
+        assert client.chat.completions.nb_calls == 2
+
+
+async def test_llm_cache_ttl():
+    llm_cache = InMemoryLLMCache(ttl=0.01)
+    await llm_cache.set("key", {"a": 1})
+    assert await llm_cache.get("key") == {"a": 1}
+    await asyncio.sleep(0.02)
+    assert await llm_cache.get("key") is None
+
+
+def test_in_memory_llm_cache_lru():
+    llm_cache = InMemoryLLMCache(max_size=2)
+
+    async def fill():
+        await llm_cache.set("a", {})
+        await llm_cache.set("b", {})
+        await llm_cache.get("a")
+        await llm_cache.set("c", {})
+
+    asyncio.run(fill())
+    assert list(llm_cache.values.keys()) == ["a", "c"]
+
+
+def test_job_llm_cache():
+    llm_cache = InMemoryLLMCache()
+
+    def job_function(message, llm_cache=None):
+        return lab.JobResult(result_type=lab.ResultType.bool, value=llm_cache)
+
+    job = lab.Job(job_function=job_function, llm_cache=llm_cache)
+    result = asyncio.run(job.async_run(lab.Message(content="hello")))
+    assert result.value is llm_cache
@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+
+from phospho.log_queue import Event, LogQueue, estimate_size
+from phospho.spool import DiskSpool
+
+
+def make_event(event_id: str, to_log: bool = True, text: str = "hello") -> Event:
+    return Event(
+        id=event_id, content={"task_id": event_id, "input": text}, to_log=to_log
+    )
+
+
+def test_unbounded_queue():
+    log_queue = LogQueue()
+    for i in range(100):
+        log_queue.append(make_event(f"task_{i}"))
+    log_queue.append(make_event("streaming", to_log=False))
+
+    batch = log_queue.get_batch()
+    assert len(batch) == 100
+    assert batch[0]["task_id"] == "task_0"
+    # Events not marked as to_log stay in queue
+    assert list(log_queue.events.keys()) == ["streaming"]
+
+    log_queue.update("streaming", to_log=True)
+    assert [e["task_id"] for e in log_queue.get_batch()] == ["streaming"]
+    assert len(log_queue) == 0
+    assert log_queue.nb_bytes == 0
+
+
+def test_get_batch_max_events():
+    log_queue = LogQueue()
+    for i in range(10):
+        log_queue.append(make_event(f"task_{i}"))
+    assert len(log_queue.get_batch(max_events=3)) == 3
+    assert len(log_queue.get_batch()) == 7
+
+
+def test_drop_oldest():
+    log_queue = LogQueue(max_events=3, overflow_policy="drop_oldest")
+    for i in range(5):
+        log_queue.append(make_event(f"task_{i}"))
+    assert list(log_queue.events.keys()) == ["task_2", "task_3", "task_4"]
+    assert log_queue.nb_dropped_events == 2
+
+
+def test_drop_newest():
+    log_queue = LogQueue(max_events=3, overflow_policy="drop_newest")
+    for i in range(5):
+        log_queue.append(make_event(f"task_{i}"))
+    assert list(log_queue.events.keys()) == ["task_0", "task_1", "task_2"]
+    assert log_queue.nb_dropped_events == 2
+
+
+def test_max_bytes():
+    log_queue = LogQueue(max_bytes=1000, overflow_policy="drop_oldest")
+    for i in range(100):
+        log_queue.append(make_event(f"task_{i}", text="x" * 100))
+    assert log_queue.nb_bytes <= 1000
+    assert "task_99" in log_queue.events
+
+
+def test_update_max_bytes():
+    log_queue = LogQueue(max_bytes=1000, overflow_policy="drop_oldest")
+    for i in range(5):
+        log_queue.append(make_event(f"task_{i}", text="x" * 100))
+    # The content of a streamed event grows after it was queued
+    log_queue.events["task_4"].content["output"] = "x" * 800
+    log_queue.update("task_4")
+    assert log_queue.nb_bytes <= 1000
+    assert "task_4" in log_queue.events
+    assert "task_0" not in log_queue.events
+
+
+def test_spill_to_spool_only_events_to_log(tmp_path):
+    spool = DiskSpool(directory=str(tmp_path))
+    log_queue = LogQueue(max_events=1, overflow_policy="spill_to_disk", spool=spool)
+    log_queue.append(make_event("streaming", to_log=False))
+    log_queue.append(make_event("task_1"))
+    # The event not marked as to_log is dropped, not sent from the spool
+    assert spool.is_empty()
+    assert log_queue.nb_dropped_events == 1
+
+    log_queue.append(make_event("task_2"))
+    _, events = spool.claim_segment()
+    assert [e["task_id"] for e in events] == ["task_1"]
+
+
+def test_block():
+    log_queue = LogQueue(max_events=1, overflow_policy="block", block_timeout=2)
+    log_queue.append(make_event("task_0"))
+
+    def consume():
+        time.sleep(0.1)
+        log_queue.get_batch()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    # Blocks until the consumer makes room
+    log_queue.append(make_event("task_1"))
+    consumer.join()
+    assert list(log_queue.events.keys()) == ["task_1"]
+    assert log_queue.nb_dropped_events == 0
+
+    # Times out and drops the new event
+    log_queue.block_timeout = 0.05
+    log_queue.append(make_event("task_2"))
+    assert list(log_queue.events.keys()) == ["task_1"]
+    assert log_queue.nb_dropped_events == 1
+
+
+def test_spill_to_disk(tmp_path):
+    log_queue = LogQueue(
+        max_events=10, overflow_policy="spill_to_disk", spill_dir=str(tmp_path)
+    )
+    for i in range(25):
+        log_queue.append(make_event(f"task_{i}"))
+    assert len(log_queue.events) == 10
+    assert len(log_queue) == 25
+    assert log_queue.nb_dropped_events == 0
+
+    sent = []
+    while True:
+        batch = log_queue.get_batch()
+        if not batch:
+            break
+        sent.extend(e["task_id"] for e in batch)
+    assert sorted(sent) == sorted(f"task_{i}" for i in range(25))
+
+
+def test_spill_to_disk_max_bytes(tmp_path):
+    event_size = estimate_size(make_event("task_0").content)
+    log_queue = LogQueue(
+        max_bytes=3 * event_size,
+        overflow_policy="spill_to_disk",
+        spill_dir=str(tmp_path),
+    )
+    for i in range(10):
+        log_queue.append(make_event(f"task_{i}"))
+    assert len(log_queue.events) == 3
+    assert len(log_queue) == 10
+
+    sent = []
+    while True:
+        batch = log_queue.get_batch(max_events=2)
+        # The refill stops once the byte budget is reached
+        assert log_queue.nb_bytes <= log_queue.max_bytes
+        if not batch:
+            break
+        sent.extend(e["task_id"] for e in batch)
+    assert sorted(sent) == sorted(f"task_{i}" for i in range(10))
+
+
+def test_add_batch_never_blocks():
+    log_queue = LogQueue(max_events=2, overflow_policy="block", block_timeout=10)
+    log_queue.add_batch([{"task_id": f"task_{i}"} for i in range(5)])
+    assert len(log_queue.events) == 2
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        LogQueue(overflow_policy="unknown")
@@ -0,0 +1,98 @@
+import datetime
+import json
+
+import pydantic
+
+from phospho.utils import (
+    LOGGABLE_CONVERTERS,
+    _token_count_cache,
+    convert_content_to_loggable_content,
+    count_tokens,
+    dumps_json,
+    is_jsonable,
+    register_loggable_converter,
+)
+
+
+class Usage(pydantic.BaseModel):
+    prompt_tokens: int
+    created_at: datetime.datetime
+
+
+def test_is_jsonable():
+    for content in [1, "a", None, 1.5, [1, "a"], (1, 2), {"a": {"b": [1]}}, {1: 2}]:
+        assert is_jsonable(content)
+    for content in [object(), [1, object()], {(1, 2): 3}, b"bytes", {"a": {1, 2}}]:
+        assert not is_jsonable(content)
+
+
+def test_convert_content_to_loggable_content():
+    content = {"messages": [{"role": "user", "content": "hi"}], "n": 1}
+    # Jsonable content is returned as is
+    assert convert_content_to_loggable_content(content) is content
+
+    usage = Usage(prompt_tokens=10, created_at=datetime.datetime(2024, 1, 1))
+    converted = convert_content_to_loggable_content({"usage": usage, "n": 1})
+    assert converted == {
+        "usage": {"prompt_tokens": 10, "created_at": "2024-01-01 00:00:00"},
+        "n": 1,
+    }
+    assert is_jsonable(converted)
+
+    # Lists with non jsonable content are converted to str
+    assert isinstance(convert_content_to_loggable_content([1, object()]), str)
+    assert convert_content_to_loggable_content(b'{"a": 1}') == {"a": 1}
+
+
+def test_register_loggable_converter():
+    class Point:
+        def __init__(self, x: int, y: int):
+            self.x = x
+            self.y = y
+
+    register_loggable_converter(Point, lambda p: {"x": p.x, "y": p.y})
+    try:
+        assert convert_content_to_loggable_content({"point": Point(1, 2)}) == {
+            "point": {"x": 1, "y": 2}
+        }
+    finally:
+        LOGGABLE_CONVERTERS.pop(Point)
+
+
+def test_dumps_json():
+    content = {"a": [1, 2], "b": datetime.datetime(2024, 1, 1)}
+    assert json.loads(dumps_json(content))["a"] == [1, 2]
+
+
+class WhitespaceEncoding:
+    """Splits on whitespace, and records the encoded texts"""
+
+    name = "whitespace"
+
+    def __init__(self):
+        self.encoded = []
+        self.nb_batches = 0
+
+    def encode(self, text):
+        self.encoded.append(text)
+        return text.split()
+
+    def encode_batch(self, texts, num_threads=8):
+        self.nb_batches += 1
+        return [self.encode(text) for text in texts]
+
+
+def test_count_tokens():
+    encoding = WhitespaceEncoding()
+    texts = [f"Message number {i}" for i in range(20)] + ["You are a helpful bot"]
+    expected = [3] * 20 + [5]
+    assert count_tokens(texts, encoding=encoding) == expected
+    # Enough texts to be encoded in a batch
+    assert encoding.nb_batches == 1
+
+    # Counts are cached: only the new texts are encoded, once
+    encoding.encoded = []
+    assert count_tokens(texts[:2] + ["a b", "a b"], encoding=encoding) == [3, 3, 2, 2]
+    assert encoding.encoded == ["a b"]
+    # The cache doesn't keep the texts
+    assert all(not isinstance(text_key, str) for _, text_key in _token_count_cache)